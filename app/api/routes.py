@@ -1,8 +1,10 @@
+import logging
 from math import ceil
 import boto3
-from time import sleep
 import json
+from clickhouse_connect.driver.exceptions import DatabaseError
 from datetime import datetime
+from time import monotonic, perf_counter
 from flask import (
     Blueprint, 
     jsonify, 
@@ -10,29 +12,68 @@ from flask import (
     current_app
     )
 from app.utils.helpers import (
-    get_table_info,
-    get_tables_in_db, 
-    get_db_names, 
+    create_paginated_query,
+    create_seek_query,
+    describe_query,
+    destructure_query_request,
+    destructure_seek_request,
+    encode_seek_cursor,
+    get_total_rows,
+    get_tables_info,
     get_table_id, 
     add_table_stream_dynamodb, 
     destructure_create_table_request,
     get_stream_arn,
     is_sql_injection,
     parse_source_arn,
+    scan_stream_table_map,
     fetch_openai_output,
+    stream_openai_output,
     )
+from app.utils.aws import ThreadSafeSession
+from app.utils.guardrails import QueryRejectedError, cancel_query, new_query_id
+from app.utils.ingestion import (
+    describe_mapping,
+    describe_settings,
+    list_mappings,
+    parse_mapping_settings,
+    stream_stats,
+    suggest_mapping_settings,
+    update_mappings,
+)
+from app.utils.jobs import JobNotFoundError, JobQueueFullError
+from app.utils.kinesis import sample_stream
+from app.utils.profiling import PROFILE_SETTINGS, profile_query
+from app.utils.rollups import backfill, create_rollup, describe_rollup, drop_rollup, parse_rollup
+from app.utils.table_layout import build_create_table_query, plan_layout
+from app.utils.prompt_builder import (
+    build_summary_prompt,
+    create_summary_query,
+    destructure_summary_request,
+)
+from app.utils.schema_inference import clickhouse_schema, infer_schema
+from app.utils.sql_validator import validate_read_only
+from app.utils.streaming import (
+    resolve_response_format,
+    resolve_stream_format,
+    stream_arrow_response,
+    stream_query_response,
+    summary_event_stream,
+)
 
 api = Blueprint('main', __name__)
+logger = logging.getLogger(__name__)
+# Per process: under several gunicorn workers only the one that answered
+# /authenticate has a session (see gunicorn.conf.py).
 global_boto3_session = None
 
 @api.route("/databases", methods=["GET"])
 def get_databases():
     try:
         client = current_app.get_ch_client()
+        include_columns = request.args.get("columns", "").lower() in ("1", "true")
 
-        db_table_map = {}
-        for db in get_db_names(client):
-            db_table_map[db] = get_tables_in_db(client, db)
+        db_table_map = current_app.catalog.get(client, include_columns=include_columns)
 
         return jsonify(db_table_map)
     except Exception as e:
@@ -42,22 +83,284 @@ def get_databases():
 def query():
     try:
         client = current_app.get_ch_client()
-        query_string = request.json.get("query")
-        result = client.query(query_string)  
+        query_string, page, page_size, offset = destructure_query_request(request)
+        validate_read_only(query_string)
+        original_query = query_string
+        query_string, rollup = route_to_rollup(client, query_string)
+        stream = request.json.get("stream")
+        response_format = resolve_response_format(request)
+        profile = request.json.get("profile", False)
+        if profile and (stream or response_format == "arrow"):
+            raise ValueError("profile is only supported for buffered JSON responses")
+
+        pagination = {}
+        parameters = None
+        seek_columns = None
+        paged_query = query_string
+
+        if request.json.get("seek"):
+            if not page_size:
+                return jsonify({"error": "pageSize is required for seek pagination"}), 400
+            seek_columns, after = destructure_seek_request(request)
+            page_size = int(page_size)
+            paged_query, parameters = create_seek_query(query_string, seek_columns, after, page_size)
+            pagination = {"page_size": page_size, "seek": seek_columns}
+        elif offset is not None:
+            paged_query = create_paginated_query(query_string, page_size, offset)
+            pagination = {"page": page, "page_size": page_size}
+
+        query_guard = current_app.query_guard
+        query_id = new_query_id(request.json.get("queryId"))
+        settings = query_guard.settings(query_id, buffered=not stream and response_format != "arrow")
+        if profile:
+            settings.update(PROFILE_SETTINGS)
+
+        if response_format == "arrow":
+            if seek_columns:
+                raise ValueError("seek pagination is not supported with the arrow format")
+            warnings = query_guard.check(client, paged_query, parameters)
+            if pagination:
+                total_rows = get_total_rows(
+                    client, query_string, current_app.count_cache, settings=query_guard.settings()
+                )
+                pagination["total_rows"] = total_rows
+                pagination["total_pages"] = ceil(total_rows / pagination["page_size"])
+            columns = describe_query(client, paged_query, parameters)
+            metadata = {
+                "query": original_query,
+                "column_names": [name for name, _ in columns],
+                "column_types": [col_type for _, col_type in columns],
+                "query_id": query_id,
+                **pagination,
+            }
+            if warnings:
+                metadata["warnings"] = warnings
+            if rollup:
+                metadata["rollup"] = rollup
+            return stream_arrow_response(
+                client,
+                paged_query,
+                metadata,
+                parameters=parameters,
+                settings=settings,
+                headers={"X-Query-Id": query_id},
+            )
+
+        if stream:
+            stream_format = resolve_stream_format(stream)
+            warnings = query_guard.check(client, paged_query, parameters)
+            headers = {"X-Query-Id": query_id}
+            if warnings:
+                headers["X-Query-Warning"] = "; ".join(warnings)
+            if rollup:
+                headers["X-Query-Rollup"] = rollup
+            return stream_query_response(
+                client,
+                paged_query,
+                stream_format,
+                parameters=parameters,
+                settings=settings,
+                headers=headers,
+            )
+
+        query_cache = current_app.query_cache
+        cache_entry = None
+        # A profile describes one execution, so profiled queries skip the cache.
+        if query_cache is not None and request.json.get("cache", True) and not profile:
+            variant = None if response_format == "rows" else response_format
+            cached, cache_entry = query_cache.lookup(client, paged_query, parameters, variant)
+            if cached is not None:
+                return jsonify(cached)
+
+        warnings = query_guard.check(client, paged_query, parameters)
+        column_oriented = response_format == "columns"
+        started = perf_counter()
+        try:
+            result = client.query(
+                paged_query, parameters=parameters, settings=settings, column_oriented=column_oriented
+            )
+        except DatabaseError as e:
+            error = query_guard.result_rows_error(e)
+            if error is None:
+                raise
+            raise error from e
+        round_trip = perf_counter() - started
+
+        if column_oriented:
+            # One array per column, in column_names order.
+            data = [list(column) for column in result.result_columns]
+            rows_count = len(data[0]) if data else 0
+            last_row = dict(zip(result.column_names, (column[-1] for column in data))) if rows_count else None
+        else:
+            data = [*result.named_results()]
+            rows_count = len(data)
+            last_row = data[-1] if data else None
+
+        if pagination:
+            total_rows = get_total_rows(
+                client, query_string, current_app.count_cache, settings=query_guard.settings()
+            )
+            pagination["total_rows"] = total_rows
+            pagination["total_pages"] = ceil(total_rows / pagination["page_size"])
 
-        data = [*result.named_results()]
-        rows_count = len(data)
+        if seek_columns:
+            next_cursor = None
+            if rows_count == pagination["page_size"]:
+                next_cursor = encode_seek_cursor(seek_columns, last_row)
+            pagination["next_cursor"] = next_cursor
 
         response = {
             "metadata": {
-                "query": query_string,
+                "query": original_query,
                 "row_count": rows_count,
                 "column_names": result.column_names,
                 "column_types": [t.base_type for t in result.column_types],
+                **pagination,
             },
             "data": data,
         }
+        if column_oriented:
+            response["metadata"]["layout"] = "columns"
+        if rollup:
+            response["metadata"]["rollup"] = rollup
+        if cache_entry is not None:
+            query_cache.store(cache_entry, response)
+
+        # Added after store() so cache hits don't report another request's id.
+        response["metadata"]["query_id"] = query_id
+        if warnings:
+            response["metadata"]["warnings"] = warnings
+        if profile:
+            response["metadata"]["profile"] = profile_query(
+                client, paged_query, query_id, parameters, round_trip
+            )
         return jsonify(response)
+    except QueryRejectedError as e:
+        return jsonify({"error": str(e), "estimate": e.estimate}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+def route_to_rollup(client, query_string):
+    """
+    Rewrites an aggregate over a table with a ready rollup to read the
+    rollup instead. Returns the query to run and the rollup's table name,
+    or the query unchanged and None.
+    """
+    if not current_app.config["ROLLUP_ROUTING"] or not request.json.get("rollups", True):
+        return query_string, None
+    try:
+        routed, rollup = current_app.rollups.route(client, query_string)
+    except Exception as e:
+        # Routing is an optimization; the source table still answers.
+        logger.warning(f"Could not route query to a rollup: {e}")
+        return query_string, None
+    if rollup is None:
+        return query_string, None
+    return routed, f"{rollup['database']}.{rollup['name']}"
+
+
+@api.route('/query/cancel', methods=["POST"])
+def cancel_running_query():
+    try:
+        client = current_app.get_ch_client()
+        query_id = request.json.get("queryId")
+        if not query_id:
+            return jsonify({"error": "queryId is required"}), 400
+
+        if not cancel_query(client, new_query_id(query_id)):
+            return jsonify({"error": f"No running query with id {query_id}"}), 404
+
+        return jsonify({"cancelled": True, "queryId": query_id})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api.route('/jobs', methods=["POST"])
+def submit_job():
+    try:
+        query_string = request.json.get("query")
+        validate_read_only(query_string)
+        job = current_app.jobs.submit(query_string, request.json.get("parameters"))
+        return jsonify({"jobId": job["id"], "status": job["status"]}), 202
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api.route('/jobs/<job_id>', methods=["GET"])
+def job_status(job_id):
+    try:
+        client = current_app.get_ch_client()
+        return jsonify(current_app.jobs.status(job_id, client))
+    except JobNotFoundError:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api.route('/jobs/<job_id>/results', methods=["GET"])
+def job_results(job_id):
+    try:
+        page = int(request.args.get("page", 1))
+        page_size = int(request.args.get("pageSize", 100))
+        if page < 1 or page_size < 1:
+            raise ValueError("page and pageSize must be positive")
+
+        job, data = current_app.jobs.read_page(job_id, (page - 1) * page_size, page_size)
+        return jsonify({
+            "metadata": {
+                "job_id": job_id,
+                "query": job["query"],
+                "row_count": len(data),
+                "column_names": job["column_names"],
+                "column_types": job["column_types"],
+                "page": page,
+                "page_size": page_size,
+                "total_rows": job["row_count"],
+                "total_pages": ceil(job["row_count"] / page_size),
+            },
+            "data": data,
+        })
+    except JobNotFoundError:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api.route('/jobs/<job_id>', methods=["DELETE"])
+def cancel_job(job_id):
+    try:
+        client = current_app.get_ch_client()
+        job = current_app.jobs.cancel(job_id, client)
+        return jsonify({"jobId": job_id, "status": job["status"]})
+    except JobNotFoundError:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@api.route('/query/cache', methods=["GET"])
+def query_cache_stats():
+    query_cache = current_app.query_cache
+    if query_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **query_cache.stats()})
+
+
+@api.route('/pool', methods=["GET"])
+def pool_stats():
+    return jsonify(current_app.ch_pool.stats())
+
+
+@api.route('/query/cache', methods=["DELETE"])
+def clear_query_cache():
+    try:
+        if current_app.query_cache is not None:
+            current_app.query_cache.clear()
+        current_app.count_cache.clear()
+        return jsonify({"cleared": True})
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
@@ -71,11 +374,12 @@ def authenticate():
         access_key = data.get("accessKey")
         secret_key = data.get("secretKey")
 
-        global_boto3_session = boto3.Session(
+        global_boto3_session = ThreadSafeSession(boto3.Session(
             aws_access_key_id=access_key,
             aws_secret_access_key=secret_key,
             region_name='us-west-1'
-        )
+        ))
+        current_app.sources_cache.clear()
         kinesis_client = global_boto3_session.client('kinesis')
         
         response = kinesis_client.list_streams()
@@ -90,7 +394,6 @@ def authenticate():
 
 @api.route("/kinesis-sample", methods=["POST"])
 def kinesis_sample():
-    client = current_app.get_ch_client()
     try:
         if global_boto3_session is None:
             return jsonify({'Authentication Error': 'User had not been authenticated'}), 401
@@ -102,53 +405,89 @@ def kinesis_sample():
             return jsonify({'error': 'streamName is required'}), 400
 
         kinesis_client = global_boto3_session.client('kinesis')
-        shard_iterator = kinesis_client.get_shard_iterator(
-            StreamName=stream_name,
-            ShardId='shardId-000000000000',
-            ShardIteratorType='LATEST'
-        )['ShardIterator']
+        records = sample_stream(
+            kinesis_client,
+            stream_name,
+            count=int(data.get("sampleSize", current_app.config["KINESIS_SAMPLE_SIZE"])),
+            deadline=float(data.get("deadline", current_app.config["KINESIS_SAMPLE_DEADLINE"])),
+            iterator_type=data.get("iteratorType", current_app.config["KINESIS_SAMPLE_ITERATOR_TYPE"]),
+            timestamp=data.get("timestamp"),
+        )
 
         """
-        Trying for 10 seconds to grab a kinesis stream record using kinesis client
-        If event record exists, decode to JSON
-        Use event record and clickhouse client to infer schema
-        Return same event and inferrerd schema
+        Sample records from every shard of the stream concurrently
+        If any event records were found, decode them to JSON
+        Infer the schema locally by merging types across every sampled event
+        Optionally ask ClickHouse to infer it too, for comparison
+        Return the sampled events and inferred schema
         """
-        seconds_to_try = 5
-        times_per_second = 3
-        count = 0
-        while count < times_per_second * seconds_to_try:
-            records = kinesis_client.get_records(
-            ShardIterator=shard_iterator,
-            Limit=1
+        if records:
+            events = [json.loads(record["data"]) for record in records]
+            schemaArray = infer_schema(
+                events,
+                low_cardinality_ratio=current_app.config["LOW_CARDINALITY_RATIO"],
+                low_cardinality_min_samples=current_app.config["LOW_CARDINALITY_MIN_SAMPLES"],
             )
 
-            if records['Records']:
-                record_data = records['Records'][0]['Data'].decode('utf-8')
-                
-                client.command("SET schema_inference_make_columns_nullable = 0;")
-                client.command("SET input_format_null_as_default = 0;")
-                res = client.query(f"DESC format(JSONEachRow, '{record_data}');")
-
-                schemaArray = []
-                for row in res.result_rows:
-                    schema = {
-                        'name': row[0],
-                        'type': row[1]
-                    }
-                    schemaArray.append(schema)
-
-                return jsonify({"sampleEvent": json.loads(record_data), "inferredSchema": schemaArray})
-
-            count += 1
-            sleep(1/times_per_second)
-        
+            response = {
+                "sampleEvent": events[0],
+                "sampleEvents": events,
+                "inferredSchema": schemaArray,
+                "layout": plan_table_layout(schemaArray, events),
+            }
+            if data.get("crossCheck"):
+                client = current_app.get_ch_client()
+                response["clickhouseSchema"] = clickhouse_schema(client, events)
+
+            return jsonify(response)
+
         return jsonify({"Unsuccessful": "could not find any records"})
       
     except Exception as e:
         return jsonify({"Kinesis Sample Route Error": str(e)}), 400
     
 
+def plan_table_layout(schema, events=None, overrides=None):
+    return plan_layout(
+        schema,
+        records=events,
+        overrides=overrides,
+        ttl_days=current_app.config["LAYOUT_TTL_DAYS"],
+        dedup_window=current_app.config["LAYOUT_DEDUP_WINDOW"],
+        low_cardinality_ratio=current_app.config["LOW_CARDINALITY_RATIO"],
+        low_cardinality_min_samples=current_app.config["LOW_CARDINALITY_MIN_SAMPLES"],
+    )
+
+
+def validate_schema(schema):
+    if not isinstance(schema, list) or len(schema) == 0:
+        return False
+    return all(isinstance(col, dict) and "name" in col and "type" in col for col in schema)
+
+
+@api.route("/create-table/plan", methods=["POST"])
+def plan_table():
+    """
+    Dry run of /create-table: returns the proposed layout and the DDL it
+    would run, without touching ClickHouse or AWS.
+    """
+    try:
+        data = request.json
+        schema = data.get("schema")
+        if not validate_schema(schema):
+            return jsonify({"Schema Error": "Invalid schema format"}), 400
+
+        layout = plan_table_layout(schema, data.get("sampleEvents"), data.get("layout"))
+        return jsonify({
+            "layout": layout,
+            "createTableQuery": build_create_table_query(
+                data.get("databaseName", "default"), data.get("tableName", "table_name"), schema, layout
+            ),
+        })
+    except Exception as e:
+        return jsonify({"Plan Table Route Error": str(e)}), 400
+
+
 @api.route("/create-table", methods=["POST"])
 def create_table():
     try:
@@ -159,43 +498,52 @@ def create_table():
         
         stream_name, table_name, database_name, schema = destructure_create_table_request(request)
 
-        if not isinstance(schema, list) or len(schema) == 0:
+        if not validate_schema(schema):
             return jsonify({"Schema Error": "Invalid schema format"}), 400
 
-        for col in schema:
-            if not isinstance(col, dict) or "name" not in col or "type" not in col:
-                return jsonify({"Schema Error": "Invalid schema format"}), 400
-        
-        columns = ", ".join([f'{col["name"]} {col["type"]}' for col in schema])
+        # Checked before anything is created, so a bad value can't leave a
+        # table and a DynamoDB mapping behind without a Lambda trigger.
+        chosen_ingestion = parse_mapping_settings(request.json.get("ingestion"))
 
-        create_table_query = f"CREATE TABLE {database_name}.{table_name} "\
-                              f"({columns}"\
-                              f") ENGINE = MergeTree()"\
-                              f" PRIMARY KEY {schema[0]["name"]}"
-        
-        query = create_table_query.strip()
+        """
+        Plan the layout from the sampled events (if the client sent them
+        back from /kinesis-sample) with the user's overrides applied
+        """
+        layout = plan_table_layout(schema, request.json.get("sampleEvents"), request.json.get("layout"))
+        query = build_create_table_query(database_name, table_name, schema, layout)
 
         if is_sql_injection(query, True):
             return jsonify({"Error": "Possible dangerous query operation"})
 
         client.command(query)
+        current_app.catalog.invalidate()
         
         stream_arn = get_stream_arn(global_boto3_session, stream_name)
         table_id = get_table_id(client, table_name)
         add_table_stream_dynamodb(global_boto3_session, stream_arn, table_id)
+        current_app.sources_cache.clear()
+
+        """
+        Suggested mapping settings from the stream's shard count and
+        record rate, with any the user picked taking precedence
+        """
+        ingestion = {**suggest_ingestion(stream_name), **chosen_ingestion}
 
         lambda_client = global_boto3_session.client('lambda')
 
-        lambda_client.create_event_source_mapping(
+        mapping = lambda_client.create_event_source_mapping(
             EventSourceArn=stream_arn,
-            FunctionName='kinesis-to-clickhouse-dev',
+            FunctionName=current_app.config["INGEST_FUNCTION_NAME"],
             StartingPosition='LATEST',
-            BatchSize=3
+            **ingestion
         )
 
         return jsonify({
             "success": True,
             "createTableQuery": query,
+            "layout": layout,
+            "ingestion": describe_settings(ingestion),
+            "eventSourceMappingUUID": mapping.get("UUID"),
             "message": "Table created in Clickhouse. Lambda trigger added. Mapping added to dynamo",
             "tableUUID": table_id,
             "streamARN": stream_arn
@@ -204,21 +552,187 @@ def create_table():
         return jsonify({"Create Table Route Error": str(e)}), 400
 
 
+def suggest_ingestion(stream_name, stats=None):
+    try:
+        stats = stats or stream_stats(
+            global_boto3_session, stream_name, window=current_app.config["INGEST_METRICS_WINDOW"]
+        )
+    except Exception as e:
+        # Suggestions are best effort; fall back to the one-shard defaults.
+        logger.warning(f"Could not read stream stats for {stream_name}: {e}")
+        stats = {}
+    return suggest_mapping_settings(
+        stats.get("shardCount"),
+        records_per_second=stats.get("peakRecordsPerSecond"),
+        average_record_bytes=stats.get("averageRecordBytes"),
+        target_inserts_per_second=current_app.config["INGEST_TARGET_INSERTS_PER_SECOND"],
+        consumer_records_per_second=current_app.config["INGEST_CONSUMER_RECORDS_PER_SECOND"],
+    )
+
+
+@api.route('/ingestion/<stream_name>', methods=['GET'])
+def view_ingestion(stream_name):
+    """
+    The stream's shard count and record rate, the current settings of its
+    event source mappings and the suggested ones
+    """
+    try:
+        if global_boto3_session is None:
+            return jsonify({'Authentication Error': 'User had not been authenticated'}), 401
+
+        stats = stream_stats(
+            global_boto3_session, stream_name, window=current_app.config["INGEST_METRICS_WINDOW"]
+        )
+        mappings = list_mappings(
+            global_boto3_session.client('lambda'), stats["streamARN"], current_app.config["INGEST_FUNCTION_NAME"]
+        )
+        return jsonify({
+            "stream": stats,
+            "mappings": [describe_mapping(mapping) for mapping in mappings],
+            "suggested": describe_settings(suggest_ingestion(stream_name, stats)),
+        })
+    except Exception as e:
+        return jsonify({"Ingestion Route Error": str(e)}), 400
+
+
+@api.route('/ingestion/<stream_name>', methods=['PUT'])
+def update_ingestion(stream_name):
+    """
+    Retunes the stream's existing event source mappings in place. Settings
+    left out keep their current value, or take the suggested one with
+    "suggested": true.
+    """
+    try:
+        if global_boto3_session is None:
+            return jsonify({'Authentication Error': 'User had not been authenticated'}), 401
+
+        data = request.json or {}
+        settings = parse_mapping_settings(data)
+        if data.get("suggested"):
+            settings = {**suggest_ingestion(stream_name), **settings}
+        if not settings:
+            return jsonify({"Ingestion Route Error": "No mapping settings to update"}), 400
+
+        mappings = update_mappings(
+            global_boto3_session.client('lambda'),
+            get_stream_arn(global_boto3_session, stream_name),
+            current_app.config["INGEST_FUNCTION_NAME"],
+            settings,
+        )
+        if not mappings:
+            return jsonify({"Ingestion Route Error": f"No event source mapping for stream {stream_name}"}), 404
+
+        return jsonify({"mappings": [describe_mapping(mapping) for mapping in mappings]})
+    except Exception as e:
+        return jsonify({"Ingestion Route Error": str(e)}), 400
+
+
+@api.route('/rollups', methods=['GET'])
+def view_rollups():
+    try:
+        client = current_app.get_ch_client()
+        source = request.args.get("source")
+        rollups = [
+            describe_rollup(rollup)
+            for rollup in current_app.rollups.get(client)
+            if source is None or rollup["source"] == source
+        ]
+        return jsonify({"rollups": rollups})
+    except Exception as e:
+        return jsonify({"Rollups Route Error": str(e)}), 400
+
+
+@api.route('/rollups', methods=['POST'])
+def add_rollup():
+    """
+    Creates an AggregatingMergeTree rollup of a table and the materialized
+    view that keeps it up to date. Existing rows are added by backfill.
+    """
+    try:
+        client = current_app.get_ch_client()
+        data = request.json or {}
+        database, _, table = str(data.get("source", "")).rpartition(".")
+        catalog = current_app.catalog.get(client, include_columns=True)
+        columns = catalog.get(database or "default", {}).get(table, [])
+
+        rollup = parse_rollup(data, {column["name"]: column["type"] for column in columns})
+        rollup, create_table_query, create_view_query = create_rollup(
+            client, rollup, dedup_window=current_app.config["ROLLUP_DEDUP_WINDOW"]
+        )
+        current_app.catalog.invalidate()
+        current_app.rollups.invalidate()
+
+        return jsonify({
+            "rollup": describe_rollup(rollup),
+            "createTableQuery": create_table_query,
+            "createViewQuery": create_view_query,
+        })
+    except Exception as e:
+        return jsonify({"Rollups Route Error": str(e)}), 400
+
+
+@api.route('/rollups/<database>/<name>/backfill', methods=['POST'])
+def backfill_rollup(database, name):
+    """
+    Aggregates the rows that predate the rollup's view, a chunk at a time,
+    for up to ROLLUP_BACKFILL_MAX_SECONDS; call again until it is ready.
+    """
+    try:
+        client = current_app.get_ch_client()
+        rollup = current_app.rollups.find(client, database, name)
+        if rollup is None:
+            return jsonify({"Rollups Route Error": f"No rollup {database}.{name}"}), 404
+
+        rollup = backfill(
+            client,
+            rollup,
+            chunk_seconds=current_app.config["ROLLUP_BACKFILL_CHUNK"],
+            deadline=monotonic() + current_app.config["ROLLUP_BACKFILL_MAX_SECONDS"],
+        )
+        current_app.rollups.invalidate()
+        return jsonify({"rollup": describe_rollup(rollup)})
+    except Exception as e:
+        return jsonify({"Rollups Route Error": str(e)}), 400
+
+
+@api.route('/rollups/<database>/<name>', methods=['DELETE'])
+def remove_rollup(database, name):
+    try:
+        client = current_app.get_ch_client()
+        rollup = current_app.rollups.find(client, database, name)
+        if rollup is None:
+            return jsonify({"Rollups Route Error": f"No rollup {database}.{name}"}), 404
+
+        drop_rollup(client, rollup)
+        current_app.catalog.invalidate()
+        current_app.rollups.invalidate()
+        return jsonify({"dropped": f"{database}.{name}"})
+    except Exception as e:
+        return jsonify({"Rollups Route Error": str(e)}), 400
+
+
 @api.route('/sources', methods=['GET'])
 def view_sources():
     client = current_app.get_ch_client()
     global global_boto3_session
 
     try:
-        dynamo_client = global_boto3_session.resource("dynamodb")
-        dynamo_table = dynamo_client.Table("stream_table_map")
-        response = dynamo_table.scan()
-        items = response['Items']
-        
+        data_sources = current_app.sources_cache.get("sources")
+        if data_sources is not None:
+            return jsonify(data_sources)
+
+        items = scan_stream_table_map(
+            global_boto3_session, segments=current_app.config["DYNAMODB_SCAN_SEGMENTS"]
+        )
+        tables_info = get_tables_info(client, [item['table_id'] for item in items])
+
         data_sources = []
         for item in items:
+            if item['table_id'] not in tables_info:
+                logger.warning(f"No ClickHouse table found for mapping {item}")
+                continue
             stream_type, stream_name = parse_source_arn(item['stream_id'])
-            table_name, created_on = get_table_info(client, item['table_id'])
+            table_name, created_on = tables_info[item['table_id']]
             created_on = f"{created_on:%m-%d-%Y}"
             data_sources.append({
                 'streamName': stream_name,
@@ -227,6 +741,7 @@ def view_sources():
                 'createdOn': created_on
             })
 
+        current_app.sources_cache.set("sources", data_sources)
         return jsonify(data_sources)
     except Exception as e:
         return jsonify({"Sources Route Error": str(e)}), 400
@@ -239,6 +754,13 @@ def get_api_key():
     
     return jsonify({"api_key": api_key})
 
+def get_openai_options():
+    return {
+        "timeout": (current_app.config["OPENAI_CONNECT_TIMEOUT"], current_app.config["OPENAI_TIMEOUT"]),
+        "endpoint": current_app.config["OPENAI_API_URL"],
+        "cache": current_app.openai_cache,
+    }
+
 @api.route('/api-response', methods=["POST"])
 def view_api_output():
     api_key = current_app.config.get("CHAT_GPT_API_KEY")
@@ -246,11 +768,53 @@ def view_api_output():
         prompt = request.json.get("prompt")
         if not prompt:
             return jsonify({"error": "No prompt provided"}), 400
-        
-        text = fetch_openai_output(prompt, api_key)
+
+        openai_options = get_openai_options()
+
+        if request.json.get("stream"):
+            return summary_event_stream(
+                stream_openai_output(prompt, api_key, **openai_options)
+            )
+
+        text = fetch_openai_output(prompt, api_key, **openai_options)
         if text is None:
             return jsonify({"error": "Failed to get response from OpenAI"}), 500
 
         return jsonify({"response": text})
     except Exception as e:
-        return jsonify({"error": "An unexpected error occurred"}), 500
\ No newline at end of file
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+@api.route('/api-response/query', methods=["POST"])
+def view_query_summary():
+    """
+    Summarizes the rows of a query or table without shipping them through
+    the browser: ClickHouse groups identical rows and keeps the most
+    frequent ones, and only that compact table is sent to OpenAI.
+    """
+    api_key = current_app.config.get("CHAT_GPT_API_KEY")
+    try:
+        query_string, group_by, top_k, token_budget = destructure_summary_request(request)
+        validate_read_only(query_string)
+
+        client = current_app.get_ch_client()
+        columns = describe_query(client, query_string)
+        summary_query = create_summary_query(query_string, columns, group_by, top_k)
+        prompt, metadata = build_summary_prompt(client.query(summary_query), token_budget)
+    except Exception as e:
+        return jsonify({"Summary Route Error": str(e)}), 400
+
+    try:
+        openai_options = get_openai_options()
+
+        if request.json.get("stream"):
+            return summary_event_stream(
+                stream_openai_output(prompt, api_key, **openai_options)
+            )
+
+        text = fetch_openai_output(prompt, api_key, **openai_options)
+        if text is None:
+            return jsonify({"error": "Failed to get response from OpenAI"}), 500
+
+        return jsonify({"response": text, "metadata": metadata})
+    except Exception as e:
+        return jsonify({"error": "An unexpected error occurred"}), 500
@@ -1,16 +1,34 @@
 import logging
 import os
+import tempfile
+from contextlib import contextmanager
 import clickhouse_connect
+from clickhouse_connect.driver import httputil
+from clickhouse_connect.driver.exceptions import OperationalError
 from dotenv import load_dotenv
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from app.api.routes import api
+from app.utils.catalog import Catalog
+from app.utils.compression import ResponseCompressor
+from app.utils.guardrails import QueryGuard
+from app.utils.jobs import JobManager
+from app.utils.json_provider import ORJSONProvider
+from app.utils.metrics import instrument_app, instrument_client, metrics_response
+from app.utils.pool import ClientPool, track_connection_errors
+from app.utils.rollups import RollupRegistry
+from app.utils.cache import FileBackend, MemoryBackend, ResultCache, TTLCache
 from flask import g
 
 
+def env_flag(name, default="false"):
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+
 def create_app(config=None, client=None):
     print(f"Creating app with config: {config}")
     app = Flask(__name__, static_folder='../dist')
+    app.json = ORJSONProvider(app)
     CORS(app)
     
     @app.route('/', defaults={'path': ''})
@@ -30,7 +48,69 @@ def create_app(config=None, client=None):
     app.config["CH_PORT"] = int(os.getenv("CH_PORT", 8123))
     app.config["CH_USER"] = os.getenv("CH_USER", "default")
     app.config["CH_PASSWORD"] = os.getenv("CH_PASSWORD", "")
+    # Wire compression between the client and ClickHouse: lz4, zstd, gzip, br or none.
+    app.config["CH_COMPRESS"] = os.getenv("CH_COMPRESS", "lz4")
+    app.config["CH_POOL_SIZE"] = int(os.getenv("CH_POOL_SIZE", 8))
+    app.config["CH_POOL_ACQUIRE_TIMEOUT"] = float(os.getenv("CH_POOL_ACQUIRE_TIMEOUT", 10))
+    app.config["CH_POOL_HEALTH_CHECK_INTERVAL"] = float(os.getenv("CH_POOL_HEALTH_CHECK_INTERVAL", 30))
+    app.config["CH_POOL_KEEP_IDLE"] = int(os.getenv("CH_POOL_KEEP_IDLE", 30))
+    # Response encodings in preference order; empty disables compression.
+    app.config["RESPONSE_COMPRESSION"] = os.getenv("RESPONSE_COMPRESSION", "zstd,br,gzip")
+    app.config["RESPONSE_COMPRESSION_MIN_SIZE"] = int(os.getenv("RESPONSE_COMPRESSION_MIN_SIZE", 1024))
+    app.config["METRICS_ENABLED"] = env_flag("METRICS_ENABLED", "true")
     app.config["CHAT_GPT_API_KEY"] = os.getenv("CHAT_GPT_API_KEY", "")
+    app.config["OPENAI_API_URL"] = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+    app.config["OPENAI_CONNECT_TIMEOUT"] = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+    app.config["OPENAI_TIMEOUT"] = float(os.getenv("OPENAI_TIMEOUT", 30))
+    app.config["OPENAI_CACHE_TTL"] = int(os.getenv("OPENAI_CACHE_TTL", 3600))
+    app.config["OPENAI_CACHE_SIZE"] = int(os.getenv("OPENAI_CACHE_SIZE", 256))
+    app.config["QUERY_COUNT_CACHE_TTL"] = int(os.getenv("QUERY_COUNT_CACHE_TTL", 300))
+    app.config["QUERY_COUNT_CACHE_SIZE"] = int(os.getenv("QUERY_COUNT_CACHE_SIZE", 1024))
+    app.config["QUERY_CACHE_ENABLED"] = env_flag("QUERY_CACHE_ENABLED", "true")
+    app.config["QUERY_CACHE_TTL"] = int(os.getenv("QUERY_CACHE_TTL", 60))
+    app.config["QUERY_CACHE_MAX_BYTES"] = int(os.getenv("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    app.config["QUERY_CACHE_VALIDATE_INTERVAL"] = float(os.getenv("QUERY_CACHE_VALIDATE_INTERVAL", 1))
+    # Set to a shared directory (e.g. /dev/shm/helios-query-cache) to share
+    # cached results between gunicorn workers; empty keeps it per process.
+    app.config["QUERY_CACHE_DIR"] = os.getenv("QUERY_CACHE_DIR", "")
+    # Per-query limits for /api/query; 0 leaves the server default.
+    app.config["QUERY_MAX_EXECUTION_TIME"] = int(os.getenv("QUERY_MAX_EXECUTION_TIME", 60))
+    app.config["QUERY_MAX_RESULT_ROWS"] = int(os.getenv("QUERY_MAX_RESULT_ROWS", 1000000))
+    app.config["QUERY_MAX_MEMORY_USAGE"] = int(os.getenv("QUERY_MAX_MEMORY_USAGE", 0))
+    # off, warn or reject queries whose EXPLAIN ESTIMATE exceeds the thresholds.
+    app.config["QUERY_ESTIMATE_MODE"] = os.getenv("QUERY_ESTIMATE_MODE", "off")
+    app.config["QUERY_MAX_ESTIMATED_ROWS"] = int(os.getenv("QUERY_MAX_ESTIMATED_ROWS", 0))
+    app.config["QUERY_MAX_ESTIMATED_BYTES"] = int(os.getenv("QUERY_MAX_ESTIMATED_BYTES", 0))
+    app.config["JOBS_DIR"] = os.getenv("JOBS_DIR", os.path.join(tempfile.gettempdir(), "helios-jobs"))
+    app.config["JOBS_MAX_WORKERS"] = int(os.getenv("JOBS_MAX_WORKERS", 2))
+    app.config["JOBS_MAX_QUEUED"] = int(os.getenv("JOBS_MAX_QUEUED", 16))
+    app.config["JOBS_RETENTION"] = int(os.getenv("JOBS_RETENTION", 3600))
+    app.config["JOBS_MAX_EXECUTION_TIME"] = int(os.getenv("JOBS_MAX_EXECUTION_TIME", 3600))
+    app.config["JOBS_MAX_RESULT_ROWS"] = int(os.getenv("JOBS_MAX_RESULT_ROWS", 0))
+    app.config["CATALOG_REFRESH_INTERVAL"] = float(os.getenv("CATALOG_REFRESH_INTERVAL", 10))
+    app.config["SOURCES_CACHE_TTL"] = int(os.getenv("SOURCES_CACHE_TTL", 30))
+    app.config["DYNAMODB_SCAN_SEGMENTS"] = int(os.getenv("DYNAMODB_SCAN_SEGMENTS", 1))
+    app.config["KINESIS_SAMPLE_SIZE"] = int(os.getenv("KINESIS_SAMPLE_SIZE", 10))
+    app.config["KINESIS_SAMPLE_DEADLINE"] = float(os.getenv("KINESIS_SAMPLE_DEADLINE", 5))
+    app.config["KINESIS_SAMPLE_ITERATOR_TYPE"] = os.getenv("KINESIS_SAMPLE_ITERATOR_TYPE", "TRIM_HORIZON")
+    app.config["LOW_CARDINALITY_RATIO"] = float(os.getenv("LOW_CARDINALITY_RATIO", 0.5))
+    app.config["LOW_CARDINALITY_MIN_SAMPLES"] = int(os.getenv("LOW_CARDINALITY_MIN_SAMPLES", 10))
+    app.config["LAYOUT_TTL_DAYS"] = int(os.getenv("LAYOUT_TTL_DAYS", 0))
+    # Inserted blocks whose hashes new tables keep for insert deduplication; 0 disables.
+    # Off by default: inserts without a token are deduplicated by a hash of
+    # their data, so identical batches from the Lambda would be dropped.
+    app.config["LAYOUT_DEDUP_WINDOW"] = int(os.getenv("LAYOUT_DEDUP_WINDOW", 0))
+    # Rewrite eligible /api/query aggregates to read a ready rollup.
+    app.config["ROLLUP_ROUTING"] = env_flag("ROLLUP_ROUTING", "true")
+    # Rollup tables only take view blocks and tokened backfill chunks, so
+    # they keep insert hashes by default.
+    app.config["ROLLUP_DEDUP_WINDOW"] = int(os.getenv("ROLLUP_DEDUP_WINDOW", 1000))
+    app.config["ROLLUP_BACKFILL_CHUNK"] = int(os.getenv("ROLLUP_BACKFILL_CHUNK", 86400))
+    app.config["ROLLUP_BACKFILL_MAX_SECONDS"] = float(os.getenv("ROLLUP_BACKFILL_MAX_SECONDS", 30))
+    app.config["INGEST_FUNCTION_NAME"] = os.getenv("INGEST_FUNCTION_NAME", "kinesis-to-clickhouse-dev")
+    app.config["INGEST_TARGET_INSERTS_PER_SECOND"] = float(os.getenv("INGEST_TARGET_INSERTS_PER_SECOND", 1))
+    app.config["INGEST_CONSUMER_RECORDS_PER_SECOND"] = int(os.getenv("INGEST_CONSUMER_RECORDS_PER_SECOND", 500))
+    app.config["INGEST_METRICS_WINDOW"] = int(os.getenv("INGEST_METRICS_WINDOW", 3600))
 
     if config:
         logger.debug(f"Updating config: {config}")
@@ -40,32 +120,133 @@ def create_app(config=None, client=None):
 
     app.register_blueprint(api, url_prefix='/api')
 
+    if app.config["METRICS_ENABLED"]:
+        instrument_app(app)
+        app.add_url_rule("/metrics", "metrics", metrics_response)
+
+    encodings = [e.strip() for e in app.config["RESPONSE_COMPRESSION"].split(",") if e.strip()]
+    if encodings:
+        app.after_request(
+            ResponseCompressor(encodings, min_size=app.config["RESPONSE_COMPRESSION_MIN_SIZE"])
+        )
+
+    app.count_cache = TTLCache(
+        max_entries=app.config["QUERY_COUNT_CACHE_SIZE"],
+        ttl=app.config["QUERY_COUNT_CACHE_TTL"],
+    )
+
+    app.query_guard = QueryGuard(
+        max_execution_time=app.config["QUERY_MAX_EXECUTION_TIME"],
+        max_result_rows=app.config["QUERY_MAX_RESULT_ROWS"],
+        max_memory_usage=app.config["QUERY_MAX_MEMORY_USAGE"],
+        estimate_mode=app.config["QUERY_ESTIMATE_MODE"],
+        max_estimated_rows=app.config["QUERY_MAX_ESTIMATED_ROWS"],
+        max_estimated_bytes=app.config["QUERY_MAX_ESTIMATED_BYTES"],
+    )
+
+    app.catalog = Catalog(refresh_interval=app.config["CATALOG_REFRESH_INTERVAL"])
+    app.rollups = RollupRegistry(refresh_interval=app.config["CATALOG_REFRESH_INTERVAL"])
+    app.openai_cache = TTLCache(
+        max_entries=app.config["OPENAI_CACHE_SIZE"],
+        ttl=app.config["OPENAI_CACHE_TTL"],
+    )
+    app.sources_cache = TTLCache(max_entries=1, ttl=app.config["SOURCES_CACHE_TTL"])
+
+    app.query_cache = None
+    if app.config["QUERY_CACHE_ENABLED"]:
+        cache_dir = app.config["QUERY_CACHE_DIR"]
+        app.query_cache = ResultCache(
+            backend=FileBackend(cache_dir) if cache_dir else MemoryBackend(),
+            max_bytes=app.config["QUERY_CACHE_MAX_BYTES"],
+            ttl=app.config["QUERY_CACHE_TTL"],
+            validate_interval=app.config["QUERY_CACHE_VALIDATE_INTERVAL"],
+        )
+
+    pool_manager = httputil.get_pool_manager(
+        maxsize=app.config["CH_POOL_SIZE"],
+        keep_idle=app.config["CH_POOL_KEEP_IDLE"],
+    )
+
+    ch_compress = app.config["CH_COMPRESS"].strip().lower()
+    if ch_compress in ("", "none", "false", "0"):
+        ch_compress = False
+
+    def create_ch_client():
+        logger.debug("Creating new ClickHouse client")
+        try:
+            ch_client = clickhouse_connect.get_client(
+                host=app.config["CH_HOST"],
+                port=app.config["CH_PORT"],
+                username=app.config["CH_USER"],
+                password=app.config["CH_PASSWORD"],
+                pool_mgr=pool_manager,
+                compress=ch_compress,
+            )
+            if app.config["METRICS_ENABLED"]:
+                instrument_client(ch_client)
+            track_connection_errors(ch_client)
+            logger.debug("ClickHouse client created successfully")
+            return ch_client
+        except Exception as e:
+            logger.error(f"Failed to create ClickHouse client: {str(e)}")
+            raise
+
+    app.ch_pool = ClientPool(
+        create_ch_client,
+        size=app.config["CH_POOL_SIZE"],
+        acquire_timeout=app.config["CH_POOL_ACQUIRE_TIMEOUT"],
+        health_check_interval=app.config["CH_POOL_HEALTH_CHECK_INTERVAL"],
+    )
+
     def get_ch_client():
         if 'ch_client' not in g:
             if client:
                 g.ch_client = client
             else:
-                logger.debug("Creating new ClickHouse client")
-                try:
-                    g.ch_client = clickhouse_connect.get_client(
-                        host=app.config["CH_HOST"],
-                        port=app.config["CH_PORT"],
-                        username=app.config["CH_USER"],
-                        password=app.config["CH_PASSWORD"],
-                    )
-                    logger.debug("ClickHouse client created successfully")
-                except Exception as e:
-                    logger.error(f"Failed to create ClickHouse client: {str(e)}")
-                    raise
+                g.ch_client = app.ch_pool.acquire()
         return g.ch_client
 
     @app.teardown_appcontext
-    def close_ch_client(e=None):
+    def release_ch_client(e=None):
         ch_client = g.pop('ch_client', None)
+        broken = g.pop('ch_client_broken', False) or isinstance(e, OperationalError)
         if ch_client is not None and ch_client != client:
-            ch_client.close()
+            app.ch_pool.release(ch_client, broken=broken)
     
+    @contextmanager
+    def checkout_ch_client():
+        """
+        Pool checkout for work outside a request, e.g. background jobs.
+        """
+        if client:
+            yield client
+            return
+        ch_client = app.ch_pool.acquire()
+        broken = False
+        try:
+            yield ch_client
+        except OperationalError:
+            broken = True
+            raise
+        finally:
+            app.ch_pool.release(ch_client, broken=broken)
+
     app.get_ch_client = get_ch_client
+    app.checkout_ch_client = checkout_ch_client
+
+    job_settings = {
+        "max_execution_time": app.config["JOBS_MAX_EXECUTION_TIME"],
+        "max_result_rows": app.config["JOBS_MAX_RESULT_ROWS"],
+        "max_memory_usage": app.config["QUERY_MAX_MEMORY_USAGE"],
+    }
+    app.jobs = JobManager(
+        app.config["JOBS_DIR"],
+        checkout_ch_client,
+        max_workers=app.config["JOBS_MAX_WORKERS"],
+        max_queued=app.config["JOBS_MAX_QUEUED"],
+        retention=app.config["JOBS_RETENTION"],
+        settings={name: value for name, value in job_settings.items() if value},
+    )
 
     return app
 
@@ -0,0 +1,30 @@
+import threading
+
+from app.utils.metrics import instrument_session
+
+
+class ThreadSafeSession:
+    """
+    boto3 sessions must not be used from several threads at once, but the
+    clients they create can be. This wrapper creates each client once, under
+    a lock, and shares it between request threads (gthread) or greenlets
+    (gevent). Resources are not thread-safe either, so a fresh one is built
+    per call, also under the lock. Calls made through either are timed for
+    /metrics.
+    """
+
+    def __init__(self, session):
+        self.session = instrument_session(session)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, service_name):
+        with self._lock:
+            client = self._clients.get(service_name)
+            if client is None:
+                client = self._clients[service_name] = self.session.client(service_name)
+            return client
+
+    def resource(self, service_name):
+        with self._lock:
+            return self.session.resource(service_name)
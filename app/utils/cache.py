@@ -0,0 +1,454 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from time import monotonic, time
+
+import orjson
+
+from app.utils.json_provider import ORJSON_OPTIONS, default, stdlib_dumps
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache where every entry also expires after a TTL.
+    Used for values that are cheap to hold but expensive to recompute,
+    e.g. the total row count behind a paginated query.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+# /query result cache
+MISSING = object()
+
+TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+((?:`[^`]+`|\"[^\"]+\"|\w+)(?:\.(?:`[^`]+`|\"[^\"]+\"|\w+))?)(?![\w.]|\s*\()",
+    re.IGNORECASE,
+)
+
+# Calls whose result changes between runs of the same query, so caching it
+# would serve a stale answer until the TTL.
+NON_DETERMINISTIC_PATTERN = re.compile(
+    r"\b(?:now|now64|nowInBlock|today|yesterday|rand\w*|random\w*|generateUUIDv\d|generateULID"
+    r"|generateSnowflakeID|fuzzBits|uptime)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query_string):
+    """
+    Collapses whitespace outside of quoted literals and drops trailing
+    semicolons, so formatting differences between dashboards share an entry.
+    Returns the normalized SQL and a copy with string literals blanked out
+    that is safe to scan for table references.
+    """
+    normalized = []
+    scannable = []
+    i = 0
+    n = len(query_string)
+    pending_space = False
+
+    while i < n:
+        char = query_string[i]
+        if char.isspace():
+            pending_space = True
+            i += 1
+            continue
+        if pending_space and normalized:
+            normalized.append(" ")
+            scannable.append(" ")
+        pending_space = False
+
+        if char in "'\"`":
+            end = i + 1
+            while end < n and query_string[end] != char:
+                end += 2 if query_string[end] == "\\" else 1
+            literal = query_string[i:end + 1]
+            normalized.append(literal)
+            scannable.append(literal if char != "'" else "''")
+            i = end + 1
+            continue
+
+        normalized.append(char)
+        scannable.append(char)
+        i += 1
+
+    normalized = "".join(normalized).rstrip("; ")
+    return normalized, "".join(scannable)
+
+
+def referenced_tables(scannable_query, default_database="default"):
+    tables = set()
+    for match in TABLE_REFERENCE_PATTERN.finditer(scannable_query):
+        parts = [part.strip('`"') for part in match.group(1).split(".", 1)]
+        if len(parts) == 1:
+            parts.insert(0, default_database)
+        tables.add(tuple(parts))
+    return tables
+
+
+def get_table_versions(client, tables):
+    """
+    One round trip over system.tables/system.parts. A table's version changes
+    when its metadata is modified or when its set of active parts changes
+    (inserts, merges, mutations, drops). Only MergeTree tables have parts to
+    watch; views and other engines come back as None, like missing tables.
+    """
+    if not tables:
+        return {}
+
+    names = sorted(f"{database}.{name}" for database, name in tables)
+    res = client.query(
+        """
+        SELECT
+            t.database,
+            t.name,
+            toString(t.metadata_modification_time),
+            p.parts,
+            p.rows,
+            toString(p.last_modified)
+        FROM system.tables AS t
+        LEFT JOIN (
+            SELECT database, table, count() AS parts, sum(rows) AS rows,
+                   max(modification_time) AS last_modified
+            FROM system.parts
+            WHERE active AND has({names:Array(String)}, concat(database, '.', table))
+            GROUP BY database, table
+        ) AS p ON p.database = t.database AND p.table = t.name
+        WHERE has({names:Array(String)}, concat(t.database, '.', t.name))
+          AND t.engine LIKE '%MergeTree'
+        """,
+        parameters={"names": names},
+    )
+    versions = {table: None for table in tables}
+    for database, name, *version in res.result_rows:
+        versions[(database, name)] = tuple(str(value) for value in version)
+    return versions
+
+
+def encode_entry(entry):
+    """
+    Cache entries are JSON, not pickle, so whoever can write to a shared
+    cache directory can't run code in the workers that read it. They are
+    encoded like API responses, so a hit renders the same bytes the miss
+    did. Payloads holding (U)Int128/256 values beyond 64 bits go through
+    the stdlib encoder, whose decoder keeps their precision; the first byte
+    records which one wrote the entry.
+    """
+    try:
+        return b"o" + orjson.dumps(entry, default=default, option=ORJSON_OPTIONS)
+    except TypeError:
+        return b"j" + stdlib_dumps(entry).encode("utf-8")
+
+
+def decode_entry(payload):
+    if payload[:1] == b"o":
+        return orjson.loads(payload[1:])
+    return json.loads(payload[1:])
+
+
+def version_list(versions):
+    """Table versions as JSON-friendly [database, table, version] triples."""
+    return [
+        [database, name, None if version is None else list(version)]
+        for (database, name), version in sorted(versions.items())
+    ]
+
+
+class MemoryBackend:
+    shared = False
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+            return payload
+
+    def set(self, key, payload):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = payload
+            self.size += len(payload)
+
+    def delete(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+    def evict(self, max_bytes):
+        evicted = 0
+        with self._lock:
+            while self.size > max_bytes and self._entries:
+                _, payload = self._entries.popitem(last=False)
+                self.size -= len(payload)
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileBackend:
+    """
+    Stores one file per entry in a directory that every gunicorn worker on
+    the host can see. File mtime is the LRU clock. Pointing the directory at
+    /dev/shm keeps the shared cache in memory.
+    """
+
+    shared = True
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.entry")
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".entry"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    @property
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                payload = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return payload
+
+    def set(self, key, payload):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, max_bytes):
+        evicted = 0
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = sorted(self._entries())
+            size = sum(entry_size for _, entry_size, _ in entries)
+            for _, entry_size, path in entries:
+                if size <= max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    evicted += 1
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+        return evicted
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class ResultCache:
+    """
+    Caches whole /query responses keyed by normalized SQL. Entries expire
+    after ttl seconds, the cache is bounded to max_bytes of encoded payload
+    with LRU eviction, and an entry is dropped as soon as any table it reads
+    from changes. Table versions are looked up at most once every
+    validate_interval seconds, so a burst of identical dashboard queries
+    costs a single system.tables/system.parts round trip.
+    """
+
+    def __init__(self, backend=None, max_bytes=64 * 1024 * 1024, ttl=60, validate_interval=1):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._versions = TTLCache(max_entries=4096, ttl=validate_interval)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+
+    def _prepare(self, query_string, parameters, variant=None):
+        normalized, scannable = normalize_query(query_string)
+        tables = referenced_tables(scannable)
+        if not tables or any(database == "system" for database, _ in tables):
+            return None, None
+        if NON_DETERMINISTIC_PATTERN.search(scannable):
+            return None, None
+        key_parts = [normalized, parameters]
+        if variant is not None:
+            key_parts.append(variant)
+        raw_key = json.dumps(key_parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest(), tables
+
+    def _current_versions(self, client, tables):
+        versions = {}
+        missing = set()
+        for table in tables:
+            version = self._versions.get(table, MISSING)
+            if version is MISSING:
+                missing.add(table)
+            else:
+                versions[table] = version
+        if missing:
+            for table, version in get_table_versions(client, missing).items():
+                self._versions.set(table, version)
+                versions[table] = version
+        return versions
+
+    def lookup(self, client, query_string, parameters=None, variant=None):
+        """
+        Returns (response, entry). On a miss response is None and entry
+        holds the key and the table versions read *before* the query runs,
+        to be handed back to store(); a change that lands while the query is
+        running then invalidates the entry instead of being masked by it.
+        entry is None when the query is not cacheable. variant separates
+        differently shaped responses to the same query.
+        """
+        key, tables = self._prepare(query_string, parameters, variant)
+        if key is None:
+            return None, None
+
+        versions = self._current_versions(client, tables)
+        # A view's result changes with tables it doesn't show a version for.
+        if any(version is None for version in versions.values()):
+            return None, None
+        payload = self.backend.get(key)
+        if payload is not None:
+            try:
+                expires_at, cached_versions, response = decode_entry(payload)
+            except ValueError:
+                # Not an entry this cache wrote; drop it like a stale one.
+                expires_at = cached_versions = response = None
+            if expires_at is not None and expires_at > time() and cached_versions == version_list(versions):
+                self._count("hits")
+                return response, None
+            self.backend.delete(key)
+            self._count("invalidations")
+
+        self._count("misses")
+        return None, (key, versions)
+
+    def store(self, entry, response):
+        if entry is None:
+            return
+
+        key, versions = entry
+        payload = encode_entry((time() + self.ttl, version_list(versions), response))
+        if len(payload) > self.max_bytes:
+            return
+
+        self.backend.set(key, payload)
+        evicted = self.backend.evict(self.max_bytes)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def clear(self):
+        self.backend.clear()
+        self._versions.clear()
+
+    def stats(self):
+        """
+        entries and bytes describe the backend, which a FileBackend shares
+        with every worker; the lookup counters under "process" are this
+        worker's own.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "shared": self.backend.shared,
+            "entries": len(self.backend),
+            "bytes": self.backend.size,
+            "max_bytes": self.max_bytes,
+            "process": {
+                "pid": os.getpid(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            },
+        }
+
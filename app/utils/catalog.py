@@ -0,0 +1,103 @@
+import threading
+from time import monotonic
+
+FINGERPRINT_QUERY = """
+    SELECT
+        d.name,
+        groupBitXor(cityHash64(t.name, t.metadata_modification_time)) AS fingerprint
+    FROM system.databases AS d
+    LEFT JOIN (
+        SELECT database, name, metadata_modification_time
+        FROM system.tables
+        WHERE NOT is_temporary
+    ) AS t ON t.database = d.name
+    GROUP BY d.name
+"""
+
+TABLES_QUERY = """
+    SELECT database, name
+    FROM system.tables
+    WHERE NOT is_temporary AND has({databases:Array(String)}, database)
+    ORDER BY database, name
+"""
+
+COLUMNS_QUERY = """
+    SELECT database, table, name, type
+    FROM system.columns
+    WHERE has({databases:Array(String)}, database)
+    ORDER BY database, table, position
+"""
+
+
+class Catalog:
+    """
+    In-memory copy of the database -> table (-> columns) map behind
+    /api/databases. Requests inside refresh_interval are served without
+    touching ClickHouse. After that a single fingerprint query over
+    system.databases/system.tables tells which databases changed, and only
+    those are reloaded, with one system.tables query and, when columns have
+    been asked for before, one system.columns query.
+    """
+
+    def __init__(self, refresh_interval=10):
+        self.refresh_interval = refresh_interval
+        self._fingerprints = {}
+        self._tables = {}
+        self._columns = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._checked_at = None
+
+    def get(self, client, include_columns=False):
+        with self._lock:
+            if include_columns and self._columns is None:
+                self._columns = {}
+                self._fingerprints = {}
+                self._checked_at = None
+
+            if self._checked_at is None or monotonic() - self._checked_at >= self.refresh_interval:
+                self._refresh(client)
+
+            if include_columns:
+                return {
+                    db: {table: self._columns.get(db, {}).get(table, []) for table in tables}
+                    for db, tables in self._tables.items()
+                }
+            return {db: list(tables) for db, tables in self._tables.items()}
+
+    def _refresh(self, client):
+        fingerprints = {
+            db: fingerprint for db, fingerprint in client.query(FINGERPRINT_QUERY).result_rows
+        }
+        changed = [db for db, fp in fingerprints.items() if self._fingerprints.get(db) != fp]
+
+        for db in set(self._tables) - set(fingerprints):
+            self._tables.pop(db, None)
+            if self._columns is not None:
+                self._columns.pop(db, None)
+
+        if changed:
+            self._load(client, changed)
+
+        self._fingerprints = fingerprints
+        self._checked_at = monotonic()
+
+    def _load(self, client, databases):
+        parameters = {"databases": databases}
+
+        tables = {db: [] for db in databases}
+        for db, name in client.query(TABLES_QUERY, parameters=parameters).result_rows:
+            tables[db].append(name)
+        self._tables.update(tables)
+        self._tables = dict(sorted(self._tables.items()))
+
+        if self._columns is not None:
+            columns = {db: {} for db in databases}
+            for db, table, name, col_type in client.query(
+                COLUMNS_QUERY, parameters=parameters
+            ).result_rows:
+                columns[db].setdefault(table, []).append({"name": name, "type": col_type})
+            self._columns.update(columns)
@@ -0,0 +1,138 @@
+import gzip
+import zlib
+
+import brotli
+import zstandard
+from flask import request
+
+ENCODINGS = ("zstd", "br", "gzip")
+
+# Levels chosen for latency: each is within a few percent of the encoder's
+# best ratio on JSON results at a fraction of the CPU cost.
+LEVELS = {"zstd": 3, "br": 4, "gzip": 6}
+
+COMPRESSIBLE_MIMETYPES = frozenset(
+    [
+        "application/json",
+        "application/x-ndjson",
+        "application/vnd.apache.arrow.stream",
+        "application/javascript",
+        "text/event-stream",
+        "text/html",
+        "text/css",
+        "text/javascript",
+        "text/plain",
+        "image/svg+xml",
+    ]
+)
+
+
+def compress(encoding, data):
+    level = LEVELS[encoding]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+class StreamEncoder:
+    """
+    Incremental encoder that flushes after every chunk, so a client reading
+    an NDJSON, SSE or Arrow stream can decode each chunk as soon as it
+    arrives instead of waiting for the compressor's window to fill.
+    """
+
+    def __init__(self, encoding):
+        level = LEVELS[encoding]
+        self.encoding = encoding
+        if encoding == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        elif encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        if self.encoding == "zstd":
+            return self._compressor.compress(chunk) + self._compressor.flush(
+                zstandard.COMPRESSOBJ_FLUSH_BLOCK
+            )
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class ResponseCompressor:
+    """
+    after_request hook that encodes responses with the best encoding both
+    sides support, in the server's preference order. Buffered responses
+    smaller than min_size are sent as is. Streamed responses are always
+    encoded, chunk by chunk.
+    """
+
+    def __init__(self, encodings=None, min_size=1024):
+        unknown = set(encodings or ()) - set(ENCODINGS)
+        if unknown:
+            raise ValueError(
+                f"Unsupported response encodings {sorted(unknown)}, expected {list(ENCODINGS)}"
+            )
+        self.encodings = list(encodings or ENCODINGS)
+        self.min_size = min_size
+
+    def negotiate(self, accept_encodings):
+        best, best_quality = None, 0
+        for encoding in self.encodings:
+            quality = accept_encodings[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def __call__(self, response):
+        if (
+            not self.encodings
+            or response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed or response.direct_passthrough:
+            response.direct_passthrough = False
+            response.response = self._encode_stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(compress(encoding, data))
+
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _encode_stream(self, chunks, encoding):
+        encoder = StreamEncoder(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if chunk:
+                    yield encoder.compress(chunk)
+            yield encoder.finish()
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
@@ -0,0 +1,151 @@
+import re
+import uuid
+
+from app.utils.helpers import strip_query
+
+ESTIMATE_MODES = ("off", "warn", "reject")
+QUERY_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+TABLE_SIZES_QUERY = """
+    SELECT database, name, total_bytes, total_rows
+    FROM system.tables
+    WHERE (database, name) IN {tables:Array(Tuple(String, String))}
+"""
+
+
+class QueryRejectedError(ValueError):
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+def new_query_id(requested=None):
+    """
+    Uses the client supplied id when it is well formed, so a dashboard can
+    cancel a query it is still waiting on; otherwise generates one.
+    """
+    if requested is None:
+        return f"helios-{uuid.uuid4()}"
+    if not isinstance(requested, str) or not QUERY_ID_PATTERN.match(requested):
+        raise ValueError("queryId must be 1-128 letters, digits or _.:- characters")
+    return requested
+
+
+class QueryGuard:
+    """
+    Limits attached to every user query. settings() returns the per-query
+    ClickHouse settings (a limit of 0 is left at the server default), and
+    check() optionally runs EXPLAIN ESTIMATE first and warns about or
+    rejects queries expected to read more than max_estimated_rows rows or
+    max_estimated_bytes bytes.
+    """
+
+    def __init__(
+        self,
+        max_execution_time=0,
+        max_result_rows=0,
+        max_memory_usage=0,
+        estimate_mode="off",
+        max_estimated_rows=0,
+        max_estimated_bytes=0,
+    ):
+        if estimate_mode not in ESTIMATE_MODES:
+            raise ValueError(f"estimate_mode must be one of {list(ESTIMATE_MODES)}")
+        self.limits = {
+            "max_execution_time": max_execution_time,
+            "max_result_rows": max_result_rows,
+            "max_memory_usage": max_memory_usage,
+        }
+        self.estimate_mode = estimate_mode
+        self.max_estimated_rows = max_estimated_rows
+        self.max_estimated_bytes = max_estimated_bytes
+
+    def settings(self, query_id=None, buffered=True):
+        """
+        max_result_rows is only attached to buffered results: streamed and
+        Arrow responses never hold the whole result, so they aren't capped.
+        """
+        settings = {name: value for name, value in self.limits.items() if value}
+        if not buffered:
+            settings.pop("max_result_rows", None)
+        if query_id is not None:
+            settings["query_id"] = query_id
+        return settings
+
+    def result_rows_error(self, error):
+        """
+        A clearer error for a buffered query that hit max_result_rows, or
+        None when `error` is something else.
+        """
+        if "TOO_MANY_ROWS" not in str(error):
+            return None
+        return ValueError(
+            f"The result has more than {self.limits['max_result_rows']} rows (QUERY_MAX_RESULT_ROWS). "
+            "Page through it, stream it, or run it as a job."
+        )
+
+    def estimate(self, client, query_string, parameters=None):
+        """
+        Sums EXPLAIN ESTIMATE over every table the query reads. Bytes are
+        extrapolated from each table's average row size in system.tables,
+        which is only queried when a byte threshold is configured.
+        """
+        result = client.query(
+            f"EXPLAIN ESTIMATE {strip_query(query_string)}", parameters=parameters
+        )
+        rows_by_table = {}
+        estimate = {"rows": 0, "parts": 0, "marks": 0, "bytes": None}
+        for database, table, parts, rows, marks in result.result_rows:
+            rows_by_table[(database, table)] = rows_by_table.get((database, table), 0) + rows
+            estimate["rows"] += rows
+            estimate["parts"] += parts
+            estimate["marks"] += marks
+
+        if self.max_estimated_bytes and rows_by_table:
+            estimate["bytes"] = 0
+            sizes = client.query(
+                TABLE_SIZES_QUERY, parameters={"tables": list(rows_by_table)}
+            ).result_rows
+            for database, table, total_bytes, total_rows in sizes:
+                if total_rows:
+                    row_bytes = (total_bytes or 0) / total_rows
+                    estimate["bytes"] += int(rows_by_table[(database, table)] * row_bytes)
+        return estimate
+
+    def check(self, client, query_string, parameters=None):
+        """
+        Returns a list of warnings (empty when the estimate is within
+        limits or estimation is off). Raises QueryRejectedError instead in
+        reject mode.
+        """
+        if self.estimate_mode == "off" or not (self.max_estimated_rows or self.max_estimated_bytes):
+            return []
+
+        estimate = self.estimate(client, query_string, parameters)
+        warnings = []
+        if self.max_estimated_rows and estimate["rows"] > self.max_estimated_rows:
+            warnings.append(
+                f"Query is estimated to read {estimate['rows']} rows "
+                f"(limit {self.max_estimated_rows})"
+            )
+        if self.max_estimated_bytes and (estimate["bytes"] or 0) > self.max_estimated_bytes:
+            warnings.append(
+                f"Query is estimated to read {estimate['bytes']} bytes "
+                f"(limit {self.max_estimated_bytes})"
+            )
+
+        if warnings and self.estimate_mode == "reject":
+            raise QueryRejectedError("; ".join(warnings), estimate)
+        return warnings
+
+
+def cancel_query(client, query_id):
+    """
+    Issues KILL QUERY for query_id and returns the ids ClickHouse matched
+    (empty if nothing with that id is running).
+    """
+    result = client.query(
+        "KILL QUERY WHERE query_id = {query_id:String} ASYNC",
+        parameters={"query_id": query_id},
+    )
+    return [row[1] for row in result.result_rows]
@@ -1,21 +1,24 @@
+import base64
+import hashlib
 import json
+import logging
 import re
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 
 from boto3.dynamodb.conditions import Key
-from flask import jsonify
+from boto3.dynamodb.types import TypeDeserializer
 import requests
 
-# get-databases route
-def get_db_names(client):
-    return [db["name"] for db in client.query("SHOW DATABASES").named_results()]
+from app.utils.sql_validator import (
+    SQLValidationError,
+    validate_create_table,
+    validate_read_only,
+)
 
+logger = logging.getLogger(__name__)
 
-def get_tables_in_db(client, db_name):
-    return [
-        table["name"]
-        for table in client.query(f"SHOW TABLES FROM {db_name}").named_results()
-    ]
+IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
 
 
 # query route
@@ -33,9 +36,118 @@ def destructure_query_request(request):
     return query_string, page, page_size, offset
 
 
+def strip_query(query_string):
+    return query_string.strip().rstrip(";").strip()
+
+
+def wrap_query(query_string):
+    # The closing paren goes on its own line so a trailing -- comment can't swallow it.
+    return f"(\n{strip_query(query_string)}\n)"
+
+
 def create_paginated_query(query_string, page_size, offset):
-    paginated_query = f"{query_string} LIMIT {page_size} OFFSET {offset}"
-    return paginated_query
+    # Wrapped rather than appended: a query with its own LIMIT can't take a second one.
+    return f"SELECT * FROM {wrap_query(query_string)} LIMIT {int(page_size)} OFFSET {int(offset)}"
+
+
+def create_count_query(query_string):
+    return f"SELECT count() FROM {wrap_query(query_string)}"
+
+
+def describe_query(client, query_string, parameters=None):
+    res = client.query(f"DESCRIBE {wrap_query(query_string)}", parameters=parameters)
+    return [(row[0], row[1]) for row in res.result_rows]
+
+
+def get_total_rows(client, query_string, count_cache, settings=None):
+    """
+    Counts the rows behind a paginated query once and serves later pages of
+    the same query from count_cache until the entry expires.
+    """
+    key = " ".join(strip_query(query_string).split())
+    total_rows = count_cache.get(key)
+    if total_rows is None:
+        total_rows = int(
+            client.query(create_count_query(query_string), settings=settings).first_row[0]
+        )
+        count_cache.set(key, total_rows)
+    return total_rows
+
+
+# keyset (seek) pagination
+def destructure_seek_request(request):
+    seek_columns = request.json.get("seek")
+    cursor = request.json.get("cursor")
+
+    if isinstance(seek_columns, str):
+        seek_columns = [seek_columns]
+    if not seek_columns or not all(
+        isinstance(col, str) and IDENTIFIER_PATTERN.match(col) for col in seek_columns
+    ):
+        raise ValueError("seek must be a list of column names")
+
+    after = decode_seek_cursor(cursor, seek_columns) if cursor else None
+    return seek_columns, after
+
+
+def create_seek_query(query_string, seek_columns, after, page_size):
+    """
+    Builds `WHERE (a, b) > (last a, last b) ORDER BY a, b LIMIT n` in its
+    expanded OR form so ClickHouse can use the leading sort key column for
+    index analysis. Cursor values are bound as String query parameters,
+    which ClickHouse converts to the column type when comparing.
+    """
+    columns = [f"`{col}`" for col in seek_columns]
+    parameters = {}
+    where = ""
+
+    if after is not None:
+        terms = []
+        for i, col in enumerate(columns):
+            parameters[f"seek_{i}"] = after[i]
+            equal = [f"{columns[j]} = {{seek_{j}:String}}" for j in range(i)]
+            terms.append(" AND ".join([*equal, f"{col} > {{seek_{i}:String}}"]))
+        where = " WHERE " + " OR ".join(f"({term})" for term in terms)
+
+    seek_query = (
+        f"SELECT * FROM {wrap_query(query_string)}{where}"
+        f" ORDER BY {', '.join(columns)}"
+        f" LIMIT {int(page_size)}"
+    )
+    return seek_query, parameters
+
+
+def encode_seek_cursor(seek_columns, row):
+    values = [_seek_value(row[col]) for col in seek_columns]
+    payload = json.dumps({"columns": seek_columns, "values": values})
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+def decode_seek_cursor(cursor, seek_columns):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        columns, values = payload["columns"], payload["values"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    if columns != seek_columns or len(values) != len(seek_columns):
+        raise ValueError("Cursor does not match the seek columns")
+    if not all(isinstance(value, str) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _seek_value(value):
+    if value is None:
+        raise ValueError("seek columns cannot contain NULL values")
+    if isinstance(value, datetime):
+        fmt = "%Y-%m-%d %H:%M:%S.%f" if value.microsecond else "%Y-%m-%d %H:%M:%S"
+        return value.strftime(fmt)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
 
 
 # create-table route
@@ -67,16 +179,59 @@ def get_table_id(client, table_name):
     return res.first_row[0]
 
 
-def get_table_info(client, table_id):
+# sources route
+def get_tables_info(client, table_ids):
+    """
+    Resolves many table UUIDs in one round trip.
+    Returns {table_id: (name, metadata_modification_time)}.
+    """
+    if not table_ids:
+        return {}
+
     res = client.query(
-        f"""
-        SELECT name, metadata_modification_time
+        """
+        SELECT toString(uuid), name, metadata_modification_time
         FROM system.tables
         WHERE database = 'default'
-        AND toString(uuid) = '{table_id}'
-        """
+        AND has({table_ids:Array(String)}, toString(uuid))
+        """,
+        parameters={"table_ids": sorted(set(table_ids))},
     )
-    return res.first_row
+    return {table_id: (name, created_on) for table_id, name, created_on in res.result_rows}
+
+
+def scan_stream_table_map(session, segments=1):
+    """
+    Reads every item of the stream_table_map table, following
+    LastEvaluatedKey past the 1 MB page limit. With segments > 1 the table
+    is read as a parallel scan, one thread per segment. Uses the low-level
+    client because, unlike resources, clients are safe to share between
+    threads.
+    """
+    dynamo_client = session.client("dynamodb")
+    deserializer = TypeDeserializer()
+
+    def scan_segment(segment):
+        items = []
+        kwargs = {"TableName": "stream_table_map"}
+        if segments > 1:
+            kwargs.update(Segment=segment, TotalSegments=segments)
+
+        while True:
+            response = dynamo_client.scan(**kwargs)
+            items.extend(
+                {key: deserializer.deserialize(value) for key, value in item.items()}
+                for item in response.get("Items", [])
+            )
+            if "LastEvaluatedKey" not in response:
+                return items
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    if segments <= 1:
+        return scan_segment(0)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return [item for items in executor.map(scan_segment, range(segments)) for item in items]
 
 
 def parse_source_arn(stream_id):
@@ -97,27 +252,12 @@ def parse_source_arn_name(stream_type, stream_id):
 
 
 def is_sql_injection(query, create_table=False):
-    dangerous_keywords = [
-        "DROP",
-        "DELETE",
-        "TRUNCATE",
-        "ALTER",
-        "INSERT",
-        "EXEC",
-        "EXECUTE",
-        "UPDATE",
-        "UNION",
-        "--",
-    ]
-
-    if create_table:
-        dangerous_keywords.append(";")
-
-    pattern = (
-        r"\b(" + "|".join(re.escape(keyword) for keyword in dangerous_keywords) + r")\b"
-    )
-
-    if re.search(pattern, query, re.IGNORECASE):
+    try:
+        if create_table:
+            validate_create_table(query)
+        else:
+            validate_read_only(query)
+    except SQLValidationError:
         return True
     return False
 
@@ -141,8 +281,21 @@ def add_table_stream_dynamodb(session, stream_arn, ch_table_id):
 
     dynamo_table.put_item(Item={"stream_id": stream_arn, "table_id": str(ch_table_id)})
 
-def fetch_openai_output(prompt, api_key):
-    endpoint = 'https://api.openai.com/v1/chat/completions'
+# api-response route
+OPENAI_ENDPOINT = 'https://api.openai.com/v1/chat/completions'
+OPENAI_MODEL = "gpt-4o"
+OPENAI_SYSTEM_PROMPT = "You are to take in a table of error data for input. Then provide a precise informative summary of the errors. Please be insightful. No markdown please. No symbols like *, #, etc for formatting. Prefer to keep it short and simple."
+
+# One keep-alive connection pool for every OpenAI call in this process,
+# instead of a new TLS handshake per request.
+# Mounted for http:// too, so an OPENAI_API_URL proxy gets the same pool.
+openai_session = requests.Session()
+openai_adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16)
+openai_session.mount("https://", openai_adapter)
+openai_session.mount("http://", openai_adapter)
+
+
+def build_openai_request(prompt, api_key, stream=False):
     headers = {
         'Authorization': f"Bearer {api_key}",
         'Content-Type': 'application/json'
@@ -152,7 +305,7 @@ def fetch_openai_output(prompt, api_key):
         "messages": [
             {
                 "role": "system",
-                "content": "You are to take in a table of error data for input. Then provide a precise informative summary of the errors. Please be insightful. No markdown please. No symbols like *, #, etc for formatting. Prefer to keep it short and simple."
+                "content": OPENAI_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -160,13 +313,81 @@ def fetch_openai_output(prompt, api_key):
             }
         ],
         "max_tokens": 500,
-        "model": "gpt-4o"
+        "model": OPENAI_MODEL
     }
+    if stream:
+        body["stream"] = True
+
+    return headers, body
+
+
+def openai_cache_key(prompt):
+    content = json.dumps([OPENAI_MODEL, OPENAI_SYSTEM_PROMPT, prompt])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def fetch_openai_output(prompt, api_key, timeout=None, endpoint=OPENAI_ENDPOINT, cache=None):
+    """
+    cache is an optional TTLCache; identical prompts are answered from it
+    instead of paying for another completion.
+    """
+    key = openai_cache_key(prompt)
+    if cache is not None:
+        text = cache.get(key)
+        if text is not None:
+            return text
+
+    headers, body = build_openai_request(prompt, api_key)
 
     try:
-        response = requests.post(endpoint, headers=headers, json=body)
+        response = openai_session.post(endpoint, headers=headers, json=body, timeout=timeout)
         data = response.json()
-        return data['choices'][0]['message']['content']
+        text = data['choices'][0]['message']['content']
     except requests.RequestException as error:
-        print(f"An error occurred: {error}")
-        return None
\ No newline at end of file
+        logger.error(f"OpenAI request failed: {error}")
+        return None
+
+    if cache is not None:
+        cache.set(key, text)
+    return text
+
+
+def stream_openai_output(prompt, api_key, timeout=None, endpoint=OPENAI_ENDPOINT, cache=None):
+    """
+    Yields the summary as text deltas while OpenAI generates it. The full
+    text is cached once the stream ends with `data: [DONE]` (a connection
+    that closes early leaves a partial summary), and a cached summary is
+    yielded as a single chunk.
+    """
+    key = openai_cache_key(prompt)
+    if cache is not None:
+        text = cache.get(key)
+        if text is not None:
+            yield text
+            return
+
+    headers, body = build_openai_request(prompt, api_key, stream=True)
+    chunks = []
+    done = False
+
+    with openai_session.post(
+        endpoint, headers=headers, json=body, timeout=timeout, stream=True
+    ) as response:
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                done = True
+                break
+            choices = json.loads(payload).get("choices") or [{}]
+            delta = choices[0].get("delta", {}).get("content")
+            if delta:
+                chunks.append(delta)
+                yield delta
+
+    if not done:
+        logger.warning("OpenAI stream ended without [DONE]; the summary may be incomplete")
+    elif cache is not None and chunks:
+        cache.set(key, "".join(chunks))
@@ -0,0 +1,168 @@
+"""
+Tuning for the Lambda event source mapping that feeds a table from its
+Kinesis stream. Every batch Lambda receives becomes one ClickHouse insert,
+and every insert a new part, so the mapping settings decide how fast parts
+pile up: BatchSize=3 under load means hundreds of tiny inserts a second and
+"too many parts".
+"""
+from datetime import datetime, timedelta, timezone
+from math import ceil
+
+from botocore.exceptions import ClientError
+
+# Request key -> (create/update_event_source_mapping parameter, min, max),
+# with the limits Lambda enforces for Kinesis sources.
+MAPPING_SETTINGS = {
+    "batchSize": ("BatchSize", 1, 10000),
+    "maximumBatchingWindowInSeconds": ("MaximumBatchingWindowInSeconds", 0, 300),
+    "parallelizationFactor": ("ParallelizationFactor", 1, 10),
+}
+
+# Lambda's synchronous invocation payload limit is 6 MB; stay under it
+# once records are base64 encoded in the event.
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+MIN_SUGGESTED_BATCH_SIZE = 100
+
+
+def parse_mapping_settings(data):
+    """
+    Returns the create/update_event_source_mapping parameters for the
+    camelCase settings present in `data`. Raises ValueError on values
+    Lambda would reject.
+    """
+    settings = {}
+    for key, (parameter, low, high) in MAPPING_SETTINGS.items():
+        value = (data or {}).get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"{key} must be an integer")
+        if not low <= value <= high:
+            raise ValueError(f"{key} must be between {low} and {high}")
+        settings[parameter] = value
+    return settings
+
+
+def describe_settings(settings):
+    return {
+        key: settings.get(parameter)
+        for key, (parameter, low, high) in MAPPING_SETTINGS.items()
+    }
+
+
+def stream_stats(session, stream_name, window=3600):
+    """
+    Shard count and record rate of a stream. The rate comes from the
+    stream's CloudWatch IncomingRecords/IncomingBytes over the last
+    `window` seconds: the average and the busiest minute. It is None when
+    CloudWatch has no data points (new streams, or no permission).
+    """
+    summary = session.client("kinesis").describe_stream_summary(StreamName=stream_name)[
+        "StreamDescriptionSummary"
+    ]
+    stats = {
+        "streamARN": summary["StreamARN"],
+        "shardCount": int(summary["OpenShardCount"]),
+        "recordsPerSecond": None,
+        "peakRecordsPerSecond": None,
+        "averageRecordBytes": None,
+    }
+
+    cloudwatch = session.client("cloudwatch")
+    ends_at = datetime.now(timezone.utc)
+    sums = {}
+    for metric in ("IncomingRecords", "IncomingBytes"):
+        try:
+            response = cloudwatch.get_metric_statistics(
+                Namespace="AWS/Kinesis",
+                MetricName=metric,
+                Dimensions=[{"Name": "StreamName", "Value": stream_name}],
+                StartTime=ends_at - timedelta(seconds=window),
+                EndTime=ends_at,
+                Period=60,
+                Statistics=["Sum"],
+            )
+        except ClientError:
+            return stats
+        sums[metric] = [point["Sum"] for point in response["Datapoints"]]
+
+    records = sums["IncomingRecords"]
+    if records:
+        stats["recordsPerSecond"] = round(sum(records) / window, 3)
+        stats["peakRecordsPerSecond"] = round(max(records) / 60, 3)
+        if sum(records):
+            stats["averageRecordBytes"] = round(sum(sums["IncomingBytes"]) / sum(records))
+    return stats
+
+
+def suggest_mapping_settings(
+    shard_count,
+    records_per_second=None,
+    average_record_bytes=None,
+    target_inserts_per_second=1.0,
+    consumer_records_per_second=500,
+):
+    """
+    Settings that keep the table at about `target_inserts_per_second`
+    inserts:
+
+    - ParallelizationFactor: 1 unless a shard brings in more records than
+      one invocation at a time keeps up with (`consumer_records_per_second`).
+      Each extra batcher is another stream of inserts.
+    - MaximumBatchingWindowInSeconds: long enough that shards x
+      parallelization batchers, each flushing once per window, stay near
+      the target insert rate.
+    - BatchSize: twice what a batcher receives in one window at the
+      `records_per_second` rate, so the window rather than the size closes
+      batches, capped by Lambda's payload limit.
+    """
+    shards = max(shard_count or 1, 1)
+    per_shard = (records_per_second or 0) / shards
+
+    parallelization = min(max(ceil(per_shard / consumer_records_per_second), 1), 10)
+    batchers = shards * parallelization
+    window = min(max(ceil(batchers / target_inserts_per_second), 1), 300)
+
+    batch_size = ceil(per_shard / parallelization * window * 2)
+    high = 10000
+    if average_record_bytes:
+        high = min(high, max(MAX_BATCH_BYTES // average_record_bytes, 1))
+    batch_size = min(max(batch_size, MIN_SUGGESTED_BATCH_SIZE), high)
+
+    return {
+        "BatchSize": batch_size,
+        "MaximumBatchingWindowInSeconds": window,
+        "ParallelizationFactor": parallelization,
+    }
+
+
+def list_mappings(lambda_client, stream_arn, function_name):
+    mappings = []
+    kwargs = {"EventSourceArn": stream_arn, "FunctionName": function_name}
+    while True:
+        response = lambda_client.list_event_source_mappings(**kwargs)
+        mappings.extend(response.get("EventSourceMappings", []))
+        marker = response.get("NextMarker")
+        if not marker:
+            return mappings
+        kwargs["Marker"] = marker
+
+
+def describe_mapping(mapping):
+    return {
+        "uuid": mapping["UUID"],
+        "state": mapping.get("State"),
+        **describe_settings(mapping),
+    }
+
+
+def update_mappings(lambda_client, stream_arn, function_name, settings):
+    """
+    Applies `settings` in place to every mapping from the stream to the
+    function; the mappings keep their UUID and checkpoint.
+    """
+    return [
+        lambda_client.update_event_source_mapping(UUID=mapping["UUID"], **settings)
+        for mapping in list_mappings(lambda_client, stream_arn, function_name)
+    ]
@@ -0,0 +1,314 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import time
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from app.utils.guardrails import cancel_query
+from app.utils.helpers import describe_query, strip_query
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PREFIX = "helios-job-"
+TERMINAL_STATUSES = ("finished", "failed", "cancelled")
+
+PROGRESS_QUERY = """
+    SELECT read_rows, read_bytes, total_rows_approx, elapsed, memory_usage
+    FROM system.processes
+    WHERE query_id = {query_id:String}
+"""
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+class JobNotFoundError(Exception):
+    pass
+
+
+class JobManager:
+    """
+    Runs long queries in a bounded background executor and spools their
+    results to `directory` as Arrow IPC files, one record batch per
+    ClickHouse block. Job state lives next to the results as JSON so any
+    gunicorn worker can report status, serve pages or cancel a job that
+    another worker is running. Pages are read by memory mapping only the
+    batches they overlap, so fetching a page never re-runs the query.
+    """
+
+    def __init__(
+        self,
+        directory,
+        checkout_client,
+        max_workers=2,
+        max_queued=16,
+        retention=3600,
+        settings=None,
+    ):
+        self.directory = directory
+        self.checkout_client = checkout_client
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.retention = retention
+        self.settings = settings or {}
+        os.makedirs(directory, exist_ok=True)
+        self._lock_path = os.path.join(directory, ".lock")
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="query-job"
+        )
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._cleaned_at = 0
+
+    def _path(self, job_id, suffix):
+        return os.path.join(self.directory, f"{job_id}{suffix}")
+
+    def _write_state(self, job):
+        tmp = self._path(job["id"], f".json.{os.getpid()}.{threading.get_ident()}")
+        with open(tmp, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job["id"], ".json"))
+
+    @contextmanager
+    def _state_lock(self):
+        # Serializes status changes across threads and worker processes, so
+        # a cancel is never overwritten by the executor's next write.
+        with open(self._lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _update_state(self, job, **changes):
+        """
+        Applies changes and writes the job unless it was cancelled (or
+        deleted) meanwhile; returns whether it was written.
+        """
+        with self._state_lock():
+            try:
+                current = self.load(job["id"])
+            except JobNotFoundError:
+                return False
+            if current["status"] == "cancelled":
+                job.update(status="cancelled")
+                return False
+            job.update(changes)
+            self._write_state(job)
+            return True
+
+    def load(self, job_id):
+        if not job_id.startswith(JOB_ID_PREFIX) or os.sep in job_id:
+            raise JobNotFoundError(job_id)
+        try:
+            with open(self._path(job_id, ".json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise JobNotFoundError(job_id)
+
+    def submit(self, query_string, parameters=None):
+        if self._pid != os.getpid():
+            self._reset()
+        self.cleanup()
+
+        with self._lock:
+            if self._pending >= self.max_queued:
+                raise JobQueueFullError(
+                    f"Too many query jobs in progress (limit {self.max_queued})"
+                )
+            self._pending += 1
+
+        job = {
+            "id": f"{JOB_ID_PREFIX}{uuid.uuid4()}",
+            "status": "queued",
+            "query": query_string,
+            "submitted_at": time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "row_count": None,
+            "column_names": None,
+            "column_types": None,
+            "batch_rows": None,
+        }
+        self._write_state(job)
+        try:
+            self._executor.submit(self._run, job, parameters)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job
+
+    def _run(self, job, parameters):
+        try:
+            if not self._update_state(job, status="running", started_at=time()):
+                return
+            self._execute(job, parameters)
+        except Exception as e:
+            self._remove_results(job["id"])
+            if self._update_state(job, status="failed", error=str(e), finished_at=time()):
+                logger.warning(f"Query job {job['id']} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _execute(self, job, parameters):
+        partial = self._path(job["id"], ".arrow.partial")
+        query_string = strip_query(job["query"])
+        settings = {**self.settings, "query_id": job["id"]}
+        batch_rows = []
+        writer = None
+
+        with self.checkout_client() as client:
+            columns = describe_query(client, query_string, parameters)
+            if not self._update_state(
+                job,
+                column_names=[name for name, _ in columns],
+                column_types=[col_type for _, col_type in columns],
+            ):
+                return
+
+            stream = client.query_arrow_stream(
+                query_string, parameters=parameters, settings=settings, use_strings=True
+            )
+            try:
+                with stream:
+                    for batch in stream:
+                        if writer is None:
+                            writer = ipc.new_file(partial, batch.schema)
+                        if batch.num_rows:
+                            writer.write_batch(batch)
+                            batch_rows.append(batch.num_rows)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+        if writer is not None:
+            os.replace(partial, self._path(job["id"], ".arrow"))
+        finished = self._update_state(
+            job,
+            status="finished",
+            finished_at=time(),
+            row_count=sum(batch_rows),
+            batch_rows=batch_rows,
+        )
+        if not finished:
+            self._remove_results(job["id"])
+
+    def status(self, job_id, client=None):
+        """
+        Returns the job state; while it is running and a client is given,
+        adds progress read from system.processes.
+        """
+        job = self.load(job_id)
+        response = {key: value for key, value in job.items() if key != "batch_rows"}
+
+        if job["status"] == "running" and client is not None:
+            rows = client.query(PROGRESS_QUERY, parameters={"query_id": job_id}).result_rows
+            if rows:
+                read_rows, read_bytes, total_rows_approx, elapsed, memory_usage = rows[0]
+                response["progress"] = {
+                    "read_rows": read_rows,
+                    "read_bytes": read_bytes,
+                    "total_rows_approx": total_rows_approx,
+                    "elapsed": elapsed,
+                    "memory_usage": memory_usage,
+                    "fraction": (
+                        min(read_rows / total_rows_approx, 1.0) if total_rows_approx else None
+                    ),
+                }
+        return response
+
+    def read_page(self, job_id, offset, limit):
+        """
+        Returns (job, rows) for rows [offset, offset + limit) of a finished
+        job, reading only the record batches that overlap the page.
+        """
+        job = self.load(job_id)
+        if job["status"] != "finished":
+            raise ValueError(f"Job is {job['status']}, results are not available")
+        if not job["row_count"] or offset >= job["row_count"]:
+            return job, []
+
+        batches = []
+        start = 0
+        skip = None
+        with pa.memory_map(self._path(job_id, ".arrow")) as source:
+            reader = ipc.open_file(source)
+            for i, num_rows in enumerate(job["batch_rows"]):
+                end = start + num_rows
+                if end > offset and start < offset + limit:
+                    if skip is None:
+                        skip = offset - start
+                    batches.append(reader.get_batch(i))
+                elif start >= offset + limit:
+                    break
+                start = end
+            rows = pa.Table.from_batches(batches).slice(skip, limit).to_pylist()
+        return job, rows
+
+    def cancel(self, job_id, client):
+        """
+        Marks the job cancelled (a queued job is then skipped by the
+        executor) and kills its query if it is running on any worker. A job
+        that already ended is deleted along with its results.
+        """
+        with self._state_lock():
+            job = self.load(job_id)
+            if job["status"] in TERMINAL_STATUSES:
+                self.delete(job_id)
+                return {**job, "status": "deleted"}
+            job.update(status="cancelled", finished_at=time())
+            self._write_state(job)
+        cancel_query(client, job_id)
+        return job
+
+    def delete(self, job_id):
+        self._remove_results(job_id)
+        self._remove(self._path(job_id, ".json"))
+
+    def _remove_results(self, job_id):
+        self._remove(self._path(job_id, ".arrow.partial"))
+        self._remove(self._path(job_id, ".arrow"))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self, now=None):
+        """
+        Deletes jobs that finished more than `retention` seconds ago, and
+        jobs stuck queued or running for twice that long (their worker
+        died). Runs at most once a minute from submit().
+        """
+        now = now or time()
+        if now - self._cleaned_at < 60:
+            return
+        self._cleaned_at = now
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            job_id = name[: -len(".json")]
+            try:
+                job = self.load(job_id)
+            except (JobNotFoundError, ValueError):
+                continue
+            if job["status"] in TERMINAL_STATUSES:
+                expired = now - job["finished_at"] > self.retention
+            else:
+                expired = now - job["submitted_at"] > 2 * self.retention
+            if expired:
+                self.delete(job_id)
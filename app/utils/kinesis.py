@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import monotonic
+
+ITERATOR_TYPES = ("LATEST", "TRIM_HORIZON", "AT_TIMESTAMP")
+
+# Kinesis allows 5 GetRecords calls per second per shard.
+POLL_INTERVAL = 0.2
+
+
+def list_shard_ids(kinesis_client, stream_name):
+    shard_ids = []
+    kwargs = {"StreamName": stream_name}
+    while True:
+        response = kinesis_client.list_shards(**kwargs)
+        shard_ids.extend(shard["ShardId"] for shard in response.get("Shards", []))
+        next_token = response.get("NextToken")
+        if not next_token:
+            return shard_ids
+        kwargs = {"NextToken": next_token}
+
+
+def parse_sample_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, (int, float)):
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def sample_stream(
+    kinesis_client,
+    stream_name,
+    count=1,
+    deadline=5,
+    iterator_type="TRIM_HORIZON",
+    timestamp=None,
+    max_workers=16,
+):
+    """
+    Reads every shard of the stream concurrently and returns as soon as
+    `count` records have been collected or `deadline` seconds have passed.
+
+    A shard stops being polled once it is caught up (MillisBehindLatest == 0
+    with nothing returned) unless the iterator is LATEST, where new records
+    can only arrive by waiting. That makes TRIM_HORIZON/AT_TIMESTAMP return
+    immediately on idle streams that still have history.
+    """
+    if iterator_type not in ITERATOR_TYPES:
+        raise ValueError(f"iteratorType must be one of {list(ITERATOR_TYPES)}")
+    if iterator_type == "AT_TIMESTAMP" and timestamp is None:
+        raise ValueError("timestamp is required for AT_TIMESTAMP")
+
+    shard_ids = list_shard_ids(kinesis_client, stream_name)
+    if not shard_ids:
+        return []
+
+    ends_at = monotonic() + deadline
+    done = threading.Event()
+    lock = threading.Lock()
+    records = []
+
+    iterator_kwargs = {"StreamName": stream_name, "ShardIteratorType": iterator_type}
+    if iterator_type == "AT_TIMESTAMP":
+        iterator_kwargs["Timestamp"] = parse_sample_timestamp(timestamp)
+
+    def read_shard(shard_id):
+        shard_iterator = kinesis_client.get_shard_iterator(
+            ShardId=shard_id, **iterator_kwargs
+        )["ShardIterator"]
+
+        while shard_iterator and not done.is_set() and monotonic() < ends_at:
+            with lock:
+                remaining = count - len(records)
+            if remaining <= 0:
+                break
+
+            response = kinesis_client.get_records(ShardIterator=shard_iterator, Limit=remaining)
+            shard_records = response.get("Records", [])
+            shard_iterator = response.get("NextShardIterator")
+
+            with lock:
+                for record in shard_records[: count - len(records)]:
+                    records.append(
+                        {
+                            "shardId": shard_id,
+                            "sequenceNumber": record.get("SequenceNumber"),
+                            "arrivalTimestamp": record.get("ApproximateArrivalTimestamp"),
+                            "data": record["Data"],
+                        }
+                    )
+                if len(records) >= count:
+                    done.set()
+
+            if shard_records:
+                continue
+            caught_up = response.get("MillisBehindLatest", 0) == 0
+            if caught_up and iterator_type != "LATEST":
+                break
+            done.wait(min(POLL_INTERVAL, max(ends_at - monotonic(), 0)))
+
+    workers = min(len(shard_ids), max_workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(read_shard, shard_id) for shard_id in shard_ids]
+        try:
+            for future in futures:
+                future.result()
+        finally:
+            done.set()
+
+    return records
@@ -0,0 +1,272 @@
+import os
+from time import perf_counter
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# prometheus_client switches to file-backed values when this is set before it
+# is imported; gunicorn.conf.py sets it so every worker writes to the same
+# directory and /metrics sums them.
+MULTIPROC_DIR_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+# Queries are capped at QUERY_MAX_EXECUTION_TIME (60s by default).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Entry points only: none of these calls another, so nothing is counted twice.
+CLIENT_OPERATIONS = {
+    "query": "query",
+    "command": "command",
+    "insert": "insert",
+    "query_row_block_stream": "stream",
+    "query_arrow_stream": "stream",
+}
+
+HTTP_REQUESTS = Counter(
+    "helios_http_requests_total",
+    "HTTP requests by route and status.",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "helios_http_request_duration_seconds",
+    "HTTP request latency, including the body of streamed responses.",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "helios_http_requests_in_progress",
+    "HTTP requests being served.",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+CLICKHOUSE_DURATION = Histogram(
+    "helios_clickhouse_query_duration_seconds",
+    "ClickHouse call latency; streams are timed until they are closed.",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+CLICKHOUSE_ERRORS = Counter(
+    "helios_clickhouse_query_errors_total",
+    "ClickHouse calls that raised.",
+    ["operation"],
+)
+CLICKHOUSE_READ_ROWS = Counter(
+    "helios_clickhouse_read_rows_total",
+    "Rows read by ClickHouse, from the query summary.",
+    ["operation"],
+)
+CLICKHOUSE_READ_BYTES = Counter(
+    "helios_clickhouse_read_bytes_total",
+    "Bytes read by ClickHouse, from the query summary.",
+    ["operation"],
+)
+CLICKHOUSE_WRITTEN_ROWS = Counter(
+    "helios_clickhouse_written_rows_total",
+    "Rows written by ClickHouse, from the query summary.",
+    ["operation"],
+)
+CLICKHOUSE_RESULT_ROWS = Counter(
+    "helios_clickhouse_result_rows_total",
+    "Rows returned to the API.",
+    ["operation"],
+)
+AWS_DURATION = Histogram(
+    "helios_aws_request_duration_seconds",
+    "AWS API call latency, including botocore retries.",
+    ["service", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+AWS_ERRORS = Counter(
+    "helios_aws_request_errors_total",
+    "AWS API calls that failed.",
+    ["service", "operation"],
+)
+
+
+def metrics_registry():
+    if os.getenv(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def metrics_response():
+    return Response(generate_latest(metrics_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+def instrument_app(app):
+    """
+    Records latency, status and in-flight counts per URL rule (not per path,
+    so label cardinality stays bounded). Timing ends at teardown, which for
+    responses wrapped in stream_with_context is after the last chunk.
+    """
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_labels = (request.method, _route())
+        g.metrics_started = perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(e=None):
+        labels = g.pop("metrics_labels", None)
+        if labels is None:
+            return
+        status = g.pop("metrics_status", 500 if e is not None else 200)
+        HTTP_REQUEST_DURATION.labels(*labels).observe(perf_counter() - g.pop("metrics_started"))
+        HTTP_REQUESTS.labels(*labels, str(status)).inc()
+        HTTP_REQUESTS_IN_PROGRESS.labels(*labels).dec()
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def instrument_client(client):
+    """
+    Wraps a ClickHouse client's query entry points in place to record their
+    latency, errors and the read/written counts ClickHouse reports in the
+    X-ClickHouse-Summary header.
+    """
+    for name, operation in CLIENT_OPERATIONS.items():
+        method = getattr(client, name, None)
+        if method is not None:
+            setattr(client, name, _timed_call(method, operation))
+    return client
+
+
+def _timed_call(method, operation):
+    def call(*args, **kwargs):
+        started = perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            CLICKHOUSE_ERRORS.labels(operation).inc()
+            CLICKHOUSE_DURATION.labels(operation).observe(perf_counter() - started)
+            raise
+        if operation == "stream":
+            return MeteredStream(result, operation, started)
+        CLICKHOUSE_DURATION.labels(operation).observe(perf_counter() - started)
+        record_summary(operation, getattr(result, "summary", None))
+        row_count = getattr(result, "row_count", None)
+        if isinstance(row_count, int):
+            CLICKHOUSE_RESULT_ROWS.labels(operation).inc(row_count)
+        return result
+
+    return call
+
+
+def record_summary(operation, summary):
+    if not isinstance(summary, dict):
+        return
+    for key, counter in (
+        ("read_rows", CLICKHOUSE_READ_ROWS),
+        ("read_bytes", CLICKHOUSE_READ_BYTES),
+        ("written_rows", CLICKHOUSE_WRITTEN_ROWS),
+    ):
+        try:
+            value = int(summary.get(key) or 0)
+        except (TypeError, ValueError):
+            continue
+        if value:
+            counter.labels(operation).inc(value)
+
+
+class MeteredStream:
+    """
+    Stands in for a clickhouse_connect StreamContext and records the stream's
+    duration and row count when it is closed. The summary header arrives
+    before the data, so read counts are not known for streams.
+    """
+
+    def __init__(self, stream, operation, started):
+        self._stream = stream
+        self._operation = operation
+        self._started = started
+        self._rows = 0
+        self._failed = False
+        self._recorded = False
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            block = next(self._stream)
+        except StopIteration:
+            raise
+        except Exception:
+            self._failed = True
+            raise
+        self._rows += block.num_rows if hasattr(block, "num_rows") else len(block)
+        return block
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return self._stream.__exit__(exc_type, exc_val, exc_tb)
+        finally:
+            self._record(failed=self._failed or exc_type is not None)
+
+    def _record(self, failed):
+        if self._recorded:
+            return
+        self._recorded = True
+        CLICKHOUSE_DURATION.labels(self._operation).observe(perf_counter() - self._started)
+        CLICKHOUSE_RESULT_ROWS.labels(self._operation).inc(self._rows)
+        if failed:
+            CLICKHOUSE_ERRORS.labels(self._operation).inc()
+
+
+def instrument_session(session):
+    """
+    Times every API call made by clients and resources created from a boto3
+    session, from botocore's before-call to after-call (or after-call-error)
+    events.
+    """
+    session.events.register("before-call", _before_aws_call)
+    session.events.register("after-call", _after_aws_call)
+    session.events.register("after-call-error", _after_aws_call_error)
+    return session
+
+
+def _before_aws_call(model, context, **kwargs):
+    context["metrics_labels"] = (model.service_model.endpoint_prefix, model.name)
+    context["metrics_started"] = perf_counter()
+
+
+def _after_aws_call(http_response, context, **kwargs):
+    _record_aws_call(context, failed=http_response.status_code >= 300)
+
+
+def _after_aws_call_error(context, **kwargs):
+    _record_aws_call(context, failed=True)
+
+
+def _record_aws_call(context, failed):
+    labels = context.pop("metrics_labels", None)
+    if labels is None:
+        return
+    AWS_DURATION.labels(*labels).observe(perf_counter() - context.pop("metrics_started"))
+    if failed:
+        AWS_ERRORS.labels(*labels).inc()
@@ -0,0 +1,167 @@
+import logging
+import os
+import threading
+from collections import deque
+from time import monotonic
+
+from clickhouse_connect.driver.exceptions import OperationalError
+from flask import g, has_app_context
+
+logger = logging.getLogger(__name__)
+
+# Client calls that talk to ClickHouse; an OperationalError from any of them
+# means the client's connection can't be trusted any more.
+CLIENT_CALLS = ("query", "command", "insert", "raw_query", "query_row_block_stream", "query_arrow_stream")
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+class ClientPool:
+    """
+    Thread-safe pool of ClickHouse clients for one worker process. Clients
+    are created lazily up to `size`, handed out exclusively (a client carries
+    its own session, which ClickHouse refuses to share between concurrent
+    queries) and reused most-recently-released first so idle ones can age
+    out. A client that sat idle longer than health_check_interval is pinged
+    before it is handed out, and broken clients are closed and replaced.
+    """
+
+    def __init__(self, factory, size=8, acquire_timeout=10, health_check_interval=30):
+        self.factory = factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.health_check_interval = health_check_interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = deque()
+        self._in_use = 0
+        self._available = threading.Condition(threading.Lock())
+        self._stats = {
+            "created": 0,
+            "acquired": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "health_checks": 0,
+            "evicted": 0,
+        }
+
+    def _check_fork(self):
+        # A pool inherited through fork (e.g. gunicorn --preload) must not
+        # share sockets with its parent.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def acquire(self):
+        self._check_fork()
+        deadline = monotonic() + self.acquire_timeout
+
+        with self._available:
+            while True:
+                if self._idle:
+                    client, released_at = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.size:
+                    client, released_at = None, None
+                    self._in_use += 1
+                    break
+
+                remaining = deadline - monotonic()
+                self._stats["waits"] += 1
+                if remaining <= 0 or not self._available.wait(remaining):
+                    self._stats["timeouts"] += 1
+                    raise PoolExhaustedError(
+                        f"No ClickHouse client available after {self.acquire_timeout}s "
+                        f"(pool size {self.size})"
+                    )
+
+        try:
+            if client is not None and monotonic() - released_at > self.health_check_interval:
+                self._count("health_checks")
+                if not client.ping():
+                    logger.warning("Evicting ClickHouse client that failed its health check")
+                    self._discard(client)
+                    client = None
+            if client is None:
+                client = self.factory()
+                self._count("created")
+        except Exception:
+            with self._available:
+                self._in_use -= 1
+                self._available.notify()
+            raise
+
+        self._count("acquired")
+        return client
+
+    def release(self, client, broken=False):
+        if self._pid != os.getpid():
+            return
+        if broken:
+            self._discard(client)
+        with self._available:
+            self._in_use -= 1
+            if not broken:
+                self._idle.append((client, monotonic()))
+            self._available.notify()
+
+    def _count(self, name):
+        with self._available:
+            self._stats[name] += 1
+
+    def _discard(self, client):
+        self._count("evicted")
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"Error closing evicted ClickHouse client: {str(e)}")
+
+    def close(self):
+        with self._available:
+            idle, self._idle = self._idle, deque()
+        for client, _ in idle:
+            client.close()
+
+    def stats(self):
+        with self._available:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                **self._stats,
+            }
+
+
+def track_connection_errors(client):
+    """
+    Wraps a pooled client's calls in place so that an OperationalError
+    marks it broken for the current request. Routes turn their exceptions
+    into 400 responses, so the teardown that releases the client never
+    sees them itself.
+    """
+    for name in CLIENT_CALLS:
+        method = getattr(client, name, None)
+        if method is not None:
+            setattr(client, name, _flagged_call(method))
+    return client
+
+
+def _flagged_call(method):
+    def call(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except OperationalError as e:
+            note_connection_error(e)
+            raise
+
+    return call
+
+
+def note_connection_error(e):
+    """Flags the request's client for eviction if e is a connection error."""
+    if isinstance(e, OperationalError) and has_app_context():
+        g.ch_client_broken = True
@@ -0,0 +1,156 @@
+import json
+import logging
+
+from app.utils.helpers import strip_query
+
+logger = logging.getLogger(__name__)
+
+# Settings a profiled query runs with, so it reaches query_log even when the
+# server or user profile turned logging off.
+PROFILE_SETTINGS = {"log_queries": 1, "log_profile_events": 1}
+
+QUERY_LOG_QUERY = """
+    SELECT
+        query_duration_ms,
+        read_rows,
+        read_bytes,
+        result_rows,
+        result_bytes,
+        memory_usage,
+        ProfileEvents['UserTimeMicroseconds'],
+        ProfileEvents['SystemTimeMicroseconds'],
+        ProfileEvents['OSCPUWaitMicroseconds'],
+        ProfileEvents['OSIOWaitMicroseconds'],
+        ProfileEvents['DiskReadElapsedMicroseconds'],
+        ProfileEvents['NetworkSendElapsedMicroseconds'],
+        ProfileEvents['SelectedParts'],
+        ProfileEvents['SelectedMarks']
+    FROM system.query_log
+    WHERE query_id = {query_id:String}
+        AND type = 'QueryFinish'
+        AND event_date >= yesterday()
+    ORDER BY event_time_microseconds DESC
+    LIMIT 1
+"""
+
+
+def profile_query(client, query_string, query_id, parameters=None, round_trip=None):
+    """
+    Execution stats for a query that already finished with `query_id`:
+    counters and the time breakdown from system.query_log (flushed first,
+    as the log is otherwise written every few seconds), plus the parts and
+    granules each table's indexes selected, from EXPLAIN indexes = 1.
+    Either half reports an "error" instead of failing the request.
+    """
+    profile = {"query_id": query_id}
+    try:
+        client.command("SYSTEM FLUSH LOGS")
+        rows = client.query(QUERY_LOG_QUERY, parameters={"query_id": query_id}).result_rows
+        if rows:
+            profile.update(_query_log_stats(rows[0], round_trip))
+        else:
+            profile["error"] = f"Query {query_id} was not found in system.query_log"
+    except Exception as e:
+        logger.warning(f"Failed to read query_log for {query_id}: {str(e)}")
+        profile["error"] = str(e)
+
+    try:
+        profile["tables"] = explain_indexes(client, query_string, parameters)
+    except Exception as e:
+        logger.warning(f"Failed to explain indexes for {query_id}: {str(e)}")
+        profile["explain_error"] = str(e)
+    return profile
+
+
+def _query_log_stats(row, round_trip):
+    (
+        duration_ms,
+        read_rows,
+        read_bytes,
+        result_rows,
+        result_bytes,
+        memory_usage,
+        user_us,
+        system_us,
+        cpu_wait_us,
+        io_wait_us,
+        disk_read_us,
+        network_send_us,
+        selected_parts,
+        selected_marks,
+    ) = row
+    elapsed = {
+        "server_ms": duration_ms,
+        "cpu_user_ms": user_us / 1000,
+        "cpu_system_ms": system_us / 1000,
+        "cpu_wait_ms": cpu_wait_us / 1000,
+        "io_wait_ms": io_wait_us / 1000,
+        "disk_read_ms": disk_read_us / 1000,
+        "network_send_ms": network_send_us / 1000,
+    }
+    if round_trip is not None:
+        # Time this API waited on the query, including transfer and decoding.
+        elapsed["round_trip_ms"] = round(round_trip * 1000, 3)
+    return {
+        "read_rows": read_rows,
+        "read_bytes": read_bytes,
+        "result_rows": result_rows,
+        "result_bytes": result_bytes,
+        "memory_usage": memory_usage,
+        "selected_parts": selected_parts,
+        "selected_marks": selected_marks,
+        "elapsed": elapsed,
+    }
+
+
+def explain_indexes(client, query_string, parameters=None):
+    """
+    One entry per MergeTree read in the plan: the parts and granules
+    considered and selected, and what each index (MinMax, Partition,
+    PrimaryKey, Skip) pruned.
+    """
+    result = client.query(
+        f"EXPLAIN indexes = 1, json = 1 {strip_query(query_string)}", parameters=parameters
+    )
+    plan = json.loads("".join(row[0] for row in result.result_rows))
+    tables = []
+    for node in plan:
+        _collect_reads(node.get("Plan", node), tables)
+    return tables
+
+
+def _collect_reads(node, tables):
+    if node.get("Node Type") == "ReadFromMergeTree":
+        indexes = node.get("Indexes", [])
+        table = {
+            "table": node.get("Description"),
+            "parts": _pruning(node, indexes, "Parts"),
+            "granules": _pruning(node, indexes, "Granules"),
+            "indexes": [
+                {
+                    "type": index.get("Type"),
+                    "name": index.get("Name"),
+                    "keys": index.get("Keys"),
+                    "condition": index.get("Condition"),
+                    "parts": [index.get("Initial Parts"), index.get("Selected Parts")],
+                    "granules": [index.get("Initial Granules"), index.get("Selected Granules")],
+                }
+                for index in indexes
+            ],
+        }
+        tables.append(table)
+    for child in node.get("Plans", []):
+        _collect_reads(child, tables)
+
+
+def _pruning(node, indexes, unit):
+    """
+    {"initial": n, "selected": m}: what the first index started from and
+    what the last one left, or the node's own count when no index applied.
+    """
+    if indexes:
+        return {
+            "initial": indexes[0].get(f"Initial {unit}"),
+            "selected": indexes[-1].get(f"Selected {unit}"),
+        }
+    return {"initial": node.get(unit), "selected": node.get(unit)}
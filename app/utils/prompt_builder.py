@@ -0,0 +1,132 @@
+from app.utils.helpers import IDENTIFIER_PATTERN, wrap_query
+
+# Rough OpenAI tokenizer ratio for English text and tabular data.
+CHARS_PER_TOKEN = 4
+MAX_VALUE_LENGTH = 200
+
+# Columns of these types make nearly every row distinct, so they are
+# summarized per group as first/last seen instead of grouped on.
+TIME_TYPES = ("DateTime", "DateTime64", "Date", "Date32")
+IDENTITY_TYPES = ("UUID",)
+
+
+def destructure_summary_request(request):
+    data = request.json
+    query_string = data.get("query")
+    table = data.get("table")
+    group_by = data.get("groupBy")
+    top_k = int(data.get("topK", 20))
+    token_budget = int(data.get("tokenBudget", 2000))
+
+    if table:
+        parts = table.split(".")
+        if len(parts) > 2 or not all(IDENTIFIER_PATTERN.match(part) for part in parts):
+            raise ValueError("table must be a table name or database.table")
+        query_string = f"SELECT * FROM {table}"
+    if not query_string:
+        raise ValueError("query or table is required")
+    # A bare string would pass per character and then match columns by substring.
+    if group_by is not None and not (
+        isinstance(group_by, list)
+        and all(isinstance(col, str) and IDENTIFIER_PATTERN.match(col) for col in group_by)
+    ):
+        raise ValueError("groupBy must be a list of column names")
+
+    return query_string, group_by, top_k, token_budget
+
+
+def base_type(col_type):
+    for wrapper in ("Nullable(", "LowCardinality("):
+        while col_type.startswith(wrapper):
+            col_type = col_type[len(wrapper):-1]
+    return col_type.split("(")[0]
+
+
+def create_summary_query(query_string, columns, group_by=None, top_k=20):
+    """
+    Groups identical rows inside ClickHouse and keeps the top_k most
+    frequent ones. Long values are truncated, time columns become
+    first_seen/last_seen per group, and window functions carry the total
+    and distinct row counts so one query returns everything the prompt needs.
+    """
+    if group_by:
+        dimensions = [name for name, _ in columns if name in group_by]
+    else:
+        dimensions = [
+            name
+            for name, col_type in columns
+            if base_type(col_type) not in TIME_TYPES + IDENTITY_TYPES
+        ]
+    time_columns = [
+        name for name, col_type in columns if base_type(col_type) in TIME_TYPES and name not in dimensions
+    ]
+    if not dimensions:
+        raise ValueError("No columns to group by")
+
+    select = [
+        f"substring(toString(`{name}`), 1, {MAX_VALUE_LENGTH}) AS `{name}`" for name in dimensions
+    ]
+    select.append("count() AS occurrences")
+    for name in time_columns:
+        select.append(f"min(`{name}`) AS `first_seen_{name}`")
+        select.append(f"max(`{name}`) AS `last_seen_{name}`")
+    select.append("sum(count()) OVER () AS total_rows")
+    select.append("count() OVER () AS distinct_rows")
+
+    return (
+        f"SELECT {', '.join(select)}"
+        f" FROM {wrap_query(query_string)}"
+        f" GROUP BY {', '.join(f'`{name}`' for name in dimensions)}"
+        f" ORDER BY occurrences DESC"
+        f" LIMIT {int(top_k)}"
+    )
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def build_summary_prompt(result, token_budget=2000):
+    """
+    Renders the aggregated rows as a compact tab-separated table, adding
+    rows (most frequent first) only while the prompt stays within
+    token_budget.
+    """
+    names = [name for name in result.column_names if name not in ("total_rows", "distinct_rows")]
+    rows = [dict(zip(result.column_names, row)) for row in result.result_rows]
+    total_rows = rows[0]["total_rows"] if rows else 0
+    distinct_rows = rows[0]["distinct_rows"] if rows else 0
+
+    lines = [
+        f"{total_rows} error rows, {distinct_rows} distinct. "
+        f"Most frequent first, occurrences = number of identical rows:",
+        "\t".join(names),
+    ]
+    used = estimate_tokens("\n".join(lines))
+    rows_in_prompt = 0
+
+    for row in rows:
+        line = "\t".join(_render(row[name]) for name in names)
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+        rows_in_prompt += 1
+
+    if rows_in_prompt < distinct_rows:
+        lines.append(f"({distinct_rows - rows_in_prompt} less frequent distinct rows omitted)")
+
+    metadata = {
+        "total_rows": int(total_rows),
+        "distinct_rows": int(distinct_rows),
+        "rows_in_prompt": rows_in_prompt,
+        "estimated_tokens": estimate_tokens("\n".join(lines)),
+    }
+    return "\n".join(lines), metadata
+
+
+def _render(value):
+    if value is None:
+        return "NULL"
+    return str(value).replace("\t", " ").replace("\n", " ")
@@ -0,0 +1,626 @@
+import json
+import logging
+import re
+import threading
+from datetime import datetime, timezone
+from time import monotonic
+
+from app.utils.helpers import IDENTIFIER_PATTERN, describe_query
+from app.utils.schema_inference import quote_name
+from app.utils.table_layout import TIME_TYPES, type_name, unwrap_type
+
+logger = logging.getLogger(__name__)
+
+# Rollup definitions are kept as JSON in the target table's comment, so
+# they live (and are dropped) with the table and every worker sees them.
+COMMENT_PREFIX = "helios-rollup:"
+
+# granularity -> (bucket function, INTERVAL unit, seconds)
+GRANULARITIES = {
+    "minute": ("toStartOfMinute", "MINUTE", 60),
+    "hour": ("toStartOfHour", "HOUR", 3600),
+    "day": ("toStartOfDay", "DAY", 86400),
+}
+
+MEASURE_FUNCTIONS = ("count", "uniq", "uniqExact", "sum", "min", "max", "avg")
+MEASURE_PATTERN = re.compile(r"^\s*([A-Za-z]+)\s*\(\s*(\*|[A-Za-z_][A-Za-z0-9_]*)?\s*\)\s*$")
+
+ROLLUPS_QUERY = """
+    SELECT database, name, comment
+    FROM system.tables
+    WHERE engine = 'AggregatingMergeTree' AND startsWith(comment, {prefix:String})
+    ORDER BY database, name
+"""
+
+
+def parse_rollup(data, source_columns):
+    """
+    Validates a POST /rollups body against the source table's columns
+    ({name: type}) and returns the rollup definition.
+    """
+    source = data.get("source")
+    if not isinstance(source, str) or not source:
+        raise ValueError("source is required")
+    database, _, table = source.rpartition(".")
+    database = database or "default"
+    if not source_columns:
+        raise ValueError(f"Table {database}.{table} does not exist")
+
+    granularity = data.get("granularity", "hour")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+    name = data.get("name") or f"{table}_by_{granularity}"
+    if not IDENTIFIER_PATTERN.match(name):
+        raise ValueError(f"Invalid rollup name {name}")
+
+    time_column = data.get("timeColumn") or next(
+        (col for col, col_type in source_columns.items() if _is_date_time(col_type)), None
+    )
+    if time_column not in source_columns or not _is_date_time(source_columns[time_column]):
+        raise ValueError("timeColumn must be a non-nullable DateTime or DateTime64 column of the source")
+
+    dimensions = data.get("dimensions") or []
+    if not isinstance(dimensions, list):
+        raise ValueError("dimensions must be a list of column names")
+    for dimension in dimensions:
+        if dimension not in source_columns or dimension == time_column:
+            raise ValueError(f"Dimension {dimension} must be a column of the source other than the time column")
+        if unwrap_type(source_columns[dimension])[1]:
+            raise ValueError(f"Dimension {dimension} is Nullable and can't be in the sorting key")
+    if len(set(dimensions)) != len(dimensions):
+        raise ValueError("Duplicate dimensions")
+
+    measures = []
+    for measure in data.get("measures") or ["count()"]:
+        match = MEASURE_PATTERN.match(measure) if isinstance(measure, str) else None
+        if not match or match.group(1) not in MEASURE_FUNCTIONS:
+            raise ValueError(f"Measures look like count() or uniq(column), using {', '.join(MEASURE_FUNCTIONS)}")
+        function, column = match.group(1), match.group(2)
+        if function == "count":
+            column = None
+        elif column in (None, "*") or column not in source_columns:
+            raise ValueError(f"{function} needs a column of the source: {measure}")
+        elif column == time_column:
+            # The rollup SELECT names the bucket after the time column, and
+            # the alias would win: max() would aggregate the bucket instead.
+            raise ValueError(f"{measure} can't aggregate the time column, which the rollup buckets")
+        measure_name = function if column is None else f"{function}_{column}"
+        if measure_name in (m["name"] for m in measures):
+            continue
+        measures.append({"function": function, "column": column, "name": measure_name})
+
+    return {
+        "database": database,
+        "name": name,
+        "source": f"{database}.{table}",
+        "timeColumn": time_column,
+        "granularity": granularity,
+        "dimensions": dimensions,
+        "measures": measures,
+    }
+
+
+def _is_date_time(col_type):
+    inner, nullable, low_cardinality = unwrap_type(col_type)
+    return not nullable and type_name(inner) in TIME_TYPES[:2]
+
+
+def _bucket(rollup):
+    function = GRANULARITIES[rollup["granularity"]][0]
+    return f"{function}({quote_name(rollup['timeColumn'])})"
+
+
+def _source_name(rollup):
+    database, table = rollup["source"].split(".", 1)
+    return f"{quote_name(database)}.{quote_name(table)}"
+
+
+def _table_name(rollup, suffix=""):
+    return f"{quote_name(rollup['database'])}.{quote_name(rollup['name'] + suffix)}"
+
+
+def build_select_query(rollup, where=None):
+    """
+    The aggregation behind the rollup: dimensions, the time column cut to
+    the granularity (keeping its name) and one -State per measure.
+    """
+    bucket = _bucket(rollup)
+    columns = [quote_name(dimension) for dimension in rollup["dimensions"]]
+    columns.append(f"{bucket} AS {quote_name(rollup['timeColumn'])}")
+    for measure in rollup["measures"]:
+        argument = quote_name(measure["column"]) if measure["column"] else ""
+        columns.append(f"{measure['function']}State({argument}) AS {quote_name(measure['name'])}")
+    group_by = [quote_name(dimension) for dimension in rollup["dimensions"]] + [bucket]
+    query = f"SELECT {', '.join(columns)} FROM {_source_name(rollup)}"
+    if where:
+        query += f" WHERE {where}"
+    return query + f" GROUP BY {', '.join(group_by)}"
+
+
+def _since_filter(rollup):
+    return f"{_bucket(rollup)} >= toDateTime({int(rollup['since'])})"
+
+
+def _comment(rollup):
+    text = COMMENT_PREFIX + json.dumps(rollup, separators=(",", ":"))
+    return "'" + text.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def build_rollup_queries(rollup, columns, dedup_window=0):
+    """
+    Returns the CREATE TABLE for the AggregatingMergeTree target, with
+    columns ([(name, type)]) as DESCRIBE reports them for the select, and
+    the CREATE MATERIALIZED VIEW feeding it rows from `since` on.
+    """
+    definitions = ", ".join(f"{quote_name(name)} {col_type}" for name, col_type in columns)
+    time_column = quote_name(rollup["timeColumn"])
+    order_by = [quote_name(dimension) for dimension in rollup["dimensions"]] + [time_column]
+    create_table = (
+        f"CREATE TABLE {_table_name(rollup)} ({definitions}) "
+        f"ENGINE = AggregatingMergeTree() PARTITION BY toYYYYMM({time_column}) ORDER BY ({', '.join(order_by)})"
+    )
+    if dedup_window:
+        # Lets a backfill chunk be inserted again under the same token.
+        create_table += f" SETTINGS non_replicated_deduplication_window = {int(dedup_window)}"
+    create_table += f" COMMENT {_comment(rollup)}"
+
+    create_view = (
+        f"CREATE MATERIALIZED VIEW {_table_name(rollup, '_mv')} TO {_table_name(rollup)} AS "
+        + build_select_query(rollup, _since_filter(rollup))
+    )
+    return create_table, create_view
+
+
+def create_rollup(client, rollup, dedup_window=0):
+    """
+    Creates the target table and the materialized view. The view only
+    aggregates rows from `since`, the start of the next bucket, so rows
+    already in the source are left to backfill() and nothing is counted
+    twice. Returns the rollup with its state and the DDL that was run.
+    """
+    function, unit, _ = GRANULARITIES[rollup["granularity"]]
+    since = int(client.query(f"SELECT toUnixTimestamp({function}(now()) + INTERVAL 1 {unit})").first_row[0])
+    time_column = quote_name(rollup["timeColumn"])
+    start = client.query(
+        f"SELECT toUnixTimestamp({function}(min({time_column}))) FROM {_source_name(rollup)} "
+        f"WHERE {time_column} < toDateTime({since}) HAVING count() > 0"
+    ).result_rows
+    first = int(start[0][0]) if start else since
+    rollup = {**rollup, "since": since, "backfill": {"from": first, "until": first}}
+
+    columns = describe_query(client, build_select_query(rollup))
+    create_table, create_view = build_rollup_queries(rollup, columns, dedup_window)
+    client.command(create_table)
+    try:
+        client.command(create_view)
+    except Exception:
+        client.command(f"DROP TABLE IF EXISTS {_table_name(rollup)}")
+        raise
+    return rollup, create_table, create_view
+
+
+def backfill(client, rollup, chunk_seconds=86400, deadline=None):
+    """
+    Aggregates the rows before `since` into the rollup, chunk_seconds of
+    buckets per INSERT ... SELECT, oldest first, and records progress in
+    the table comment after each chunk. Stops at `deadline` (a monotonic()
+    time) or at the chunk ending at `since` while that is still ahead.
+    Each chunk is inserted with a deduplication token naming its range,
+    so a chunk repeated after a failure between insert and comment update
+    is dropped by ClickHouse. Returns the updated rollup.
+    """
+    progress = dict(rollup["backfill"])
+    now = int(client.query("SELECT toUnixTimestamp(now())").first_row[0])
+    target = _table_name(rollup)
+    while progress["until"] < rollup["since"]:
+        start = progress["until"]
+        end = min(start + chunk_seconds, rollup["since"])
+        if end > now:
+            break
+        client.command(
+            f"INSERT INTO {target} "
+            + build_select_query(
+                rollup, f"{_bucket(rollup)} >= toDateTime({start}) AND {_bucket(rollup)} < toDateTime({end})"
+            ),
+            settings={"insert_deduplication_token": f"{rollup['database']}.{rollup['name']}:{start}-{end}"},
+        )
+        progress["until"] = end
+        rollup = {**rollup, "backfill": dict(progress)}
+        client.command(f"ALTER TABLE {target} MODIFY COMMENT {_comment(rollup)}")
+        if deadline is not None and monotonic() >= deadline:
+            break
+    return rollup
+
+
+def drop_rollup(client, rollup):
+    client.command(f"DROP VIEW IF EXISTS {_table_name(rollup, '_mv')}")
+    client.command(f"DROP TABLE IF EXISTS {_table_name(rollup)}")
+
+
+def is_ready(rollup):
+    return rollup["backfill"]["until"] >= rollup["since"]
+
+
+def describe_rollup(rollup):
+    def iso(seconds):
+        return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat()
+
+    backfill_state = rollup["backfill"]
+    return {
+        "table": f"{rollup['database']}.{rollup['name']}",
+        "view": f"{rollup['database']}.{rollup['name']}_mv",
+        "source": rollup["source"],
+        "timeColumn": rollup["timeColumn"],
+        "granularity": rollup["granularity"],
+        "dimensions": rollup["dimensions"],
+        "measures": [
+            f"{m['function']}({m['column'] or ''})" for m in rollup["measures"]
+        ],
+        "since": iso(rollup["since"]),
+        "backfill": {"from": iso(backfill_state["from"]), "until": iso(backfill_state["until"])},
+        "ready": is_ready(rollup),
+    }
+
+
+class RollupRegistry:
+    """
+    The rollups found in ClickHouse, read from the comments of
+    AggregatingMergeTree tables and kept for refresh_interval seconds, and
+    the routing of /api/query aggregates to them.
+    """
+
+    def __init__(self, refresh_interval=10):
+        self.refresh_interval = refresh_interval
+        self._rollups = []
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def get(self, client):
+        with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at >= self.refresh_interval:
+                self._rollups = self._load(client)
+                self._loaded_at = monotonic()
+            return list(self._rollups)
+
+    def find(self, client, database, name):
+        for rollup in self.get(client):
+            if rollup["database"] == database and rollup["name"] == name:
+                return rollup
+        return None
+
+    def _load(self, client):
+        rollups = []
+        for database, name, comment in client.query(
+            ROLLUPS_QUERY, parameters={"prefix": COMMENT_PREFIX}
+        ).result_rows:
+            try:
+                rollup = json.loads(comment[len(COMMENT_PREFIX):])
+            except ValueError:
+                logger.warning(f"Ignoring rollup {database}.{name} with an unreadable definition")
+                continue
+            rollups.append({**rollup, "database": database, "name": name})
+        return rollups
+
+    def route(self, client, query_string):
+        """
+        Returns (query, rollup): the query rewritten to read the best ready
+        rollup of its table, or the query unchanged and None.
+        """
+        parsed = parse_aggregate_query(query_string)
+        if parsed is None:
+            return query_string, None
+        candidates = [
+            rollup for rollup in self.get(client) if rollup["source"] == parsed["source"] and is_ready(rollup)
+        ]
+        # Coarsest buckets and fewest dimensions first: the fewest rows to merge.
+        candidates.sort(key=lambda r: (-GRANULARITIES[r["granularity"]][2], len(r["dimensions"])))
+        for rollup in candidates:
+            rewritten = rewrite_query(query_string, parsed, rollup)
+            if rewritten is not None:
+                return rewritten, rollup
+        return query_string, None
+
+
+# Query routing. Only a narrow, easily checked shape of query is rewritten:
+#
+#   SELECT ... FROM [db.]table [WHERE ...] [GROUP BY ...] [HAVING ...] [ORDER BY ...] [LIMIT n [OFFSET m]]
+#
+# where every column outside the measures' aggregates is a rollup dimension,
+# a SELECT alias, the time column inside a bucketing function at least as
+# coarse as the rollup's, or, in WHERE, the time column compared with >= or
+# < to a literal on a bucket boundary. Each aggregate becomes -Merge of its
+# state column and the table becomes the rollup, which keeps the dimension
+# and time column names. Anything else runs against the source table.
+
+TOKEN_PATTERN = re.compile(
+    r"""
+      (?P<space>\s+)
+    | (?P<comment>--|/\*|\#)
+    | (?P<string>'(?:[^'\\]|\\.|'')*')
+    | (?P<quoted>`(?:[^`\\]|\\.|``)*`|"(?:[^"\\]|\\.|"")*")
+    | (?P<number>\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<operator>>=|<=|!=|<>|==|\|\||[-+*/%=<>(),.])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+CLAUSES = ("SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT")
+
+UNSUPPORTED_KEYWORDS = frozenset(
+    [
+        "ARRAY", "DISTINCT", "EXCEPT", "FINAL", "FORMAT", "GLOBAL", "INTERSECT", "INTO", "JOIN",
+        "OVER", "PREWHERE", "QUALIFY", "SAMPLE", "SETTINGS", "UNION", "USING", "WINDOW", "WITH",
+    ]
+)
+
+KEYWORDS = frozenset(
+    [
+        "AND", "AS", "ASC", "BETWEEN", "CASE", "DESC", "ELSE", "END", "FALSE", "ILIKE", "IN", "IS",
+        "LIKE", "NOT", "NULL", "OR", "THEN", "TRUE", "WHEN",
+    ]
+)
+
+INTERVAL_UNITS = frozenset(["SECOND", "MINUTE", "HOUR", "DAY", "WEEK", "MONTH", "QUARTER", "YEAR"])
+
+# Functions of the time column that only depend on which bucket of at
+# least this many seconds a row falls in.
+TIME_FUNCTIONS = {
+    "toStartOfMinute": 60,
+    "toStartOfFiveMinutes": 300,
+    "toStartOfTenMinutes": 600,
+    "toStartOfFifteenMinutes": 900,
+    "toStartOfHour": 3600,
+    "toHour": 3600,
+    "toStartOfDay": 86400,
+    "toDate": 86400,
+    "toYYYYMMDD": 86400,
+    "toDayOfWeek": 86400,
+    "toDayOfMonth": 86400,
+    "toMonday": 86400,
+    "toStartOfWeek": 86400,
+    "toStartOfMonth": 86400,
+    "toYYYYMM": 86400,
+    "toMonth": 86400,
+    "toStartOfQuarter": 86400,
+    "toStartOfYear": 86400,
+    "toYear": 86400,
+}
+
+SCALAR_FUNCTIONS = frozenset(
+    [
+        "abs", "ceil", "coalesce", "concat", "divide", "empty", "endsWith", "floor", "formatDateTime",
+        "greatest", "if", "ifNull", "intDiv", "least", "length", "lower", "minus", "multiIf", "multiply",
+        "notEmpty", "now", "plus", "round", "startsWith", "toDateTime", "toFloat64", "toInt64",
+        "toString", "toUInt64", "today", "upper", "yesterday",
+    ]
+)
+
+# ClickHouse matches these aggregate names case-insensitively.
+CASE_INSENSITIVE_MEASURES = {"count": "count", "sum": "sum", "min": "min", "max": "max", "avg": "avg"}
+
+ARITHMETIC = frozenset(["+", "-", "*", "/", "%", "||"])
+
+
+def tokenize(query_string):
+    """
+    Returns [(kind, value, start, end)] for the query, without whitespace,
+    or None when it holds comments or anything the router doesn't know.
+    """
+    tokens = []
+    position = 0
+    while position < len(query_string):
+        match = TOKEN_PATTERN.match(query_string, position)
+        if match is None or match.lastgroup == "comment":
+            return None
+        kind, text = match.lastgroup, match.group()
+        if kind == "quoted":
+            kind, text = "identifier", text[1:-1].replace(text[0] * 2, text[0])
+        if kind != "space":
+            tokens.append((kind, text, match.start(), match.end()))
+        position = match.end()
+    return tokens
+
+
+def parse_aggregate_query(query_string):
+    """
+    Splits a single-table SELECT with at least one rollup-able aggregate
+    into its clauses. Returns None for anything that can't be routed.
+    """
+    tokens = tokenize(query_string.strip().rstrip(";"))
+    if not tokens or tokens[0][0] != "word" or tokens[0][1].upper() != "SELECT":
+        return None
+
+    clauses = {}
+    current = None
+    depth = 0
+    for index, (kind, value, start, end) in enumerate(tokens):
+        upper = value.upper() if kind == "word" else None
+        if upper in UNSUPPORTED_KEYWORDS or (upper == "SELECT" and index > 0):
+            return None
+        if value == "(" and kind == "operator":
+            depth += 1
+        elif value == ")" and kind == "operator":
+            depth -= 1
+            if depth < 0:
+                return None
+        elif depth == 0 and upper in CLAUSES:
+            if upper in clauses or (current and CLAUSES.index(upper) < CLAUSES.index(current)):
+                return None
+            current = upper
+            clauses[current] = []
+            continue
+        if current in ("GROUP", "ORDER") and not clauses[current]:
+            if upper != "BY":
+                return None
+            clauses[current].append(None)
+            continue
+        clauses[current].append(tokens[index])
+    if depth != 0 or "FROM" not in clauses:
+        return None
+    has_aggregate = any(
+        kind == "word"
+        and CASE_INSENSITIVE_MEASURES.get(value.lower(), value) in MEASURE_FUNCTIONS
+        and index + 1 < len(tokens)
+        and tokens[index + 1][1] == "("
+        for index, (kind, value, _, _) in enumerate(tokens)
+    )
+    if not has_aggregate:
+        return None
+    for name in ("GROUP", "ORDER"):
+        if name in clauses:
+            clauses[name] = clauses[name][1:]
+
+    table = clauses.pop("FROM")
+    if len(table) == 1 and table[0][0] in ("word", "identifier"):
+        source = f"default.{table[0][1]}"
+    elif len(table) == 3 and table[1][1] == "." and {table[0][0], table[2][0]} <= {"word", "identifier"}:
+        source = f"{table[0][1]}.{table[2][1]}"
+    else:
+        return None
+
+    limit = clauses.pop("LIMIT", [])
+    if any(kind != "number" and value not in (",",) and value.upper() != "OFFSET" for kind, value, _, _ in limit):
+        return None
+
+    return {"source": source, "table_span": (table[0][2], table[-1][3]), "clauses": clauses}
+
+
+def rewrite_query(query_string, parsed, rollup):
+    """
+    The query reading `rollup` instead of its source table, or None when
+    the rollup can't answer it exactly.
+    """
+    dimensions = set(rollup["dimensions"])
+    time_column = rollup["timeColumn"]
+    resolution = GRANULARITIES[rollup["granularity"]][2]
+    measures = {(m["function"], m["column"]): m["name"] for m in rollup["measures"]}
+    aliases = {
+        tokens[i + 1][1]
+        for tokens in parsed["clauses"].values()
+        for i, token in enumerate(tokens[:-1])
+        if token[0] == "word" and token[1].upper() == "AS" and tokens[i + 1][0] in ("word", "identifier")
+    }
+
+    replacements = []
+    for clause, tokens in parsed["clauses"].items():
+        index = 0
+        while index < len(tokens):
+            kind, value, start, end = tokens[index]
+            following = tokens[index + 1][1] if index + 1 < len(tokens) else None
+            upper = value.upper() if kind == "word" else None
+
+            if upper == "INTERVAL":
+                if following is None or tokens[index + 1][0] not in ("number", "string"):
+                    return None
+                has_unit = index + 2 < len(tokens) and tokens[index + 2][1].upper() in INTERVAL_UNITS
+                index += 3 if has_unit else 2
+                continue
+            if upper in KEYWORDS:
+                index += 1
+                continue
+
+            if kind == "word" and following == "(":
+                close = _closing(tokens, index + 1)
+                arguments = tokens[index + 2 : close]
+                function = CASE_INSENSITIVE_MEASURES.get(value.lower(), value)
+                if function in MEASURE_FUNCTIONS:
+                    column = _measure_column(function, arguments)
+                    if column is False or (function, column) not in measures:
+                        return None
+                    merge = f"{function}Merge({quote_name(measures[(function, column)])})"
+                    replacements.append((start, tokens[close][3], merge))
+                    index = close + 1
+                    continue
+                if (
+                    TIME_FUNCTIONS.get(value, 0) >= resolution
+                    and len(arguments) == 1
+                    and arguments[0][1] == time_column
+                    and arguments[0][0] in ("word", "identifier")
+                ):
+                    index = close + 1
+                    continue
+                if value not in SCALAR_FUNCTIONS and value not in TIME_FUNCTIONS:
+                    return None
+                index += 2
+                continue
+
+            if kind in ("word", "identifier"):
+                # An alias is only taken as one where it is defined (after AS)
+                # or referenced outside SELECT, so `user_id AS user_id`
+                # doesn't pass the column off as an alias.
+                defined = index > 0 and tokens[index - 1][0] == "word" and tokens[index - 1][1].upper() == "AS"
+                is_alias = value in aliases and (defined or clause != "SELECT")
+                if value not in dimensions and not is_alias:
+                    if value != time_column or clause != "WHERE" or not _bucket_bound(tokens, index, resolution):
+                        return None
+            elif kind == "operator":
+                if value == ".":
+                    return None
+                if value == "*" and (index == 0 or tokens[index - 1][1] in (",", "(")):
+                    return None
+            index += 1
+
+    if not replacements:
+        return None
+    start, end = parsed["table_span"]
+    replacements.append((start, end, f"{quote_name(rollup['database'])}.{quote_name(rollup['name'])}"))
+    for start, end, text in sorted(replacements, reverse=True):
+        query_string = query_string[:start] + text + query_string[end:]
+    return query_string
+
+
+def _closing(tokens, open_index):
+    depth = 0
+    for index in range(open_index, len(tokens)):
+        if tokens[index][1] == "(" and tokens[index][0] == "operator":
+            depth += 1
+        elif tokens[index][1] == ")" and tokens[index][0] == "operator":
+            depth -= 1
+            if depth == 0:
+                return index
+    return len(tokens)
+
+
+def _measure_column(function, arguments):
+    if function == "count" and (not arguments or [a[1] for a in arguments] == ["*"]):
+        return None
+    if len(arguments) == 1 and arguments[0][0] in ("word", "identifier"):
+        return arguments[0][1]
+    return False
+
+
+def _bucket_bound(tokens, index, resolution):
+    """
+    True for `time >= 'boundary'`, `time < 'boundary'` or the mirrored
+    forms, where 'boundary' starts a bucket: then comparing the bucket
+    start instead of the row's time selects exactly the same rows.
+    """
+
+    def value(i):
+        return tokens[i][1] if 0 <= i < len(tokens) else None
+
+    if value(index + 1) in (">=", "<") and tokens[index + 2 : index + 3] and tokens[index + 2][0] == "string":
+        literal, before, after = tokens[index + 2][1], value(index - 1), value(index + 3)
+    elif value(index - 1) in ("<=", ">") and index >= 2 and tokens[index - 2][0] == "string":
+        literal, before, after = tokens[index - 2][1], value(index - 3), value(index + 1)
+    else:
+        return False
+    if before in ARITHMETIC or after in ARITHMETIC:
+        return False
+    try:
+        bound = datetime.fromisoformat(literal[1:-1])
+    except ValueError:
+        return False
+    if bound.tzinfo is not None or bound.second or bound.microsecond:
+        return False
+    if resolution >= 3600 and bound.minute:
+        return False
+    if resolution >= 86400 and bound.hour:
+        return False
+    return True
@@ -0,0 +1,236 @@
+import json
+import re
+
+DATETIME_PATTERN = re.compile(
+    r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.(\d{1,9}))?(?:Z|[+-]\d{2}:?\d{2})?$"
+)
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+TIMESTAMP_NAME_PATTERN = re.compile(r"(timestamp|_time$|_at$|^time$|^ts$)", re.IGNORECASE)
+
+# 2000-01-01 .. 2100-01-01 as epoch seconds; integers named like timestamps
+# inside this range are treated as DateTime.
+EPOCH_SECONDS_RANGE = (946684800, 4102444800)
+
+INT64_MAX = 2**63 - 1
+
+# Observed value kinds, ordered so that merging two scalar kinds widens to
+# the larger one (Bool < Int < Float < String).
+SCALAR_ORDER = {"bool": 0, "int": 1, "float": 2, "string": 3}
+
+
+class FieldStats:
+    """
+    Everything observed about one JSON field across a batch of records.
+    Nested arrays and objects keep their own FieldStats, so the merge is
+    recursive.
+    """
+
+    def __init__(self, name, distinct_limit=10000):
+        self.name = name
+        self.distinct_limit = distinct_limit
+        self.count = 0
+        self.nulls = 0
+        self.kinds = set()
+        self.min_int = None
+        self.max_int = None
+        self.distinct = set()
+        self.distinct_overflow = False
+        self.string_values = 0
+        self.datetime_values = 0
+        self.date_values = 0
+        self.max_fraction_digits = 0
+        self.element = None
+        self.fields = None
+
+    def observe(self, value):
+        self.count += 1
+
+        if value is None:
+            self.nulls += 1
+            return
+
+        if isinstance(value, bool):
+            self.kinds.add("bool")
+        elif isinstance(value, int):
+            self.kinds.add("int")
+            self.min_int = value if self.min_int is None else min(self.min_int, value)
+            self.max_int = value if self.max_int is None else max(self.max_int, value)
+        elif isinstance(value, float):
+            self.kinds.add("float")
+        elif isinstance(value, str):
+            self.kinds.add("string")
+            self.string_values += 1
+            match = DATETIME_PATTERN.match(value)
+            if match:
+                self.datetime_values += 1
+                if match.group(1):
+                    self.max_fraction_digits = max(self.max_fraction_digits, len(match.group(1)))
+            elif DATE_PATTERN.match(value):
+                self.date_values += 1
+        elif isinstance(value, list):
+            self.kinds.add("array")
+            if self.element is None:
+                self.element = FieldStats(f"{self.name}[]", self.distinct_limit)
+            for item in value:
+                self.element.observe(item)
+            return
+        elif isinstance(value, dict):
+            self.kinds.add("object")
+            if self.fields is None:
+                self.fields = {}
+            observe_object(self.fields, value, self.count - 1, self.distinct_limit)
+            return
+
+        if not self.distinct_overflow:
+            self.distinct.add(value)
+            if len(self.distinct) > self.distinct_limit:
+                self.distinct_overflow = True
+                self.distinct = set()
+
+    @property
+    def non_null(self):
+        return self.count - self.nulls
+
+    @property
+    def cardinality(self):
+        return None if self.distinct_overflow else len(self.distinct)
+
+
+def observe_object(fields, record, records_before, distinct_limit=10000):
+    """
+    Merges one JSON object into `fields`. A field first seen after
+    `records_before` records is back-filled with that many missing values,
+    so fields absent from some records end up nullable.
+    """
+    for name, value in record.items():
+        stats = fields.get(name)
+        if stats is None:
+            stats = fields[name] = FieldStats(name, distinct_limit)
+            stats.count = stats.nulls = records_before
+        stats.observe(value)
+
+    for name, stats in fields.items():
+        if name not in record:
+            stats.observe(None)
+
+
+def infer_field_stats(records, distinct_limit=10000):
+    fields = {}
+    for i, record in enumerate(records):
+        if isinstance(record, (bytes, str)):
+            record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError("Every sampled record must be a JSON object")
+        observe_object(fields, record, i, distinct_limit)
+    return fields
+
+
+def resolve_type(
+    stats,
+    low_cardinality_ratio=0.5,
+    low_cardinality_min_samples=10,
+    nullable=True,
+):
+    """
+    Maps merged observations to a ClickHouse type:
+    mixed scalar kinds widen Bool -> Int64 -> Float64 -> String, strings
+    that all look like ISO dates or datetimes become Date/DateTime(64),
+    integers named like timestamps in a plausible epoch range become
+    DateTime, repetitive strings become LowCardinality(String), and any
+    null or missing value makes the column Nullable.
+    """
+    kinds = stats.kinds
+
+    if not kinds:
+        return "Nullable(String)" if nullable else "String"
+
+    if "object" in kinds or "array" in kinds:
+        if kinds == {"array"}:
+            element = "String"
+            if stats.element.count:
+                element = resolve_type(stats.element, nullable=True)
+            return f"Array({element})"
+        if kinds == {"object"}:
+            inner = ", ".join(
+                f"{quote_name(name)} {resolve_type(field, nullable=True)}"
+                for name, field in stats.fields.items()
+            )
+            return f"Tuple({inner})"
+        return _nullable("String", stats, nullable)
+
+    widest = max(kinds, key=SCALAR_ORDER.get)
+
+    if widest == "string":
+        if kinds == {"string"}:
+            if stats.datetime_values == stats.string_values:
+                digits = stats.max_fraction_digits
+                base = f"DateTime64({3 if digits <= 3 else 6 if digits <= 6 else 9})" if digits else "DateTime"
+                return _nullable(base, stats, nullable)
+            if stats.date_values == stats.string_values:
+                return _nullable("Date", stats, nullable)
+            if _is_low_cardinality(stats, low_cardinality_ratio, low_cardinality_min_samples):
+                return f"LowCardinality({_nullable('String', stats, nullable)})"
+        return _nullable("String", stats, nullable)
+
+    if widest == "float":
+        return _nullable("Float64", stats, nullable)
+
+    if widest == "int":
+        if (
+            kinds == {"int"}
+            and TIMESTAMP_NAME_PATTERN.search(stats.name)
+            and EPOCH_SECONDS_RANGE[0] <= stats.min_int
+            and stats.max_int <= EPOCH_SECONDS_RANGE[1]
+        ):
+            return _nullable("DateTime", stats, nullable)
+        if stats.max_int is not None and stats.max_int > INT64_MAX:
+            return _nullable("UInt64", stats, nullable)
+        return _nullable("Int64", stats, nullable)
+
+    return _nullable("Bool", stats, nullable)
+
+
+def _nullable(base, stats, nullable):
+    if nullable and stats.nulls:
+        return f"Nullable({base})"
+    return base
+
+
+def _is_low_cardinality(stats, ratio, min_samples):
+    cardinality = stats.cardinality
+    if cardinality is None or stats.non_null < min_samples:
+        return False
+    return cardinality <= stats.non_null * ratio
+
+
+def quote_name(name, always=False):
+    if not always and re.match(r"^[A-Za-z_][A-Za-z0-9_]*$", name):
+        return name
+    return "`" + name.replace("\\", "\\\\").replace("`", "\\`") + "`"
+
+
+def infer_schema(records, **options):
+    """
+    Infers an inferredSchema list ([{"name", "type"}, ...]) from a batch of
+    decoded JSON records, in order of first appearance.
+    """
+    fields = infer_field_stats(records)
+    return [{"name": name, "type": resolve_type(stats, **options)} for name, stats in fields.items()]
+
+
+def clickhouse_schema(client, records):
+    """
+    Asks ClickHouse to infer the schema of the same records, for comparing
+    against infer_schema. Settings are passed per query so the pooled
+    client's session is left untouched.
+    """
+    data = "\n".join(json.dumps(record) for record in records)
+    literal = data.replace("\\", "\\\\").replace("'", "\\'")
+    res = client.query(
+        f"DESC format(JSONEachRow, '{literal}')",
+        settings={
+            "schema_inference_make_columns_nullable": 0,
+            "input_format_null_as_default": 0,
+        },
+    )
+    return [{"name": row[0], "type": row[1]} for row in res.result_rows]
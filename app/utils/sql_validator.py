@@ -0,0 +1,186 @@
+import re
+
+# Everything that is not SQL code: string literals, quoted identifiers,
+# heredocs and comments. Each alternative either finds its terminator or
+# runs to the end of the input (the *_open groups), so the scan never
+# backtracks and stays linear in the query length.
+LITERAL_PATTERN = re.compile(
+    r"""
+      '(?:[^'\\]+|\\.|'')*(?:'|(?P<string_open>\Z))
+    | "(?:[^"\\]+|\\.|"")*(?:"|(?P<identifier_open>\Z))
+    | `(?:[^`\\]+|\\.|``)*(?:`|(?P<backtick_open>\Z))
+    | \$(?P<tag>\w*)\$(?:.*?\$(?P=tag)\$|.*(?P<heredoc_open>\Z))
+    | (?P<comment>--[^\n]*|\#[!\s][^\n]*|/\*.*?(?:\*/|(?P<comment_open>\Z)))
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+UNTERMINATED_GROUPS = ("string_open", "identifier_open", "backtick_open", "heredoc_open", "comment_open")
+
+READ_ONLY_STATEMENTS = frozenset(["SELECT", "WITH", "SHOW", "DESCRIBE", "DESC", "EXPLAIN", "EXISTS"])
+
+WRITE_KEYWORDS = frozenset(
+    [
+        "ALTER",
+        "ATTACH",
+        "CREATE",
+        "DELETE",
+        "DETACH",
+        "DROP",
+        "GRANT",
+        "INSERT",
+        "INTO",
+        "OPTIMIZE",
+        "RENAME",
+        "REVOKE",
+        "TRUNCATE",
+        "UPDATE",
+    ]
+)
+
+# Write keywords followed by what they take when they begin a statement, so
+# a column or alias that happens to be called `update` or `delete` passes.
+# Statements that can only come first (GRANT, SYSTEM, KILL, ...) are already
+# caught by the check on the first word.
+WRITE_STATEMENT_PATTERN = re.compile(
+    r"""
+    \b(?P<keyword>
+        INSERT(?=\s+INTO\b)
+      | DELETE(?=\s+FROM\b)
+      | UPDATE(?=\s+(?:[\w.]+\s+)?SET\b)
+      | (?:ALTER|ATTACH|CREATE|DETACH|DROP|OPTIMIZE|RENAME|TRUNCATE)
+        (?=\s+(?:OR\s+REPLACE\s+|TEMPORARY\s+|MATERIALIZED\s+)*
+           (?:TABLE|DATABASE|DICTIONARY|VIEW|FUNCTION|USER|ROLE|QUOTA|POLICY|PROFILE|INDEX)\b)
+      | INTO(?=\s+OUTFILE\b)
+    )
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+
+# Settings a query's own SETTINGS clause may not change: the per-query limits
+# the API attaches, what happens when one is hit, and readonly.
+GUARDED_SETTING_PATTERN = re.compile(
+    r"^(?:readonly|max_execution_time\w*|max_result_\w+|max_memory_usage\w*"
+    r"|max_(?:rows|bytes)_to_\w+|\w+_overflow_mode|timeout_\w+)$",
+    re.IGNORECASE,
+)
+SETTINGS_CLAUSE_PATTERN = re.compile(r"\bSETTINGS\s+(?=[A-Za-z_]\w*\s*=)", re.IGNORECASE)
+SETTINGS_TOKEN_PATTERN = re.compile(r"[A-Za-z_]\w*|\S")
+OPENING_BRACKETS = "([{"
+CLOSING_BRACKETS = ")]}"
+
+
+class SQLValidationError(ValueError):
+    pass
+
+
+def strip_literals(query, allow_comments=True):
+    """
+    Returns the query with every literal and comment replaced by a space,
+    leaving only the SQL code that keywords and statement separators can
+    appear in.
+    """
+
+    def replace(match):
+        # lastgroup is None for the common case of a terminated string or
+        # quoted identifier, which keeps this callback cheap on large IN lists.
+        group = match.lastgroup
+        if group is None or group == "tag":
+            return " "
+        if group == "comment":
+            if match.group("comment_open") is not None:
+                group = "comment_open"
+            elif not allow_comments:
+                raise SQLValidationError("Comments are not allowed")
+            else:
+                return " "
+        if group in UNTERMINATED_GROUPS:
+            raise SQLValidationError("Unterminated string, identifier or comment")
+        return " "
+
+    return LITERAL_PATTERN.sub(replace, query)
+
+
+def split_statements(code):
+    statements = [statement.strip() for statement in code.split(";")]
+    statements = [statement for statement in statements if statement]
+    if not statements:
+        raise SQLValidationError("Empty query")
+    if len(statements) > 1:
+        raise SQLValidationError("Multi-statements are not allowed")
+    return statements[0]
+
+
+def query_settings(statement):
+    """
+    Names assigned by the SETTINGS clauses of a statement without literals.
+    Values can hold commas inside (), [] or {} (e.g. a Map of table
+    filters), so only a top-level comma starts the next `name =`. A clause
+    ends at a closing bracket of its own subquery or at a top-level word
+    that doesn't start an assignment.
+    """
+    names = []
+    for clause in SETTINGS_CLAUSE_PATTERN.finditer(statement):
+        tokens = [token.group() for token in SETTINGS_TOKEN_PATTERN.finditer(statement, clause.end())]
+        depth = 0
+        expect_name = True
+        for index, token in enumerate(tokens):
+            if token in OPENING_BRACKETS:
+                depth += 1
+            elif token in CLOSING_BRACKETS:
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth:
+                continue
+            elif token == ",":
+                expect_name = True
+            elif expect_name:
+                if not (token[0].isalpha() or token[0] == "_") or tokens[index + 1 : index + 2] != ["="]:
+                    break
+                names.append(token)
+                expect_name = False
+    return names
+
+
+def validate_read_only(query):
+    """
+    Raises SQLValidationError unless query is a single read-only statement
+    (SELECT, WITH, SHOW, DESCRIBE, EXPLAIN or EXISTS) that leaves the API's
+    limits alone. Keywords inside strings, quoted identifiers and comments
+    are ignored, so `WHERE event_type = 'delete'` is accepted, and so are
+    unquoted columns named like keywords (`SELECT update FROM t`).
+    """
+    statement = split_statements(strip_literals(query))
+    words = [word.upper() for word in WORD_PATTERN.findall(statement)]
+
+    if not statement.startswith("(") and (not words or words[0] not in READ_ONLY_STATEMENTS):
+        raise SQLValidationError("Only read-only queries are allowed")
+
+    # SHOW CREATE TABLE names a statement without running it.
+    if words[:1] != ["SHOW"]:
+        writes = {match.group("keyword").upper() for match in WRITE_STATEMENT_PATTERN.finditer(statement)}
+        if writes:
+            raise SQLValidationError(f"Write operations are not allowed: {', '.join(sorted(writes))}")
+
+    guarded = sorted({name for name in query_settings(statement) if GUARDED_SETTING_PATTERN.match(name)})
+    if guarded:
+        raise SQLValidationError(f"Query settings may not change the API's limits: {', '.join(guarded)}")
+
+
+def validate_create_table(query):
+    """
+    Raises SQLValidationError unless query is a single CREATE TABLE
+    statement with no comments and no other write keywords, which is what
+    /create-table builds from the user supplied schema.
+    """
+    statement = split_statements(strip_literals(query, allow_comments=False))
+    words = [word.upper() for word in WORD_PATTERN.findall(statement)]
+
+    if words[:2] != ["CREATE", "TABLE"]:
+        raise SQLValidationError("Only CREATE TABLE statements are allowed")
+
+    writes = WRITE_KEYWORDS.intersection(words[1:]) - {"CREATE"}
+    if writes or words.count("CREATE") > 1:
+        raise SQLValidationError(f"Write operations are not allowed: {', '.join(sorted(writes or {'CREATE'}))}")
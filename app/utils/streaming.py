@@ -0,0 +1,204 @@
+import io
+import logging
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from flask import Response, current_app, stream_with_context
+
+from app.utils.pool import note_connection_error
+
+logger = logging.getLogger(__name__)
+
+STREAM_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+RESPONSE_FORMATS = ("rows", "columns", "arrow")
+
+
+def resolve_response_format(request):
+    """
+    "format" in the body wins; otherwise an Accept header preferring
+    Arrow selects it, and everything else gets the row layout.
+    """
+    response_format = request.json.get("format")
+    if response_format is None:
+        return "arrow" if request.accept_mimetypes.best == ARROW_MIMETYPE else "rows"
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(
+            f"Unsupported format '{response_format}', expected one of {list(RESPONSE_FORMATS)}"
+        )
+    return response_format
+
+
+def resolve_stream_format(stream):
+    if stream is True:
+        return "ndjson"
+    if stream in STREAM_MIMETYPES:
+        return stream
+    raise ValueError(
+        f"Unsupported stream format '{stream}', expected one of {list(STREAM_MIMETYPES)}"
+    )
+
+
+def stream_query_response(
+    client, query_string, stream_format, parameters=None, settings=None, headers=None
+):
+    """
+    Opens a row block stream and returns a chunked response that writes each
+    block as soon as ClickHouse sends it. The stream is opened before the
+    response starts so syntax errors still surface as a normal 400.
+    """
+    stream = client.query_row_block_stream(
+        query_string, parameters=parameters, settings=settings
+    )
+    dumps = current_app.json.dumps
+
+    if stream_format == "json":
+        body = _json_array_frames(stream, query_string, dumps)
+    else:
+        body = _ndjson_frames(stream, query_string, dumps)
+
+    return Response(
+        stream_with_context(body),
+        mimetype=STREAM_MIMETYPES[stream_format],
+        headers={"X-Accel-Buffering": "no", **(headers or {})},
+    )
+
+
+def _stream_metadata(stream, query_string):
+    return {
+        "query": query_string,
+        "column_names": list(stream.source.column_names),
+        "column_types": [t.base_type for t in stream.source.column_types],
+    }
+
+
+def _ndjson_frames(stream, query_string, dumps):
+    """
+    First line is a {"metadata": ...} header frame, every following line is a
+    row as a JSON array in column_names order, and the last line is a
+    {"summary": ...} frame (or {"error": ...} if the stream broke midway).
+    """
+    with stream:
+        yield dumps({"metadata": _stream_metadata(stream, query_string)}) + "\n"
+        row_count = 0
+        try:
+            for block in stream:
+                row_count += len(block)
+                yield "".join(dumps(row) + "\n" for row in block)
+        except Exception as e:
+            note_connection_error(e)
+            yield dumps({"error": str(e), "row_count": row_count}) + "\n"
+            return
+        yield dumps({"summary": {"row_count": row_count}}) + "\n"
+
+
+def _json_array_frames(stream, query_string, dumps):
+    """
+    Same document shape as the buffered /query response, written in chunks:
+    {"metadata": {...}, "data": [{...}, ...], "row_count": n}
+    """
+    with stream:
+        metadata = _stream_metadata(stream, query_string)
+        column_names = metadata["column_names"]
+        yield '{"metadata": ' + dumps(metadata) + ', "data": ['
+        row_count = 0
+        error = None
+        try:
+            for block in stream:
+                chunk = ",".join(dumps(dict(zip(column_names, row))) for row in block)
+                if row_count and chunk:
+                    chunk = "," + chunk
+                row_count += len(block)
+                yield chunk
+        except Exception as e:
+            note_connection_error(e)
+            error = str(e)
+        tail = f'], "row_count": {row_count}'
+        if error is not None:
+            tail += ', "error": ' + dumps(error)
+        yield tail + "}"
+
+
+def stream_arrow_response(
+    client, query_string, metadata, parameters=None, settings=None, headers=None
+):
+    """
+    Relays ClickHouse's ArrowStream output as an Arrow IPC stream, one
+    record batch per block. The metadata block travels as JSON in the
+    schema's "helios" metadata key, so Arrow clients keep column_types and
+    pagination.
+
+    Arrow IPC has no error frame, and a stream cut at a batch boundary
+    reads as complete. If ClickHouse fails midway, the end-of-stream
+    marker is withheld and the error re-raised, so the server drops the
+    connection before the final chunk and clients see a truncated
+    response instead of a short, valid-looking result.
+    """
+    stream = client.query_arrow_stream(
+        query_string, parameters=parameters, settings=settings, use_strings=True
+    )
+    dumps = current_app.json.dumps
+    schema_metadata = {"helios": dumps(metadata)}
+
+    def body():
+        buffer = io.BytesIO()
+        writer = None
+        with stream:
+            try:
+                for batch in stream:
+                    if writer is None:
+                        writer = ipc.new_stream(buffer, batch.schema.with_metadata(schema_metadata))
+                    writer.write_batch(batch)
+                    yield _drain(buffer)
+            except Exception as e:
+                note_connection_error(e)
+                logger.error(f"Arrow stream failed: {str(e)}")
+                raise
+            if writer is None:
+                schema = getattr(stream.gen, "schema", None) or pa.schema([])
+                writer = ipc.new_stream(buffer, schema.with_metadata(schema_metadata))
+            writer.close()
+            yield _drain(buffer)
+
+    return Response(
+        stream_with_context(body()),
+        mimetype=ARROW_MIMETYPE,
+        headers={"X-Accel-Buffering": "no", **(headers or {})},
+    )
+
+
+def _drain(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+
+def summary_event_stream(chunks):
+    """
+    Relays text chunks as server-sent events: one {"delta": ...} message per
+    chunk, then a `done` event, or an `error` event if the upstream call
+    failed partway.
+    """
+    dumps = current_app.json.dumps
+
+    def events():
+        try:
+            for chunk in chunks:
+                yield f"data: {dumps({'delta': chunk})}\n\n"
+        except Exception as e:
+            logger.error(f"Summary stream failed: {str(e)}")
+            yield f"event: error\ndata: {dumps({'error': 'Failed to get response from OpenAI'})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
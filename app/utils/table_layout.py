@@ -0,0 +1,301 @@
+import re
+
+from app.utils.schema_inference import TIMESTAMP_NAME_PATTERN, infer_field_stats, quote_name
+
+LAYOUT_KEYS = ("orderBy", "partitionBy", "ttl", "codecs", "lowCardinality", "dedup")
+CODEC_PATTERN = re.compile(r"^[A-Za-z0-9]+(\(\d+\))?(\s*,\s*[A-Za-z0-9]+(\(\d+\))?)*$")
+
+MAX_SORT_DIMENSIONS = 3
+TIME_TYPES = ("DateTime64", "DateTime", "Date32", "Date")
+INTEGER_PATTERN = re.compile(r"^U?Int\d+$")
+# Types a sorting key dimension may have; floats and compound types make
+# poor keys, UUIDs are unique per row.
+DIMENSION_PATTERN = re.compile(r"^(String|FixedString|U?Int\d+|Bool|Enum8|Enum16|Date|Date32)$")
+# ReplacingMergeTree keeps the row with the highest version.
+VERSION_PATTERN = re.compile(r"^(U?Int\d+|Date|Date32|DateTime|DateTime64)$")
+
+
+def unwrap_type(col_type):
+    """
+    Returns (inner type, nullable, low_cardinality) for a ClickHouse type,
+    e.g. LowCardinality(Nullable(String)) -> ("String", True, True).
+    """
+    nullable = low_cardinality = False
+    while True:
+        if col_type.startswith("LowCardinality(") and col_type.endswith(")"):
+            col_type = col_type[len("LowCardinality("):-1]
+            low_cardinality = True
+        elif col_type.startswith("Nullable(") and col_type.endswith(")"):
+            col_type = col_type[len("Nullable("):-1]
+            nullable = True
+        else:
+            return col_type, nullable, low_cardinality
+
+
+def type_name(col_type):
+    return col_type.split("(")[0]
+
+
+def plan_layout(
+    schema,
+    records=None,
+    overrides=None,
+    ttl_days=0,
+    dedup_window=0,
+    low_cardinality_ratio=0.5,
+    low_cardinality_min_samples=10,
+):
+    """
+    Proposes a MergeTree layout for `schema` ([{"name", "type"}]) using the
+    sampled records when there are any:
+
+    - ORDER BY: up to three repetitive columns, fewest distinct values
+      first, then the time column. Unique-per-row columns such as UUIDs are
+      left out, since a sparse index over them prunes nothing.
+    - PARTITION BY: the time column's month.
+    - TTL: the time column plus ttl_days, when ttl_days is set.
+    - Codecs: DoubleDelta for timestamps that arrive in order, Delta for
+      other dates and increasing integers, ZSTD for the rest.
+    - LowCardinality for String columns with few distinct values.
+    - Dedup: keep the hashes of the last `dedup_window` inserted blocks
+      (non_replicated_deduplication_window), so an insert repeated with
+      the same insert_deduplication_token is dropped. An insert without a
+      token is hashed by its data instead, so two identical batches from a
+      producer that sends no tokens also collapse into one. With a
+      "version" column the engine becomes ReplacingMergeTree(version).
+
+    Keys of `overrides` (same names as the returned layout) replace the
+    proposal; "codecs" is merged per column. "notes" explains each choice.
+    """
+    columns = {col["name"]: unwrap_type(col["type"]) for col in schema}
+    stats = infer_field_stats(records) if records else {}
+    notes = []
+
+    def repetitive(name):
+        field = stats.get(name)
+        if field is None or field.cardinality is None:
+            return False
+        if field.non_null < low_cardinality_min_samples:
+            return False
+        return field.cardinality <= field.non_null * low_cardinality_ratio
+
+    time_column = _time_column(columns)
+
+    low_cardinality = []
+    for name, (inner, nullable, wrapped) in columns.items():
+        if inner == "String" and (wrapped or repetitive(name)):
+            low_cardinality.append(name)
+            if not wrapped:
+                notes.append(f"{name}: {stats[name].cardinality} distinct values, LowCardinality")
+
+    dimensions = [
+        name
+        for name, (inner, nullable, wrapped) in columns.items()
+        if name != time_column and not nullable and DIMENSION_PATTERN.match(type_name(inner))
+    ]
+    if stats:
+        dimensions = sorted(
+            (name for name in dimensions if repetitive(name)),
+            key=lambda name: stats[name].cardinality,
+        )
+    else:
+        dimensions = [
+            name
+            for name in dimensions
+            if columns[name][2] or type_name(columns[name][0]) in ("Bool", "Enum8", "Enum16")
+        ]
+    order_by = dimensions[:MAX_SORT_DIMENSIONS]
+    if time_column:
+        order_by.append(time_column)
+    if not order_by:
+        # Nothing to go on: keep the first usable column, as before.
+        order_by = [
+            name
+            for name, (inner, nullable, wrapped) in columns.items()
+            if not nullable and DIMENSION_PATTERN.match(type_name(inner))
+        ][:1]
+    if order_by:
+        notes.append(
+            "ORDER BY "
+            + ", ".join(
+                f"{name} ({stats[name].cardinality} distinct)"
+                if name in stats and stats[name].cardinality is not None and name != time_column
+                else name
+                for name in order_by
+            )
+        )
+
+    partition_by = ttl = None
+    if time_column:
+        time_expr = _date_time_expr(time_column, columns[time_column][0])
+        partition_by = f"toYYYYMM({quote_name(time_column, always=True)})"
+        if ttl_days:
+            ttl = f"{time_expr} + INTERVAL {int(ttl_days)} DAY"
+
+    codecs = {}
+    for name, (inner, nullable, wrapped) in columns.items():
+        codec = _codec(name, inner, name == time_column, name in low_cardinality, records)
+        if codec:
+            codecs[name] = codec
+
+    layout = {
+        "orderBy": order_by,
+        "partitionBy": partition_by,
+        "ttl": ttl,
+        "codecs": codecs,
+        "lowCardinality": low_cardinality,
+        "dedup": {"window": int(dedup_window)} if dedup_window else None,
+    }
+    if overrides:
+        layout = apply_overrides(layout, overrides, columns)
+    layout["notes"] = notes
+    return layout
+
+
+def _time_column(columns):
+    candidates = [
+        name
+        for name, (inner, nullable, wrapped) in columns.items()
+        if not nullable and type_name(inner) in TIME_TYPES
+    ]
+    named = [name for name in candidates if TIMESTAMP_NAME_PATTERN.search(name)]
+    return (named or candidates or [None])[0]
+
+
+def _date_time_expr(name, inner):
+    # TTL expressions must evaluate to Date or DateTime.
+    if type_name(inner) == "DateTime64":
+        return f"toDateTime({quote_name(name, always=True)})"
+    return quote_name(name, always=True)
+
+
+def _increasing(name, records):
+    """
+    Whether the sampled values of `name` arrive in order, or None when
+    there are too few of them to tell.
+    """
+    values = [record.get(name) for record in records or [] if isinstance(record, dict)]
+    values = [value for value in values if value is not None]
+    if len(values) < 2:
+        return None
+    if len({type(value) for value in values}) > 1:
+        return False
+    return all(a <= b for a, b in zip(values, values[1:])) and values[0] != values[-1]
+
+
+def _codec(name, inner, is_time_column, low_cardinality, records):
+    kind = type_name(inner)
+    if low_cardinality or kind in ("Bool", "Enum8", "Enum16", "UUID"):
+        return None
+    if kind in TIME_TYPES:
+        if is_time_column and _increasing(name, records) is not False:
+            return "DoubleDelta, ZSTD(1)"
+        return "Delta, ZSTD(1)"
+    if INTEGER_PATTERN.match(kind):
+        return "Delta, ZSTD(1)" if _increasing(name, records) is True else "ZSTD(1)"
+    if kind in ("String", "FixedString"):
+        return "ZSTD(3)"
+    return "ZSTD(1)"
+
+
+def apply_overrides(layout, overrides, columns):
+    """
+    Validates user overrides against the schema and merges them into a
+    proposed layout. Raises ValueError on anything that does not fit.
+    """
+    unknown = set(overrides) - set(LAYOUT_KEYS) - {"notes"}
+    if unknown:
+        raise ValueError(f"Unknown layout keys {sorted(unknown)}, expected {list(LAYOUT_KEYS)}")
+    layout = {**layout, "codecs": dict(layout["codecs"])}
+
+    if "orderBy" in overrides:
+        order_by = overrides["orderBy"] or []
+        for name in order_by:
+            if name not in columns:
+                raise ValueError(f"orderBy column {name} is not in the schema")
+            if columns[name][1]:
+                raise ValueError(f"orderBy column {name} is Nullable")
+        layout["orderBy"] = list(order_by)
+
+    for key in ("partitionBy", "ttl"):
+        if key in overrides:
+            value = overrides[key]
+            if value is not None and not isinstance(value, str):
+                raise ValueError(f"{key} must be an expression string or null")
+            layout[key] = value or None
+
+    for name, codec in (overrides.get("codecs") or {}).items():
+        if name not in columns:
+            raise ValueError(f"codecs column {name} is not in the schema")
+        if codec is None:
+            layout["codecs"].pop(name, None)
+        elif not isinstance(codec, str) or not CODEC_PATTERN.match(codec):
+            raise ValueError(f"Invalid codec for {name}: {codec}")
+        else:
+            layout["codecs"][name] = codec
+
+    if "lowCardinality" in overrides:
+        names = overrides["lowCardinality"] or []
+        for name in names:
+            if name not in columns:
+                raise ValueError(f"lowCardinality column {name} is not in the schema")
+        layout["lowCardinality"] = list(names)
+
+    if "dedup" in overrides:
+        layout["dedup"] = _dedup_override(overrides["dedup"], layout["dedup"], columns)
+    return layout
+
+
+def _dedup_override(dedup, proposed, columns):
+    if not dedup:
+        return None
+    if not isinstance(dedup, dict) or set(dedup) - {"window", "version"}:
+        raise ValueError('dedup must be null or an object with "window" and/or "version"')
+    window = dedup.get("window", (proposed or {}).get("window", 0))
+    if isinstance(window, bool) or not isinstance(window, int) or window < 0:
+        raise ValueError("dedup window must be a non-negative integer")
+    result = {"window": window}
+    version = dedup.get("version")
+    if version is not None:
+        if version not in columns:
+            raise ValueError(f"dedup version column {version} is not in the schema")
+        inner, nullable, wrapped = columns[version]
+        if nullable or not VERSION_PATTERN.match(type_name(inner)):
+            raise ValueError(f"dedup version column {version} must be a non-nullable integer, Date or DateTime")
+        result["version"] = version
+    return result
+
+
+def build_create_table_query(database_name, table_name, schema, layout):
+    # Names are always quoted so columns like `update` get past validate_create_table.
+    definitions = []
+    for col in schema:
+        name = col["name"]
+        col_type = col["type"]
+        inner, nullable, wrapped = unwrap_type(col_type)
+        if name in layout["lowCardinality"] and not wrapped:
+            col_type = f"LowCardinality({col_type})"
+        definition = f"{quote_name(name, always=True)} {col_type}"
+        codec = layout["codecs"].get(name)
+        if codec:
+            definition += f" CODEC({codec})"
+        definitions.append(definition)
+
+    dedup = layout.get("dedup") or {}
+    engine = "MergeTree()"
+    if dedup.get("version"):
+        engine = f"ReplacingMergeTree({quote_name(dedup['version'], always=True)})"
+
+    order_by = [quote_name(name, always=True) for name in layout["orderBy"]]
+    query = (
+        f"CREATE TABLE {database_name}.{table_name} ({', '.join(definitions)}) "
+        f"ENGINE = {engine}"
+    )
+    if layout["partitionBy"]:
+        query += f" PARTITION BY {layout['partitionBy']}"
+    query += f" ORDER BY ({', '.join(order_by)})" if order_by else " ORDER BY tuple()"
+    if layout["ttl"]:
+        query += f" TTL {layout['ttl']}"
+    if dedup.get("window"):
+        query += f" SETTINGS non_replicated_deduplication_window = {int(dedup['window'])}"
+    return query
@@ -0,0 +1,92 @@
+"""
+    python -m app.worker [--stream NAME] [--batch-rows 100000] [--flush-interval 5] [--async-insert]
+
+Reads AWS credentials from the usual boto3 chain (environment, profile or
+role) and ClickHouse from CH_*, like the API. Runs until interrupted.
+"""
+import argparse
+import logging
+import os
+import signal
+import sys
+
+import boto3
+import clickhouse_connect
+from dotenv import load_dotenv
+
+from app.main import env_flag
+from app.utils.aws import ThreadSafeSession
+from app.worker.checkpoints import FileCheckpointStore
+from app.worker.consumer import IngestWorker
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(prog="app.worker", description="Kinesis to ClickHouse ingestion worker.")
+    parser.add_argument("--stream", action="append", help="Only consume this stream (repeatable)")
+    parser.add_argument("--batch-rows", type=int, default=int(os.getenv("INGEST_BATCH_ROWS", 100_000)))
+    parser.add_argument(
+        "--batch-bytes", type=int, default=int(os.getenv("INGEST_BATCH_BYTES", 32 * 1024 * 1024))
+    )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        default=float(os.getenv("INGEST_FLUSH_INTERVAL", 5)),
+        help="Seconds before a batch is inserted whatever its size",
+    )
+    parser.add_argument(
+        "--async-insert",
+        action="store_true",
+        default=env_flag("INGEST_ASYNC_INSERT"),
+        help="Insert with async_insert=1, wait_for_async_insert=1",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        dest="dedup",
+        action="store_false",
+        default=env_flag("INGEST_DEDUP", "true"),
+        help="Insert without deduplication tokens or write-ahead ranges",
+    )
+    parser.add_argument(
+        "--starting-position",
+        choices=["LATEST", "TRIM_HORIZON"],
+        default=os.getenv("INGEST_STARTING_POSITION", "LATEST"),
+        help="Where shards without a checkpoint start",
+    )
+    parser.add_argument("--checkpoints", default=os.getenv("INGEST_CHECKPOINT_PATH", "ingest-checkpoints.json"))
+    parser.add_argument("--report-interval", type=float, default=float(os.getenv("INGEST_REPORT_INTERVAL", 10)))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    session = ThreadSafeSession(boto3.Session(region_name=os.getenv("AWS_REGION", "us-west-1")))
+    client = clickhouse_connect.get_client(
+        host=os.getenv("CH_HOST", "localhost"),
+        port=int(os.getenv("CH_PORT", 8123)),
+        username=os.getenv("CH_USER", "default"),
+        password=os.getenv("CH_PASSWORD", ""),
+        compress=os.getenv("CH_COMPRESS", "lz4"),
+    )
+    worker = IngestWorker(
+        session,
+        client,
+        FileCheckpointStore(args.checkpoints),
+        streams=args.stream,
+        batch_rows=args.batch_rows,
+        batch_bytes=args.batch_bytes,
+        flush_interval=args.flush_interval,
+        async_insert=args.async_insert,
+        dedup=args.dedup,
+        starting_position=args.starting_position,
+        report_interval=args.report_interval,
+    )
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import re
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from app.utils.table_layout import type_name, unwrap_type
+
+DEFAULTS = {
+    "String": "",
+    "FixedString": "",
+    "Bool": False,
+    "UUID": "00000000-0000-0000-0000-000000000000",
+    "Date": date(1970, 1, 1),
+    "Date32": date(1970, 1, 1),
+    "DateTime": datetime(1970, 1, 1, tzinfo=timezone.utc),
+    "DateTime64": datetime(1970, 1, 1, tzinfo=timezone.utc),
+}
+
+
+INTEGER_PATTERN = re.compile(r"^(U?)Int(\d+)$")
+
+
+def to_datetime(value):
+    if isinstance(value, bool):
+        raise TypeError(f"expected a date and time, got {value!r}")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime):
+        return value
+    raise TypeError(f"expected a date and time, got {value!r}")
+
+
+def to_date(value):
+    if isinstance(value, bool):
+        raise TypeError(f"expected a date, got {value!r}")
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc).date()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, date):
+        return value
+    raise TypeError(f"expected a date, got {value!r}")
+
+
+def integer_converter(unsigned, bits):
+    low, high = (0, 2**bits - 1) if unsigned else (-(2 ** (bits - 1)), 2 ** (bits - 1) - 1)
+
+    def to_integer(value):
+        # JSON numbers may arrive as 3.0 or "3"; anything else would fail
+        # the whole insert.
+        if isinstance(value, bool):
+            raise TypeError(f"expected an integer, got {value!r}")
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        elif isinstance(value, str):
+            value = int(value.strip())
+        if not isinstance(value, int):
+            raise TypeError(f"expected an integer, got {value!r}")
+        if not low <= value <= high:
+            raise ValueError(f"{value} is out of range for {'U' if unsigned else ''}Int{bits}")
+        return value
+
+    return to_integer
+
+
+def to_float(value):
+    if isinstance(value, bool):
+        raise TypeError(f"expected a number, got {value!r}")
+    if isinstance(value, (int, float, str)):
+        return float(value)
+    raise TypeError(f"expected a number, got {value!r}")
+
+
+def to_decimal(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise TypeError(f"expected a number, got {value!r}")
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"expected a number, got {value!r}")
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ("true", "false", "0", "1"):
+        return value.lower() in ("true", "1")
+    raise ValueError(f"expected a boolean, got {value!r}")
+
+
+def to_uuid(value):
+    if isinstance(value, uuid.UUID):
+        return value
+    if not isinstance(value, str):
+        raise TypeError(f"expected a UUID, got {value!r}")
+    return uuid.UUID(value)
+
+
+def container_converter(kind):
+    expected = list if kind in ("Array", "Tuple") else dict
+
+    def check(value):
+        if not isinstance(value, expected):
+            raise TypeError(f"expected a JSON {'array' if expected is list else 'object'}, got {value!r}")
+        return value
+
+    return check
+
+
+def to_string(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value if isinstance(value, str) else str(value)
+
+
+CONVERTERS = {
+    "DateTime": to_datetime,
+    "DateTime64": to_datetime,
+    "Date": to_date,
+    "Date32": to_date,
+    "String": to_string,
+    "FixedString": to_string,
+    "Float32": to_float,
+    "Float64": to_float,
+    "Bool": to_bool,
+    "UUID": to_uuid,
+}
+
+
+def value_converter(kind):
+    match = INTEGER_PATTERN.match(kind)
+    if match:
+        return integer_converter(match.group(1) == "U", int(match.group(2)))
+    if kind.startswith("Decimal"):
+        return to_decimal
+    if kind in ("Array", "Tuple", "Map"):
+        return container_converter(kind)
+    return CONVERTERS.get(kind)
+
+
+def column_converter(col_type):
+    """
+    Returns a function turning a decoded JSON value into what
+    clickhouse_connect expects for col_type: ISO strings and epoch seconds
+    become dates and datetimes, nested JSON in String columns is kept as
+    text, numbers, booleans and UUIDs are checked, and missing values
+    become NULL or the type's default. A value that doesn't fit raises
+    TypeError or ValueError here, so the record is skipped instead of
+    failing the whole insert.
+    """
+    inner, nullable, low_cardinality = unwrap_type(col_type)
+    kind = type_name(inner)
+    convert = value_converter(kind)
+    if nullable:
+        default = None
+    elif kind.startswith(("Array", "Map")):
+        default = [] if kind.startswith("Array") else {}
+    else:
+        default = DEFAULTS.get(kind, 0)
+
+    def converter(value):
+        if value is None:
+            return default
+        return convert(value) if convert else value
+
+    return converter
+
+
+class ColumnBatch:
+    """
+    Rows of one table held as column lists, ready for a column-oriented
+    client.insert, plus the first and last sequence number read from each
+    shard: the last ones checkpoint the batch once inserted, the ranges
+    identify it for deduplication.
+    """
+
+    def __init__(self, column_names, column_types):
+        self.column_names = list(column_names)
+        self.column_types = list(column_types)
+        self.converters = [column_converter(col_type) for col_type in column_types]
+        self.columns = [[] for _ in column_names]
+        self.ranges = {}
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, record, shard_id, sequence_number, size):
+        # Convert the whole row first so a bad value leaves no partial row.
+        values = [converter(record.get(name)) for name, converter in zip(self.column_names, self.converters)]
+        for column, value in zip(self.columns, values):
+            column.append(value)
+        self.advance(shard_id, sequence_number)
+        self.rows += 1
+        self.bytes += size
+
+    def advance(self, shard_id, sequence_number):
+        """Extends the shard's range, e.g. past a record that is skipped."""
+        if shard_id in self.ranges:
+            self.ranges[shard_id][1] = sequence_number
+        else:
+            self.ranges[shard_id] = [sequence_number, sequence_number]
+
+    @property
+    def positions(self):
+        return {shard_id: last for shard_id, (first, last) in self.ranges.items()}
+
+    def dedup_token(self, stream_arn):
+        """
+        insert_deduplication_token for the batch. It depends only on the
+        stream and the shard ranges, so re-reading the same ranges after a
+        crash yields the same token.
+        """
+        key = stream_arn + "|" + "|".join(
+            f"{shard_id}:{first}-{last}" for shard_id, (first, last) in sorted(self.ranges.items())
+        )
+        return hashlib.sha256(key.encode()).hexdigest()
@@ -0,0 +1,66 @@
+import json
+import os
+import threading
+
+
+class FileCheckpointStore:
+    """
+    Per stream and shard, the last inserted sequence number, plus the
+    sequence ranges of the batch being inserted, kept in a JSON file:
+
+        {"positions": {stream_arn: {shard_id: sequence_number}},
+         "pending": {stream_arn: {shard_id: [first, last]}}}
+
+    A batch's ranges are written ahead of its insert (begin) and cleared
+    with the checkpoint after it (update). After a crash in between, the
+    worker re-reads exactly those ranges and inserts them again under the
+    same deduplication token, so ClickHouse drops the copy if the first
+    insert had landed.
+
+    Writes go to a temporary file that replaces the old one, so a crash
+    leaves either the previous or the new state, never a torn file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        self._positions = state.get("positions", {})
+        self._pending = state.get("pending", {})
+
+    def get(self, stream_arn, shard_id):
+        with self._lock:
+            return self._positions.get(stream_arn, {}).get(shard_id)
+
+    def pending(self, stream_arn):
+        with self._lock:
+            return dict(self._pending.get(stream_arn, {}))
+
+    def begin(self, stream_arn, ranges):
+        with self._lock:
+            self._pending[stream_arn] = dict(ranges)
+            self._write()
+
+    def update(self, stream_arn, positions):
+        with self._lock:
+            if not positions and stream_arn not in self._pending:
+                return
+            self._positions.setdefault(stream_arn, {}).update(positions)
+            self._pending.pop(stream_arn, None)
+            self._write()
+
+    def positions(self):
+        with self._lock:
+            return {stream: dict(shards) for stream, shards in self._positions.items()}
+
+    def _write(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"positions": self._positions, "pending": self._pending}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
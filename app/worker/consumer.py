@@ -0,0 +1,500 @@
+"""
+In-process replacement for the kinesis-to-clickhouse Lambda: reads every
+shard of the streams in stream_table_map and bulk-inserts them into their
+tables.
+
+One thread per shard polls GetRecords and appends decoded records to its
+table's ColumnBatch. The main loop flushes a table's batch with one
+column-oriented client.insert once it reaches `batch_rows` rows,
+`batch_bytes` bytes or `flush_interval` seconds of age, then checkpoints
+the last inserted sequence number of every shard in it. After a restart
+shards resume AFTER_SEQUENCE_NUMBER of their checkpoint.
+
+A crash or timeout between an insert and its checkpoint would deliver the
+batch twice. With dedup on (the default), each insert carries an
+insert_deduplication_token derived from the batch's shard sequence ranges,
+and the ranges are written ahead of the insert; a restart re-reads exactly
+those ranges and repeats the insert under the same token. Tables that keep
+deduplication hashes (non_replicated_deduplication_window > 0, or any
+Replicated*MergeTree) then store every record exactly once.
+"""
+import json
+import logging
+import re
+import threading
+from time import monotonic
+
+from app.utils.helpers import get_tables_info, parse_source_arn_name, scan_stream_table_map
+from app.utils.kinesis import POLL_INTERVAL, list_shard_ids
+from app.worker.batch import ColumnBatch
+
+logger = logging.getLogger(__name__)
+
+ASYNC_INSERT_SETTINGS = {"async_insert": 1, "wait_for_async_insert": 1}
+
+# GetRecords returns at most 10000 records per call.
+RECORDS_PER_CALL = 10000
+
+DEDUP_WINDOW_PATTERN = re.compile(r"\bnon_replicated_deduplication_window\s*=\s*(\d+)")
+
+# Cap on the seconds a failed insert or shard read waits before its retry;
+# the wait starts at retry_backoff and doubles per failure.
+MAX_RETRY_BACKOFF = 60
+
+
+class WorkerStats:
+    COUNTERS = (
+        "records", "bytes", "rows", "inserts", "deduplicated", "skipped", "insert_errors", "read_errors"
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = monotonic()
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self._last_report = (self.started, dict(self.counts))
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def report(self, since_start=False):
+        """Totals plus rates since the previous report, or since the start."""
+        now = monotonic()
+        counts = self.snapshot()
+        since, before = self._last_report
+        if since_start:
+            since, before = self.started, dict.fromkeys(self.COUNTERS, 0)
+        self._last_report = (now, counts)
+        elapsed = max(now - since, 1e-9)
+        return {
+            **counts,
+            "seconds": round(now - self.started, 3),
+            "records_per_second": round((counts["records"] - before["records"]) / elapsed, 1),
+            "rows_per_second": round((counts["rows"] - before["rows"]) / elapsed, 1),
+            "mb_per_second": round((counts["bytes"] - before["bytes"]) / elapsed / 1e6, 3),
+        }
+
+
+class TableSink:
+    """
+    The batch being filled for one stream's table. Shard threads add to it
+    under the lock; only the main loop flushes, so the ClickHouse client is
+    never used from two threads at once.
+    """
+
+    def __init__(self, client, stream_arn, database, table, checkpoints, stats, options):
+        self.client = client
+        self.stream_arn = stream_arn
+        self.database = database
+        self.table = table
+        self.checkpoints = checkpoints
+        self.stats = stats
+        self.options = options
+        self.lock = threading.Lock()
+
+        described = client.query(
+            "DESCRIBE TABLE {database:Identifier}.{table:Identifier}",
+            parameters={"database": database, "table": table},
+        ).result_rows
+        self.column_names = [row[0] for row in described]
+        self.column_types = [row[1] for row in described]
+        self.batch = self._new_batch()
+        self.retry = None
+        self.failures = 0
+        self.retry_at = None
+
+    def _new_batch(self):
+        self.opened_at = None
+        return ColumnBatch(self.column_names, self.column_types)
+
+    def add(self, shard_id, record):
+        with self.lock:
+            self.decode(self.batch, shard_id, record)
+            # Skipped records count too: their positions still need a
+            # checkpoint, or they are re-read after every restart.
+            if self.opened_at is None:
+                self.opened_at = monotonic()
+
+    def decode(self, batch, shard_id, record):
+        """
+        Decodes one Kinesis record into `batch`. Records that are not a
+        JSON object, or whose values don't fit the columns, are skipped
+        (and logged) rather than blocking their shard.
+        """
+        data = record["Data"]
+        sequence_number = record["SequenceNumber"]
+        try:
+            row = json.loads(data)
+            if not isinstance(row, dict):
+                raise ValueError("record is not a JSON object")
+            batch.add(row, shard_id, sequence_number, len(data))
+            return True
+        except (TypeError, ValueError) as e:
+            batch.advance(shard_id, sequence_number)
+            self.stats.add(skipped=1)
+            logger.warning(f"Skipping {self.table} record {sequence_number}: {e}")
+            return False
+
+    def replay(self, kinesis_client, stream_name):
+        """
+        Rebuilds the batch whose ranges were written ahead of an insert that
+        was not checkpointed, so the next flush inserts it again under the
+        same token.
+        """
+        ranges = self.checkpoints.pending(self.stream_arn)
+        if not ranges:
+            return
+        batch = self._new_batch()
+        for shard_id, (first, last) in sorted(ranges.items()):
+            for record in read_range(kinesis_client, stream_name, shard_id, first, last):
+                self.decode(batch, shard_id, record)
+            if batch.ranges.get(shard_id) != [first, last]:
+                logger.warning(
+                    f"Could not re-read {stream_name} {shard_id} {first}-{last}, "
+                    f"got {batch.ranges.get(shard_id)}; the replayed batch may not deduplicate"
+                )
+        self.retry = batch
+        logger.info(f"Replaying {batch.rows} rows of an unconfirmed insert into {self.table}")
+
+    def resume_after(self, shard_id):
+        """Sequence number a shard's reader continues after, if any."""
+        if self.retry is not None and shard_id in self.retry.ranges:
+            return self.retry.ranges[shard_id][1]
+        return self.checkpoints.get(self.stream_arn, shard_id)
+
+    def due(self, now):
+        with self.lock:
+            batch = self.batch
+            if self.retry is not None:
+                return self.retry_at is None or now >= self.retry_at
+            if batch.rows >= self.options["batch_rows"] or batch.bytes >= self.options["batch_bytes"]:
+                return True
+            return self.opened_at is not None and now - self.opened_at >= self.options["flush_interval"]
+
+    def full(self):
+        """Shard threads pause while a batch twice the flush size waits."""
+        with self.lock:
+            return (
+                self.batch.rows >= 2 * self.options["batch_rows"]
+                or self.batch.bytes >= 2 * self.options["batch_bytes"]
+            )
+
+    def flush(self):
+        """
+        Inserts the batch that failed last time if there is one, otherwise
+        the current one, and checkpoints it. A batch whose insert or
+        checkpoint failed is kept and retried once its backoff
+        (retry_backoff seconds, doubling up to MAX_RETRY_BACKOFF) has
+        passed, so rows are never dropped.
+
+        With dedup on, the batch's ranges are written ahead and the insert
+        carries insert_deduplication_token, so a retry of an insert that
+        did land (timeout, crash before the checkpoint) is dropped by
+        ClickHouse instead of duplicating rows.
+        """
+        if self.retry is None:
+            with self.lock:
+                self.retry, self.batch = self.batch, self._new_batch()
+        batch = self.retry
+        try:
+            if batch.rows:
+                self._insert(batch)
+            self.checkpoints.update(self.stream_arn, batch.positions)
+        except Exception:
+            backoff = min(self.options["retry_backoff"] * 2**self.failures, MAX_RETRY_BACKOFF)
+            self.failures += 1
+            self.retry_at = monotonic() + backoff
+            raise
+        self.retry = None
+        self.failures = 0
+        self.retry_at = None
+        return batch.rows
+
+    def _insert(self, batch):
+        settings = dict(self.options["insert_settings"])
+        if self.options["dedup"]:
+            self.checkpoints.begin(self.stream_arn, batch.ranges)
+            settings["insert_deduplication_token"] = batch.dedup_token(self.stream_arn)
+        try:
+            summary = self.client.insert(
+                self.table,
+                batch.columns,
+                column_names=batch.column_names,
+                database=self.database,
+                column_type_names=batch.column_types,
+                column_oriented=True,
+                settings=settings,
+            )
+        except Exception:
+            self.stats.add(insert_errors=1)
+            raise
+        written = written_rows(summary, batch.rows, "async_insert" in settings)
+        self.stats.add(rows=written, bytes=batch.bytes, inserts=1, deduplicated=batch.rows - written)
+
+
+def deduplication_window(client, database, table):
+    """
+    How many insert hashes a table keeps for deduplication: its
+    non_replicated_deduplication_window, or the server default for it.
+    None for Replicated* tables, which always keep them.
+    """
+    result = client.query(
+        """
+        SELECT
+            engine,
+            engine_full,
+            (SELECT value FROM system.merge_tree_settings WHERE name = 'non_replicated_deduplication_window')
+        FROM system.tables
+        WHERE database = {database:String} AND name = {table:String}
+        """,
+        parameters={"database": database, "table": table},
+    )
+    if not result.result_rows:
+        return 0
+    engine, engine_full, default_window = result.result_rows[0]
+    if engine.startswith("Replicated"):
+        return None
+    match = DEDUP_WINDOW_PATTERN.search(engine_full or "")
+    return int(match.group(1) if match else default_window or 0)
+
+
+def written_rows(summary, rows, async_insert=False):
+    """
+    Rows ClickHouse reports written for an insert; fewer than sent when
+    blocks were dropped as duplicates. Async inserts don't report them.
+    """
+    reported = getattr(summary, "summary", None)
+    if async_insert or not isinstance(reported, dict) or "written_rows" not in reported:
+        return rows
+    return min(int(reported["written_rows"]), rows)
+
+
+def read_range(kinesis_client, stream_name, shard_id, first, last):
+    """Yields the records of a shard from sequence number first to last."""
+    shard_iterator = kinesis_client.get_shard_iterator(
+        StreamName=stream_name,
+        ShardId=shard_id,
+        ShardIteratorType="AT_SEQUENCE_NUMBER",
+        StartingSequenceNumber=first,
+    )["ShardIterator"]
+    while shard_iterator:
+        response = kinesis_client.get_records(ShardIterator=shard_iterator, Limit=RECORDS_PER_CALL)
+        for record in response.get("Records", []):
+            if int(record["SequenceNumber"]) > int(last):
+                return
+            yield record
+            if record["SequenceNumber"] == last:
+                return
+        if not response.get("Records") and response.get("MillisBehindLatest", 0) == 0:
+            return
+        shard_iterator = response.get("NextShardIterator")
+
+
+class IngestWorker:
+    def __init__(
+        self,
+        session,
+        client,
+        checkpoints,
+        streams=None,
+        batch_rows=100_000,
+        batch_bytes=32 * 1024 * 1024,
+        flush_interval=5,
+        async_insert=False,
+        dedup=True,
+        starting_position="LATEST",
+        report_interval=10,
+        shard_refresh_interval=60,
+        records_per_call=RECORDS_PER_CALL,
+        retry_backoff=1.0,
+    ):
+        self.session = session
+        self.client = client
+        self.checkpoints = checkpoints
+        self.streams = set(streams) if streams else None
+        self.starting_position = starting_position
+        self.report_interval = report_interval
+        self.shard_refresh_interval = shard_refresh_interval
+        self.records_per_call = records_per_call
+        self.options = {
+            "batch_rows": batch_rows,
+            "batch_bytes": batch_bytes,
+            "flush_interval": flush_interval,
+            "insert_settings": dict(ASYNC_INSERT_SETTINGS) if async_insert else {},
+            "dedup": dedup,
+            "retry_backoff": retry_backoff,
+        }
+        if async_insert and dedup:
+            self.options["insert_settings"]["async_insert_deduplicate"] = 1
+        self.stats = WorkerStats()
+        self.sinks = {}
+        self.readers = {}
+        self._stopped = threading.Event()
+
+    def discover(self):
+        """
+        Creates a sink for every mapped stream whose table exists, and
+        starts a reader for each shard not read yet. Shards that appear
+        after the first pass (resharding) are read from TRIM_HORIZON.
+        """
+        first_pass = not self.sinks
+        items = scan_stream_table_map(self.session)
+        tables = get_tables_info(self.client, [item["table_id"] for item in items])
+
+        for item in items:
+            stream_arn = item["stream_id"]
+            stream_name = parse_source_arn_name("kinesis", stream_arn)
+            if self.streams is not None and stream_name not in self.streams:
+                continue
+            if item["table_id"] not in tables:
+                logger.warning(f"No ClickHouse table found for mapping {item}")
+                continue
+            kinesis_client = self.session.client("kinesis")
+            if stream_arn not in self.sinks:
+                table_name = tables[item["table_id"]][0]
+                sink = TableSink(
+                    self.client, stream_arn, "default", table_name, self.checkpoints, self.stats, self.options
+                )
+                if self.options["dedup"]:
+                    self._check_dedup_window(table_name)
+                sink.replay(kinesis_client, stream_name)
+                self.sinks[stream_arn] = sink
+                logger.info(f"Ingesting {stream_name} into default.{table_name}")
+
+            for shard_id in list_shard_ids(kinesis_client, stream_name):
+                if (stream_arn, shard_id) in self.readers:
+                    continue
+                position = self.starting_position if first_pass else "TRIM_HORIZON"
+                reader = threading.Thread(
+                    target=self.read_shard,
+                    args=(self.sinks[stream_arn], stream_name, shard_id, position),
+                    name=f"shard-{stream_name}-{shard_id}",
+                    daemon=True,
+                )
+                self.readers[(stream_arn, shard_id)] = reader
+                reader.start()
+
+    def _check_dedup_window(self, table_name):
+        try:
+            window = deduplication_window(self.client, "default", table_name)
+        except Exception as e:
+            logger.warning(f"Could not read the deduplication window of default.{table_name}: {e}")
+            return
+        if window == 0:
+            logger.warning(
+                f"default.{table_name} keeps no insert hashes (non_replicated_deduplication_window = 0), "
+                "so ClickHouse ignores deduplication tokens and a retried batch can be inserted twice"
+            )
+
+    def shard_iterator(self, kinesis_client, stream_name, shard_id, sequence_number, position):
+        kwargs = {"StreamName": stream_name, "ShardId": shard_id}
+        if sequence_number:
+            kwargs.update(ShardIteratorType="AFTER_SEQUENCE_NUMBER", StartingSequenceNumber=sequence_number)
+        else:
+            kwargs["ShardIteratorType"] = position
+        return kinesis_client.get_shard_iterator(**kwargs)["ShardIterator"]
+
+    def read_shard(self, sink, stream_name, shard_id, position):
+        """
+        Polls one shard until it is closed or the worker stops. Errors
+        other than throttling and expired iterators (network, 5xx, access)
+        are logged and retried after retry_backoff seconds, doubling up to
+        MAX_RETRY_BACKOFF, so a shard is never silently dropped.
+        """
+        kinesis_client = self.session.client("kinesis")
+        last_sequence = sink.resume_after(shard_id)
+        shard_iterator = None
+        failures = 0
+
+        while not self._stopped.is_set():
+            if sink.full():
+                self._stopped.wait(POLL_INTERVAL)
+                continue
+
+            called_at = monotonic()
+            try:
+                if shard_iterator is None:
+                    shard_iterator = self.shard_iterator(
+                        kinesis_client, stream_name, shard_id, last_sequence, position
+                    )
+                response = kinesis_client.get_records(
+                    ShardIterator=shard_iterator, Limit=self.records_per_call
+                )
+            except kinesis_client.exceptions.ProvisionedThroughputExceededException:
+                self._stopped.wait(1)
+                continue
+            except kinesis_client.exceptions.ExpiredIteratorException:
+                shard_iterator = None
+                continue
+            except Exception as e:
+                backoff = min(self.options["retry_backoff"] * 2**failures, MAX_RETRY_BACKOFF)
+                failures += 1
+                self.stats.add(read_errors=1)
+                logger.error(
+                    f"Reading shard {shard_id} of {stream_name} failed ({failures} in a row), "
+                    f"retrying in {backoff:.1f}s: {e}"
+                )
+                self._stopped.wait(backoff)
+                continue
+            failures = 0
+
+            records = response.get("Records", [])
+            for record in records:
+                sink.add(shard_id, record)
+            if records:
+                last_sequence = records[-1]["SequenceNumber"]
+                self.stats.add(records=len(records))
+            shard_iterator = response.get("NextShardIterator")
+            if shard_iterator is None:
+                logger.info(f"Shard {shard_id} of {stream_name} is closed")
+                return
+
+            # Kinesis allows 5 GetRecords calls per second per shard.
+            self._stopped.wait(max(POLL_INTERVAL - (monotonic() - called_at), 0))
+
+    def flush_due(self, force=False):
+        now = monotonic()
+        for sink in self.sinks.values():
+            if force or sink.due(now):
+                try:
+                    sink.flush()
+                except Exception as e:
+                    logger.error(
+                        f"Flush into {sink.database}.{sink.table} failed ({sink.failures} in a row), "
+                        f"retrying in {sink.retry_at - monotonic():.1f}s: {e}"
+                    )
+
+    def run(self, until=None, poll=0.05):
+        """
+        Consumes until stop() is called or `until()` returns true, then
+        flushes what is left and returns the final report.
+        """
+        self.discover()
+        refreshed_at = reported_at = monotonic()
+        try:
+            while not self._stopped.is_set() and not (until and until()):
+                self.flush_due()
+                now = monotonic()
+                if now - refreshed_at >= self.shard_refresh_interval:
+                    self.discover()
+                    refreshed_at = now
+                if self.report_interval and now - reported_at >= self.report_interval:
+                    logger.info(f"Ingest: {self.stats.report()}")
+                    reported_at = now
+                self._stopped.wait(poll)
+        finally:
+            self._stopped.set()
+            for reader in self.readers.values():
+                reader.join()
+            self.flush_due(force=True)
+        report = self.stats.report(since_start=True)
+        logger.info(f"Ingest finished: {report}")
+        return report
+
+    def stop(self):
+        self._stopped.set()
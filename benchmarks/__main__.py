@@ -0,0 +1,149 @@
+"""
+    python -m benchmarks run [--live] [--output results.json] [--baseline old.json]
+    python -m benchmarks load --events 10000000 --pypi 10000000
+    python -m benchmarks list
+    python -m benchmarks dedup [--live] [--batches 50] [--batch-rows 10000]
+"""
+import argparse
+import json
+import os
+import sys
+
+from benchmarks.scenarios import SCENARIOS, select_scenarios
+
+
+def run_command(args):
+    from benchmarks.runner import compare, run, write_results
+
+    options = {
+        "live": args.live,
+        "rows": args.rows,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "cache": args.cache,
+        "mappings": args.mappings,
+        "clickhouse_latency": args.clickhouse_latency_ms / 1000,
+        "openai_latency": args.openai_latency_ms / 1000,
+    }
+    document = run(select_scenarios(args.scenario, live=args.live), options)
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        document["baseline"] = baseline.get("commit")
+        document["regressions"] = compare(document, baseline, args.threshold)
+        for regression in document["regressions"]:
+            print(
+                f"REGRESSION {regression['name']}: p50 {regression['p50_ms'][0]} -> "
+                f"{regression['p50_ms'][1]} ms, throughput {regression['throughput_rps'][0]} -> "
+                f"{regression['throughput_rps'][1]} req/s",
+                file=sys.stderr,
+            )
+        failed = bool(document["regressions"])
+
+    write_results(document, args.output)
+    return 1 if failed else 0
+
+
+def live_client():
+    import clickhouse_connect
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    return clickhouse_connect.get_client(
+        host=os.getenv("CH_HOST", "localhost"),
+        port=int(os.getenv("CH_PORT", 8123)),
+        username=os.getenv("CH_USER", "default"),
+        password=os.getenv("CH_PASSWORD", ""),
+    )
+
+
+def load_command(args):
+    from benchmarks.loader import load
+
+    client = live_client()
+    loaded = load(client, events=args.events, pypi=args.pypi, truncate=not args.append)
+    for table, (rows, seconds) in loaded.items():
+        print(f"{table}: {rows} rows in {seconds:.1f}s", file=sys.stderr)
+    return 0
+
+
+def dedup_command(args):
+    from benchmarks.dedup import run
+    from benchmarks.runner import git_commit, write_results
+
+    document = run(
+        batches=args.batches,
+        batch_rows=args.batch_rows,
+        client=live_client() if args.live else None,
+    )
+    flush = document["worker_flush_ms"]
+    print(f"worker flush      dedup {flush['dedup']:>8.3f} ms  no dedup {flush['no_dedup']:>8.3f} ms", file=sys.stderr)
+    for name, result in document.get("clickhouse", {}).items():
+        print(
+            f"{name:<10} {result['rows_per_second']:>10} rows/s  after redelivery count {result['count']:>9}  "
+            f"FINAL {result['count_final']:>9} in {result['count_final_ms']:.1f} ms",
+            file=sys.stderr,
+        )
+    write_results({"commit": git_commit(), **document}, args.output)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks", description="API benchmarks.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmark scenarios.")
+    run_parser.add_argument(
+        "--live",
+        action="store_true",
+        help="Use the ClickHouse configured by CH_* (load it first) instead of the fake client",
+    )
+    run_parser.add_argument("--scenario", action="append", help="Only run this scenario (repeatable)")
+    run_parser.add_argument("--rows", type=int, default=100_000, help="Rows per table in the fake client")
+    run_parser.add_argument("--requests", type=int, default=50, help="Measured requests per phase")
+    run_parser.add_argument("--concurrency", type=int, default=4, help="Connections in the throughput phase")
+    run_parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per scenario")
+    run_parser.add_argument("--cache", action="store_true", help="Keep the query, sources and OpenAI caches on")
+    run_parser.add_argument("--mappings", type=int, default=50, help="Stream/table mappings in fake DynamoDB")
+    run_parser.add_argument("--clickhouse-latency-ms", type=float, default=0, help="Fake ClickHouse time per call")
+    run_parser.add_argument("--openai-latency-ms", type=float, default=0, help="Fake OpenAI time per completion")
+    run_parser.add_argument("--output", default="-", help="Results file, - for stdout")
+    run_parser.add_argument("--baseline", help="Earlier results file to compare against")
+    run_parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Regression tolerance as a fraction (default 0.1)"
+    )
+    run_parser.set_defaults(handler=run_command)
+
+    load_parser = commands.add_parser("load", help="Fill default.events and default.pypi.")
+    load_parser.add_argument("--events", type=int, default=1_000_000)
+    load_parser.add_argument("--pypi", type=int, default=1_000_000)
+    load_parser.add_argument("--append", action="store_true", help="Keep existing rows")
+    load_parser.set_defaults(handler=load_command)
+
+    dedup_parser = commands.add_parser("dedup", help="Measure the cost of exactly-once ingestion.")
+    dedup_parser.add_argument("--live", action="store_true", help="Also measure inserts into the ClickHouse from CH_*")
+    dedup_parser.add_argument("--batches", type=int, default=50)
+    dedup_parser.add_argument("--batch-rows", type=int, default=10_000)
+    dedup_parser.add_argument("--output", default="-", help="Results file, - for stdout")
+    dedup_parser.set_defaults(handler=dedup_command)
+
+    list_parser = commands.add_parser("list", help="List the scenarios.")
+    list_parser.set_defaults(
+        handler=lambda args: print(
+            "\n".join(
+                f"{s['name']:<26} {s['method']:<5} {s['path']}" + (" (live only)" if s.get("live_only") else "")
+                for s in SCENARIOS
+            )
+        )
+        or 0
+    )
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+Cost of exactly-once ingestion.
+
+Worker side (always): flushing batches through the ingestion worker's
+TableSink with dedup on (write-ahead ranges plus a token per insert) and
+off, against a client that discards inserts, so only the worker's own
+overhead is timed.
+
+ClickHouse side (--live): the same batches inserted into a plain MergeTree,
+a MergeTree keeping deduplication hashes with a token per insert, and a
+ReplacingMergeTree; then every batch is delivered a second time, as
+Kinesis would after a lost acknowledgement, and the tables are counted.
+Only the token table stays exact without FINAL.
+"""
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+from clickhouse_connect.driver.summary import QuerySummary
+
+from app.worker.batch import ColumnBatch
+from app.worker.checkpoints import FileCheckpointStore
+from app.worker.consumer import TableSink, WorkerStats
+
+COLUMNS = [
+    ("user_id", "Int32"),
+    ("event_type", "LowCardinality(String)"),
+    ("event_timestamp", "DateTime"),
+    ("sequence", "UInt64"),
+]
+
+TABLES = {
+    "plain": "ENGINE = MergeTree() ORDER BY (event_type, event_timestamp, sequence)",
+    "token": (
+        "ENGINE = MergeTree() ORDER BY (event_type, event_timestamp, sequence) "
+        "SETTINGS non_replicated_deduplication_window = 1000"
+    ),
+    "replacing": "ENGINE = ReplacingMergeTree(sequence) ORDER BY (event_type, user_id, event_timestamp)",
+}
+
+STREAM_ARN = "arn:aws:kinesis:us-west-1:123456789012:stream/benchmark"
+
+
+def make_batches(batches, batch_rows, seed=7):
+    rng = random.Random(seed)
+    started = datetime(2024, 7, 1, tzinfo=timezone.utc)
+    names = [name for name, _ in COLUMNS]
+    types = [col_type for _, col_type in COLUMNS]
+    result = []
+    sequence = 0
+    for _ in range(batches):
+        batch = ColumnBatch(names, types)
+        for _ in range(batch_rows):
+            sequence += 1
+            record = {
+                "user_id": rng.randrange(100_000),
+                "event_type": rng.choice(["click", "view", "purchase", "add_to_cart"]),
+                "event_timestamp": started + timedelta(seconds=sequence),
+                "sequence": sequence,
+            }
+            batch.add(record, f"shardId-{sequence % 4:012d}", str(10**20 + sequence), 100)
+        result.append(batch)
+    return result
+
+
+class DiscardingClient:
+    def __init__(self):
+        self.inserts = 0
+
+    def query(self, query, parameters=None):
+        return type("Result", (), {"result_rows": [(name, col_type) for name, col_type in COLUMNS]})()
+
+    def insert(self, table, data, **kwargs):
+        self.inserts += 1
+        return QuerySummary({"written_rows": str(len(data[0]))})
+
+
+def time_worker_flushes(batches, dedup):
+    """Median milliseconds per TableSink.flush() of a prepared batch."""
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoints = FileCheckpointStore(Path(directory) / "checkpoints.json")
+        options = {
+            "batch_rows": 0,
+            "batch_bytes": 0,
+            "flush_interval": 0,
+            "insert_settings": {},
+            "dedup": dedup,
+            "retry_backoff": 1,
+        }
+        sink = TableSink(DiscardingClient(), STREAM_ARN, "default", "events", checkpoints, WorkerStats(), options)
+        timings = []
+        for batch in batches:
+            sink.retry = batch
+            started = perf_counter()
+            sink.flush()
+            timings.append(perf_counter() - started)
+    return round(median(timings) * 1000, 3)
+
+
+def insert_all(client, table, batches, token):
+    started = perf_counter()
+    for batch in batches:
+        settings = {"insert_deduplication_token": batch.dedup_token(STREAM_ARN)} if token else {}
+        client.insert(
+            table,
+            batch.columns,
+            column_names=batch.column_names,
+            column_type_names=batch.column_types,
+            column_oriented=True,
+            settings=settings,
+        )
+    return perf_counter() - started
+
+
+def run_live(client, batches):
+    rows = sum(batch.rows for batch in batches)
+    columns = ", ".join(f"{name} {col_type}" for name, col_type in COLUMNS)
+    results = {}
+    for name, engine in TABLES.items():
+        table = f"default.bench_dedup_{name}"
+        client.command(f"DROP TABLE IF EXISTS {table}")
+        client.command(f"CREATE TABLE {table} ({columns}) {engine}")
+        try:
+            first = insert_all(client, table, batches, token=name == "token")
+            redelivery = insert_all(client, table, batches, token=name == "token")
+
+            count = client.query(f"SELECT count() FROM {table}").first_row[0]
+            started = perf_counter()
+            final_count = client.query(f"SELECT count() FROM {table} FINAL").first_row[0]
+            final_ms = (perf_counter() - started) * 1000
+            results[name] = {
+                "rows_per_second": round(rows / first),
+                "redelivery_rows_per_second": round(rows / redelivery),
+                "count": count,
+                "count_final": final_count,
+                "count_final_ms": round(final_ms, 3),
+            }
+        finally:
+            client.command(f"DROP TABLE IF EXISTS {table}")
+    return results
+
+
+def run(batches=50, batch_rows=10_000, client=None):
+    prepared = make_batches(batches, batch_rows)
+    document = {
+        "batches": batches,
+        "batch_rows": batch_rows,
+        "worker_flush_ms": {
+            "dedup": time_worker_flushes(prepared, dedup=True),
+            "no_dedup": time_worker_flushes(prepared, dedup=False),
+        },
+    }
+    if client is not None:
+        document["clickhouse"] = run_live(client, prepared)
+    return document
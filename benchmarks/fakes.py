@@ -0,0 +1,358 @@
+"""
+Stand-ins for the services the API talks to, so the benchmarks measure the
+API itself: an in-memory ClickHouse client serving generated events/pypi
+rows, a local OpenAI-compatible HTTP server, and moto-backed DynamoDB and
+Kinesis for /sources.
+"""
+import json
+import os
+import random
+import re
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from uuid import UUID
+
+import boto3
+import pyarrow as pa
+from clickhouse_connect.driver.common import StreamContext
+from clickhouse_connect.driver.exceptions import DatabaseError
+from moto import mock_aws
+
+from app.utils.aws import ThreadSafeSession
+from app.utils.catalog import COLUMNS_QUERY, FINGERPRINT_QUERY, TABLES_QUERY
+
+TABLE_COLUMNS = {
+    "events": [
+        ("user_id", "Int32"),
+        ("session_id", "UUID"),
+        ("event_type", "String"),
+        ("event_timestamp", "DateTime"),
+        ("page_url", "String"),
+        ("product_id", "Int32"),
+    ],
+    "pypi": [
+        ("TIMESTAMP", "DateTime"),
+        ("COUNTRY_CODE", "String"),
+        ("URL", "String"),
+        ("PROJECT", "String"),
+    ],
+}
+
+EVENT_TYPES = ["click", "view", "purchase", "add_to_cart"]
+EVENT_WEIGHTS = [0.7, 0.2, 0.05, 0.05]
+PAGES = ["home", "products", "cart", "checkout", "search"]
+COUNTRY_CODES = ["US", "DE", "CN", "GB", "IN", "FR", "JP", "BR", "CA", "NL"]
+PROJECTS = ["boto3", "urllib3", "requests", "numpy", "pandas", "setuptools", "pyarrow", "flask"]
+START = datetime(2024, 7, 1)
+
+TABLE_PATTERN = re.compile(r"\bFROM\s+(?:`?default`?\.)?`?(events|pypi)\b", re.IGNORECASE)
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+(\d+)(?:\s+OFFSET\s+(\d+))?", re.IGNORECASE)
+
+STREAM_ARN = "arn:aws:kinesis:us-west-1:123456789012:stream/bench_stream_{}"
+
+
+def generate_rows(table, count, seed=0):
+    rng = random.Random(seed)
+    span = 30 * 24 * 3600
+    if table == "events":
+        return [
+            (
+                rng.randrange(100_000),
+                UUID(int=rng.getrandbits(128)),
+                rng.choices(EVENT_TYPES, EVENT_WEIGHTS)[0],
+                START + timedelta(seconds=i * span // count),
+                f"https://example.com/{rng.choice(PAGES)}/{rng.randrange(1000)}",
+                rng.randrange(10_000),
+            )
+            for i in range(count)
+        ]
+    rows = []
+    for i in range(count):
+        project = rng.choice(PROJECTS)
+        rows.append(
+            (
+                START + timedelta(seconds=i * span // count),
+                rng.choice(COUNTRY_CODES),
+                f"/packages/{project}-{rng.randrange(1, 3)}.{rng.randrange(30)}.0.tar.gz",
+                project,
+            )
+        )
+    return rows
+
+
+class FakeType:
+    def __init__(self, name):
+        self.name = name
+        self.base_type = name
+
+
+class FakeResult:
+    def __init__(self, column_names, column_types, rows, column_oriented=False, read_rows=None):
+        self.column_names = tuple(column_names)
+        self.column_types = [FakeType(t) for t in column_types]
+        self.result_rows = rows
+        self.row_count = len(rows)
+        self.column_oriented = column_oriented
+        self.summary = {"read_rows": str(len(rows) if read_rows is None else read_rows)}
+
+    @property
+    def result_columns(self):
+        return [list(column) for column in zip(*self.result_rows)] or [
+            [] for _ in self.column_names
+        ]
+
+    def close(self):
+        pass
+
+    @property
+    def first_row(self):
+        return self.result_rows[0] if self.result_rows else None
+
+    def named_results(self):
+        for row in self.result_rows:
+            yield dict(zip(self.column_names, row))
+
+
+class FakeClickHouseClient:
+    """
+    Answers the queries the routes issue without a server: catalog and
+    system table lookups get canned rows, DESCRIBE/count()/EXPLAIN ESTIMATE
+    are derived from the generated tables, and any other query returns the
+    referenced table's rows with its LIMIT/OFFSET clauses applied in order.
+    Filters, aggregates and ORDER BY are not evaluated, so scenarios that
+    need them only run against a real ClickHouse. `latency` seconds are
+    slept per call to model server time.
+    """
+
+    def __init__(self, rows=100_000, seed=0, latency=0.0):
+        self.latency = latency
+        self.tables = {table: generate_rows(table, rows, seed) for table in TABLE_COLUMNS}
+        self._arrow_tables = {}
+        self._lock = threading.Lock()
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+    def command(self, sql, parameters=None, settings=None, **kwargs):
+        if self.latency:
+            sleep(self.latency)
+        return None
+
+    def query(self, sql, parameters=None, settings=None, column_oriented=False, **kwargs):
+        if self.latency:
+            sleep(self.latency)
+        names, types, rows = self._answer(sql, parameters or {})
+        return FakeResult(names, types, rows, column_oriented)
+
+    def query_row_block_stream(self, sql, parameters=None, settings=None, **kwargs):
+        result = self.query(sql, parameters, settings)
+        rows = result.result_rows
+        blocks = (rows[i : i + 65536] for i in range(0, len(rows), 65536))
+        return StreamContext(result, blocks)
+
+    def query_arrow_stream(self, sql, parameters=None, settings=None, **kwargs):
+        # Converted once per table and sliced, so the conversion isn't timed
+        # as part of every request.
+        result = self.query(sql, parameters, settings)
+        table = self._table(sql)
+        start, stop = self._window(sql, len(self.tables[table]))
+        batches = self._arrow_table(table).slice(start, stop - start).to_batches(65536)
+        return StreamContext(result, iter(batches))
+
+    def _arrow_table(self, table):
+        with self._lock:
+            if table not in self._arrow_tables:
+                names = [name for name, _ in TABLE_COLUMNS[table]]
+                columns = zip(*self.tables[table])
+                self._arrow_tables[table] = pa.table(
+                    {
+                        name: [str(v) if isinstance(v, UUID) else v for v in values]
+                        for name, values in zip(names, columns)
+                    }
+                )
+            return self._arrow_tables[table]
+
+    def _answer(self, sql, parameters):
+        stripped = sql.strip()
+        if sql == FINGERPRINT_QUERY:
+            return ["name", "fingerprint"], ["String", "UInt64"], [("default", 1)]
+        if sql == TABLES_QUERY:
+            return ["database", "name"], ["String", "String"], [
+                ("default", table) for table in TABLE_COLUMNS
+            ]
+        if sql == COLUMNS_QUERY:
+            return ["database", "table", "name", "type"], ["String"] * 4, [
+                ("default", table, name, col_type)
+                for table, columns in TABLE_COLUMNS.items()
+                for name, col_type in columns
+            ]
+        if "table_ids" in parameters:
+            return ["uuid", "name", "metadata_modification_time"], [
+                "String", "String", "DateTime"
+            ], [(tid, f"table_{tid[-6:]}", START) for tid in parameters["table_ids"]]
+        if "system.parts" in sql:
+            return ["database", "name", "mtime", "parts", "rows", "modified"], [
+                "String", "String", "String", "UInt64", "UInt64", "String"
+            ], [
+                ("default", table, str(START), 1, len(rows), str(START))
+                for table, rows in self.tables.items()
+            ]
+
+        table = self._table(sql)
+        if stripped.startswith("DESCRIBE"):
+            return ["name", "type"], ["String", "String"], list(TABLE_COLUMNS[table])
+        if stripped.startswith("SELECT count() FROM ("):
+            return ["count()"], ["UInt64"], [(len(self._rows(sql, table)),)]
+        if stripped.startswith("EXPLAIN ESTIMATE"):
+            rows = len(self.tables[table])
+            return ["database", "table", "parts", "rows", "marks"], [
+                "String", "String", "UInt64", "UInt64", "UInt64"
+            ], [("default", table, 1, rows, rows // 8192 + 1)]
+        if stripped.startswith("KILL QUERY"):
+            return ["kill_status", "query_id"], ["String", "String"], []
+
+        names, types = zip(*TABLE_COLUMNS[table])
+        return names, types, self._rows(sql, table)
+
+    def _table(self, sql):
+        match = TABLE_PATTERN.search(sql)
+        return match.group(1).lower() if match else "events"
+
+    def _rows(self, sql, table):
+        start, stop = self._window(sql, len(self.tables[table]))
+        return self.tables[table][start:stop]
+
+    def _window(self, sql, total):
+        # Like ClickHouse, one LIMIT per (sub)query; nested ones apply inner first.
+        scopes = set()
+        for match in LIMIT_PATTERN.finditer(sql):
+            scope = _enclosing_paren(sql, match.start())
+            if scope in scopes:
+                raise DatabaseError(f"Syntax error: second LIMIT in {sql!r}")
+            scopes.add(scope)
+        start, stop = 0, total
+        for limit, offset in LIMIT_PATTERN.findall(sql):
+            start = min(start + int(offset or 0), stop)
+            stop = min(start + int(limit), stop)
+        return start, stop
+
+
+def _enclosing_paren(sql, position):
+    """Index of the innermost unclosed "(" before position, or -1 at the top level."""
+    opened = []
+    for index, char in enumerate(sql[:position]):
+        if char == "(":
+            opened.append(index)
+        elif char == ")" and opened:
+            opened.pop()
+    return opened[-1] if opened else -1
+
+
+class FakeOpenAI:
+    """
+    Local OpenAI-compatible chat completions server. Answers with `tokens`
+    words after `latency` seconds, as one JSON body or as SSE deltas when
+    the request asks to stream.
+    """
+
+    def __init__(self, latency=0.0, tokens=60):
+        self.latency = latency
+        self.tokens = tokens
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body go out in separate writes; without this,
+                # Nagle's algorithm holds the body back for a delayed ACK.
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if fake.latency:
+                    sleep(fake.latency)
+                words = [f"word{i} " for i in range(fake.tokens)]
+                if body.get("stream"):
+                    chunks = [
+                        f"data: {json.dumps({'choices': [{'delta': {'content': w}}]})}\n\n"
+                        for w in words
+                    ]
+                    payload = ("".join(chunks) + "data: [DONE]\n\n").encode()
+                    content_type = "text/event-stream"
+                else:
+                    message = {"role": "assistant", "content": "".join(words)}
+                    payload = json.dumps({"choices": [{"message": message}]}).encode()
+                    content_type = "application/json"
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@contextmanager
+def fake_aws(mappings=50, region="us-west-1"):
+    """
+    moto-backed AWS with a stream_table_map of `mappings` Kinesis streams,
+    yielding the session /authenticate would have created.
+    """
+    previous = {key: os.environ.get(key) for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY")}
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    try:
+        with mock_aws():
+            session = boto3.Session(region_name=region)
+            session.client("dynamodb").create_table(
+                TableName="stream_table_map",
+                KeySchema=[
+                    {"AttributeName": "stream_id", "KeyType": "HASH"},
+                    {"AttributeName": "table_id", "KeyType": "RANGE"},
+                ],
+                AttributeDefinitions=[
+                    {"AttributeName": "stream_id", "AttributeType": "S"},
+                    {"AttributeName": "table_id", "AttributeType": "S"},
+                ],
+                BillingMode="PAY_PER_REQUEST",
+            )
+            table = session.resource("dynamodb").Table("stream_table_map")
+            with table.batch_writer() as batch:
+                for i in range(mappings):
+                    batch.put_item(
+                        Item={"stream_id": STREAM_ARN.format(i), "table_id": str(UUID(int=i + 1))}
+                    )
+            yield ThreadSafeSession(session)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
@@ -0,0 +1,104 @@
+"""
+Bulk-fills default.events and default.pypi for the live benchmarks. Rows
+are generated by ClickHouse itself (INSERT ... SELECT FROM numbers()), so
+loading tens of millions of rows takes seconds rather than shipping them
+over HTTP, and values are derived from hashes of the row number, so the
+same scale always produces the same data.
+"""
+import sys
+from time import perf_counter
+
+CREATE_TABLES = {
+    "events": """
+        CREATE TABLE IF NOT EXISTS default.events
+        (
+            user_id Int32,
+            session_id UUID,
+            event_type String,
+            event_timestamp DateTime,
+            page_url String,
+            product_id Int32
+        )
+        ENGINE = MergeTree()
+        ORDER BY (user_id, event_timestamp)
+    """,
+    "pypi": """
+        CREATE TABLE IF NOT EXISTS default.pypi
+        (
+            TIMESTAMP DateTime,
+            COUNTRY_CODE String,
+            URL String,
+            PROJECT String
+        )
+        ENGINE = MergeTree
+        PRIMARY KEY TIMESTAMP
+    """,
+}
+
+# {start} and {count} select the numbers() chunk, {rows} is the total so
+# timestamps spread evenly over 30 days whatever the chunking.
+INSERT_QUERIES = {
+    "events": """
+        INSERT INTO default.events
+        SELECT
+            toInt32(cityHash64(number, 'user') % 100000) AS user_id,
+            reinterpretAsUUID(sipHash128(number)) AS session_id,
+            multiIf(h < 70, 'click', h < 90, 'view', h < 95, 'purchase', 'add_to_cart') AS event_type,
+            toDateTime('2024-07-01 00:00:00') + intDiv(number * 2592000, {rows}) AS event_timestamp,
+            concat(
+                'https://example.com/',
+                ['home', 'products', 'cart', 'checkout', 'search'][1 + cityHash64(number, 'page') % 5],
+                '/',
+                toString(cityHash64(number, 'item') % 1000)
+            ) AS page_url,
+            toInt32(cityHash64(number, 'product') % 10000) AS product_id
+        FROM
+        (
+            SELECT number, cityHash64(number, 'type') % 100 AS h
+            FROM numbers({start}, {count})
+        )
+    """,
+    "pypi": """
+        INSERT INTO default.pypi
+        SELECT
+            toDateTime('2024-07-01 00:00:00') + intDiv(number * 2592000, {rows}) AS TIMESTAMP,
+            ['US', 'DE', 'CN', 'GB', 'IN', 'FR', 'JP', 'BR', 'CA', 'NL'][1 + cityHash64(number, 'country') % 10] AS COUNTRY_CODE,
+            concat('/packages/', project, '-', toString(1 + cityHash64(number, 'major') % 2), '.',
+                   toString(cityHash64(number, 'minor') % 30), '.0.tar.gz') AS URL,
+            project AS PROJECT
+        FROM
+        (
+            SELECT
+                number,
+                ['boto3', 'urllib3', 'requests', 'numpy', 'pandas', 'setuptools', 'pyarrow', 'flask']
+                    [1 + cityHash64(number, 'project') % 8] AS project
+            FROM numbers({start}, {count})
+        )
+    """,
+}
+
+INSERT_SETTINGS = {"max_insert_threads": 4}
+
+
+def load(client, events=1_000_000, pypi=1_000_000, truncate=True, chunk=10_000_000):
+    """
+    Creates the tables when missing and fills them with `events` and
+    `pypi` rows, in numbers() chunks of `chunk` rows. Returns
+    {table: (rows, seconds)}.
+    """
+    loaded = {}
+    for table, rows in (("events", events), ("pypi", pypi)):
+        client.command(CREATE_TABLES[table])
+        if truncate:
+            client.command(f"TRUNCATE TABLE default.{table}")
+        started = perf_counter()
+        for start in range(0, rows, chunk):
+            count = min(chunk, rows - start)
+            client.command(
+                INSERT_QUERIES[table].format(start=start, count=count, rows=rows),
+                settings=INSERT_SETTINGS,
+            )
+            print(f"{table}: {start + count}/{rows} rows", file=sys.stderr)
+        client.command(f"OPTIMIZE TABLE default.{table} FINAL")
+        loaded[table] = (rows, perf_counter() - started)
+    return loaded
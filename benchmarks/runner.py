@@ -0,0 +1,208 @@
+import json
+import logging
+import platform
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from statistics import mean
+from time import perf_counter
+from unittest.mock import patch
+
+import requests
+from werkzeug.serving import make_server
+
+from app.main import create_app
+from benchmarks.fakes import FakeClickHouseClient, FakeOpenAI, fake_aws
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    return {
+        "p50": round(percentile(ordered, 0.5) * 1000, 3),
+        "p90": round(percentile(ordered, 0.9) * 1000, 3),
+        "p99": round(percentile(ordered, 0.99) * 1000, 3),
+        "mean": round(mean(ordered) * 1000, 3),
+        "min": round(ordered[0] * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def send(http, base_url, scenario):
+    """
+    Returns (seconds, response bytes, ok). The body is read to the end, so
+    streamed responses are timed until their last chunk.
+    """
+    started = perf_counter()
+    response = http.request(
+        scenario["method"], base_url + scenario["path"], json=scenario.get("json"), stream=True
+    )
+    size = sum(len(chunk) for chunk in response.raw.stream(65536, decode_content=False))
+    elapsed = perf_counter() - started
+    response.raw.release_conn()
+    return elapsed, size, response.status_code < 400
+
+
+def run_scenario(base_url, scenario, requests_count=50, concurrency=4, warmup=5):
+    """
+    Latency: requests_count requests one after another on a keep-alive
+    connection. Throughput: the same number spread over `concurrency`
+    connections at once, reported as completed requests per second.
+    """
+    errors = 0
+    with requests.Session() as http:
+        for _ in range(warmup):
+            send(http, base_url, scenario)
+        latencies = []
+        sizes = []
+        for _ in range(requests_count):
+            elapsed, size, ok = send(http, base_url, scenario)
+            latencies.append(elapsed)
+            sizes.append(size)
+            errors += not ok
+
+    def worker(count):
+        results = []
+        with requests.Session() as http:
+            for _ in range(count):
+                results.append(send(http, base_url, scenario))
+        return results
+
+    shares = [requests_count // concurrency + (i < requests_count % concurrency) for i in range(concurrency)]
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        loaded = [r for results in executor.map(worker, shares) for r in results]
+    wall = perf_counter() - started
+    errors += sum(not ok for _, _, ok in loaded)
+
+    return {
+        "name": scenario["name"],
+        "method": scenario["method"],
+        "path": scenario["path"],
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "errors": errors,
+        "response_bytes": round(mean(sizes)),
+        "latency_ms": summarize(latencies),
+        "loaded_latency_ms": summarize([elapsed for elapsed, _, _ in loaded]),
+        "throughput_rps": round(len(loaded) / wall, 2),
+    }
+
+
+def bench_config(options, openai_url):
+    config = {
+        "CHAT_GPT_API_KEY": "benchmark",
+        "OPENAI_API_URL": openai_url,
+    }
+    if not options["cache"]:
+        # Measure the work behind each route, not the caches in front of it.
+        config.update(
+            QUERY_CACHE_ENABLED=False,
+            QUERY_COUNT_CACHE_TTL=0,
+            SOURCES_CACHE_TTL=0,
+            OPENAI_CACHE_TTL=0,
+        )
+    return config
+
+
+def run(scenarios, options):
+    """
+    Serves the app on a threaded werkzeug server (a stand-in for one
+    gunicorn gthread worker) with OpenAI and AWS faked, against the fake
+    ClickHouse client or the one configured by CH_* when options["live"],
+    and returns the results document.
+    """
+    with ExitStack() as stack:
+        openai = stack.enter_context(FakeOpenAI(latency=options["openai_latency"]))
+        aws_session = stack.enter_context(fake_aws(mappings=options["mappings"]))
+        stack.enter_context(patch("app.api.routes.global_boto3_session", aws_session))
+
+        client = None
+        if not options["live"]:
+            client = FakeClickHouseClient(
+                rows=options["rows"], latency=options["clickhouse_latency"]
+            )
+        app = create_app(config=bench_config(options, openai.url), client=client)
+        # create_app() turns on DEBUG logging; per-request logs would skew timings.
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        stack.callback(server.shutdown)
+        base_url = f"http://127.0.0.1:{server.server_port}"
+
+        results = []
+        for scenario in scenarios:
+            result = run_scenario(
+                base_url,
+                scenario,
+                requests_count=options["requests"],
+                concurrency=options["concurrency"],
+                warmup=options["warmup"],
+            )
+            print(
+                f"{result['name']:<26} p50 {result['latency_ms']['p50']:>9.2f} ms  "
+                f"p99 {result['latency_ms']['p99']:>9.2f} ms  "
+                f"{result['throughput_rps']:>8.1f} req/s  errors {result['errors']}",
+                file=sys.stderr,
+            )
+            results.append(result)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "options": options,
+        "results": results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    Scenarios whose p50 latency grew, or whose throughput fell, by more
+    than `threshold` (a fraction) relative to baseline.
+    """
+    previous = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+        latency = result["latency_ms"]["p50"] / before["latency_ms"]["p50"] - 1
+        throughput = 1 - result["throughput_rps"] / before["throughput_rps"]
+        if latency > threshold or throughput > threshold:
+            regressions.append(
+                {
+                    "name": result["name"],
+                    "p50_ms": [before["latency_ms"]["p50"], result["latency_ms"]["p50"]],
+                    "throughput_rps": [before["throughput_rps"], result["throughput_rps"]],
+                }
+            )
+    return regressions
+
+
+def write_results(document, path):
+    if path == "-":
+        print(json.dumps(document, indent=2))
+        return
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
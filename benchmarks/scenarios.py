@@ -0,0 +1,108 @@
+"""
+One entry per measured request. `live_only` scenarios need ClickHouse to
+evaluate filters or aggregates and are skipped against the fake client.
+"""
+
+SUMMARY_PROMPT = (
+    "event_type,page_url,occurrences\n"
+    + "\n".join(f"error_{i},https://example.com/checkout/{i},{1000 - i}" for i in range(40))
+)
+
+SCENARIOS = [
+    {"name": "databases", "method": "GET", "path": "/api/databases"},
+    {"name": "databases-columns", "method": "GET", "path": "/api/databases?columns=true"},
+    {
+        "name": "query-small",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT * FROM events LIMIT 100"},
+    },
+    {
+        "name": "query-rows-10k",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT * FROM events LIMIT 10000"},
+    },
+    {
+        "name": "query-columns-10k",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT * FROM events LIMIT 10000", "format": "columns"},
+    },
+    {
+        "name": "query-arrow-10k",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT * FROM events LIMIT 10000", "format": "arrow"},
+    },
+    {
+        "name": "query-ndjson-10k",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT * FROM events LIMIT 10000", "stream": "ndjson"},
+    },
+    {
+        "name": "query-page",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT * FROM events", "page": 50, "pageSize": 100},
+    },
+    {
+        "name": "query-seek",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {
+            "query": "SELECT * FROM events",
+            "pageSize": 100,
+            "seek": ["user_id", "event_timestamp"],
+        },
+    },
+    {
+        "name": "query-events-by-type",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT event_type, count() AS n FROM events GROUP BY event_type"},
+        "live_only": True,
+    },
+    {
+        # The same query kept on the raw table, to compare with a rollup of events.
+        "name": "query-events-by-type-raw",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {"query": "SELECT event_type, count() AS n FROM events GROUP BY event_type", "rollups": False},
+        "live_only": True,
+    },
+    {
+        "name": "query-pypi-top-projects",
+        "method": "POST",
+        "path": "/api/query",
+        "json": {
+            "query": "SELECT PROJECT, count() AS downloads FROM pypi "
+            "GROUP BY PROJECT ORDER BY downloads DESC LIMIT 10"
+        },
+        "live_only": True,
+    },
+    {"name": "sources", "method": "GET", "path": "/api/sources"},
+    {
+        "name": "summary",
+        "method": "POST",
+        "path": "/api/api-response",
+        "json": {"prompt": SUMMARY_PROMPT},
+    },
+    {
+        "name": "summary-stream",
+        "method": "POST",
+        "path": "/api/api-response",
+        "json": {"prompt": SUMMARY_PROMPT, "stream": True},
+    },
+]
+
+
+def select_scenarios(names=None, live=False):
+    selected = [s for s in SCENARIOS if live or not s.get("live_only")]
+    if names:
+        unknown = set(names) - {s["name"] for s in SCENARIOS}
+        if unknown:
+            raise ValueError(f"Unknown scenarios {sorted(unknown)}")
+        selected = [s for s in selected if s["name"] in names]
+    return selected
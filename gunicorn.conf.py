@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+
+# The slow routes (/kinesis-sample, /api-response, /create-table) spend
+# almost all of their time waiting on AWS and OpenAI. With the default sync
+# worker each of those requests holds a whole process, so a few concurrent
+# users can starve /query. gthread (default) or gevent workers keep serving
+# other requests while they wait.
+#
+#   GUNICORN_WORKER_CLASS=gthread  threads per process (GUNICORN_THREADS)
+#   GUNICORN_WORKER_CLASS=gevent   cooperative greenlets, needs the gevent
+#                                  extra (poetry install -E gevent)
+#   GUNICORN_WORKER_CLASS=sync     previous behaviour
+#
+# One process by default. The boto3 session, table catalog, query/sources/
+# OpenAI caches, ClickHouse pool and background JobManager all live in the
+# process, so with several workers each keeps its own copy: caches hit less,
+# catalog refreshes and jobs are per process, and /api/pool or
+# /api/query/cache describe whichever worker answered. Concurrency comes from
+# GUNICORN_THREADS instead. Raise GUNICORN_WORKERS only with QUERY_CACHE_DIR
+# and JOBS_DIR on storage all workers share, and note that the boto3 session
+# (global_boto3_session in app/api/routes.py) is never shared: /api/authenticate
+# only logs in the worker that answered it, and the AWS routes on every other
+# worker keep returning 401.
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 1))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+
+# Workers write their metrics to files in this directory and /metrics sums
+# them, so every scrape sees the whole server whichever worker answers it.
+# It must be set before the app (and prometheus_client) is imported.
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "helios-metrics")
+)
+
+
+def on_starting(server):
+    # Values left over from a previous run would be added to this one's.
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -39,3 +39,13 @@ def generate_data():
     result = subprocess.run(["python3", "generate_data2.py"], check=True)
     sys.exit(result.returncode)
 
+
+
+def run_benchmark():
+    result = subprocess.run(["python3", "-m", "benchmarks", *sys.argv[1:]])
+    sys.exit(result.returncode)
+
+
+def run_ingest():
+    result = subprocess.run(["python3", "-m", "app.worker", *sys.argv[1:]])
+    sys.exit(result.returncode)
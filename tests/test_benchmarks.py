@@ -0,0 +1,76 @@
+import json
+
+import pytest
+from clickhouse_connect.driver.exceptions import DatabaseError
+
+from app.main import create_app
+from benchmarks.__main__ import main
+from benchmarks.fakes import FakeClickHouseClient
+from benchmarks.runner import compare
+from benchmarks.scenarios import SCENARIOS
+
+
+class TestFakeClickHouseClient:
+    def test_limits_apply_in_order(self):
+        client = FakeClickHouseClient(rows=1000)
+        events = client.tables["events"]
+        result = client.query("SELECT * FROM (SELECT * FROM events LIMIT 300) LIMIT 100 OFFSET 250")
+        assert result.result_rows == events[250:300]
+        with pytest.raises(DatabaseError):
+            client.query("SELECT * FROM events LIMIT 300 LIMIT 100 OFFSET 250")
+        assert client.query("SELECT count() FROM (SELECT * FROM events LIMIT 10)").first_row == (10,)
+
+    def test_page_of_query_with_limit(self):
+        client = FakeClickHouseClient(rows=1000)
+        app = create_app(config={"TESTING": True, "QUERY_CACHE_ENABLED": False}, client=client)
+
+        response = app.test_client().post(
+            "/api/query", json={"query": "SELECT * FROM events LIMIT 95", "page": 2, "pageSize": 10}
+        )
+
+        assert response.status_code == 200
+        assert response.json["metadata"]["total_rows"] == 95
+        assert [row["user_id"] for row in response.json["data"]] == [row[0] for row in client.tables["events"][10:20]]
+
+    def test_arrow_matches_rows(self):
+        client = FakeClickHouseClient(rows=1000)
+        with client.query_arrow_stream("SELECT * FROM pypi LIMIT 5 OFFSET 10") as stream:
+            batches = list(stream)
+        assert [row["PROJECT"] for b in batches for row in b.to_pylist()] == [
+            row[3] for row in client.tables["pypi"][10:15]
+        ]
+
+
+def test_run_writes_json(tmp_path):
+    output = tmp_path / "results.json"
+    exit_code = main(
+        ["run", "--rows", "2000", "--requests", "2", "--concurrency", "2", "--warmup", "0",
+         "--mappings", "3", "--output", str(output)]
+    )
+    document = json.loads(output.read_text())
+
+    assert exit_code == 0
+    names = [result["name"] for result in document["results"]]
+    assert names == [s["name"] for s in SCENARIOS if not s.get("live_only")]
+    for result in document["results"]:
+        assert result["errors"] == 0, result["name"]
+        assert result["latency_ms"]["p50"] > 0
+        assert result["throughput_rps"] > 0
+
+    slower = json.loads(output.read_text())
+    for result in slower["results"]:
+        result["latency_ms"]["p50"] *= 2
+    assert [r["name"] for r in compare(slower, document)] == names
+    assert compare(document, document) == []
+
+
+def test_dedup_writes_json(tmp_path):
+    output = tmp_path / "dedup.json"
+    exit_code = main(["dedup", "--batches", "3", "--batch-rows", "100", "--output", str(output)])
+    document = json.loads(output.read_text())
+
+    assert exit_code == 0
+    assert document["batches"] == 3
+    assert document["worker_flush_ms"]["dedup"] > 0
+    assert document["worker_flush_ms"]["no_dedup"] > 0
+    assert "clickhouse" not in document
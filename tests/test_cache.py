@@ -0,0 +1,205 @@
+import pickle
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app.utils.cache import (
+    FileBackend,
+    MemoryBackend,
+    ResultCache,
+    TTLCache,
+    normalize_query,
+    referenced_tables,
+)
+
+
+def make_versions_client(versions):
+    """
+    versions maps "db.table" to a (mtime, parts, rows, modified) tuple and can
+    be mutated by the test to simulate inserts and merges.
+    """
+    client = MagicMock()
+
+    def query(sql, parameters=None):
+        result = MagicMock()
+        result.result_rows = [
+            (*name.split("."), *versions[name])
+            for name in parameters["names"]
+            if name in versions
+        ]
+        return result
+
+    client.query.side_effect = query
+    return client
+
+
+def response_for(rows):
+    return {"metadata": {"row_count": len(rows)}, "data": rows}
+
+
+class TestTTLCache:
+    def test_expiry_and_lru(self):
+        cache = TTLCache(max_entries=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+
+        with patch("app.utils.cache.monotonic", return_value=10**9):
+            assert cache.get("a") is None
+
+
+class TestQueryNormalization:
+    def test_whitespace_outside_literals_is_collapsed(self):
+        a, _ = normalize_query("SELECT  count()\n FROM   events WHERE x = 'a  b';")
+        b, _ = normalize_query("SELECT count() FROM events WHERE x = 'a  b'")
+        assert a == b
+        assert "'a  b'" in a
+
+    def test_referenced_tables(self):
+        _, scannable = normalize_query(
+            "SELECT * FROM events e JOIN analytics.`users` u ON e.id = u.id "
+            "WHERE e.name = 'FROM secret' AND e.id IN (SELECT id FROM numbers(10))"
+        )
+        assert referenced_tables(scannable) == {("default", "events"), ("analytics", "users")}
+
+
+class TestResultCache:
+    def test_hit_after_store(self):
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        cache = ResultCache()
+
+        cached, entry = cache.lookup(client, "SELECT count() FROM events")
+        assert cached is None
+        cache.store(entry, response_for([{"c": 100}]))
+
+        cached, entry = cache.lookup(client, "select count() FROM  events ;".replace("select", "SELECT"))
+        assert cached == response_for([{"c": 100}])
+        assert entry is None
+        assert cache.stats()["process"]["hits"] == 1
+        assert cache.stats()["process"]["misses"] == 1
+
+    def test_part_change_invalidates(self):
+        versions = {"default.events": ("t1", 3, 100, "t1")}
+        client = make_versions_client(versions)
+        cache = ResultCache(validate_interval=0)
+
+        _, entry = cache.lookup(client, "SELECT count() FROM events")
+        cache.store(entry, response_for([{"c": 100}]))
+
+        versions["default.events"] = ("t1", 4, 150, "t2")
+        cached, entry = cache.lookup(client, "SELECT count() FROM events")
+        assert cached is None
+        assert entry is not None
+        assert cache.stats()["process"]["invalidations"] == 1
+
+    def test_ttl_expiry(self):
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        cache = ResultCache(ttl=0)
+        _, entry = cache.lookup(client, "SELECT count() FROM events")
+        cache.store(entry, response_for([]))
+        cached, _ = cache.lookup(client, "SELECT count() FROM events")
+        assert cached is None
+
+    def test_lru_eviction_by_bytes(self):
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        cache = ResultCache(max_bytes=3000)
+        rows = [{"value": "x" * 1000}]
+
+        for i in range(3):
+            _, entry = cache.lookup(client, f"SELECT {i} FROM events")
+            cache.store(entry, response_for(rows))
+
+        stats = cache.stats()
+        assert stats["bytes"] <= 3000
+        assert stats["process"]["evictions"] >= 1
+        assert cache.lookup(client, "SELECT 0 FROM events")[0] is None
+        assert cache.lookup(client, "SELECT 2 FROM events")[0] is not None
+
+    def test_system_and_tableless_queries_are_not_cached(self):
+        cache = ResultCache()
+        client = make_versions_client({})
+        assert cache.lookup(client, "SELECT now()") == (None, None)
+        assert cache.lookup(client, "SELECT * FROM system.processes") == (None, None)
+        client.query.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "SELECT count() FROM events WHERE event_timestamp > now() - INTERVAL 1 HOUR",
+            "SELECT * FROM events WHERE toDate(event_timestamp) = today()",
+            "SELECT * FROM events ORDER BY rand() LIMIT 10",
+            "SELECT generateUUIDv4(), user_id FROM events",
+        ],
+    )
+    def test_non_deterministic_queries_are_not_cached(self, query):
+        cache = ResultCache()
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        assert cache.lookup(client, query) == (None, None)
+        assert cache.lookup(client, "SELECT 'now()' FROM events")[1] is not None
+
+    def test_views_are_not_cached(self):
+        # get_table_versions only reports MergeTree tables, so a view has no version.
+        cache = ResultCache()
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        assert cache.lookup(client, "SELECT * FROM events_view") == (None, None)
+        assert cache.lookup(client, "SELECT * FROM events JOIN events_view USING id") == (None, None)
+        assert "t.engine LIKE '%MergeTree'" in client.query.call_args.args[0]
+
+    def test_file_backend_is_shared(self, tmp_path):
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        worker_a = ResultCache(backend=FileBackend(str(tmp_path)))
+        worker_b = ResultCache(backend=FileBackend(str(tmp_path)))
+
+        _, entry = worker_a.lookup(client, "SELECT count() FROM events")
+        worker_a.store(entry, response_for([{"c": 1}]))
+
+        cached, _ = worker_b.lookup(client, "SELECT count() FROM events")
+        assert cached == response_for([{"c": 1}])
+
+    def test_file_backend_stores_json(self, tmp_path):
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        cache = ResultCache(backend=FileBackend(str(tmp_path)))
+        _, entry = cache.lookup(client, "SELECT count() FROM events")
+        key = entry[0]
+        response = response_for([{"at": datetime(2024, 7, 1, 12), "big": 2**100, "price": Decimal("1.50")}])
+        cache.store(entry, response)
+
+        with open(tmp_path / f"{key}.entry", "rb") as f:
+            assert b"2024-07-01T12:00:00" in f.read()
+        cached, _ = cache.lookup(client, "SELECT count() FROM events")
+        assert cached["data"] == [{"at": "2024-07-01T12:00:00", "big": 2**100, "price": "1.50"}]
+
+        # Anything else found in the shared directory is never unpickled.
+        with open(tmp_path / f"{key}.entry", "wb") as f:
+            f.write(pickle.dumps(response))
+        assert cache.lookup(client, "SELECT count() FROM events")[0] is None
+        assert cache.stats()["entries"] == 0
+
+    def test_stats_label_process_counters(self, tmp_path):
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        worker_a = ResultCache(backend=FileBackend(str(tmp_path)))
+        worker_b = ResultCache(backend=FileBackend(str(tmp_path)))
+        _, entry = worker_a.lookup(client, "SELECT count() FROM events")
+        worker_a.store(entry, response_for([]))
+        worker_b.lookup(client, "SELECT count() FROM events")
+
+        stats = worker_a.stats()
+        assert stats["shared"] is True
+        assert stats["entries"] == worker_b.stats()["entries"] == 1
+        assert stats["process"]["misses"] == 1 and stats["process"]["hits"] == 0
+        assert worker_b.stats()["process"]["hits"] == 1
+        assert ResultCache().stats()["shared"] is False
+
+    @pytest.mark.parametrize("backend", [MemoryBackend, None])
+    def test_clear(self, backend, tmp_path):
+        backend = backend() if backend else FileBackend(str(tmp_path))
+        client = make_versions_client({"default.events": ("t1", 3, 100, "t1")})
+        cache = ResultCache(backend=backend)
+        _, entry = cache.lookup(client, "SELECT count() FROM events")
+        cache.store(entry, response_for([]))
+        cache.clear()
+        assert cache.stats()["entries"] == 0
@@ -0,0 +1,110 @@
+from unittest.mock import MagicMock
+
+from app.utils.catalog import COLUMNS_QUERY, FINGERPRINT_QUERY, TABLES_QUERY, Catalog
+
+
+def make_catalog_client(tables):
+    """
+    tables maps database -> {table: [(column, type), ...]} and can be mutated
+    by the test; fingerprints are derived from it like system.tables would.
+    """
+    client = MagicMock()
+
+    def query(sql, parameters=None):
+        result = MagicMock()
+        if sql == FINGERPRINT_QUERY:
+            result.result_rows = [
+                (db, hash(tuple(sorted((name, tuple(cols)) for name, cols in db_tables.items()))))
+                for db, db_tables in tables.items()
+            ]
+        elif sql == TABLES_QUERY:
+            result.result_rows = [
+                (db, name)
+                for db in parameters["databases"]
+                for name in sorted(tables.get(db, {}))
+            ]
+        elif sql == COLUMNS_QUERY:
+            result.result_rows = [
+                (db, name, col, col_type)
+                for db in parameters["databases"]
+                for name, cols in tables.get(db, {}).items()
+                for col, col_type in cols
+            ]
+        return result
+
+    client.query.side_effect = query
+    return client
+
+
+def queries_run(client):
+    return [call.args[0] for call in client.query.call_args_list]
+
+
+class TestCatalog:
+    def test_single_tables_query_for_all_databases(self):
+        client = make_catalog_client(
+            {
+                "default": {"events": [], "pypi": []},
+                "analytics": {"daily": []},
+                "empty": {},
+            }
+        )
+        catalog = Catalog()
+
+        assert catalog.get(client) == {
+            "analytics": ["daily"],
+            "default": ["events", "pypi"],
+            "empty": [],
+        }
+        assert queries_run(client) == [FINGERPRINT_QUERY, TABLES_QUERY]
+
+    def test_served_from_memory_within_refresh_interval(self):
+        client = make_catalog_client({"default": {"events": []}})
+        catalog = Catalog(refresh_interval=60)
+        catalog.get(client)
+        client.query.reset_mock()
+
+        catalog.get(client)
+        client.query.assert_not_called()
+
+    def test_only_changed_databases_are_reloaded(self):
+        tables = {"default": {"events": []}, "analytics": {"daily": []}}
+        client = make_catalog_client(tables)
+        catalog = Catalog(refresh_interval=0)
+        catalog.get(client)
+        client.query.reset_mock()
+
+        assert catalog.get(client) == {"analytics": ["daily"], "default": ["events"]}
+        assert queries_run(client) == [FINGERPRINT_QUERY]
+
+        tables["default"]["pypi"] = []
+        client.query.reset_mock()
+        assert catalog.get(client)["default"] == ["events", "pypi"]
+        assert client.query.call_args_list[1].kwargs["parameters"] == {"databases": ["default"]}
+
+        del tables["analytics"]
+        assert "analytics" not in catalog.get(client)
+
+    def test_columns(self):
+        client = make_catalog_client({"default": {"events": [("user_id", "String"), ("ts", "DateTime")]}})
+        catalog = Catalog()
+
+        assert catalog.get(client, include_columns=True) == {
+            "default": {
+                "events": [
+                    {"name": "user_id", "type": "String"},
+                    {"name": "ts", "type": "DateTime"},
+                ]
+            }
+        }
+        assert COLUMNS_QUERY in queries_run(client)
+
+    def test_invalidate_forces_a_check(self):
+        client = make_catalog_client({"default": {"events": []}})
+        catalog = Catalog(refresh_interval=60)
+        catalog.get(client)
+        catalog.invalidate()
+        client.query.reset_mock()
+
+        catalog.get(client)
+        assert queries_run(client) == [FINGERPRINT_QUERY]
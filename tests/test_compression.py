@@ -0,0 +1,148 @@
+import gzip
+import json
+import random
+import zlib
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import brotli
+import pytest
+import zstandard
+from flask import Flask, Response, jsonify
+from app.utils.compression import LEVELS, ResponseCompressor, StreamEncoder, compress
+
+EVENT_TYPES = ["login", "logout", "page_view", "purchase", "add_to_cart", "search"]
+
+
+def make_events(count, seed=7):
+    """Rows shaped like default.events results from /api/query."""
+    rng = random.Random(seed)
+    start = datetime(2024, 7, 1)
+    return [
+        {
+            "event_id": f"{rng.getrandbits(128):032x}",
+            "user_id": rng.randint(1, 50_000),
+            "event_type": rng.choice(EVENT_TYPES),
+            "event_timestamp": (start + timedelta(seconds=i * 7)).isoformat(sep=" "),
+            "page_url": f"https://shop.example.com/products/{rng.randint(1, 2000)}",
+            "duration_ms": rng.randint(5, 30_000),
+        }
+        for i in range(count)
+    ]
+
+
+def decode(encoding, data):
+    if encoding == "zstd":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if encoding == "br":
+        return brotli.decompress(data)
+    return gzip.decompress(data)
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    events = make_events(2000)
+
+    @app.route("/events")
+    def events_route():
+        return jsonify({"data": events})
+
+    @app.route("/small")
+    def small():
+        return jsonify({"ok": True})
+
+    @app.route("/stream")
+    def stream():
+        return Response((json.dumps(row) + "\n" for row in events[:50]), mimetype="application/x-ndjson")
+
+    @app.route("/png")
+    def png():
+        return Response(b"\x89PNG" + b"\0" * 4096, mimetype="image/png")
+
+    app.after_request(ResponseCompressor(["zstd", "br", "gzip"], min_size=1024))
+    return app
+
+
+class TestNegotiation:
+    @pytest.mark.parametrize(
+        "accept, expected",
+        [
+            ("gzip, deflate, br, zstd", "zstd"),
+            ("gzip, br", "br"),
+            ("gzip", "gzip"),
+            ("zstd;q=0.5, gzip", "gzip"),
+            ("*", "zstd"),
+            ("identity", None),
+            ("", None),
+        ],
+    )
+    def test_picks_best_supported(self, app, accept, expected):
+        response = app.test_client().get("/events", headers={"Accept-Encoding": accept})
+        assert response.headers.get("Content-Encoding") == expected
+        assert "Accept-Encoding" in response.headers["Vary"]
+
+    def test_round_trip(self, app):
+        plain = app.test_client().get("/events").get_data()
+        for encoding in ("zstd", "br", "gzip"):
+            response = app.test_client().get("/events", headers={"Accept-Encoding": encoding})
+            assert decode(encoding, response.get_data()) == plain
+            assert int(response.headers["Content-Length"]) == len(response.get_data())
+
+    def test_below_threshold(self, app):
+        response = app.test_client().get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
+    def test_incompressible_mimetype(self, app):
+        response = app.test_client().get("/png", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
+
+class TestStreaming:
+    @pytest.mark.parametrize("encoding", ["zstd", "br", "gzip"])
+    def test_stream_round_trip(self, app, encoding):
+        response = app.test_client().get("/stream", headers={"Accept-Encoding": encoding})
+        assert response.headers["Content-Encoding"] == encoding
+        assert "Content-Length" not in response.headers
+        plain = app.test_client().get("/stream").get_data()
+        assert decode(encoding, response.get_data()) == plain
+
+    @pytest.mark.parametrize("encoding", ["zstd", "br", "gzip"])
+    def test_each_chunk_is_decodable_immediately(self, encoding):
+        encoder = StreamEncoder(encoding)
+        if encoding == "zstd":
+            decode_chunk = zstandard.ZstdDecompressor().decompressobj().decompress
+        elif encoding == "br":
+            decode_chunk = brotli.Decompressor().process
+        else:
+            decode_chunk = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress
+
+        for i in range(5):
+            line = json.dumps({"row": i}).encode() + b"\n"
+            assert decode_chunk(encoder.compress(line)) == line
+
+
+class TestMeasurements:
+    """
+    Bandwidth/latency tradeoff for a 10,000 row events result at the
+    configured levels. Run with -s to print the table.
+    """
+
+    def test_events_result_set(self):
+        payload = json.dumps({"data": make_events(10_000)}).encode()
+        print(f"\n{'identity':>9}: {len(payload) / 1024:9.1f} KiB")
+
+        ratios = {}
+        for encoding in ("zstd", "br", "gzip"):
+            started = perf_counter()
+            encoded = compress(encoding, payload)
+            elapsed = perf_counter() - started
+            ratios[encoding] = len(payload) / len(encoded)
+            # At 100 Mbit/s every saved MiB is ~84 ms on the wire.
+            print(
+                f"{encoding:>9}: {len(encoded) / 1024:9.1f} KiB  ratio {ratios[encoding]:4.1f}x  "
+                f"encode {elapsed * 1000:6.1f} ms (level {LEVELS[encoding]})"
+            )
+            assert elapsed < 1
+
+        assert all(ratio > 3 for ratio in ratios.values())
@@ -0,0 +1,94 @@
+"""
+Load test for the threaded serving mode: while slow I/O-bound requests
+(/kinesis-sample waiting on Kinesis) are in flight, fast /query requests
+must keep their latency. The threaded werkzeug server here models a
+gunicorn gthread worker; the single-threaded one models a sync worker.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+from werkzeug.serving import make_server
+
+from app.main import create_app
+from tests.test_config import TEST_CONFIG
+
+SLOW_SECONDS = 0.5
+SLOW_REQUESTS = 8
+FAST_REQUESTS = 20
+
+
+def make_fast_ch_client():
+    client = MagicMock()
+    result = client.query.return_value
+    result.named_results.return_value = [{"count": 1}]
+    result.column_names = ("count",)
+    result.column_types = [MagicMock(base_type="UInt64")]
+    return client
+
+
+def slow_sample_stream(*args, **kwargs):
+    sleep(SLOW_SECONDS)
+    return []
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(threaded):
+        app = create_app(
+            config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False}, client=make_fast_ch_client()
+        )
+        server = make_server("127.0.0.1", 0, app, threaded=threaded)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    with patch("app.api.routes.global_boto3_session", MagicMock()), patch(
+        "app.api.routes.sample_stream", side_effect=slow_sample_stream
+    ):
+        yield start
+
+    for server in servers:
+        server.shutdown()
+
+
+def fast_latencies_during_slow_requests(base_url):
+    with requests.Session() as http:
+        http.post(f"{base_url}/api/query", json={"query": "SELECT 1"})
+
+    with ThreadPoolExecutor(max_workers=SLOW_REQUESTS) as executor:
+        slow = [
+            executor.submit(
+                requests.post, f"{base_url}/api/kinesis-sample", json={"streamName": "events"}
+            )
+            for _ in range(SLOW_REQUESTS)
+        ]
+        sleep(0.05)
+
+        latencies = []
+        with requests.Session() as http:
+            for _ in range(FAST_REQUESTS):
+                started = perf_counter()
+                response = http.post(f"{base_url}/api/query", json={"query": "SELECT 1"})
+                latencies.append(perf_counter() - started)
+                assert response.status_code == 200
+
+        assert all(future.result().status_code == 200 for future in slow)
+
+    return sorted(latencies)
+
+
+def test_fast_routes_keep_latency_while_slow_routes_are_in_flight(serve):
+    latencies = fast_latencies_during_slow_requests(serve(threaded=True))
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    assert p95 < SLOW_SECONDS / 2
+
+
+def test_single_threaded_worker_stalls_fast_routes(serve):
+    latencies = fast_latencies_during_slow_requests(serve(threaded=False))
+    assert latencies[-1] >= SLOW_SECONDS * 0.8
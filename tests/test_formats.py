@@ -0,0 +1,191 @@
+import json
+from time import perf_counter
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pytest
+from app.main import create_app
+from tests.test_config import TEST_CONFIG
+
+WIDE_COLUMNS = [f"metric_{i:02d}" for i in range(20)]
+WIDE_ROWS = 20_000
+
+
+class FakeArrowStream:
+    def __init__(self, batches):
+        self.batches = batches
+        self.gen = SimpleNamespace(schema=batches[0].schema if batches else pa.schema([("n", pa.uint64())]))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        for batch in self.batches:
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+
+def make_client(column_names, columns, batch_size=1000):
+    row_count = len(columns[0]) if columns else 0
+
+    def query(sql, parameters=None, settings=None, column_oriented=False):
+        if sql.startswith("DESCRIBE"):
+            return SimpleNamespace(result_rows=[(name, "UInt64") for name in column_names])
+        if sql.startswith("SELECT count()"):
+            return SimpleNamespace(first_row=(row_count,))
+        rows = list(zip(*columns))
+        return SimpleNamespace(
+            column_names=tuple(column_names),
+            column_types=tuple(SimpleNamespace(base_type="UInt64") for _ in column_names),
+            result_columns=columns if column_oriented else None,
+            named_results=lambda: (dict(zip(column_names, row)) for row in rows),
+        )
+
+    def query_arrow_stream(sql, parameters=None, settings=None, use_strings=None):
+        table = pa.table(dict(zip(column_names, columns)))
+        return FakeArrowStream(table.to_batches(max_chunksize=batch_size))
+
+    client = MagicMock()
+    client.query.side_effect = query
+    client.query_arrow_stream.side_effect = query_arrow_stream
+    return client
+
+
+def make_test_client(ch_client):
+    app = create_app(config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False}, client=ch_client)
+    return app.test_client()
+
+
+def read_arrow(response):
+    reader = ipc.open_stream(response.get_data())
+    metadata = json.loads(reader.schema.metadata[b"helios"])
+    return metadata, reader.read_all()
+
+
+class TestColumnsFormat:
+    def test_one_array_per_column(self):
+        client = make_test_client(make_client(["a", "b"], [[1, 2, 3], [4, 5, 6]]))
+        response = client.post("/api/query", json={"query": "SELECT a, b FROM t", "format": "columns"})
+        data = response.get_json()
+        assert data["data"] == [[1, 2, 3], [4, 5, 6]]
+        assert data["metadata"]["column_names"] == ["a", "b"]
+        assert data["metadata"]["column_types"] == ["UInt64", "UInt64"]
+        assert data["metadata"]["row_count"] == 3
+        assert data["metadata"]["layout"] == "columns"
+
+    def test_seek_cursor(self):
+        client = make_test_client(make_client(["a"], [[1, 2]]))
+        response = client.post(
+            "/api/query",
+            json={"query": "SELECT a FROM t", "format": "columns", "seek": ["a"], "pageSize": 2},
+        )
+        assert response.get_json()["metadata"]["next_cursor"]
+
+    def test_unknown_format(self):
+        client = make_test_client(make_client(["a"], [[1]]))
+        response = client.post("/api/query", json={"query": "SELECT a FROM t", "format": "xml"})
+        assert response.status_code == 400
+        assert "Unsupported format" in response.get_json()["error"]
+
+
+class TestArrowFormat:
+    def test_arrow_stream_with_metadata(self):
+        client = make_test_client(make_client(["a", "b"], [list(range(2500)), list(range(2500))]))
+        response = client.post("/api/query", json={"query": "SELECT a, b FROM t", "format": "arrow"})
+        assert response.mimetype == "application/vnd.apache.arrow.stream"
+
+        metadata, table = read_arrow(response)
+        assert metadata["column_names"] == ["a", "b"]
+        assert metadata["column_types"] == ["UInt64", "UInt64"]
+        assert metadata["query_id"] == response.headers["X-Query-Id"]
+        assert table.num_rows == 2500
+        assert table.column("a").to_pylist()[-1] == 2499
+
+    def test_negotiated_by_accept_header(self):
+        client = make_test_client(make_client(["a"], [[1]]))
+        response = client.post(
+            "/api/query",
+            json={"query": "SELECT a FROM t", "page": 1, "pageSize": 10},
+            headers={"Accept": "application/vnd.apache.arrow.stream"},
+        )
+        metadata, table = read_arrow(response)
+        assert metadata["total_rows"] == 1
+        assert table.num_rows == 1
+
+    def test_empty_result_keeps_schema(self):
+        client = make_test_client(make_client(["n"], []))
+        response = client.post("/api/query", json={"query": "SELECT n FROM t", "format": "arrow"})
+        _, table = read_arrow(response)
+        assert table.num_rows == 0
+        assert table.schema.names == ["n"]
+
+    def test_error_midway_truncates_stream(self):
+        ch_client = make_client(["a"], [list(range(10))])
+        batches = pa.table({"a": list(range(10))}).to_batches(max_chunksize=5)
+        ch_client.query_arrow_stream.side_effect = lambda *args, **kwargs: FakeArrowStream(
+            [batches[0], Exception("Code: 241. MEMORY_LIMIT_EXCEEDED")]
+        )
+        client = make_test_client(ch_client)
+        response = client.post("/api/query", json={"query": "SELECT a FROM t", "format": "arrow"})
+        assert "X-Query-Metadata" not in response.headers
+
+        received = b""
+        with pytest.raises(Exception, match="MEMORY_LIMIT_EXCEEDED"):
+            for chunk in response.response:
+                received += chunk
+        # The first batch arrived, but no end-of-stream marker after it.
+        reader = ipc.open_stream(received)
+        assert reader.read_next_batch().num_rows == 5
+        assert not received.endswith(b"\xff\xff\xff\xff\x00\x00\x00\x00")
+
+    def test_seek_not_supported(self):
+        client = make_test_client(make_client(["a"], [[1]]))
+        response = client.post(
+            "/api/query",
+            json={"query": "SELECT a FROM t", "format": "arrow", "seek": ["a"], "pageSize": 1},
+        )
+        assert response.status_code == 400
+
+
+class TestFormatBenchmark:
+    """
+    Encode time and bytes on the wire for a 20 column x 20,000 row result in
+    each layout. Run with -s to see the numbers.
+    """
+
+    @pytest.fixture
+    def client(self):
+        columns = [list(range(i, i + WIDE_ROWS)) for i in range(len(WIDE_COLUMNS))]
+        return make_test_client(make_client(WIDE_COLUMNS, columns, batch_size=65_536))
+
+    @staticmethod
+    def measure(client, response_format):
+        body = {"query": "SELECT * FROM wide", "format": response_format}
+        best = None
+        for _ in range(3):
+            started = perf_counter()
+            payload = client.post("/api/query", json=body).get_data()
+            elapsed = perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, len(payload)
+
+    def test_columnar_layouts_are_smaller_and_faster(self, client):
+        results = {fmt: self.measure(client, fmt) for fmt in ("rows", "columns", "arrow")}
+        for fmt, (elapsed, size) in results.items():
+            print(f"{fmt:>8}: {elapsed * 1000:8.1f} ms {size / 1024:10.1f} KiB")
+
+        rows_time, rows_bytes = results["rows"]
+        columns_time, columns_bytes = results["columns"]
+        arrow_time, arrow_bytes = results["arrow"]
+
+        assert columns_bytes < rows_bytes * 0.5
+        assert columns_time < rows_time
+        # Arrow trades size (fixed width numbers) for skipping JSON entirely.
+        assert arrow_bytes < rows_bytes
+        assert arrow_time < rows_time
@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from clickhouse_connect.driver.exceptions import DatabaseError
+from app.main import create_app
+from app.utils.guardrails import (
+    TABLE_SIZES_QUERY,
+    QueryGuard,
+    QueryRejectedError,
+    cancel_query,
+    new_query_id,
+)
+from tests.test_config import TEST_CONFIG
+
+# database, table, parts, rows, marks
+ESTIMATE_ROWS = [("default", "events", 4, 5_000_000, 620), ("default", "users", 1, 1000, 1)]
+# database, name, total_bytes, total_rows
+TABLE_SIZES = [("default", "events", 500_000_000, 10_000_000), ("default", "users", 10_000, 1000)]
+
+
+def make_client():
+    def query(sql, parameters=None, settings=None, **kwargs):
+        if sql.startswith("EXPLAIN ESTIMATE"):
+            return SimpleNamespace(result_rows=ESTIMATE_ROWS)
+        if sql == TABLE_SIZES_QUERY:
+            return SimpleNamespace(result_rows=TABLE_SIZES)
+        if sql.startswith("KILL QUERY"):
+            if parameters["query_id"] == "running":
+                return SimpleNamespace(result_rows=[("waiting", "running", "default", "SELECT 1")])
+            return SimpleNamespace(result_rows=[])
+        result = MagicMock()
+        result.named_results.return_value = [{"n": 1}]
+        result.column_names = ("n",)
+        result.column_types = (SimpleNamespace(base_type="UInt8"),)
+        return result
+
+    client = MagicMock()
+    client.query.side_effect = query
+    return client
+
+
+class TestQueryGuard:
+    def test_settings_skip_unset_limits(self):
+        guard = QueryGuard(max_execution_time=30, max_memory_usage=0)
+        assert guard.settings() == {"max_execution_time": 30}
+        assert guard.settings("q1") == {"max_execution_time": 30, "query_id": "q1"}
+
+    def test_streams_are_not_row_capped(self):
+        guard = QueryGuard(max_execution_time=30, max_result_rows=100)
+        assert guard.settings()["max_result_rows"] == 100
+        assert guard.settings("q1", buffered=False) == {"max_execution_time": 30, "query_id": "q1"}
+
+    def test_estimate_sums_tables_and_extrapolates_bytes(self):
+        guard = QueryGuard(max_estimated_bytes=1)
+        estimate = guard.estimate(make_client(), "SELECT * FROM events JOIN users USING id")
+        assert estimate == {
+            "rows": 5_001_000,
+            "parts": 5,
+            "marks": 621,
+            "bytes": 5_000_000 * 50 + 1000 * 10,
+        }
+
+    def test_estimate_skips_table_sizes_without_byte_limit(self):
+        client = make_client()
+        estimate = QueryGuard(max_estimated_rows=1).estimate(client, "SELECT * FROM events")
+        assert estimate["bytes"] is None
+        assert client.query.call_count == 1
+
+    def test_off_mode_runs_no_estimate(self):
+        client = make_client()
+        assert QueryGuard(max_estimated_rows=1).check(client, "SELECT 1") == []
+        client.query.assert_not_called()
+
+    def test_warn_mode(self):
+        guard = QueryGuard(estimate_mode="warn", max_estimated_rows=1_000_000)
+        warnings = guard.check(make_client(), "SELECT * FROM events")
+        assert warnings == ["Query is estimated to read 5001000 rows (limit 1000000)"]
+
+    def test_reject_mode(self):
+        guard = QueryGuard(estimate_mode="reject", max_estimated_bytes=100_000_000)
+        with pytest.raises(QueryRejectedError) as e:
+            guard.check(make_client(), "SELECT * FROM events")
+        assert "bytes" in str(e.value)
+        assert e.value.estimate["rows"] == 5_001_000
+
+    def test_within_limits(self):
+        guard = QueryGuard(estimate_mode="reject", max_estimated_rows=10_000_000)
+        assert guard.check(make_client(), "SELECT * FROM events") == []
+
+    def test_invalid_mode(self):
+        with pytest.raises(ValueError):
+            QueryGuard(estimate_mode="sometimes")
+
+
+class TestQueryId:
+    def test_generated(self):
+        assert new_query_id().startswith("helios-")
+        assert new_query_id() != new_query_id()
+
+    def test_client_supplied(self):
+        assert new_query_id("dashboard-1:panel.2") == "dashboard-1:panel.2"
+        with pytest.raises(ValueError):
+            new_query_id("x' OR 1=1")
+
+    def test_cancel(self):
+        assert cancel_query(make_client(), "running") == ["running"]
+        assert cancel_query(make_client(), "finished") == []
+
+
+class TestQueryRoute:
+    @pytest.fixture
+    def ch_client(self):
+        return make_client()
+
+    def make_test_client(self, ch_client, **config):
+        app = create_app(
+            config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False, **config}, client=ch_client
+        )
+        return app.test_client()
+
+    def test_limits_and_query_id_are_attached(self, ch_client):
+        client = self.make_test_client(
+            ch_client, QUERY_MAX_EXECUTION_TIME=5, QUERY_MAX_RESULT_ROWS=100, QUERY_MAX_MEMORY_USAGE=10**9
+        )
+        response = client.post("/api/query", json={"query": "SELECT 1 AS n", "queryId": "panel-7"})
+        assert response.status_code == 200
+        assert response.get_json()["metadata"]["query_id"] == "panel-7"
+
+        settings = ch_client.query.call_args.kwargs["settings"]
+        assert settings == {
+            "max_execution_time": 5,
+            "max_result_rows": 100,
+            "max_memory_usage": 10**9,
+            "query_id": "panel-7",
+        }
+
+    def test_result_rows_limit_is_explained(self, ch_client):
+        query = ch_client.query.side_effect
+
+        def too_many_rows(sql, **kwargs):
+            if sql == "SELECT number FROM numbers(1000)":
+                raise DatabaseError("Code: 396. DB::Exception: Limit for result exceeded. (TOO_MANY_ROWS_OR_BYTES)")
+            return query(sql, **kwargs)
+
+        ch_client.query.side_effect = too_many_rows
+        client = self.make_test_client(ch_client, QUERY_MAX_RESULT_ROWS=100)
+        response = client.post("/api/query", json={"query": "SELECT number FROM numbers(1000)"})
+        assert response.status_code == 400
+        assert "more than 100 rows (QUERY_MAX_RESULT_ROWS)" in response.get_json()["error"]
+
+    def test_warn(self, ch_client):
+        client = self.make_test_client(
+            ch_client, QUERY_ESTIMATE_MODE="warn", QUERY_MAX_ESTIMATED_ROWS=1000
+        )
+        response = client.post("/api/query", json={"query": "SELECT * FROM events"})
+        assert response.status_code == 200
+        assert response.get_json()["metadata"]["warnings"]
+
+    def test_reject(self, ch_client):
+        client = self.make_test_client(
+            ch_client, QUERY_ESTIMATE_MODE="reject", QUERY_MAX_ESTIMATED_ROWS=1000
+        )
+        response = client.post("/api/query", json={"query": "SELECT * FROM events"})
+        assert response.status_code == 400
+        data = response.get_json()
+        assert "estimated to read" in data["error"]
+        assert data["estimate"]["rows"] == 5_001_000
+        assert not any(
+            call.args[0] == "SELECT * FROM events" for call in ch_client.query.call_args_list
+        )
+
+    def test_cancel(self, ch_client):
+        client = self.make_test_client(ch_client)
+        response = client.post("/api/query/cancel", json={"queryId": "running"})
+        assert response.get_json() == {"cancelled": True, "queryId": "running"}
+
+        response = client.post("/api/query/cancel", json={"queryId": "finished"})
+        assert response.status_code == 404
+
+        response = client.post("/api/query/cancel", json={})
+        assert response.status_code == 400
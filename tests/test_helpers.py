@@ -0,0 +1,31 @@
+from unittest.mock import MagicMock
+
+import pytest
+from app.utils.helpers import (
+    create_count_query,
+    create_paginated_query,
+    create_seek_query,
+    describe_query,
+)
+
+
+@pytest.mark.parametrize(
+    "build",
+    [
+        lambda q: create_paginated_query(q, 10, 0),
+        create_count_query,
+        lambda q: create_seek_query(q, ["id"], None, 10)[0],
+    ],
+)
+def test_trailing_comment_stays_inside_subquery(build):
+    query = build("SELECT 1 -- latest only")
+
+    assert "(\nSELECT 1 -- latest only\n)" in query
+
+
+def test_describe_wraps_on_new_lines():
+    client = MagicMock()
+    client.query.return_value.result_rows = [("x", "UInt8")]
+
+    assert describe_query(client, "SELECT 1 AS x -- one") == [("x", "UInt8")]
+    assert client.query.call_args.args[0] == "DESCRIBE (\nSELECT 1 AS x -- one\n)"
@@ -0,0 +1,255 @@
+import io
+import json
+import zipfile
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app.main import create_app
+from app.utils.aws import ThreadSafeSession
+from app.utils.ingestion import (
+    list_mappings,
+    parse_mapping_settings,
+    stream_stats,
+    suggest_mapping_settings,
+    update_mappings,
+)
+from tests.test_config import TEST_CONFIG
+
+FUNCTION_NAME = "kinesis-to-clickhouse-dev"
+
+
+def lambda_zip():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("handler.py", "def handler(event, context):\n    return None\n")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def aws_session(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        session = boto3.Session(region_name="us-west-1")
+        session.client("kinesis").create_stream(StreamName="events", ShardCount=4)
+        role = session.client("iam").create_role(
+            RoleName="ingest",
+            AssumeRolePolicyDocument=json.dumps({"Version": "2012-10-17", "Statement": []}),
+        )
+        session.client("lambda").create_function(
+            FunctionName=FUNCTION_NAME,
+            Runtime="python3.12",
+            Role=role["Role"]["Arn"],
+            Handler="handler.handler",
+            Code={"ZipFile": lambda_zip()},
+        )
+        yield session
+
+
+def stream_arn(session, stream_name="events"):
+    return session.client("kinesis").describe_stream_summary(StreamName=stream_name)[
+        "StreamDescriptionSummary"
+    ]["StreamARN"]
+
+
+def put_rate(session, records_per_minute, record_bytes=500, minutes=10, stream_name="events"):
+    now = datetime.now(timezone.utc)
+    for metric, value in (("IncomingRecords", records_per_minute), ("IncomingBytes", records_per_minute * record_bytes)):
+        session.client("cloudwatch").put_metric_data(
+            Namespace="AWS/Kinesis",
+            MetricData=[
+                {
+                    "MetricName": metric,
+                    "Dimensions": [{"Name": "StreamName", "Value": stream_name}],
+                    "Timestamp": now - timedelta(minutes=minute + 1),
+                    "Value": value,
+                }
+                for minute in range(minutes)
+            ],
+        )
+
+
+class TestMappingSettings:
+    def test_parse(self):
+        assert parse_mapping_settings({"batchSize": 500, "parallelizationFactor": 2}) == {
+            "BatchSize": 500,
+            "ParallelizationFactor": 2,
+        }
+        assert parse_mapping_settings(None) == {}
+
+    @pytest.mark.parametrize(
+        "data, message",
+        [
+            ({"batchSize": 0}, "between 1 and 10000"),
+            ({"maximumBatchingWindowInSeconds": 301}, "between 0 and 300"),
+            ({"parallelizationFactor": 11}, "between 1 and 10"),
+            ({"batchSize": "100"}, "integer"),
+            ({"batchSize": True}, "integer"),
+        ],
+    )
+    def test_rejects_invalid(self, data, message):
+        with pytest.raises(ValueError, match=message):
+            parse_mapping_settings(data)
+
+    def test_idle_stream(self):
+        assert suggest_mapping_settings(1) == {
+            "BatchSize": 100,
+            "MaximumBatchingWindowInSeconds": 1,
+            "ParallelizationFactor": 1,
+        }
+
+    def test_window_keeps_insert_rate_near_target(self):
+        settings = suggest_mapping_settings(4, records_per_second=400)
+        # Four batchers flushing every 4s: one insert a second.
+        assert settings == {
+            "BatchSize": 800,
+            "MaximumBatchingWindowInSeconds": 4,
+            "ParallelizationFactor": 1,
+        }
+
+    def test_hot_shards_get_parallelized(self):
+        settings = suggest_mapping_settings(2, records_per_second=3000, consumer_records_per_second=500)
+        assert settings["ParallelizationFactor"] == 3
+        assert settings["MaximumBatchingWindowInSeconds"] == 6
+        assert settings["BatchSize"] == 6000
+
+    def test_batch_size_limits(self):
+        assert suggest_mapping_settings(1, records_per_second=100_000)["BatchSize"] == 10000
+        settings = suggest_mapping_settings(1, records_per_second=2000, average_record_bytes=4096)
+        assert settings["BatchSize"] == 1024
+
+
+class TestStreamStats:
+    def test_without_metrics(self, aws_session):
+        stats = stream_stats(aws_session, "events")
+        assert stats["shardCount"] == 4
+        assert stats["streamARN"] == stream_arn(aws_session)
+        assert stats["recordsPerSecond"] is None
+
+    def test_rates_from_cloudwatch(self, aws_session):
+        put_rate(aws_session, 6000, record_bytes=250, minutes=10)
+        stats = stream_stats(aws_session, "events", window=3600)
+        assert stats["peakRecordsPerSecond"] == 100
+        assert stats["recordsPerSecond"] == pytest.approx(6000 * 10 / 3600, abs=0.001)
+        assert stats["averageRecordBytes"] == 250
+
+
+class TestMappings:
+    def test_update_in_place(self, aws_session):
+        lambda_client = aws_session.client("lambda")
+        arn = stream_arn(aws_session)
+        created = lambda_client.create_event_source_mapping(
+            EventSourceArn=arn, FunctionName=FUNCTION_NAME, StartingPosition="LATEST", BatchSize=3
+        )
+        updated = update_mappings(
+            lambda_client, arn, FUNCTION_NAME, {"BatchSize": 1000, "MaximumBatchingWindowInSeconds": 5}
+        )
+        assert [mapping["UUID"] for mapping in updated] == [created["UUID"]]
+        (mapping,) = list_mappings(lambda_client, arn, FUNCTION_NAME)
+        assert mapping["BatchSize"] == 1000
+        assert mapping["MaximumBatchingWindowInSeconds"] == 5
+
+
+class TestIngestionRoutes:
+    @pytest.fixture
+    def http(self, aws_session):
+        app = create_app(config=TEST_CONFIG)
+        with patch("app.api.routes.global_boto3_session", ThreadSafeSession(aws_session)):
+            yield app.test_client()
+
+    def create_mapping(self, aws_session, **settings):
+        return aws_session.client("lambda").create_event_source_mapping(
+            EventSourceArn=stream_arn(aws_session),
+            FunctionName=FUNCTION_NAME,
+            StartingPosition="LATEST",
+            **settings,
+        )
+
+    def test_view(self, http, aws_session):
+        put_rate(aws_session, 24000)
+        mapping = self.create_mapping(aws_session, BatchSize=3)
+        response = http.get("/api/ingestion/events")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["stream"]["shardCount"] == 4
+        assert data["mappings"][0]["uuid"] == mapping["UUID"]
+        assert data["mappings"][0]["batchSize"] == 3
+        assert data["suggested"] == {
+            "batchSize": 800,
+            "maximumBatchingWindowInSeconds": 4,
+            "parallelizationFactor": 1,
+        }
+
+    def test_update(self, http, aws_session):
+        mapping = self.create_mapping(aws_session, BatchSize=3)
+        response = http.put("/api/ingestion/events", json={"batchSize": 2000, "parallelizationFactor": 2})
+        assert response.status_code == 200
+        (updated,) = response.get_json()["mappings"]
+        assert updated["uuid"] == mapping["UUID"]
+        assert updated["batchSize"] == 2000
+        assert updated["parallelizationFactor"] == 2
+
+    def test_update_with_suggested(self, http, aws_session):
+        self.create_mapping(aws_session, BatchSize=3)
+        response = http.put("/api/ingestion/events", json={"suggested": True, "batchSize": 50})
+        (updated,) = response.get_json()["mappings"]
+        assert updated["batchSize"] == 50
+        assert updated["maximumBatchingWindowInSeconds"] == 4
+
+    def test_update_errors(self, http, aws_session):
+        response = http.put("/api/ingestion/events", json={})
+        assert response.status_code == 400
+        response = http.put("/api/ingestion/events", json={"batchSize": 20000})
+        assert "between 1 and 10000" in response.get_json()["Ingestion Route Error"]
+        response = http.put("/api/ingestion/events", json={"batchSize": 100})
+        assert response.status_code == 404
+
+    @patch("app.api.routes.add_table_stream_dynamodb")
+    @patch("app.api.routes.get_table_id", return_value="table-uuid")
+    def test_create_table_uses_suggested_and_chosen_settings(self, get_table_id, add_mapping, aws_session):
+        app = create_app(config=TEST_CONFIG, client=MagicMock())
+        put_rate(aws_session, 24000)
+        with patch("app.api.routes.global_boto3_session", ThreadSafeSession(aws_session)):
+            response = app.test_client().post(
+                "/api/create-table",
+                json={
+                    "streamName": "events",
+                    "tableName": "events",
+                    "schema": [{"name": "id", "type": "Int32"}],
+                    "ingestion": {"parallelizationFactor": 2},
+                },
+            )
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["ingestion"] == {
+            "batchSize": 800,
+            "maximumBatchingWindowInSeconds": 4,
+            "parallelizationFactor": 2,
+        }
+        (mapping,) = list_mappings(aws_session.client("lambda"), stream_arn(aws_session), FUNCTION_NAME)
+        assert mapping["UUID"] == data["eventSourceMappingUUID"]
+        assert mapping["BatchSize"] == 800
+        assert mapping["ParallelizationFactor"] == 2
+
+    @patch("app.api.routes.add_table_stream_dynamodb")
+    def test_create_table_checks_settings_first(self, add_mapping, aws_session):
+        ch_client = MagicMock()
+        app = create_app(config=TEST_CONFIG, client=ch_client)
+        with patch("app.api.routes.global_boto3_session", ThreadSafeSession(aws_session)):
+            response = app.test_client().post(
+                "/api/create-table",
+                json={
+                    "streamName": "events",
+                    "tableName": "events",
+                    "schema": [{"name": "id", "type": "Int32"}],
+                    "ingestion": {"batchSize": 20000},
+                },
+            )
+        assert response.status_code == 400
+        assert "between 1 and 10000" in response.get_json()["Create Table Route Error"]
+        ch_client.command.assert_not_called()
+        add_mapping.assert_not_called()
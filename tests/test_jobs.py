@@ -0,0 +1,230 @@
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pyarrow as pa
+import pytest
+from app.main import create_app
+from app.utils.jobs import JobManager, JobNotFoundError, JobQueueFullError
+from tests.test_config import TEST_CONFIG
+
+
+class FakeArrowStream:
+    def __init__(self, batches, gate=None):
+        self.batches = batches
+        self.gate = gate
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        for batch in self.batches:
+            if self.gate is not None and not self.gate.wait(5):
+                raise Exception("Code: 394. QUERY_WAS_CANCELLED")
+            yield batch
+
+
+def make_batches(total, batch_size):
+    return [
+        pa.record_batch(
+            [pa.array(range(start, min(start + batch_size, total))), pa.array([f"row {i}" for i in range(start, min(start + batch_size, total))])],
+            names=["n", "label"],
+        )
+        for start in range(0, total, batch_size)
+    ]
+
+
+def make_client(batches, gate=None):
+    def query(sql, parameters=None, settings=None):
+        if sql.startswith("DESCRIBE"):
+            return SimpleNamespace(result_rows=[("n", "UInt64"), ("label", "String")])
+        if "system.processes" in sql:
+            return SimpleNamespace(result_rows=[(500, 4000, 1000, 1.5, 1024)])
+        if sql.startswith("KILL QUERY"):
+            if gate is not None:
+                gate.clear()
+            return SimpleNamespace(result_rows=[("waiting", parameters["query_id"], "default", "")])
+        raise AssertionError(sql)
+
+    client = MagicMock()
+    client.query.side_effect = query
+    client.query_arrow_stream.side_effect = lambda *args, **kwargs: FakeArrowStream(batches, gate)
+    return client
+
+
+def make_manager(tmp_path, client, **options):
+    @contextmanager
+    def checkout():
+        yield client
+
+    return JobManager(str(tmp_path), checkout, settings={"max_execution_time": 60}, **options)
+
+
+def wait_for(manager, job_id, statuses=("finished", "failed", "cancelled")):
+    for _ in range(200):
+        job = manager.load(job_id)
+        if job["status"] in statuses:
+            return job
+        threading.Event().wait(0.01)
+    raise AssertionError(f"job stuck in {job['status']}")
+
+
+class TestJobManager:
+    def test_spools_and_pages_results(self, tmp_path):
+        client = make_client(make_batches(1000, 64))
+        manager = make_manager(tmp_path, client)
+
+        job = manager.submit("SELECT n, label FROM t;")
+        finished = wait_for(manager, job["id"])
+        assert finished["status"] == "finished"
+        assert finished["row_count"] == 1000
+        assert finished["column_types"] == ["UInt64", "String"]
+
+        settings = client.query_arrow_stream.call_args.kwargs["settings"]
+        assert settings == {"max_execution_time": 60, "query_id": job["id"]}
+
+        _, rows = manager.read_page(job["id"], 60, 10)
+        assert rows == [{"n": n, "label": f"row {n}"} for n in range(60, 70)]
+        _, rows = manager.read_page(job["id"], 990, 100)
+        assert [row["n"] for row in rows] == list(range(990, 1000))
+        assert manager.read_page(job["id"], 1000, 10)[1] == []
+
+        # Pages never re-run the query.
+        assert client.query_arrow_stream.call_count == 1
+
+    def test_empty_result(self, tmp_path):
+        manager = make_manager(tmp_path, make_client([]))
+        job = manager.submit("SELECT 1 WHERE 0")
+        assert wait_for(manager, job["id"])["row_count"] == 0
+        assert manager.read_page(job["id"], 0, 10)[1] == []
+
+    def test_failed_job(self, tmp_path):
+        client = make_client([])
+        client.query_arrow_stream.side_effect = Exception("Code: 60. UNKNOWN_TABLE")
+        manager = make_manager(tmp_path, client)
+        job = manager.submit("SELECT * FROM missing")
+        failed = wait_for(manager, job["id"])
+        assert failed["status"] == "failed"
+        assert "UNKNOWN_TABLE" in failed["error"]
+        with pytest.raises(ValueError):
+            manager.read_page(job["id"], 0, 10)
+
+    def test_progress_and_cancel(self, tmp_path):
+        gate = threading.Event()
+        client = make_client(make_batches(100, 10), gate)
+        manager = make_manager(tmp_path, client)
+        job = manager.submit("SELECT * FROM big")
+        wait_for(manager, job["id"], ("running",))
+
+        status = manager.status(job["id"], client)
+        assert status["progress"]["fraction"] == 0.5
+
+        manager.cancel(job["id"], client)
+        cancelled = wait_for(manager, job["id"])
+        assert cancelled["status"] == "cancelled"
+        assert cancelled["error"] is None
+        assert not list(tmp_path.glob("*.arrow*"))
+
+    def test_cancel_after_last_batch_is_kept(self, tmp_path):
+        client = make_client(make_batches(20, 10))
+        manager = make_manager(tmp_path, client)
+        submitted = []
+
+        class CancelledOnExit(FakeArrowStream):
+            def __exit__(self, *args):
+                # The cancel lands after the last batch, before "finished".
+                manager.cancel(submitted[0]["id"], client)
+
+        client.query_arrow_stream.side_effect = lambda *args, **kwargs: CancelledOnExit(make_batches(20, 10))
+        submitted.append(manager.submit("SELECT * FROM big"))
+        job = wait_for(manager, submitted[0]["id"])
+        threading.Event().wait(0.05)
+
+        assert manager.load(job["id"])["status"] == "cancelled"
+        assert not list(tmp_path.glob("*.arrow*"))
+
+    def test_cancelled_while_queued_never_runs(self, tmp_path):
+        gate = threading.Event()
+        client = make_client(make_batches(10, 5), gate)
+        manager = make_manager(tmp_path, client, max_workers=1)
+        running = manager.submit("SELECT 1")
+        queued = manager.submit("SELECT 2")
+        wait_for(manager, running["id"], ("running",))
+
+        manager.cancel(queued["id"], client)
+        gate.set()
+        wait_for(manager, running["id"])
+        threading.Event().wait(0.05)
+        assert manager.load(queued["id"])["status"] == "cancelled"
+        assert client.query_arrow_stream.call_count == 1
+
+    def test_queue_is_bounded(self, tmp_path):
+        gate = threading.Event()
+        manager = make_manager(tmp_path, make_client(make_batches(10, 5), gate), max_workers=1, max_queued=2)
+        manager.submit("SELECT 1")
+        manager.submit("SELECT 2")
+        with pytest.raises(JobQueueFullError):
+            manager.submit("SELECT 3")
+        gate.set()
+
+    def test_retention_cleanup(self, tmp_path):
+        manager = make_manager(tmp_path, make_client(make_batches(10, 5)), retention=60)
+        job = manager.submit("SELECT 1")
+        finished = wait_for(manager, job["id"])
+
+        manager.cleanup(now=finished["finished_at"] + 30)
+        assert manager.load(job["id"])
+
+        manager._cleaned_at = 0
+        manager.cleanup(now=finished["finished_at"] + 61)
+        with pytest.raises(JobNotFoundError):
+            manager.load(job["id"])
+        assert not list(tmp_path.glob("helios-job-*"))
+
+    def test_unknown_job(self, tmp_path):
+        manager = make_manager(tmp_path, make_client([]))
+        with pytest.raises(JobNotFoundError):
+            manager.load("helios-job-missing")
+        with pytest.raises(JobNotFoundError):
+            manager.load("../etc/passwd")
+
+
+class TestJobsRoutes:
+    @pytest.fixture
+    def client(self, tmp_path):
+        ch_client = make_client(make_batches(250, 100))
+        app = create_app(config={**TEST_CONFIG, "JOBS_DIR": str(tmp_path)}, client=ch_client)
+        yield app.test_client()
+
+    def test_submit_poll_and_page(self, client):
+        response = client.post("/api/jobs", json={"query": "SELECT n, label FROM t"})
+        assert response.status_code == 202
+        job_id = response.get_json()["jobId"]
+
+        for _ in range(200):
+            status = client.get(f"/api/jobs/{job_id}").get_json()
+            if status["status"] == "finished":
+                break
+            threading.Event().wait(0.01)
+        assert status["row_count"] == 250
+
+        response = client.get(f"/api/jobs/{job_id}/results?page=3&pageSize=100")
+        data = response.get_json()
+        assert data["metadata"]["total_pages"] == 3
+        assert data["metadata"]["column_names"] == ["n", "label"]
+        assert [row["n"] for row in data["data"]] == list(range(200, 250))
+
+        response = client.delete(f"/api/jobs/{job_id}")
+        assert response.get_json()["status"] == "deleted"
+        assert client.get(f"/api/jobs/{job_id}").status_code == 404
+
+    def test_rejects_writes(self, client):
+        response = client.post("/api/jobs", json={"query": "DROP TABLE t"})
+        assert response.status_code == 400
+
+    def test_unknown_job(self, client):
+        assert client.get("/api/jobs/helios-job-nope/results").status_code == 404
@@ -0,0 +1,150 @@
+import json
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from ipaddress import IPv4Address, IPv6Address
+from time import perf_counter
+from uuid import UUID
+
+import pytest
+from flask import Flask, jsonify
+from flask.json.provider import DefaultJSONProvider
+from app.utils.json_provider import ORJSONProvider
+
+ROW_COUNT = 100_000
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.json = ORJSONProvider(app)
+    return app
+
+
+def make_rows(count):
+    start = datetime(2024, 7, 1, 12, 0, 0)
+    return [
+        {
+            "event_id": UUID(int=i),
+            "user_id": i % 50_000,
+            "event_type": "page_view",
+            "event_timestamp": start + timedelta(seconds=i),
+            "event_date": date(2024, 7, 1),
+            "amount": Decimal("19.99"),
+            "score": i / 7,
+            "is_mobile": i % 2 == 0,
+            "referrer": None,
+        }
+        for i in range(count)
+    ]
+
+
+class TestClickHouseTypes:
+    def test_native_and_fallback_types(self, app):
+        row = {
+            "datetime": datetime(2024, 7, 1, 12, 30, 5),
+            "datetime64": datetime(2024, 7, 1, 12, 30, 5, 123000),
+            "datetime_tz": datetime(2024, 7, 1, 12, 30, 5, tzinfo=timezone.utc),
+            "date": date(2024, 7, 1),
+            "uuid": UUID("12345678-1234-5678-1234-567812345678"),
+            "decimal": Decimal("12345678901234567890.0123456789"),
+            "ipv4": IPv4Address("10.0.0.1"),
+            "ipv6": IPv6Address("::1"),
+            "fixed_string": b"abc\x00",
+            "tuple": (1, "a"),
+            "array": [1, 2, 3],
+            "map": {1: "one", 2: "two"},
+            "nan": float("nan"),
+            "int64": 2**63 - 1,
+        }
+        with app.app_context():
+            decoded = json.loads(jsonify(row).get_data())
+
+        assert decoded == {
+            "datetime": "2024-07-01T12:30:05",
+            "datetime64": "2024-07-01T12:30:05.123000",
+            "datetime_tz": "2024-07-01T12:30:05+00:00",
+            "date": "2024-07-01",
+            "uuid": "12345678-1234-5678-1234-567812345678",
+            "decimal": "12345678901234567890.0123456789",
+            "ipv4": "10.0.0.1",
+            "ipv6": "::1",
+            "fixed_string": "abc\x00",
+            "tuple": [1, "a"],
+            "array": [1, 2, 3],
+            "map": {"1": "one", "2": "two"},
+            "nan": None,
+            "int64": 2**63 - 1,
+        }
+
+    def test_wide_integers_fall_back_with_same_formatting(self, app):
+        row = {"uint256": 2**200, "when": datetime(2024, 7, 1), "id": UUID(int=1), "ip": IPv4Address("1.2.3.4")}
+        with app.app_context():
+            decoded = json.loads(app.json.dumps(row))
+        assert decoded == {
+            "uint256": 2**200,
+            "when": "2024-07-01T00:00:00",
+            "id": "00000000-0000-0000-0000-000000000001",
+            "ip": "1.2.3.4",
+        }
+
+    def test_fallback_writes_non_finite_floats_as_null(self, app):
+        row = {"uint256": 2**200, "nan": float("nan"), "values": (1.5, float("inf"), float("-inf"))}
+        with app.app_context():
+            encoded = app.json.dumps(row)
+        assert "NaN" not in encoded and "Infinity" not in encoded
+        # Strict parsers, unlike json.loads, reject NaN and Infinity.
+        decoded = json.loads(encoded, parse_constant=lambda name: pytest.fail(f"{name} in output"))
+        assert decoded == {"uint256": 2**200, "nan": None, "values": [1.5, None, None]}
+
+    def test_keeps_column_order(self, app):
+        with app.app_context():
+            assert app.json.dumps({"b": 1, "a": 2}) == '{"b":1,"a":2}'
+
+    def test_unknown_type(self, app):
+        with pytest.raises(TypeError):
+            app.json.dumps({"x": object()})
+
+    def test_loads(self, app):
+        assert app.json.loads(b'{"query": "SELECT 1"}') == {"query": "SELECT 1"}
+
+
+class TestBenchmark:
+    """
+    Encode time for a 100,000 row /query response, stdlib-based provider vs
+    orjson. Run with -s to print the timings; they are reported, not
+    asserted, since wall-clock ratios depend on the machine.
+    """
+
+    @staticmethod
+    def encode(provider_class, response):
+        app = Flask(__name__)
+        app.json = provider_class(app)
+        best = None
+        with app.app_context():
+            for _ in range(3):
+                started = perf_counter()
+                body = jsonify(response).get_data()
+                elapsed = perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+        return best, body
+
+    def test_encode_time_reduction(self):
+        response = {"metadata": {"row_count": ROW_COUNT}, "data": make_rows(ROW_COUNT)}
+        stdlib, _ = self.encode(DefaultJSONProvider, response)
+        fast, body = self.encode(ORJSONProvider, response)
+        print(f"\nstdlib: {stdlib * 1000:.0f} ms  orjson: {fast * 1000:.0f} ms  ({stdlib / fast:.1f}x)")
+
+        decoded = json.loads(body)
+        assert decoded["metadata"] == {"row_count": ROW_COUNT}
+        assert len(decoded["data"]) == ROW_COUNT
+        assert decoded["data"][-1] == {
+            "event_id": str(UUID(int=ROW_COUNT - 1)),
+            "user_id": (ROW_COUNT - 1) % 50_000,
+            "event_type": "page_view",
+            "event_timestamp": (datetime(2024, 7, 1, 12) + timedelta(seconds=ROW_COUNT - 1)).isoformat(),
+            "event_date": "2024-07-01",
+            "amount": "19.99",
+            "score": (ROW_COUNT - 1) / 7,
+            "is_mobile": False,
+            "referrer": None,
+        }
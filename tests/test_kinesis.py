@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app.utils.kinesis import list_shard_ids, sample_stream
+
+
+@pytest.fixture
+def kinesis_client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("kinesis", region_name="us-west-1")
+        client.create_stream(StreamName="events", ShardCount=4)
+        yield client
+
+
+def put_events(kinesis_client, count):
+    for i in range(count):
+        kinesis_client.put_record(
+            StreamName="events",
+            Data=json.dumps({"user_id": f"user-{i}", "n": i}).encode("utf-8"),
+            PartitionKey=f"user-{i}",
+        )
+
+
+class TestSampleStream:
+    def test_lists_all_shards(self, kinesis_client):
+        assert len(list_shard_ids(kinesis_client, "events")) == 4
+
+    def test_reads_history_across_shards(self, kinesis_client):
+        put_events(kinesis_client, 40)
+
+        records = sample_stream(kinesis_client, "events", count=20, iterator_type="TRIM_HORIZON")
+        assert len(records) == 20
+        assert len({record["shardId"] for record in records}) > 1
+        assert all("user_id" in json.loads(record["data"]) for record in records)
+
+    def test_returns_what_exists_without_waiting(self, kinesis_client):
+        put_events(kinesis_client, 3)
+
+        started = monotonic()
+        records = sample_stream(kinesis_client, "events", count=10, deadline=5)
+        assert len(records) == 3
+        assert monotonic() - started < 2
+
+    def test_latest_on_idle_stream_stops_at_deadline(self, kinesis_client):
+        put_events(kinesis_client, 3)
+
+        started = monotonic()
+        records = sample_stream(
+            kinesis_client, "events", count=1, deadline=0.5, iterator_type="LATEST"
+        )
+        assert records == []
+        assert monotonic() - started < 2
+
+    def test_at_timestamp(self, kinesis_client):
+        put_events(kinesis_client, 5)
+        since = (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()
+
+        records = sample_stream(
+            kinesis_client, "events", count=5, iterator_type="AT_TIMESTAMP", timestamp=since
+        )
+        assert len(records) == 5
+
+    def test_rejects_unknown_iterator_type(self, kinesis_client):
+        with pytest.raises(ValueError):
+            sample_stream(kinesis_client, "events", iterator_type="AT_SEQUENCE_NUMBER")
@@ -1,12 +1,17 @@
 import json
 import random
 import string
+import threading
+import time
 from unittest.mock import patch
-from app.utils.helpers import is_sql_injection
+from app.utils.helpers import get_table_id, get_total_rows, is_sql_injection
 import pytest
 from app.main import create_app
 from clickhouse_connect import get_client
 from tests.test_config import TEST_CONFIG
+from tests.test_worker import aws_session, map_stream, put_events
+from app.worker.checkpoints import FileCheckpointStore
+from app.worker.consumer import IngestWorker
 
 # note in readme to install Clickhouse locally to run tests + make sure its running
 # curl https://clickhouse.com/ | sh
@@ -45,9 +50,7 @@ def client(app):
 class TestDatabasesRoute:
     """
     @api.route("/databases", methods=["GET"])
-    db_table_map = {}
-    for db in get_db_names(client):
-        db_table_map[db] = get_tables_in_db(client, db)
+    db_table_map = current_app.catalog.get(client, include_columns=include_columns)
     return jsonify(db_table_map)
     """
 
@@ -58,11 +61,17 @@ class TestDatabasesRoute:
         assert isinstance(data, dict)
         assert "system" in data
 
-    def test_get_databases_error(self, client, monkeypatch):
-        def mock_get_db_names(*args):
+    def test_get_databases_with_columns(self, client):
+        response = client.get("/api/databases?columns=true")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert {"name": "name", "type": "String"} in data["system"]["databases"]
+
+    def test_get_databases_error(self, client, app, monkeypatch):
+        def mock_catalog_get(*args, **kwargs):
             raise Exception("Database error")
 
-        monkeypatch.setattr("app.api.routes.get_db_names", mock_get_db_names)
+        monkeypatch.setattr(app.catalog, "get", mock_catalog_get)
         response = client.get("/api/databases")
         assert response.status_code == 400
         data = response.get_json()
@@ -105,6 +114,199 @@ class TestQueryRoute:
         data = response.get_json()
         assert "error" in data
 
+    def test_query_stream_ndjson(self, client):
+        mock_query = {
+            "query": "SELECT number, toString(number) AS label FROM system.numbers LIMIT 10000",
+            "stream": "ndjson",
+        }
+        response = client.post("/api/query", json=mock_query)
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+
+        frames = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert frames[0]["metadata"]["column_names"] == ["number", "label"]
+        assert frames[0]["metadata"]["column_types"] == ["UInt64", "String"]
+        assert frames[1] == [0, "0"]
+        assert len(frames) == 10000 + 2
+        assert frames[-1] == {"summary": {"row_count": 10000}}
+
+    def test_query_stream_json_array(self, client):
+        mock_query = {"query": "SELECT number FROM system.numbers LIMIT 3", "stream": "json"}
+        response = client.post("/api/query", json=mock_query)
+        assert response.status_code == 200
+        data = json.loads(response.get_data(as_text=True))
+        assert data["metadata"]["column_names"] == ["number"]
+        assert data["data"] == [{"number": 0}, {"number": 1}, {"number": 2}]
+        assert data["row_count"] == 3
+
+    def test_query_stream_error(self, client):
+        response = client.post("/api/query", json={"query": "INVALID SQL", "stream": True})
+        assert response.status_code == 400
+        assert "error" in response.get_json()
+
+    def test_query_paginated(self, client):
+        mock_query = {
+            "query": "SELECT number FROM system.numbers LIMIT 95",
+            "page": 2,
+            "pageSize": 10,
+        }
+        response = client.post("/api/query", json=mock_query)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert [row["number"] for row in data["data"]] == list(range(10, 20))
+        assert data["metadata"]["total_rows"] == 95
+        assert data["metadata"]["total_pages"] == 10
+        assert data["metadata"]["page"] == 2
+
+    def test_query_paginated_total_is_cached(self, client, app):
+        query_string = "SELECT number FROM numbers(42)"
+        app.count_cache.clear()
+        client.post("/api/query", json={"query": query_string, "page": 1, "pageSize": 5})
+
+        with patch("app.api.routes.get_total_rows", wraps=get_total_rows) as spy:
+            with patch.object(app.count_cache, "set") as cache_set:
+                response = client.post(
+                    "/api/query", json={"query": query_string, "page": 2, "pageSize": 5}
+                )
+        assert response.get_json()["metadata"]["total_rows"] == 42
+        assert spy.called
+        assert not cache_set.called
+
+    def test_query_seek_pagination(self, client):
+        query_string = "SELECT number % 3 AS a, number AS b FROM numbers(20)"
+        seen = []
+        cursor = None
+        while True:
+            body = {"query": query_string, "pageSize": 7, "seek": ["a", "b"]}
+            if cursor:
+                body["cursor"] = cursor
+            response = client.post("/api/query", json=body)
+            assert response.status_code == 200
+            data = response.get_json()
+            seen.extend((row["a"], row["b"]) for row in data["data"])
+            cursor = data["metadata"]["next_cursor"]
+            if cursor is None:
+                break
+
+        assert seen == sorted((n % 3, n) for n in range(20))
+
+    def test_query_seek_invalid_cursor(self, client):
+        body = {"query": "SELECT 1 AS a", "pageSize": 5, "seek": ["a"], "cursor": "bogus"}
+        response = client.post("/api/query", json=body)
+        assert response.status_code == 400
+        assert "Invalid cursor" in response.get_json()["error"]
+
+    def test_query_stream_unknown_format(self, client):
+        response = client.post("/api/query", json={"query": "SELECT 1", "stream": "xml"})
+        assert response.status_code == 400
+        assert "Unsupported stream format" in response.get_json()["error"]
+
+    def test_query_columns_format(self, client):
+        response = client.post(
+            "/api/query",
+            json={"query": "SELECT number, toString(number) AS s FROM numbers(3)", "format": "columns"},
+        )
+        data = response.get_json()
+        assert data["data"] == [[0, 1, 2], ["0", "1", "2"]]
+        assert data["metadata"]["column_types"] == ["UInt64", "String"]
+
+    def test_query_arrow_format(self, client):
+        import pyarrow.ipc as ipc
+
+        response = client.post(
+            "/api/query",
+            json={"query": "SELECT number, toString(number) AS s FROM numbers(100000)", "format": "arrow"},
+        )
+        reader = ipc.open_stream(response.get_data())
+        assert json.loads(reader.schema.metadata[b"helios"])["column_types"] == ["UInt64", "String"]
+        table = reader.read_all()
+        assert table.num_rows == 100000
+        assert table.column("s").to_pylist()[:2] == ["0", "1"]
+
+    def test_query_has_query_id(self, client):
+        response = client.post("/api/query", json={"query": "SELECT 1", "cache": False})
+        assert response.get_json()["metadata"]["query_id"].startswith("helios-")
+
+    def test_query_profile(self, client):
+        response = client.post(
+            "/api/query",
+            json={"query": "SELECT sum(number) AS total FROM numbers(100000)", "profile": True},
+        )
+        profile = response.get_json()["metadata"]["profile"]
+        assert profile["read_rows"] == 100000
+        assert profile["elapsed"]["server_ms"] >= 0
+        assert "error" not in profile
+
+    def test_query_max_execution_time(self, ch_client):
+        app = create_app(config={**TEST_CONFIG, "QUERY_MAX_EXECUTION_TIME": 1}, client=ch_client)
+        response = app.test_client().post(
+            "/api/query", json={"query": "SELECT sleepEachRow(0.5) FROM numbers(10) SETTINGS max_block_size = 1", "cache": False}
+        )
+        assert response.status_code == 400
+        assert "TIMEOUT_EXCEEDED" in response.get_json()["error"]
+
+    def test_query_cancel(self):
+        # Pooled clients, so the cancel runs on its own session.
+        app = create_app(config=TEST_CONFIG)
+        query_id = f"test-cancel-{generate_random_table_name()}"
+        results = []
+
+        def run_query():
+            response = app.test_client().post(
+                "/api/query",
+                json={"query": "SELECT sleepEachRow(0.1) FROM numbers(300) SETTINGS max_block_size = 1", "queryId": query_id, "cache": False},
+            )
+            results.append(response)
+
+        thread = threading.Thread(target=run_query)
+        thread.start()
+        cancel = None
+        for _ in range(50):
+            time.sleep(0.1)
+            cancel = app.test_client().post("/api/query/cancel", json={"queryId": query_id})
+            if cancel.status_code == 200:
+                break
+        thread.join(timeout=10)
+
+        assert cancel.status_code == 200
+        assert results[0].status_code == 400
+        assert "QUERY_WAS_CANCELLED" in results[0].get_json()["error"]
+
+
+class TestQueryCache:
+    @pytest.fixture
+    def cached_table(self, ch_client, app):
+        table_name = generate_random_table_name("cache_test_")
+        ch_client.command(
+            f"CREATE TABLE default.{table_name} (n UInt32) ENGINE = MergeTree ORDER BY n"
+        )
+        ch_client.command(f"INSERT INTO default.{table_name} SELECT number FROM numbers(10)")
+        app.query_cache.clear()
+        yield table_name
+        ch_client.command(f"DROP TABLE IF EXISTS default.{table_name}")
+
+    def test_repeated_query_is_served_from_cache(self, client, cached_table):
+        mock_query = {"query": f"SELECT count() AS c FROM {cached_table}"}
+        before = client.get("/api/query/cache").get_json()
+
+        first = client.post("/api/query", json=mock_query).get_json()
+        second = client.post("/api/query", json=mock_query).get_json()
+
+        after = client.get("/api/query/cache").get_json()
+        assert first == second
+        assert after["process"]["hits"] == before["process"]["hits"] + 1
+        assert after["process"]["misses"] == before["process"]["misses"] + 1
+
+    def test_insert_invalidates_cached_result(self, client, ch_client, cached_table):
+        mock_query = {"query": f"SELECT count() AS c FROM {cached_table}"}
+        assert client.post("/api/query", json=mock_query).get_json()["data"] == [{"c": 10}]
+
+        ch_client.command(f"INSERT INTO default.{cached_table} SELECT number FROM numbers(5)")
+        time.sleep(1.1)
+
+        assert client.post("/api/query", json=mock_query).get_json()["data"] == [{"c": 15}]
+        assert client.get("/api/query/cache").get_json()["invalidations"] >= 1
+
 
 class TestAuthenticateRoute:
     """
@@ -147,6 +349,7 @@ class TestKinesisSampleRoute:
     @api.route("/kinesis-sample", methods=["POST"])
     return jsonify({
         "sampleEvent": json.loads(record_data),
+        "sampleEvents": [json.loads(record["data"]) for record in records],
         "inferredSchema": schemaArray
     })
     """
@@ -154,6 +357,7 @@ class TestKinesisSampleRoute:
     @patch("app.api.routes.global_boto3_session")
     def test_kinesis_sample_success(self, mock_global_session, client):
         mock_kinesis = mock_global_session.client.return_value
+        mock_kinesis.list_shards.return_value = {"Shards": [{"ShardId": "shardId-000000000000"}]}
         mock_kinesis.get_records.return_value = {
             "Records": [{"Data": json.dumps({"event": "test"}).encode("utf-8")}]
         }
@@ -167,9 +371,33 @@ class TestKinesisSampleRoute:
         assert "sampleEvent" in data
         assert data["sampleEvent"] == {"event": "test"}
 
+    @patch("app.api.routes.global_boto3_session")
+    def test_kinesis_sample_cross_check(self, mock_global_session, client):
+        mock_kinesis = mock_global_session.client.return_value
+        mock_kinesis.list_shards.return_value = {"Shards": [{"ShardId": "shardId-000000000000"}]}
+        mock_kinesis.get_records.return_value = {
+            "Records": [
+                {"Data": json.dumps({"id": 1, "message": "it's here"}).encode("utf-8")},
+                {"Data": json.dumps({"id": 2, "message": None}).encode("utf-8")},
+            ]
+        }
+
+        response = client.post(
+            "/api/kinesis-sample", json={"streamName": "test_stream", "crossCheck": True}
+        )
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["inferredSchema"] == [
+            {"name": "id", "type": "Int64"},
+            {"name": "message", "type": "Nullable(String)"},
+        ]
+        assert [col["name"] for col in data["clickhouseSchema"]] == ["id", "message"]
+
     @patch("app.api.routes.global_boto3_session")
     def test_kinesis_sample_no_records(self, mock_global_session, client):
         mock_kinesis = mock_global_session.client.return_value
+        mock_kinesis.list_shards.return_value = {"Shards": [{"ShardId": "shardId-000000000000"}]}
         mock_kinesis.get_records.return_value = {"Records": []}
 
         response = client.post(
@@ -204,7 +432,8 @@ class TestCreateTableRoute:
     @api.route("/create-table", methods=["POST"])
     return jsonify({
         "success": True,
-        "create_table_query": query,
+        "createTableQuery": query,
+        "layout": layout,
         "message": "Table created in Clickhouse. Lambda trigger added. Mapping added to dynamo",
         "tableUUID": table_id,
         "streamARN": stream_arn
@@ -254,7 +483,8 @@ class TestCreateTableRoute:
         assert response.status_code == 200
         data = response.get_json()
         assert data["success"] == True
-        assert "create_table_query" in data
+        assert "ORDER BY (id)" in data["createTableQuery"]
+        assert data["layout"]["orderBy"] == ["id"]
         assert "tableUUID" in data
         assert "streamARN" in data
 
@@ -334,3 +564,41 @@ class TestCreateTableRoute:
         data = response.get_json()
         assert "Authentication Error" in data
         assert "User had not been authenticated" in data["Authentication Error"]
+
+
+
+class TestIngestWorker:
+    """
+    End to end against moto Kinesis/DynamoDB and the local ClickHouse.
+    """
+
+    def test_ingests_into_clickhouse(self, ch_client, aws_session, tmp_path):
+        table_name = generate_random_table_name()
+        ch_client.command(
+            f"CREATE TABLE default.{table_name} "
+            "(user_id Int64, event_type LowCardinality(String), event_timestamp DateTime, extra Nullable(String)) "
+            "ENGINE = MergeTree() ORDER BY (event_type, event_timestamp)"
+        )
+        try:
+            table_id = str(get_table_id(ch_client, table_name))
+            map_stream(aws_session, "events", table_id, shards=2)
+            put_events(aws_session, "events", 0, 500)
+
+            worker = IngestWorker(
+                aws_session,
+                ch_client,
+                FileCheckpointStore(tmp_path / "checkpoints.json"),
+                batch_rows=200,
+                flush_interval=0.2,
+                starting_position="TRIM_HORIZON",
+                report_interval=0,
+            )
+            deadline = time.monotonic() + 30
+            report = worker.run(
+                until=lambda: worker.stats.snapshot()["rows"] >= 500 or time.monotonic() > deadline
+            )
+
+            assert report["rows"] == 500
+            assert ch_client.query(f"SELECT count() FROM default.{table_name}").first_row[0] == 500
+        finally:
+            ch_client.command(f"DROP TABLE IF EXISTS default.{table_name}")
@@ -0,0 +1,188 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from clickhouse_connect.driver.common import StreamContext
+from moto import mock_aws
+from prometheus_client import REGISTRY
+
+from app.main import create_app
+from app.utils.aws import ThreadSafeSession
+from app.utils.metrics import instrument_client
+from tests.test_config import TEST_CONFIG
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def app():
+    app = create_app(config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False}, client=MagicMock())
+
+    @app.route("/boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    return app
+
+
+class TestRouteMetrics:
+    def test_counts_and_times_by_route(self, app):
+        labels = {"method": "GET", "route": "/api/pool"}
+        count = sample("helios_http_requests_total", status="200", **labels)
+        observed = sample("helios_http_request_duration_seconds_count", **labels)
+
+        response = app.test_client().get("/api/pool")
+
+        assert response.status_code == 200
+        assert sample("helios_http_requests_total", status="200", **labels) == count + 1
+        assert sample("helios_http_request_duration_seconds_count", **labels) == observed + 1
+        assert sample("helios_http_requests_in_progress", **labels) == 0
+
+    def test_counts_client_errors(self, app):
+        labels = {"method": "POST", "route": "/api/query", "status": "400"}
+        count = sample("helios_http_requests_total", **labels)
+
+        app.test_client().post("/api/query", json={})
+
+        assert sample("helios_http_requests_total", **labels) == count + 1
+
+    def test_unhandled_exception_counts_as_500(self, app):
+        labels = {"method": "GET", "route": "/boom", "status": "500"}
+        count = sample("helios_http_requests_total", **labels)
+        app.config["PROPAGATE_EXCEPTIONS"] = False
+
+        assert app.test_client().get("/boom").status_code == 500
+
+        assert sample("helios_http_requests_total", **labels) == count + 1
+        assert sample("helios_http_requests_in_progress", method="GET", route="/boom") == 0
+
+    def test_metrics_endpoint(self, app):
+        app.test_client().get("/api/pool")
+        response = app.test_client().get("/metrics", headers={"Accept-Encoding": "identity"})
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        assert b'helios_http_requests_total{method="GET",route="/api/pool",status="200"}' in response.data
+
+    def test_disabled(self):
+        app = create_app(config={**TEST_CONFIG, "METRICS_ENABLED": False}, client=MagicMock())
+        assert "metrics" not in app.view_functions
+
+
+class TestClickHouseMetrics:
+    def test_query_records_summary(self):
+        client = MagicMock()
+        client.query.return_value = SimpleNamespace(
+            summary={"read_rows": "1000", "read_bytes": "8000", "written_rows": "0"},
+            row_count=10,
+        )
+        instrument_client(client)
+        before = {
+            name: sample(name, operation="query")
+            for name in (
+                "helios_clickhouse_query_duration_seconds_count",
+                "helios_clickhouse_read_rows_total",
+                "helios_clickhouse_read_bytes_total",
+                "helios_clickhouse_result_rows_total",
+            )
+        }
+
+        client.query("SELECT 1")
+
+        assert sample("helios_clickhouse_query_duration_seconds_count", operation="query") == (
+            before["helios_clickhouse_query_duration_seconds_count"] + 1
+        )
+        assert sample("helios_clickhouse_read_rows_total", operation="query") == (
+            before["helios_clickhouse_read_rows_total"] + 1000
+        )
+        assert sample("helios_clickhouse_read_bytes_total", operation="query") == (
+            before["helios_clickhouse_read_bytes_total"] + 8000
+        )
+        assert sample("helios_clickhouse_result_rows_total", operation="query") == (
+            before["helios_clickhouse_result_rows_total"] + 10
+        )
+
+    def test_errors(self):
+        client = MagicMock()
+        client.command.side_effect = RuntimeError("Code: 62. Syntax error")
+        instrument_client(client)
+        errors = sample("helios_clickhouse_query_errors_total", operation="command")
+
+        with pytest.raises(RuntimeError):
+            client.command("SELEC 1")
+
+        assert sample("helios_clickhouse_query_errors_total", operation="command") == errors + 1
+
+    def test_stream_is_timed_until_closed(self):
+        source = MagicMock()
+        blocks = [[(1,), (2,)], [(3,)]]
+        client = MagicMock()
+        client.query_row_block_stream.return_value = StreamContext(source, iter(blocks))
+        instrument_client(client)
+        observed = sample("helios_clickhouse_query_duration_seconds_count", operation="stream")
+        rows = sample("helios_clickhouse_result_rows_total", operation="stream")
+
+        stream = client.query_row_block_stream("SELECT 1")
+        assert stream.source is source
+        assert sample("helios_clickhouse_query_duration_seconds_count", operation="stream") == observed
+        with stream:
+            assert list(stream) == blocks
+
+        source.close.assert_called_once()
+        assert sample("helios_clickhouse_query_duration_seconds_count", operation="stream") == observed + 1
+        assert sample("helios_clickhouse_result_rows_total", operation="stream") == rows + 3
+
+
+class TestAWSMetrics:
+    def test_calls_are_timed(self, monkeypatch):
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        labels = {"service": "kinesis", "operation": "ListStreams"}
+        observed = sample("helios_aws_request_duration_seconds_count", **labels)
+        errors = sample("helios_aws_request_errors_total", service="kinesis", operation="DescribeStream")
+
+        with mock_aws():
+            session = ThreadSafeSession(boto3.Session(region_name="us-west-1"))
+            session.client("kinesis").list_streams()
+            with pytest.raises(Exception):
+                session.client("kinesis").describe_stream(StreamName="missing")
+
+        assert sample("helios_aws_request_duration_seconds_count", **labels) == observed + 1
+        assert (
+            sample("helios_aws_request_errors_total", service="kinesis", operation="DescribeStream")
+            == errors + 1
+        )
+
+
+WORKER = """
+from app.main import create_app
+from tests.test_config import TEST_CONFIG
+from unittest.mock import MagicMock
+app = create_app(config=TEST_CONFIG, client=MagicMock())
+for _ in range({requests}):
+    app.test_client().get("/api/pool")
+if {scrape}:
+    print(app.test_client().get("/metrics", headers={{"Accept-Encoding": "identity"}}).get_data(as_text=True))
+"""
+
+
+def test_metrics_aggregate_across_processes(tmp_path):
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for requests in (2, 3):
+        subprocess.run(
+            [sys.executable, "-c", WORKER.format(requests=requests, scrape=False)],
+            env=env, cwd=cwd, check=True, capture_output=True,
+        )
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER.format(requests=1, scrape=True)],
+        env=env, cwd=cwd, check=True, capture_output=True, text=True,
+    ).stdout
+
+    assert 'helios_http_requests_total{method="GET",route="/api/pool",status="200"} 6.0' in output
@@ -0,0 +1,198 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from app.main import create_app
+from app.utils.cache import TTLCache
+from app.utils.helpers import fetch_openai_output, stream_openai_output
+from tests.test_config import TEST_CONFIG
+
+SUMMARY_CHUNKS = ["Most errors ", "are timeouts ", "from the checkout service."]
+
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        self.server.connections.add(self.client_address)
+
+        if self.server.delay:
+            sleep(self.server.delay)
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for chunk in SUMMARY_CHUNKS:
+                event = {"choices": [{"delta": {"content": chunk}}]}
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                self.wfile.flush()
+            if not self.server.truncate:
+                self.wfile.write(b"data: [DONE]\n\n")
+            self.close_connection = True
+            return
+
+        payload = json.dumps(
+            {"choices": [{"message": {"content": "".join(SUMMARY_CHUNKS)}}]}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def stub_openai():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAIHandler)
+    server.requests = []
+    server.connections = set()
+    server.delay = 0
+    server.truncate = False
+    server.url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+class TestFetchOpenAIOutput:
+    def test_returns_summary(self, stub_openai):
+        text = fetch_openai_output("error table", "key", endpoint=stub_openai.url)
+        assert text == "".join(SUMMARY_CHUNKS)
+        assert stub_openai.requests[0]["messages"][1]["content"] == "error table"
+
+    def test_connection_is_reused(self, stub_openai):
+        for i in range(3):
+            fetch_openai_output(f"prompt {i}", "key", endpoint=stub_openai.url)
+        assert len(stub_openai.requests) == 3
+        assert len(stub_openai.connections) == 1
+
+    def test_identical_prompts_hit_the_cache(self, stub_openai):
+        cache = TTLCache()
+        first = fetch_openai_output("same table", "key", endpoint=stub_openai.url, cache=cache)
+        second = fetch_openai_output("same table", "key", endpoint=stub_openai.url, cache=cache)
+        assert first == second
+        assert len(stub_openai.requests) == 1
+
+    def test_timeout(self, stub_openai):
+        stub_openai.delay = 1
+        assert fetch_openai_output("slow", "key", timeout=0.2, endpoint=stub_openai.url) is None
+
+    def test_stream(self, stub_openai):
+        cache = TTLCache()
+        chunks = list(stream_openai_output("table", "key", endpoint=stub_openai.url, cache=cache))
+        assert chunks == SUMMARY_CHUNKS
+        assert stub_openai.requests[0]["stream"] is True
+
+        assert list(stream_openai_output("table", "key", endpoint=stub_openai.url, cache=cache)) == [
+            "".join(SUMMARY_CHUNKS)
+        ]
+        assert len(stub_openai.requests) == 1
+
+    def test_stream_without_done_is_not_cached(self, stub_openai):
+        stub_openai.truncate = True
+        cache = TTLCache()
+        assert list(stream_openai_output("table", "key", endpoint=stub_openai.url, cache=cache)) == SUMMARY_CHUNKS
+        assert len(cache) == 0
+
+        list(stream_openai_output("table", "key", endpoint=stub_openai.url, cache=cache))
+        assert len(stub_openai.requests) == 2
+
+
+class TestApiResponseRoute:
+    @pytest.fixture
+    def client(self, stub_openai):
+        app = create_app(config={**TEST_CONFIG, "OPENAI_API_URL": stub_openai.url}, client=object())
+        yield app.test_client()
+
+    def test_summary(self, client):
+        response = client.post("/api/api-response", json={"prompt": "error table"})
+        assert response.status_code == 200
+        assert response.get_json() == {"response": "".join(SUMMARY_CHUNKS)}
+
+    def test_sse_stream(self, client):
+        response = client.post("/api/api-response", json={"prompt": "error table", "stream": True})
+        assert response.status_code == 200
+        assert response.mimetype == "text/event-stream"
+
+        events = response.get_data(as_text=True).strip().split("\n\n")
+        deltas = [json.loads(event[len("data: "):])["delta"] for event in events[:-1]]
+        assert deltas == SUMMARY_CHUNKS
+        assert events[-1].startswith("event: done")
+
+    def test_sse_stream_upstream_error(self, client, stub_openai):
+        stub_openai.shutdown()
+        stub_openai.server_close()
+        response = client.post("/api/api-response", json={"prompt": "error table", "stream": True})
+        assert "event: error" in response.get_data(as_text=True)
+
+
+class TestQuerySummaryRoute:
+    @pytest.fixture
+    def ch_client(self):
+        def query(sql, **kwargs):
+            if sql.startswith("DESCRIBE"):
+                return SimpleNamespace(
+                    result_rows=[("timestamp", "DateTime", "", "", "", "", ""), ("message", "String", "", "", "", "", "")]
+                )
+            return SimpleNamespace(
+                column_names=["message", "occurrences", "first_seen_timestamp", "last_seen_timestamp", "total_rows", "distinct_rows"],
+                result_rows=[("timeout", 9, "2024-01-01 00:00:00", "2024-01-02 00:00:00", 10, 2)],
+            )
+
+        client = MagicMock()
+        client.query.side_effect = query
+        return client
+
+    @pytest.fixture
+    def client(self, stub_openai, ch_client):
+        app = create_app(config={**TEST_CONFIG, "OPENAI_API_URL": stub_openai.url}, client=ch_client)
+        yield app.test_client()
+
+    def test_summarizes_aggregated_rows(self, client, ch_client, stub_openai):
+        response = client.post("/api/api-response/query", json={"table": "default.errors", "topK": 5})
+        assert response.status_code == 200
+
+        body = response.get_json()
+        assert body["response"] == "".join(SUMMARY_CHUNKS)
+        assert body["metadata"]["total_rows"] == 10
+        assert body["metadata"]["rows_in_prompt"] == 1
+
+        summary_query = ch_client.query.call_args_list[1].args[0]
+        assert "FROM (\nSELECT * FROM default.errors\n)" in summary_query
+        assert "GROUP BY `message`" in summary_query
+
+        prompt = stub_openai.requests[0]["messages"][1]["content"]
+        assert "timeout\t9" in prompt
+
+    def test_sse_stream(self, client):
+        response = client.post("/api/api-response/query", json={"table": "errors", "stream": True})
+        assert response.mimetype == "text/event-stream"
+        assert "event: done" in response.get_data(as_text=True)
+
+    def test_rejects_bad_table(self, client, ch_client):
+        response = client.post("/api/api-response/query", json={"table": "errors; DROP TABLE x"})
+        assert response.status_code == 400
+        assert "Summary Route Error" in response.get_json()
+        ch_client.query.assert_not_called()
+
+    @pytest.mark.parametrize("group_by", ["message", {"message": 1}, ["message; DROP"]])
+    def test_rejects_bad_group_by(self, client, ch_client, group_by):
+        response = client.post("/api/api-response/query", json={"table": "errors", "groupBy": group_by})
+        assert response.status_code == 400
+        ch_client.query.assert_not_called()
+
+    def test_rejects_writes(self, client, ch_client):
+        response = client.post("/api/api-response/query", json={"query": "DROP TABLE errors"})
+        assert response.status_code == 400
+        ch_client.query.assert_not_called()
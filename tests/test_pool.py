@@ -0,0 +1,130 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from clickhouse_connect.driver.exceptions import DatabaseError, OperationalError
+from app.main import create_app
+from app.utils.pool import ClientPool, PoolExhaustedError
+from tests.test_config import TEST_CONFIG
+
+
+def make_factory():
+    created = []
+
+    def factory():
+        client = MagicMock(name=f"client-{len(created)}")
+        client.ping.return_value = True
+        created.append(client)
+        return client
+
+    return factory, created
+
+
+class TestClientPool:
+    def test_clients_are_reused(self):
+        factory, created = make_factory()
+        pool = ClientPool(factory, size=2)
+
+        first = pool.acquire()
+        pool.release(first)
+        assert pool.acquire() is first
+        assert len(created) == 1
+
+    def test_clients_are_exclusive(self):
+        factory, created = make_factory()
+        pool = ClientPool(factory, size=2)
+        assert pool.acquire() is not pool.acquire()
+        assert pool.stats()["in_use"] == 2
+
+    def test_acquire_times_out_when_exhausted(self):
+        factory, _ = make_factory()
+        pool = ClientPool(factory, size=1, acquire_timeout=0.05)
+        pool.acquire()
+        with pytest.raises(PoolExhaustedError):
+            pool.acquire()
+        assert pool.stats()["timeouts"] == 1
+
+    def test_waiter_gets_released_client(self):
+        factory, _ = make_factory()
+        pool = ClientPool(factory, size=1, acquire_timeout=5)
+        held = pool.acquire()
+        acquired = []
+
+        waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+        waiter.start()
+        pool.release(held)
+        waiter.join(timeout=5)
+        assert acquired == [held]
+
+    def test_failed_health_check_evicts_client(self):
+        factory, created = make_factory()
+        pool = ClientPool(factory, size=1, health_check_interval=0)
+        stale = pool.acquire()
+        pool.release(stale)
+        stale.ping.return_value = False
+
+        fresh = pool.acquire()
+        assert fresh is not stale
+        stale.close.assert_called_once()
+        assert pool.stats()["evicted"] == 1
+
+    def test_broken_client_is_not_reused(self):
+        factory, created = make_factory()
+        pool = ClientPool(factory, size=1)
+        broken = pool.acquire()
+        pool.release(broken, broken=True)
+        assert pool.acquire() is not broken
+        assert len(created) == 2
+
+    def test_factory_failure_frees_the_slot(self):
+        pool = ClientPool(MagicMock(side_effect=Exception("connection refused")), size=1)
+        with pytest.raises(Exception):
+            pool.acquire()
+        assert pool.stats()["in_use"] == 0
+
+    def test_forked_pool_starts_empty(self):
+        factory, created = make_factory()
+        pool = ClientPool(factory, size=1)
+        pool.release(pool.acquire())
+
+        with patch("app.utils.pool.os.getpid", return_value=-1):
+            assert pool.acquire() is not created[0]
+        assert len(created) == 2
+
+
+class TestAppPool:
+    def test_requests_share_pooled_clients(self):
+        factory, created = make_factory()
+        with patch("app.main.clickhouse_connect.get_client", side_effect=lambda **kwargs: factory()):
+            app = create_app(config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False})
+            test_client = app.test_client()
+            for _ in range(3):
+                test_client.post("/api/query", json={"query": "SELECT 1"})
+
+            stats = test_client.get("/api/pool").get_json()
+        assert len(created) == 1
+        assert stats["acquired"] == 3
+        assert stats["in_use"] == 0
+        assert stats["idle"] == 1
+
+    @pytest.mark.parametrize("error, evicted", [(OperationalError("Connection reset"), 1), (DatabaseError("Syntax error"), 0)])
+    def test_route_connection_error_evicts_client(self, error, evicted):
+        factory, created = make_factory()
+
+        def failing_client(**kwargs):
+            client = factory()
+            client.query.side_effect = error
+            return client
+
+        with patch("app.main.clickhouse_connect.get_client", side_effect=failing_client):
+            app = create_app(config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False})
+            test_client = app.test_client()
+            # The route answers 400 itself, so only the flag it leaves in g
+            # tells the teardown whether the connection is broken.
+            response = test_client.post("/api/query", json={"query": "SELECT 1"})
+            assert response.status_code == 400
+
+            stats = test_client.get("/api/pool").get_json()
+        assert stats["evicted"] == evicted
+        assert stats["idle"] == 1 - evicted
+        assert created[0].close.call_count == evicted
@@ -0,0 +1,162 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from app.main import create_app
+from app.utils.profiling import QUERY_LOG_QUERY, explain_indexes, profile_query
+from tests.test_config import TEST_CONFIG
+
+# query_duration_ms, read_rows, read_bytes, result_rows, result_bytes,
+# memory_usage, user/system/cpu wait/io wait/disk read/network send (us),
+# SelectedParts, SelectedMarks
+QUERY_LOG_ROW = (42, 81920, 655360, 10, 160, 4194304, 30000, 2000, 500, 0, 1500, 250, 2, 10)
+
+EXPLAIN_PLAN = [
+    {
+        "Plan": {
+            "Node Type": "Expression",
+            "Plans": [
+                {
+                    "Node Type": "ReadFromMergeTree",
+                    "Description": "default.events",
+                    "Indexes": [
+                        {
+                            "Type": "MinMax",
+                            "Keys": ["event_timestamp"],
+                            "Condition": "(event_timestamp in [1719792000, +Inf))",
+                            "Initial Parts": 12,
+                            "Selected Parts": 4,
+                            "Initial Granules": 1220,
+                            "Selected Granules": 410,
+                        },
+                        {
+                            "Type": "PrimaryKey",
+                            "Keys": ["user_id"],
+                            "Condition": "(user_id in [42, 42])",
+                            "Initial Parts": 4,
+                            "Selected Parts": 2,
+                            "Initial Granules": 410,
+                            "Selected Granules": 10,
+                        },
+                    ],
+                },
+                {"Node Type": "ReadFromMergeTree", "Description": "default.users", "Parts": 1, "Granules": 3},
+            ],
+        }
+    }
+]
+
+
+def make_client(query_log_rows=(QUERY_LOG_ROW,)):
+    def query(sql, parameters=None, settings=None, **kwargs):
+        if sql == QUERY_LOG_QUERY:
+            return SimpleNamespace(result_rows=list(query_log_rows))
+        if sql.startswith("EXPLAIN indexes = 1, json = 1"):
+            # ClickHouse splits the JSON document over several rows.
+            text = json.dumps(EXPLAIN_PLAN, indent=1).split("\n")
+            return SimpleNamespace(result_rows=[(line,) for line in text])
+        result = MagicMock()
+        result.named_results.return_value = [{"n": 1}]
+        result.column_names = ("n",)
+        result.column_types = (SimpleNamespace(base_type="UInt8"),)
+        return result
+
+    client = MagicMock()
+    client.query.side_effect = query
+    return client
+
+
+class TestProfileQuery:
+    def test_query_log_and_indexes(self):
+        client = make_client()
+        profile = profile_query(client, "SELECT 1", "q1", round_trip=0.05)
+
+        client.command.assert_called_once_with("SYSTEM FLUSH LOGS")
+        assert profile["query_id"] == "q1"
+        assert profile["read_rows"] == 81920
+        assert profile["memory_usage"] == 4194304
+        assert profile["selected_parts"] == 2
+        assert profile["elapsed"] == {
+            "server_ms": 42,
+            "cpu_user_ms": 30.0,
+            "cpu_system_ms": 2.0,
+            "cpu_wait_ms": 0.5,
+            "io_wait_ms": 0.0,
+            "disk_read_ms": 1.5,
+            "network_send_ms": 0.25,
+            "round_trip_ms": 50.0,
+        }
+        assert [table["table"] for table in profile["tables"]] == ["default.events", "default.users"]
+
+    def test_missing_from_query_log(self):
+        profile = profile_query(make_client(query_log_rows=()), "SELECT 1", "q1")
+        assert "not found" in profile["error"]
+        assert profile["tables"]
+
+    def test_failures_are_reported(self):
+        client = MagicMock()
+        client.command.side_effect = RuntimeError("Not enough privileges")
+        client.query.side_effect = RuntimeError("Syntax error")
+        profile = profile_query(client, "SELECT 1", "q1")
+        assert profile == {
+            "query_id": "q1",
+            "error": "Not enough privileges",
+            "explain_error": "Syntax error",
+        }
+
+    def test_explain_indexes(self):
+        events, users = explain_indexes(make_client(), "SELECT * FROM events WHERE user_id = 42;")
+        assert events["parts"] == {"initial": 12, "selected": 2}
+        assert events["granules"] == {"initial": 1220, "selected": 10}
+        assert events["indexes"][1] == {
+            "type": "PrimaryKey",
+            "name": None,
+            "keys": ["user_id"],
+            "condition": "(user_id in [42, 42])",
+            "parts": [4, 2],
+            "granules": [410, 10],
+        }
+        assert users["granules"] == {"initial": 3, "selected": 3}
+        assert users["indexes"] == []
+
+
+class TestQueryRoute:
+    @pytest.fixture
+    def ch_client(self):
+        return make_client()
+
+    @pytest.fixture
+    def client(self, ch_client):
+        return create_app(config=TEST_CONFIG, client=ch_client).test_client()
+
+    def test_profile(self, client, ch_client):
+        response = client.post("/api/query", json={"query": "SELECT 1 AS n", "profile": True})
+        assert response.status_code == 200
+        metadata = response.get_json()["metadata"]
+        assert metadata["profile"]["query_id"] == metadata["query_id"]
+        assert metadata["profile"]["read_rows"] == 81920
+
+        settings = ch_client.query.call_args_list[0].kwargs["settings"]
+        assert settings["query_id"] == metadata["query_id"]
+        assert settings["log_queries"] == 1
+
+    def test_profiled_queries_skip_the_cache(self, client, ch_client):
+        for _ in range(2):
+            response = client.post("/api/query", json={"query": "SELECT 1 AS n", "profile": True})
+            assert "profile" in response.get_json()["metadata"]
+        assert ch_client.command.call_count == 2
+
+    def test_no_profile_no_extra_queries(self, client, ch_client):
+        response = client.post("/api/query", json={"query": "SELECT 1 AS n", "cache": False})
+        assert "profile" not in response.get_json()["metadata"]
+        ch_client.command.assert_not_called()
+        assert [call.args[0] for call in ch_client.query.call_args_list] == ["SELECT 1 AS n"]
+
+    @pytest.mark.parametrize("options", [{"stream": True}, {"format": "arrow"}])
+    def test_profile_requires_buffered_response(self, client, options):
+        response = client.post(
+            "/api/query", json={"query": "SELECT 1 AS n", "profile": True, **options}
+        )
+        assert response.status_code == 400
+        assert "profile" in response.get_json()["error"]
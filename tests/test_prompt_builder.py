@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+from app.utils.prompt_builder import (
+    build_summary_prompt,
+    create_summary_query,
+    estimate_tokens,
+)
+
+COLUMNS = [
+    ("timestamp", "DateTime64(3)"),
+    ("request_id", "UUID"),
+    ("service", "LowCardinality(String)"),
+    ("message", "Nullable(String)"),
+]
+
+
+def summary_result(rows, distinct_rows=None):
+    names = ["service", "message", "occurrences", "total_rows", "distinct_rows"]
+    total = sum(row[2] for row in rows)
+    distinct = len(rows) if distinct_rows is None else distinct_rows
+    return SimpleNamespace(
+        column_names=names,
+        result_rows=[(*row, total, distinct) for row in rows],
+    )
+
+
+class TestCreateSummaryQuery:
+    def test_groups_on_non_time_columns(self):
+        query = create_summary_query("SELECT * FROM errors;", COLUMNS, top_k=5)
+        assert "FROM (\nSELECT * FROM errors\n)" in query
+        assert "GROUP BY `service`, `message`" in query
+        assert "min(`timestamp`) AS `first_seen_timestamp`" in query
+        assert "request_id" not in query
+        assert query.endswith("ORDER BY occurrences DESC LIMIT 5")
+
+    def test_explicit_group_by(self):
+        query = create_summary_query("SELECT * FROM errors", COLUMNS, group_by=["message"])
+        assert "GROUP BY `message`" in query
+        assert "`service`" not in query
+
+    def test_nothing_to_group_on(self):
+        with pytest.raises(ValueError):
+            create_summary_query("SELECT * FROM errors", [("timestamp", "DateTime")])
+
+
+class TestBuildSummaryPrompt:
+    def test_renders_compact_table(self):
+        result = summary_result([("checkout", "timeout", 40), ("cart", "line1\nline2", 2)])
+        prompt, metadata = build_summary_prompt(result)
+
+        lines = prompt.split("\n")
+        assert lines[0].startswith("42 error rows, 2 distinct")
+        assert lines[1] == "service\tmessage\toccurrences"
+        assert lines[2] == "checkout\ttimeout\t40"
+        assert lines[3] == "cart\tline1 line2\t2"
+        assert metadata == {
+            "total_rows": 42,
+            "distinct_rows": 2,
+            "rows_in_prompt": 2,
+            "estimated_tokens": estimate_tokens(prompt),
+        }
+
+    def test_respects_token_budget(self):
+        rows = [("svc", "x" * 100, 1000 - i) for i in range(50)]
+        prompt, metadata = build_summary_prompt(summary_result(rows, distinct_rows=500), token_budget=300)
+
+        assert metadata["rows_in_prompt"] < 50
+        assert metadata["estimated_tokens"] <= 300 + 20
+        assert prompt.endswith(f"({500 - metadata['rows_in_prompt']} less frequent distinct rows omitted)")
+
+    def test_empty_result(self):
+        prompt, metadata = build_summary_prompt(summary_result([]))
+        assert metadata["rows_in_prompt"] == 0
+        assert prompt.startswith("0 error rows")
@@ -0,0 +1,381 @@
+import re
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.main import create_app
+from app.utils.rollups import (
+    COMMENT_PREFIX,
+    ROLLUPS_QUERY,
+    RollupRegistry,
+    backfill,
+    build_rollup_queries,
+    create_rollup,
+    describe_rollup,
+    parse_aggregate_query,
+    parse_rollup,
+    rewrite_query,
+)
+from tests.test_config import TEST_CONFIG
+
+COLUMNS = {
+    "user_id": "Int32",
+    "session_id": "String",
+    "event_type": "LowCardinality(String)",
+    "event_timestamp": "DateTime",
+    "page_url": "Nullable(String)",
+    "amount": "Float64",
+}
+
+HOUR = 3600
+SINCE = 1_720_000_800  # 2024-07-03 10:00:00 UTC, an hour boundary
+
+
+def make_rollup(**overrides):
+    data = {
+        "source": "default.events",
+        "dimensions": ["event_type"],
+        "measures": ["count()", "uniq(user_id)", "sum(amount)"],
+        **overrides,
+    }
+    rollup = parse_rollup(data, COLUMNS)
+    return {**rollup, "since": SINCE, "backfill": {"from": SINCE - 48 * HOUR, "until": SINCE}}
+
+
+class FakeRollupClient:
+    """
+    Answers the queries rollups.py runs and keeps table comments like
+    system.tables would, so the registry sees what create/backfill wrote.
+    """
+
+    def __init__(self, now=SINCE - 1800, first=SINCE - 30 * HOUR):
+        self.now = now
+        self.first = first
+        self.comments = {}
+        self.commands = []
+        self.queries = []
+
+    def command(self, sql, parameters=None, settings=None):
+        self.commands.append((sql, settings))
+        match = re.match(r"CREATE TABLE (\w+)\.(\w+) .* COMMENT '(.*)'$", sql) or re.match(
+            r"ALTER TABLE (\w+)\.(\w+) MODIFY COMMENT '(.*)'$", sql
+        )
+        if match:
+            self.comments[(match.group(1), match.group(2))] = match.group(3).replace("\\'", "'")
+        match = re.match(r"DROP TABLE IF EXISTS (\w+)\.(\w+)$", sql)
+        if match:
+            self.comments.pop((match.group(1), match.group(2)), None)
+
+    def query(self, sql, parameters=None, settings=None, column_oriented=False):
+        self.queries.append(sql)
+        result = MagicMock()
+        if sql == ROLLUPS_QUERY:
+            result.result_rows = [(db, name, comment) for (db, name), comment in sorted(self.comments.items())]
+        elif "(now()) + INTERVAL 1" in sql:
+            result.first_row = (SINCE,)
+        elif sql == "SELECT toUnixTimestamp(now())":
+            result.first_row = (self.now,)
+        elif "min(event_timestamp)" in sql:
+            result.result_rows = [(self.first,)] if self.first else []
+        elif sql.startswith("DESCRIBE"):
+            result.result_rows = [
+                ("event_type", "LowCardinality(String)"),
+                ("event_timestamp", "DateTime"),
+                ("count", "AggregateFunction(count)"),
+                ("uniq_user_id", "AggregateFunction(uniq, Int32)"),
+                ("sum_amount", "AggregateFunction(sum, Float64)"),
+            ]
+        else:
+            result.column_names = ["event_type", "n"]
+            result.column_types = []
+            result.named_results.return_value = [{"event_type": "click", "n": 3}]
+        return result
+
+
+class TestParseRollup:
+    def test_defaults(self):
+        rollup = parse_rollup({"source": "events"}, COLUMNS)
+
+        assert rollup == {
+            "database": "default",
+            "name": "events_by_hour",
+            "source": "default.events",
+            "timeColumn": "event_timestamp",
+            "granularity": "hour",
+            "dimensions": [],
+            "measures": [{"function": "count", "column": None, "name": "count"}],
+        }
+
+    def test_measures(self):
+        rollup = make_rollup(measures=["count(*)", "uniq(user_id)", "uniq( user_id )", "avg(amount)"])
+
+        assert [m["name"] for m in rollup["measures"]] == ["count", "uniq_user_id", "avg_amount"]
+
+    @pytest.mark.parametrize(
+        "overrides, message",
+        [
+            ({"source": "missing"}, "does not exist"),
+            ({"granularity": "week"}, "granularity"),
+            ({"name": "bad name"}, "Invalid rollup name"),
+            ({"timeColumn": "user_id"}, "timeColumn"),
+            ({"dimensions": ["page_url"]}, "Nullable"),
+            ({"dimensions": ["event_timestamp"]}, "other than the time column"),
+            ({"dimensions": ["event_type", "event_type"]}, "Duplicate"),
+            ({"measures": ["quantile(amount)"]}, "Measures look like"),
+            ({"measures": ["sum()"]}, "needs a column"),
+            ({"measures": ["uniq(missing)"]}, "needs a column"),
+            ({"measures": ["max(event_timestamp)"]}, "can't aggregate the time column"),
+        ],
+    )
+    def test_invalid(self, overrides, message):
+        columns = {} if overrides.get("source") == "missing" else COLUMNS
+        with pytest.raises(ValueError, match=message):
+            parse_rollup({"source": "default.events", **overrides}, columns)
+
+
+class TestBuildRollupQueries:
+    def test_ddl(self):
+        rollup = make_rollup()
+        create_table, create_view = build_rollup_queries(
+            rollup, [("event_type", "LowCardinality(String)"), ("count", "AggregateFunction(count)")], 1000
+        )
+
+        assert create_table.startswith(
+            "CREATE TABLE default.events_by_hour (event_type LowCardinality(String), count AggregateFunction(count)) "
+            "ENGINE = AggregatingMergeTree() PARTITION BY toYYYYMM(event_timestamp) "
+            "ORDER BY (event_type, event_timestamp) SETTINGS non_replicated_deduplication_window = 1000 "
+            f"COMMENT '{COMMENT_PREFIX}"
+        )
+        assert create_view == (
+            "CREATE MATERIALIZED VIEW default.events_by_hour_mv TO default.events_by_hour AS "
+            "SELECT event_type, toStartOfHour(event_timestamp) AS event_timestamp, countState() AS count, "
+            "uniqState(user_id) AS uniq_user_id, sumState(amount) AS sum_amount FROM default.events "
+            f"WHERE toStartOfHour(event_timestamp) >= toDateTime({SINCE}) "
+            "GROUP BY event_type, toStartOfHour(event_timestamp)"
+        )
+
+
+class TestCreateAndBackfill:
+    def test_create_registers_rollup(self):
+        client = FakeRollupClient()
+        rollup, create_table, create_view = create_rollup(client, parse_rollup({"source": "events"}, COLUMNS))
+
+        assert rollup["since"] == SINCE
+        assert rollup["backfill"] == {"from": SINCE - 30 * HOUR, "until": SINCE - 30 * HOUR}
+        assert [sql for sql, _ in client.commands] == [create_table, create_view]
+        assert "SETTINGS" not in create_table
+
+        registry = RollupRegistry()
+        assert registry.get(client) == [rollup]
+
+    def test_empty_source_is_ready(self):
+        client = FakeRollupClient(first=None)
+        rollup, _, _ = create_rollup(client, parse_rollup({"source": "events"}, COLUMNS))
+
+        assert describe_rollup(rollup)["ready"] is True
+
+    def test_failed_view_drops_table(self):
+        client = FakeRollupClient()
+        client.command = MagicMock(side_effect=[None, RuntimeError("no view"), None])
+
+        with pytest.raises(RuntimeError):
+            create_rollup(client, parse_rollup({"source": "events"}, COLUMNS))
+        assert client.command.call_args_list[-1].args[0] == "DROP TABLE IF EXISTS default.events_by_hour"
+
+    def test_backfill_in_chunks_until_since(self):
+        client = FakeRollupClient(now=SINCE + 60)
+        rollup, _, _ = create_rollup(client, make_rollup())
+        client.commands.clear()
+
+        rollup = backfill(client, rollup, chunk_seconds=12 * HOUR)
+
+        inserts = [(sql, settings) for sql, settings in client.commands if sql.startswith("INSERT")]
+        bounds = [(SINCE - 30 * HOUR, SINCE - 18 * HOUR), (SINCE - 18 * HOUR, SINCE - 6 * HOUR), (SINCE - 6 * HOUR, SINCE)]
+        assert [settings["insert_deduplication_token"] for _, settings in inserts] == [
+            f"default.events_by_hour:{start}-{end}" for start, end in bounds
+        ]
+        start, end = bounds[0]
+        assert inserts[0][0].startswith(
+            "INSERT INTO default.events_by_hour SELECT event_type, toStartOfHour(event_timestamp) AS event_timestamp"
+        )
+        assert (
+            f"WHERE toStartOfHour(event_timestamp) >= toDateTime({start}) "
+            f"AND toStartOfHour(event_timestamp) < toDateTime({end}) GROUP BY" in inserts[0][0]
+        )
+        assert sum(sql.startswith("ALTER TABLE") for sql, _ in client.commands) == 3
+        assert describe_rollup(rollup)["ready"] is True
+        assert RollupRegistry().get(client)[0]["backfill"]["until"] == SINCE
+
+    def test_backfill_waits_for_the_last_chunk(self):
+        client = FakeRollupClient(now=SINCE - 1800)
+        rollup, _, _ = create_rollup(client, make_rollup())
+
+        rollup = backfill(client, rollup, chunk_seconds=12 * HOUR)
+
+        assert rollup["backfill"]["until"] == SINCE - 6 * HOUR
+        assert describe_rollup(rollup)["ready"] is False
+
+    def test_backfill_stops_at_deadline(self):
+        client = FakeRollupClient(now=SINCE + 60)
+        rollup, _, _ = create_rollup(client, make_rollup())
+
+        rollup = backfill(client, rollup, chunk_seconds=HOUR, deadline=0)
+
+        assert rollup["backfill"]["until"] == SINCE - 29 * HOUR
+
+
+class TestRewriteQuery:
+    @pytest.mark.parametrize(
+        "query, expected",
+        [
+            (
+                "SELECT event_type, count() AS n FROM events GROUP BY event_type",
+                "SELECT event_type, countMerge(count) AS n FROM default.events_by_hour GROUP BY event_type",
+            ),
+            (
+                "SELECT toStartOfDay(event_timestamp) AS day, event_type, COUNT(*), uniq(user_id) "
+                "FROM default.events WHERE event_type IN ('click', 'view') "
+                "GROUP BY day, event_type ORDER BY day DESC LIMIT 10",
+                "SELECT toStartOfDay(event_timestamp) AS day, event_type, countMerge(count), "
+                "uniqMerge(uniq_user_id) FROM default.events_by_hour WHERE event_type IN ('click', 'view') "
+                "GROUP BY day, event_type ORDER BY day DESC LIMIT 10",
+            ),
+            (
+                "SELECT sum(amount) / count() FROM events "
+                "WHERE event_timestamp >= '2024-07-01 00:00:00' AND '2024-07-02' > event_timestamp",
+                "SELECT sumMerge(sum_amount) / countMerge(count) FROM default.events_by_hour "
+                "WHERE event_timestamp >= '2024-07-01 00:00:00' AND '2024-07-02' > event_timestamp",
+            ),
+            (
+                "SELECT toHour(event_timestamp) AS h, count() FROM events "
+                "WHERE toStartOfHour(event_timestamp) >= now() - INTERVAL 24 HOUR GROUP BY h HAVING count() > 10;",
+                "SELECT toHour(event_timestamp) AS h, countMerge(count) FROM default.events_by_hour "
+                "WHERE toStartOfHour(event_timestamp) >= now() - INTERVAL 24 HOUR GROUP BY h HAVING countMerge(count) > 10;",
+            ),
+        ],
+    )
+    def test_rewrites(self, query, expected):
+        parsed = parse_aggregate_query(query)
+
+        assert rewrite_query(query, parsed, make_rollup()) == expected
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "SELECT * FROM events",
+            "SELECT event_type FROM events GROUP BY event_type",
+            "SELECT user_id, count() FROM events GROUP BY user_id",
+            "SELECT user_id AS user_id, count() FROM events GROUP BY user_id",
+            "SELECT uniq(session_id) FROM events",
+            "SELECT count(DISTINCT user_id) FROM events",
+            "SELECT countIf(event_type = 'click') FROM events",
+            "SELECT count() FROM events WHERE event_timestamp >= now() - INTERVAL 1 DAY",
+            "SELECT count() FROM events WHERE event_timestamp >= '2024-07-01 00:30:00'",
+            "SELECT count() FROM events WHERE event_timestamp > '2024-07-01'",
+            "SELECT count() FROM events WHERE event_timestamp BETWEEN '2024-07-01' AND '2024-07-02'",
+            "SELECT toStartOfMinute(event_timestamp) AS m, count() FROM events GROUP BY m",
+            "SELECT count() FROM events FINAL",
+            "SELECT count() FROM events AS e",
+            "SELECT count() FROM events e JOIN users u ON e.user_id = u.id",
+            "SELECT count() FROM (SELECT * FROM events)",
+            "SELECT count() FROM events WHERE user_id IN (SELECT user_id FROM users)",
+            "SELECT count() FROM events UNION ALL SELECT count() FROM events",
+            "SELECT count() FROM events -- comment",
+            "SELECT event_type, count() FROM events GROUP BY event_type LIMIT 1 BY event_type",
+            "SELECT count() FROM events SETTINGS max_threads = 1",
+        ],
+    )
+    def test_not_eligible(self, query):
+        parsed = parse_aggregate_query(query)
+
+        assert parsed is None or rewrite_query(query, parsed, make_rollup()) is None
+
+
+class TestRollupRegistry:
+    def test_routes_to_coarsest_ready_rollup(self):
+        client = FakeRollupClient(now=SINCE + 60)
+        hourly, _, _ = create_rollup(client, make_rollup())
+        daily, _, _ = create_rollup(client, make_rollup(granularity="day", name="events_daily"))
+        registry = RollupRegistry()
+
+        query = "SELECT toDate(event_timestamp) AS d, count() FROM events GROUP BY d"
+        assert registry.route(client, query) == (query, None)
+
+        backfill(client, hourly)
+        registry.invalidate()
+        routed, rollup = registry.route(client, query)
+        assert rollup["name"] == "events_by_hour"
+
+        client.comments[("default", "events_daily")] = client.comments[("default", "events_daily")].replace(
+            f'"until":{SINCE - 30 * HOUR}', f'"until":{SINCE}'
+        )
+        registry.invalidate()
+        routed, rollup = registry.route(client, query)
+        assert rollup["name"] == "events_daily"
+        assert routed == "SELECT toDate(event_timestamp) AS d, countMerge(count) FROM default.events_daily GROUP BY d"
+
+    def test_non_aggregate_queries_skip_the_lookup(self):
+        client = FakeRollupClient()
+
+        assert RollupRegistry().route(client, "SELECT * FROM events LIMIT 10") == ("SELECT * FROM events LIMIT 10", None)
+        assert client.queries == []
+
+
+class TestRollupRoutes:
+    @pytest.fixture
+    def client(self):
+        return FakeRollupClient(now=SINCE + 60)
+
+    @pytest.fixture
+    def http(self, client):
+        app = create_app(config={**TEST_CONFIG, "QUERY_CACHE_ENABLED": False}, client=client)
+        app.catalog = MagicMock()
+        app.catalog.get.return_value = {
+            "default": {"events": [{"name": name, "type": col_type} for name, col_type in COLUMNS.items()]}
+        }
+        return app.test_client()
+
+    def test_lifecycle(self, http, client):
+        response = http.post(
+            "/api/rollups",
+            json={"source": "default.events", "dimensions": ["event_type"], "measures": ["count()"]},
+        )
+        assert response.status_code == 200
+        assert response.json["rollup"]["ready"] is False
+        assert "non_replicated_deduplication_window = 1000" in response.json["createTableQuery"]
+        assert response.json["createViewQuery"].startswith("CREATE MATERIALIZED VIEW default.events_by_hour_mv")
+
+        response = http.get("/api/rollups?source=default.events")
+        assert [r["table"] for r in response.json["rollups"]] == ["default.events_by_hour"]
+        assert response.json["rollups"][0]["measures"] == ["count()"]
+
+        query = {"query": "SELECT event_type, count() AS n FROM events GROUP BY event_type"}
+        response = http.post("/api/query", json=query)
+        assert "rollup" not in response.json["metadata"]
+
+        response = http.post("/api/rollups/default/events_by_hour/backfill")
+        assert response.json["rollup"]["ready"] is True
+
+        response = http.post("/api/query", json=query)
+        assert response.json["metadata"]["rollup"] == "default.events_by_hour"
+        assert response.json["metadata"]["query"] == query["query"]
+        assert client.queries[-1] == (
+            "SELECT event_type, countMerge(count) AS n FROM default.events_by_hour GROUP BY event_type"
+        )
+
+        response = http.post("/api/query", json={**query, "rollups": False})
+        assert "rollup" not in response.json["metadata"]
+        assert client.queries[-1] == query["query"]
+
+        response = http.delete("/api/rollups/default/events_by_hour")
+        assert response.status_code == 200
+        assert ("DROP VIEW IF EXISTS default.events_by_hour_mv", None) in client.commands
+        assert http.get("/api/rollups").json["rollups"] == []
+
+    def test_errors(self, http):
+        response = http.post("/api/rollups", json={"source": "default.missing"})
+        assert response.status_code == 400
+        assert "does not exist" in response.json["Rollups Route Error"]
+
+        assert http.post("/api/rollups/default/missing/backfill").status_code == 404
+        assert http.delete("/api/rollups/default/missing").status_code == 404
@@ -0,0 +1,92 @@
+import json
+import random
+from time import perf_counter
+
+from app.utils.schema_inference import infer_schema
+
+
+def types_of(records, **options):
+    return {col["name"]: col["type"] for col in infer_schema(records, **options)}
+
+
+class TestInferSchema:
+    def test_scalar_types(self):
+        assert types_of([{"id": 1, "price": 1.5, "ok": True, "name": "a"}]) == {
+            "id": "Int64",
+            "price": "Float64",
+            "ok": "Bool",
+            "name": "String",
+        }
+
+    def test_widening_across_records(self):
+        schema = types_of([{"a": 1, "b": 1, "c": True}, {"a": 2.5, "b": "x", "c": 3}])
+        assert schema == {"a": "Float64", "b": "String", "c": "Int64"}
+
+    def test_nullability_from_nulls_and_missing_fields(self):
+        schema = types_of([{"a": 1, "b": None}, {"a": 2, "b": 3}, {"b": 4, "c": "late"}])
+        assert schema == {"a": "Nullable(Int64)", "b": "Nullable(Int64)", "c": "Nullable(String)"}
+
+    def test_only_nulls(self):
+        assert types_of([{"a": None}]) == {"a": "Nullable(String)"}
+
+    def test_datetime_detection(self):
+        schema = types_of(
+            [
+                {
+                    "event_timestamp": "2024-07-01T12:00:00+00:00",
+                    "precise": "2024-07-01 12:00:00.123456",
+                    "day": "2024-07-01",
+                    "registration_timestamp": 1719835200,
+                    "count": 1719835200,
+                }
+            ]
+        )
+        assert schema == {
+            "event_timestamp": "DateTime",
+            "precise": "DateTime64(6)",
+            "day": "Date",
+            "registration_timestamp": "DateTime",
+            "count": "Int64",
+        }
+
+    def test_mixed_dates_fall_back_to_string(self):
+        assert types_of([{"d": "2024-07-01"}, {"d": "soon"}]) == {"d": "String"}
+
+    def test_low_cardinality_suggestion(self):
+        records = [
+            {"event_type": random.choice(["click", "view", "purchase"]), "session_id": f"s-{i}"}
+            for i in range(100)
+        ]
+        schema = types_of(records)
+        assert schema["event_type"] == "LowCardinality(String)"
+        assert schema["session_id"] == "String"
+
+    def test_low_cardinality_needs_enough_samples(self):
+        assert types_of([{"t": "click"}, {"t": "click"}]) == {"t": "String"}
+
+    def test_nested_values(self):
+        schema = types_of([{"tags": ["a", "b"], "geo": {"lat": 1.5, "lon": 2}}, {"tags": []}])
+        assert schema["tags"] == "Array(String)"
+        assert schema["geo"] == "Tuple(lat Float64, lon Int64)"
+
+    def test_records_with_quotes(self):
+        assert types_of(['{"message": "it\'s \\"quoted\\""}']) == {"message": "String"}
+
+    def test_thousands_of_records_in_milliseconds(self):
+        records = [
+            json.dumps(
+                {
+                    "user_id": f"user-{i % 500}",
+                    "session_id": f"session-{i}",
+                    "event_type": ["click", "view", "purchase", "add_to_cart"][i % 4],
+                    "event_timestamp": "2024-07-01T12:00:00.123456+00:00",
+                    "page_url": f"https://example.com/{i % 50}",
+                    "amount": i * 1.5,
+                    "quantity": i,
+                }
+            )
+            for i in range(5000)
+        ]
+        started = perf_counter()
+        infer_schema(records)
+        assert perf_counter() - started < 1
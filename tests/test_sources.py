@@ -0,0 +1,98 @@
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from app.main import create_app
+from app.utils.helpers import get_tables_info, scan_stream_table_map
+from tests.test_config import TEST_CONFIG
+
+STREAM_ARN = "arn:aws:kinesis:us-west-1:123456789012:stream/stream_{}"
+
+
+@pytest.fixture
+def aws_session(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        session = boto3.Session(region_name="us-west-1")
+        session.client("dynamodb").create_table(
+            TableName="stream_table_map",
+            KeySchema=[
+                {"AttributeName": "stream_id", "KeyType": "HASH"},
+                {"AttributeName": "table_id", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "stream_id", "AttributeType": "S"},
+                {"AttributeName": "table_id", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield session
+
+
+def put_mappings(session, count):
+    table = session.resource("dynamodb").Table("stream_table_map")
+    with table.batch_writer() as batch:
+        for i in range(count):
+            batch.put_item(Item={"stream_id": STREAM_ARN.format(i), "table_id": f"uuid-{i}"})
+
+
+def make_tables_client(table_ids):
+    client = MagicMock()
+    client.query.return_value.result_rows = [
+        (table_id, f"table_{table_id}", datetime(2024, 7, 1)) for table_id in table_ids
+    ]
+    return client
+
+
+class TestScanStreamTableMap:
+    @pytest.mark.parametrize("segments", [1, 4])
+    def test_reads_every_item(self, aws_session, segments):
+        put_mappings(aws_session, 50)
+        items = scan_stream_table_map(aws_session, segments=segments)
+        assert sorted(item["table_id"] for item in items) == sorted(f"uuid-{i}" for i in range(50))
+
+    def test_follows_last_evaluated_key(self):
+        session = MagicMock()
+        session.client.return_value.scan.side_effect = [
+            {"Items": [{"stream_id": {"S": "a"}, "table_id": {"S": "1"}}], "LastEvaluatedKey": {"k": 1}},
+            {"Items": [{"stream_id": {"S": "b"}, "table_id": {"S": "2"}}]},
+        ]
+        items = scan_stream_table_map(session)
+        assert [item["table_id"] for item in items] == ["1", "2"]
+        second_call = session.client.return_value.scan.call_args_list[1]
+        assert second_call.kwargs["ExclusiveStartKey"] == {"k": 1}
+
+
+class TestSourcesRoute:
+    def test_single_clickhouse_lookup_and_cache(self, aws_session):
+        put_mappings(aws_session, 20)
+        ch_client = make_tables_client([f"uuid-{i}" for i in range(20)])
+        app = create_app(config=TEST_CONFIG, client=ch_client)
+
+        with patch("app.api.routes.global_boto3_session", aws_session):
+            response = app.test_client().get("/api/sources")
+            assert response.status_code == 200
+            data = response.get_json()
+            assert len(data) == 20
+            assert data[0]["createdOn"] == "07-01-2024"
+            assert ch_client.query.call_count == 1
+
+            app.test_client().get("/api/sources")
+            assert ch_client.query.call_count == 1
+
+    def test_mapping_without_table_is_skipped(self, aws_session):
+        put_mappings(aws_session, 3)
+        app = create_app(config=TEST_CONFIG, client=make_tables_client(["uuid-0"]))
+
+        with patch("app.api.routes.global_boto3_session", aws_session):
+            data = app.test_client().get("/api/sources").get_json()
+        assert [source["streamName"] for source in data] == ["stream_0"]
+
+    def test_get_tables_info_skips_empty_lookup(self):
+        client = MagicMock()
+        assert get_tables_info(client, []) == {}
+        client.query.assert_not_called()
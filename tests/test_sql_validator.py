@@ -0,0 +1,173 @@
+import re
+from time import perf_counter
+
+import pytest
+from app.utils.helpers import is_sql_injection
+from app.utils.sql_validator import (
+    SQLValidationError,
+    validate_create_table,
+    validate_read_only,
+)
+
+READ_ONLY_CORPUS = [
+    "SELECT * FROM events",
+    "select count() from default.events;",
+    "SELECT * FROM events WHERE event_type = 'delete'",
+    "SELECT 'drop' AS label",
+    "SELECT 'it''s; DROP TABLE x' AS s",
+    "SELECT 'escaped \\' ; DROP TABLE x' AS s",
+    'SELECT "update" FROM events',
+    "SELECT `insert`, `drop table` FROM events",
+    "SELECT $$; DROP TABLE x$$ AS heredoc",
+    "SELECT $tag$ ' $tag$ AS heredoc",
+    "SELECT 1 -- DROP TABLE users",
+    "SELECT 1 /* ; DELETE FROM users */",
+    "SELECT 1 # ; TRUNCATE users",
+    "SELECT update_time, created_at FROM events",
+    "WITH t AS (SELECT 1 AS x) SELECT * FROM t",
+    "(SELECT 1) UNION ALL (SELECT 2)",
+    "SELECT a FROM t1 UNION ALL SELECT a FROM t2",
+    "SELECT name FROM system.tables",
+    "SHOW TABLES",
+    "DESCRIBE TABLE events",
+    "DESC events",
+    "EXPLAIN SELECT 1",
+    "EXISTS TABLE events",
+    "SELECT * FROM events SETTINGS max_threads = 2",
+    "SELECT 1 SETTINGS max_block_size = 1, max_threads = 2 FORMAT JSON",
+    "SELECT * FROM (SELECT 1 SETTINGS max_threads = 1) AS t, other WHERE max_execution_time = 0",
+    "SELECT * FROM events SETTINGS additional_table_filters = {'events': 'max_execution_time = 0'}",
+    "SELECT settings FROM events WHERE max_execution_time = 0",
+    "SELECT update, delete, insert, drop FROM events",
+    "SELECT count() AS create, any(t.alter) FROM events AS t WHERE update > 0 ORDER BY delete",
+    "SELECT into FROM events",
+    "SHOW CREATE TABLE events",
+    "SELECT * FROM events WHERE id = {id:UInt64}",
+    "\n  SELECT 1\n",
+]
+
+WRITE_CORPUS = [
+    ("DROP TABLE users", "Only read-only"),
+    ("SELECT * FROM users; DROP TABLE users", "Multi-statements are not allowed"),
+    ("SELECT 1; SELECT 2", "Multi-statements are not allowed"),
+    ("SELECT 'a';DELETE FROM users", "Multi-statements are not allowed"),
+    ("INSERT INTO users VALUES (1)", "Only read-only"),
+    ("ALTER TABLE users DELETE WHERE 1", "Only read-only"),
+    ("TRUNCATE users", "Only read-only"),
+    ("SYSTEM FLUSH LOGS", "Only read-only"),
+    ("KILL QUERY WHERE 1", "Only read-only"),
+    ("SET max_threads = 1", "Only read-only"),
+    ("OPTIMIZE TABLE users FINAL", "Only read-only"),
+    ("SELECT * FROM users INTO OUTFILE 'x.csv'", "Write operations are not allowed: INTO"),
+    ("WITH x AS (SELECT 1) INSERT INTO t SELECT * FROM x", "Write operations are not allowed: INSERT"),
+    ("SELECT * FROM (ALTER TABLE users DELETE WHERE 1)", "Write operations are not allowed: ALTER"),
+    ("SELECT * FROM t WHERE x IN (DELETE FROM users)", "Write operations are not allowed: DELETE"),
+    ("EXPLAIN AST DROP TABLE users", "Write operations are not allowed: DROP"),
+    (
+        "SELECT * FROM events SETTINGS max_execution_time=0, max_result_rows=0",
+        "may not change the API's limits: max_execution_time, max_result_rows",
+    ),
+    ("SELECT 1 SETTINGS max_threads = 1, readonly = 0", "may not change the API's limits: readonly"),
+    ("SELECT * FROM (SELECT * FROM events SETTINGS result_overflow_mode = 'break')", "result_overflow_mode"),
+    ("select 1 settings MAX_MEMORY_USAGE = 0", "MAX_MEMORY_USAGE"),
+    (
+        "SELECT * FROM events SETTINGS additional_table_filters = {'events': 'x', 'pypi': 'y'}, max_execution_time = 0",
+        "may not change the API's limits: max_execution_time",
+    ),
+    ("SELECT 1 SETTINGS max_threads=(1), max_execution_time=0", "may not change the API's limits: max_execution_time"),
+    ("SELECT 1 SETTINGS a = [1, 2], b = tuple(1, (2, 3)), max_result_rows = 0 FORMAT JSON", "max_result_rows"),
+    ("SELECT 'unterminated", "Unterminated"),
+    ("SELECT 1 /* open comment", "Unterminated"),
+    ("SELECT `open", "Unterminated"),
+    ("", "Empty query"),
+    (" ; ", "Empty query"),
+]
+
+
+class TestValidateReadOnly:
+    @pytest.mark.parametrize("query", READ_ONLY_CORPUS)
+    def test_accepts_read_only(self, query):
+        validate_read_only(query)
+
+    @pytest.mark.parametrize("query, message", WRITE_CORPUS)
+    def test_rejects_writes(self, query, message):
+        with pytest.raises(SQLValidationError, match=re.escape(message)):
+            validate_read_only(query)
+
+
+class TestValidateCreateTable:
+    def test_accepts_create_table(self):
+        validate_create_table(
+            "CREATE TABLE default.events (id Int32, note String DEFAULT 'drop') "
+            "ENGINE = MergeTree() PRIMARY KEY id"
+        )
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "CREATE TABLE t (id Int32) ENGINE = MergeTree() PRIMARY KEY id; DROP TABLE users",
+            "CREATE TABLE t (id Int32 -- ) ENGINE = Log\n) ENGINE = MergeTree() PRIMARY KEY id",
+            "CREATE TABLE t (id Int32) ENGINE = MergeTree() PRIMARY KEY id /* x */",
+            "CREATE TABLE t (id Int32 DEFAULT (SELECT 1 FROM (ALTER TABLE x))) ENGINE = Log",
+            "CREATE VIEW v AS SELECT 1",
+            "SELECT 1",
+        ],
+    )
+    def test_rejects_everything_else(self, query):
+        with pytest.raises(SQLValidationError):
+            validate_create_table(query)
+
+
+class TestIsSqlInjection:
+    def test_keeps_existing_behaviour(self):
+        assert is_sql_injection("SELECT * FROM table") == False
+        assert is_sql_injection("DROP TABLE users") == True
+        assert is_sql_injection("SELECT * FROM table; DROP TABLE users") == True
+
+    def test_ignores_keywords_in_literals(self):
+        assert is_sql_injection("SELECT * FROM events WHERE event_type = 'delete'") == False
+        assert is_sql_injection("SELECT 'drop' AS label") == False
+
+
+class TestPerformance:
+    """
+    Micro-benchmark: validation must stay linear, so a query 8x larger may
+    take at most ~8x longer (with slack for timer noise), and a multi-megabyte
+    query validates well within a request's budget.
+    """
+
+    @staticmethod
+    def build_query(n):
+        values = ", ".join(f"'value {i}; drop'" for i in range(n))
+        return f"SELECT * FROM events /* large IN list */ WHERE label IN ({values}) AND id > 0"
+
+    @staticmethod
+    def time_validation(query, repeat=3):
+        best = None
+        for _ in range(repeat):
+            started = perf_counter()
+            validate_read_only(query)
+            elapsed = perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def test_multi_megabyte_query(self):
+        query = self.build_query(200_000)
+        assert len(query) > 3_000_000
+        assert self.time_validation(query) < 1
+
+    def test_scales_linearly(self):
+        small = self.time_validation(self.build_query(20_000))
+        large = self.time_validation(self.build_query(160_000))
+        assert large < small * 8 * 3
+
+    @pytest.mark.parametrize(
+        "query",
+        ["SELECT '" + "\\'" * 200_000, "SELECT $a$" + "$" * 200_000, "SELECT 1 /*" + "*" * 200_000],
+        ids=["escaped-quotes", "heredoc", "comment"],
+    )
+    def test_pathological_literals(self, query):
+        started = perf_counter()
+        with pytest.raises(SQLValidationError):
+            validate_read_only(query)
+        assert perf_counter() - started < 1
@@ -0,0 +1,267 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.main import create_app
+from app.utils.helpers import is_sql_injection
+from app.utils.schema_inference import infer_schema
+from app.utils.sql_validator import validate_create_table
+from app.utils.table_layout import build_create_table_query, plan_layout, unwrap_type
+from tests.test_config import TEST_CONFIG
+
+
+def make_events(count=200, seed=7):
+    rng = random.Random(seed)
+    started = datetime(2024, 7, 1)
+    return [
+        {
+            "session_id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": rng.randrange(1_000_000),
+            "event_type": rng.choice(["click", "view", "purchase", "add_to_cart"]),
+            "country": rng.choice(["US", "DE", "CN", "GB", "IN", "FR", "JP", "BR"]),
+            "page_url": f"https://example.com/{rng.randrange(100_000)}",
+            "sequence": i,
+            "price": round(rng.random() * 100, 2),
+            "event_timestamp": (started + timedelta(seconds=i)).isoformat(),
+        }
+        for i in range(count)
+    ]
+
+
+@pytest.fixture
+def events():
+    return make_events()
+
+
+@pytest.fixture
+def schema(events):
+    return infer_schema(events)
+
+
+class TestPlanLayout:
+    def test_unwrap_type(self):
+        assert unwrap_type("LowCardinality(Nullable(String))") == ("String", True, True)
+        assert unwrap_type("Nullable(DateTime64(3))") == ("DateTime64(3)", True, False)
+        assert unwrap_type("Array(String)") == ("Array(String)", False, False)
+
+    def test_orders_by_cardinality_then_time(self, schema, events):
+        layout = plan_layout(schema, events)
+        # The UUID and user_id are near-unique and would not prune anything.
+        assert layout["orderBy"] == ["event_type", "country", "event_timestamp"]
+        assert layout["partitionBy"] == "toYYYYMM(`event_timestamp`)"
+        assert layout["ttl"] is None
+
+    def test_codecs(self, schema, events):
+        codecs = plan_layout(schema, events)["codecs"]
+        assert codecs["event_timestamp"] == "DoubleDelta, ZSTD(1)"
+        assert codecs["sequence"] == "Delta, ZSTD(1)"
+        assert codecs["user_id"] == "ZSTD(1)"
+        assert codecs["price"] == "ZSTD(1)"
+        assert codecs["page_url"] == "ZSTD(3)"
+        assert "event_type" not in codecs
+        assert codecs["session_id"] == "ZSTD(3)"
+
+    def test_low_cardinality(self, events):
+        schema = infer_schema(events, low_cardinality_ratio=0)
+        assert {col["name"]: col["type"] for col in schema}["event_type"] == "String"
+        layout = plan_layout(schema, events)
+        assert layout["lowCardinality"] == ["event_type", "country"]
+        assert any(note.startswith("event_type: 4 distinct") for note in layout["notes"])
+
+    def test_ttl(self, schema, events):
+        assert plan_layout(schema, events, ttl_days=90)["ttl"] == "`event_timestamp` + INTERVAL 90 DAY"
+        precise = [{"name": "created_at", "type": "DateTime64(6)"}]
+        assert plan_layout(precise, ttl_days=7)["ttl"] == "toDateTime(`created_at`) + INTERVAL 7 DAY"
+
+    def test_out_of_order_timestamps_use_delta(self, schema, events):
+        shuffled = list(events)
+        random.Random(1).shuffle(shuffled)
+        assert plan_layout(schema, shuffled)["codecs"]["event_timestamp"] == "Delta, ZSTD(1)"
+
+    def test_without_samples(self):
+        schema = [
+            {"name": "id", "type": "UUID"},
+            {"name": "kind", "type": "LowCardinality(String)"},
+            {"name": "ts", "type": "DateTime"},
+        ]
+        layout = plan_layout(schema)
+        assert layout["orderBy"] == ["kind", "ts"]
+        assert layout["codecs"] == {"ts": "DoubleDelta, ZSTD(1)"}
+
+    def test_falls_back_to_first_usable_column(self):
+        schema = [{"name": "id", "type": "Int32"}, {"name": "name", "type": "String"}]
+        layout = plan_layout(schema)
+        assert layout["orderBy"] == ["id"]
+        assert layout["partitionBy"] is None
+        schema = [{"name": "score", "type": "Nullable(Float64)"}]
+        assert plan_layout(schema)["orderBy"] == []
+
+    def test_overrides(self, schema, events):
+        layout = plan_layout(
+            schema,
+            events,
+            overrides={
+                "orderBy": ["user_id", "event_timestamp"],
+                "partitionBy": None,
+                "ttl": "event_timestamp + INTERVAL 30 DAY",
+                "codecs": {"page_url": "LZ4HC(9)", "price": None},
+                "lowCardinality": [],
+            },
+        )
+        assert layout["orderBy"] == ["user_id", "event_timestamp"]
+        assert layout["partitionBy"] is None
+        assert layout["ttl"] == "event_timestamp + INTERVAL 30 DAY"
+        assert layout["codecs"]["page_url"] == "LZ4HC(9)"
+        assert "price" not in layout["codecs"]
+        assert layout["codecs"]["sequence"] == "Delta, ZSTD(1)"
+        assert layout["lowCardinality"] == []
+
+    def test_dedup(self, schema, events):
+        assert plan_layout(schema, events)["dedup"] is None
+        assert plan_layout(schema, events, dedup_window=1000)["dedup"] == {"window": 1000}
+        layout = plan_layout(schema, events, dedup_window=1000, overrides={"dedup": {"version": "sequence"}})
+        assert layout["dedup"] == {"window": 1000, "version": "sequence"}
+        assert plan_layout(schema, events, dedup_window=1000, overrides={"dedup": None})["dedup"] is None
+
+    @pytest.mark.parametrize(
+        "overrides, message",
+        [
+            ({"dedup": {"version": "page_url"}}, "must be a non-nullable integer"),
+            ({"dedup": {"version": "missing"}}, "not in the schema"),
+            ({"dedup": {"window": -1}}, "non-negative integer"),
+            ({"dedup": {"key": "page_url"}}, "dedup must be"),
+            ({"orderBy": ["missing"]}, "not in the schema"),
+            ({"orderBy": ["score"]}, "Nullable"),
+            ({"codecs": {"page_url": "ZSTD(1)) ENGINE = Memory --"}}, "Invalid codec"),
+            ({"partitionBy": 3}, "expression string"),
+            ({"engine": "Log"}, "Unknown layout keys"),
+        ],
+    )
+    def test_rejects_bad_overrides(self, overrides, message):
+        schema = [{"name": "page_url", "type": "String"}, {"name": "score", "type": "Nullable(Float64)"}]
+        with pytest.raises(ValueError, match=message):
+            plan_layout(schema, overrides=overrides)
+
+
+class TestBuildCreateTableQuery:
+    def test_ddl(self, events):
+        schema = infer_schema(events, low_cardinality_ratio=0)
+        layout = plan_layout(schema, events, ttl_days=30)
+        query = build_create_table_query("default", "events", schema, layout)
+        validate_create_table(query)
+        assert "`event_type` LowCardinality(String)" in query
+        assert "`event_timestamp` DateTime CODEC(DoubleDelta, ZSTD(1))" in query
+        assert query.endswith(
+            "ENGINE = MergeTree() PARTITION BY toYYYYMM(`event_timestamp`) "
+            "ORDER BY (`event_type`, `country`, `event_timestamp`) "
+            "TTL `event_timestamp` + INTERVAL 30 DAY"
+        )
+
+    def test_quotes_names_and_keeps_existing_wrappers(self):
+        schema = [
+            {"name": "event type", "type": "LowCardinality(String)"},
+            {"name": "value", "type": "Nullable(Float64)"},
+        ]
+        layout = plan_layout(schema, overrides={"lowCardinality": ["event type"]})
+        query = build_create_table_query("default", "t", schema, layout)
+        assert "`event type` LowCardinality(String)," in query
+        assert "`value` Nullable(Float64) CODEC(ZSTD(1))" in query
+        assert query.endswith("ORDER BY (`event type`)")
+
+    def test_dedup_engine_and_settings(self, schema, events):
+        layout = plan_layout(schema, events, dedup_window=100)
+        query = build_create_table_query("default", "events", schema, layout)
+        validate_create_table(query)
+        assert "ENGINE = MergeTree()" in query
+        assert query.endswith("SETTINGS non_replicated_deduplication_window = 100")
+
+        layout = plan_layout(schema, events, overrides={"dedup": {"version": "sequence", "window": 10}})
+        query = build_create_table_query("default", "events", schema, layout)
+        validate_create_table(query)
+        assert "ENGINE = ReplacingMergeTree(`sequence`) PARTITION BY" in query
+        assert query.endswith("SETTINGS non_replicated_deduplication_window = 10")
+
+    def test_keyword_column_names_pass_validation(self):
+        schema = [
+            {"name": "update", "type": "DateTime"},
+            {"name": "delete", "type": "String"},
+        ]
+        query = build_create_table_query("default", "t", schema, plan_layout(schema, ttl_days=7))
+        assert not is_sql_injection(query, True)
+        assert "`update` DateTime" in query
+        assert "`delete` String" in query
+
+    def test_empty_sorting_key(self):
+        schema = [{"name": "value", "type": "Float64"}]
+        query = build_create_table_query("default", "t", schema, plan_layout(schema))
+        assert query.endswith("ENGINE = MergeTree() ORDER BY tuple()")
+
+
+class TestCreateTableRoutes:
+    @pytest.fixture
+    def ch_client(self):
+        client = MagicMock()
+        client.query.return_value.result_rows = [("table-uuid",)]
+        return client
+
+    @pytest.fixture
+    def http(self, ch_client):
+        app = create_app(config={**TEST_CONFIG, "LAYOUT_TTL_DAYS": 14}, client=ch_client)
+        return app.test_client()
+
+    def test_plan(self, http, schema, events):
+        response = http.post(
+            "/api/create-table/plan",
+            json={"tableName": "events", "schema": schema, "sampleEvents": events},
+        )
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["layout"]["orderBy"] == ["event_type", "country", "event_timestamp"]
+        assert data["layout"]["ttl"] == "`event_timestamp` + INTERVAL 14 DAY"
+        assert data["createTableQuery"].startswith("CREATE TABLE default.events (")
+        # Opt-in: tables fed without insert tokens would lose identical batches.
+        assert data["layout"]["dedup"] is None
+        assert "deduplication_window" not in data["createTableQuery"]
+
+    def test_plan_opts_in_to_dedup(self, http, schema, events):
+        response = http.post(
+            "/api/create-table/plan",
+            json={"tableName": "events", "schema": schema, "sampleEvents": events, "layout": {"dedup": {"window": 1000}}},
+        )
+        data = response.get_json()
+        assert data["layout"]["dedup"] == {"window": 1000}
+        assert data["createTableQuery"].endswith("SETTINGS non_replicated_deduplication_window = 1000")
+
+    def test_plan_rejects_bad_input(self, http, schema):
+        response = http.post("/api/create-table/plan", json={"schema": []})
+        assert response.status_code == 400
+        assert "Schema Error" in response.get_json()
+        response = http.post("/api/create-table/plan", json={"schema": schema, "layout": {"orderBy": ["x"]}})
+        assert response.status_code == 400
+        assert "not in the schema" in response.get_json()["Plan Table Route Error"]
+
+    @patch("app.api.routes.add_table_stream_dynamodb")
+    @patch("app.api.routes.get_table_id", return_value="table-uuid")
+    @patch("app.api.routes.get_stream_arn", return_value="arn:aws:kinesis:us-west-1:1:stream/events")
+    @patch("app.api.routes.global_boto3_session")
+    def test_create_table_runs_planned_ddl(self, session, get_stream_arn, get_table_id, add_mapping, http, ch_client, schema, events):
+        session.client.return_value.create_event_source_mapping.return_value = {"UUID": "mapping-uuid"}
+        response = http.post(
+            "/api/create-table",
+            json={
+                "streamName": "events",
+                "tableName": "events",
+                "schema": schema,
+                "sampleEvents": events,
+                "layout": {"ttl": None},
+            },
+        )
+        assert response.status_code == 200
+        data = response.get_json()
+        ch_client.command.assert_called_once_with(data["createTableQuery"])
+        assert "ORDER BY (`event_type`, `country`, `event_timestamp`)" in data["createTableQuery"]
+        assert data["layout"]["ttl"] is None
+        assert "TTL" not in data["createTableQuery"]
@@ -0,0 +1,459 @@
+import json
+import logging
+import threading
+from datetime import date, datetime, timezone
+from time import monotonic, sleep
+from unittest.mock import MagicMock
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from clickhouse_connect.driver.exceptions import DataError
+from clickhouse_connect.driver.summary import QuerySummary
+from moto import mock_aws
+
+from app.utils.aws import ThreadSafeSession
+from app.utils.table_layout import unwrap_type
+from app.worker.batch import ColumnBatch, column_converter
+from app.worker.checkpoints import FileCheckpointStore
+from app.worker.consumer import ASYNC_INSERT_SETTINGS, IngestWorker
+
+COLUMNS = [
+    ("user_id", "Int64"),
+    ("event_type", "LowCardinality(String)"),
+    ("event_timestamp", "DateTime"),
+    ("extra", "Nullable(String)"),
+]
+
+
+PYTHON_TYPES = {"Int64": int, "String": str, "DateTime": datetime}
+
+
+class FakeClient:
+    """Answers the worker's table lookups and records its inserts."""
+
+    def __init__(self, tables, fail_inserts=0, engine_full="MergeTree SETTINGS non_replicated_deduplication_window = 1000"):
+        self.tables = tables
+        self.fail_inserts = fail_inserts
+        self.engine_full = engine_full
+        self.inserts = []
+        self.tokens = []
+        self.lock = threading.Lock()
+
+    def query(self, query, parameters=None):
+        result = MagicMock()
+        if "engine_full" in query:
+            result.result_rows = [(self.engine_full.split(" ")[0], self.engine_full, "0")]
+        elif "system.tables" in query:
+            result.result_rows = [
+                (table_id, name, datetime(2024, 7, 1))
+                for table_id, name in self.tables.items()
+                if table_id in parameters["table_ids"]
+            ]
+        else:
+            result.result_rows = [(name, col_type, "", "", "", "", "") for name, col_type in COLUMNS]
+        return result
+
+    def insert(self, table, data, **kwargs):
+        with self.lock:
+            if self.fail_inserts:
+                self.fail_inserts -= 1
+                raise ConnectionError("ClickHouse unavailable")
+            # Like clickhouse_connect serializing the columns: one value of
+            # the wrong type fails the whole insert.
+            for column, col_type in zip(data, kwargs["column_type_names"]):
+                inner, nullable, _ = unwrap_type(col_type)
+                for value in column:
+                    if not (value is None and nullable) and not isinstance(value, PYTHON_TYPES[inner]):
+                        raise DataError(f"Unable to create native array for {col_type}: {value!r}")
+            # Like a table with a deduplication window: a repeated token
+            # writes nothing.
+            token = (kwargs.get("settings") or {}).get("insert_deduplication_token")
+            self.tokens.append(token)
+            if token is not None and self.tokens.count(token) > 1:
+                return QuerySummary({"written_rows": "0"})
+            self.inserts.append((table, data, kwargs))
+            return QuerySummary({"written_rows": str(len(data[0]))})
+
+    def rows(self, table="events"):
+        names = [name for name, _ in COLUMNS]
+        return [
+            dict(zip(names, row))
+            for name, data, _ in self.inserts
+            if name == table
+            for row in zip(*data)
+        ]
+
+
+@pytest.fixture
+def aws_session(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        session = boto3.Session(region_name="us-west-1")
+        session.client("dynamodb").create_table(
+            TableName="stream_table_map",
+            KeySchema=[
+                {"AttributeName": "stream_id", "KeyType": "HASH"},
+                {"AttributeName": "table_id", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "stream_id", "AttributeType": "S"},
+                {"AttributeName": "table_id", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield ThreadSafeSession(session)
+
+
+def map_stream(session, stream_name, table_id, shards=2):
+    kinesis = session.client("kinesis")
+    kinesis.create_stream(StreamName=stream_name, ShardCount=shards)
+    arn = kinesis.describe_stream_summary(StreamName=stream_name)["StreamDescriptionSummary"]["StreamARN"]
+    session.client("dynamodb").put_item(
+        TableName="stream_table_map", Item={"stream_id": {"S": arn}, "table_id": {"S": table_id}}
+    )
+    return arn
+
+
+def put_events(session, stream_name, start, count):
+    session.client("kinesis").put_records(
+        StreamName=stream_name,
+        Records=[
+            {
+                "Data": json.dumps(
+                    {"user_id": i, "event_type": "click", "event_timestamp": 1719835200 + i}
+                ).encode(),
+                "PartitionKey": f"user-{i}",
+            }
+            for i in range(start, start + count)
+        ],
+    )
+
+
+def run_until(worker, condition, timeout=10):
+    ends_at = monotonic() + timeout
+    return worker.run(until=lambda: condition() or monotonic() > ends_at)
+
+
+def make_worker(session, client, tmp_path, **options):
+    options = {"flush_interval": 0.2, "starting_position": "TRIM_HORIZON", "report_interval": 0, **options}
+    return IngestWorker(session, client, FileCheckpointStore(tmp_path / "checkpoints.json"), **options)
+
+
+class TestColumnBatch:
+    def test_converters(self):
+        assert column_converter("DateTime")("2024-07-01T12:00:00Z") == datetime(2024, 7, 1, 12, tzinfo=timezone.utc)
+        assert column_converter("DateTime64(3)")(0) == datetime(1970, 1, 1, tzinfo=timezone.utc)
+        assert column_converter("Date")("2024-07-01T12:00:00") == date(2024, 7, 1)
+        assert column_converter("String")({"a": 1}) == '{"a": 1}'
+        assert column_converter("LowCardinality(String)")(None) == ""
+        assert column_converter("Nullable(Int64)")(None) is None
+        assert column_converter("Int32")(None) == 0
+        assert column_converter("Array(String)")(None) == []
+        assert column_converter("UInt8")("7") == 7
+        assert column_converter("Int64")(3.0) == 3
+        assert column_converter("Float64")(1) == 1.0
+        assert column_converter("Bool")("true") is True
+        assert str(column_converter("UUID")("00000000-0000-0000-0000-000000000001")).endswith("1")
+
+    @pytest.mark.parametrize(
+        "col_type, value",
+        [
+            ("Int64", "abc"),
+            ("Int64", 1.5),
+            ("Int64", True),
+            ("UInt8", 256),
+            ("UInt32", -1),
+            ("Float64", [1]),
+            ("Bool", "yes"),
+            ("UUID", "not-a-uuid"),
+            ("DateTime", {"at": 1}),
+            ("Array(String)", "a"),
+        ],
+    )
+    def test_mismatched_values_raise(self, col_type, value):
+        with pytest.raises((TypeError, ValueError)):
+            column_converter(col_type)(value)
+
+    def test_rows_become_columns(self):
+        batch = ColumnBatch(["a", "b"], ["Int64", "Nullable(String)"])
+        batch.add({"a": 1, "b": "x"}, "shard-0", "1", 10)
+        batch.add({"a": 2}, "shard-1", "2", 10)
+        batch.advance("shard-0", "3")
+        assert batch.columns == [[1, 2], ["x", None]]
+        assert batch.positions == {"shard-0": "3", "shard-1": "2"}
+        assert (batch.rows, batch.bytes) == (2, 20)
+
+    def test_bad_value_leaves_no_partial_row(self):
+        batch = ColumnBatch(["a", "t"], ["Int64", "DateTime"])
+        with pytest.raises(ValueError):
+            batch.add({"a": 1, "t": "yesterday"}, "shard-0", "1", 10)
+        assert batch.columns == [[], []]
+
+
+class TestDedupToken:
+    def test_depends_only_on_stream_and_ranges(self):
+        first = ColumnBatch(["a"], ["Int64"])
+        first.add({"a": 1}, "shard-1", "10", 1)
+        first.add({"a": 2}, "shard-0", "5", 1)
+        first.advance("shard-1", "12")
+        second = ColumnBatch(["a"], ["Int64"])
+        second.add({"a": 2}, "shard-0", "5", 1)
+        second.add({"a": 1}, "shard-1", "10", 1)
+        second.add({"a": 3}, "shard-1", "12", 1)
+        assert first.ranges == {"shard-1": ["10", "12"], "shard-0": ["5", "5"]}
+        assert first.dedup_token("arn:1") == second.dedup_token("arn:1")
+        assert first.dedup_token("arn:1") != first.dedup_token("arn:2")
+        second.advance("shard-1", "13")
+        assert first.dedup_token("arn:1") != second.dedup_token("arn:1")
+
+
+class TestCheckpoints:
+    def test_persisted(self, tmp_path):
+        path = tmp_path / "checkpoints.json"
+        store = FileCheckpointStore(path)
+        store.update("arn:1", {"shard-0": "10"})
+        store.update("arn:1", {"shard-1": "20"})
+        assert FileCheckpointStore(path).positions() == {"arn:1": {"shard-0": "10", "shard-1": "20"}}
+        assert FileCheckpointStore(path).get("arn:1", "shard-2") is None
+
+    def test_write_ahead_ranges(self, tmp_path):
+        path = tmp_path / "checkpoints.json"
+        store = FileCheckpointStore(path)
+        store.begin("arn:1", {"shard-0": ["11", "20"]})
+        assert FileCheckpointStore(path).pending("arn:1") == {"shard-0": ["11", "20"]}
+        store.update("arn:1", {"shard-0": "20"})
+        reloaded = FileCheckpointStore(path)
+        assert reloaded.pending("arn:1") == {}
+        assert reloaded.get("arn:1", "shard-0") == "20"
+
+
+class TestIngestWorker:
+    def test_consumes_every_shard_in_batches(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=3)
+        put_events(aws_session, "events", 0, 250)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path)
+
+        report = run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 250)
+
+        rows = client.rows()
+        assert sorted(row["user_id"] for row in rows) == list(range(250))
+        assert rows[0]["event_timestamp"].tzinfo is timezone.utc
+        assert all(row["extra"] is None for row in rows)
+        assert client.inserts[0][2]["column_oriented"] is True
+        assert set(client.inserts[0][2]["settings"]) == {"insert_deduplication_token"}
+        assert report["rows"] == 250 and report["records"] == 250
+        assert report["rows_per_second"] > 0
+
+    def test_size_threshold(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 250)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path, batch_rows=100, records_per_call=50, flush_interval=60)
+
+        report = run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 200)
+        sizes = [len(data[0]) for _, data, _ in client.inserts]
+        assert sizes[:2] == [100, 100]
+        # Whatever was read after that is flushed on shutdown.
+        assert sum(sizes) == report["records"]
+
+    def test_retry_after_unconfirmed_insert_reuses_token(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 20)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path)
+        # The insert lands but the checkpoint write fails, as if the worker
+        # lost the response: the batch is retried and must not duplicate.
+        update = worker.checkpoints.update
+        failures = []
+
+        def flaky_update(stream_arn, positions):
+            if not failures:
+                failures.append(positions)
+                raise OSError("disk full")
+            update(stream_arn, positions)
+
+        worker.checkpoints.update = flaky_update
+        report = run_until(worker, lambda: len(client.tokens) >= 2)
+
+        assert client.tokens[0] == client.tokens[1]
+        assert sorted(row["user_id"] for row in client.rows()) == list(range(20))
+        assert report["deduplicated"] == 20 and report["rows"] == 20
+
+    @pytest.mark.parametrize(
+        "engine_full, warns",
+        [
+            ("MergeTree ORDER BY user_id", True),
+            ("MergeTree ORDER BY user_id SETTINGS non_replicated_deduplication_window = 1000", False),
+            ("ReplicatedMergeTree('/clickhouse/events', '{replica}') ORDER BY user_id", False),
+        ],
+    )
+    def test_warns_when_table_keeps_no_insert_hashes(self, aws_session, tmp_path, caplog, engine_full, warns):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        client = FakeClient({"uuid-events": "events"}, engine_full=engine_full)
+        worker = make_worker(aws_session, client, tmp_path)
+
+        with caplog.at_level(logging.WARNING, logger="app.worker.consumer"):
+            run_until(worker, lambda: True)
+        assert ("keeps no insert hashes" in caplog.text) is warns
+
+    def test_replays_pending_ranges_after_restart(self, aws_session, tmp_path):
+        arn = map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 10)
+        client = FakeClient({"uuid-events": "events"})
+        first = make_worker(aws_session, client, tmp_path)
+        run_until(first, lambda: first.stats.snapshot()["rows"] >= 10)
+        (token,) = client.tokens
+
+        # Crash between the insert and the checkpoint: the write-ahead
+        # ranges are still pending and the checkpoint is missing.
+        shard_id, last = next(iter(first.checkpoints.positions()[arn].items()))
+        records = aws_session.client("kinesis").get_records(
+            ShardIterator=aws_session.client("kinesis").get_shard_iterator(
+                StreamName="events", ShardId=shard_id, ShardIteratorType="TRIM_HORIZON"
+            )["ShardIterator"]
+        )["Records"]
+        path = tmp_path / "checkpoints.json"
+        path.write_text(json.dumps({"positions": {}, "pending": {arn: {shard_id: [records[0]["SequenceNumber"], last]}}}))
+
+        put_events(aws_session, "events", 10, 5)
+        restarted = make_worker(aws_session, client, tmp_path)
+        report = run_until(restarted, lambda: restarted.stats.snapshot()["rows"] >= 5)
+
+        assert client.tokens[1] == token
+        assert report["deduplicated"] == 10
+        assert sorted(row["user_id"] for row in client.rows()) == list(range(15))
+        assert FileCheckpointStore(path).pending(arn) == {}
+
+    def test_time_threshold_flushes_small_batches(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 5)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path, batch_rows=1000, flush_interval=0.3)
+
+        started = monotonic()
+        run_until(worker, lambda: client.inserts)
+        assert len(client.rows()) == 5
+        assert monotonic() - started >= 0.3
+
+    def test_resumes_from_checkpoint(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=2)
+        put_events(aws_session, "events", 0, 40)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path)
+        run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 40)
+
+        put_events(aws_session, "events", 40, 10)
+        restarted = make_worker(aws_session, client, tmp_path)
+        run_until(restarted, lambda: restarted.stats.snapshot()["rows"] >= 10)
+        sleep(0.3)
+        assert sorted(row["user_id"] for row in client.rows()) == list(range(50))
+
+    def test_failed_insert_is_retried(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 20)
+        client = FakeClient({"uuid-events": "events"}, fail_inserts=2)
+        worker = make_worker(aws_session, client, tmp_path, flush_interval=0.05, retry_backoff=0.2)
+
+        started = monotonic()
+        report = run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 20)
+        assert sorted(row["user_id"] for row in client.rows()) == list(range(20))
+        assert report["insert_errors"] == 2
+        # Backed off 0.2s, then 0.4s, instead of retrying every loop tick.
+        assert monotonic() - started >= 0.6
+        assert len(client.tokens) == 1
+
+    def test_read_error_is_retried(self, aws_session, tmp_path, monkeypatch):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 10)
+        kinesis = aws_session.client("kinesis")
+        get_records = kinesis.get_records
+        errors = []
+
+        def flaky_get_records(**kwargs):
+            if len(errors) < 2:
+                errors.append(kwargs)
+                raise ClientError({"Error": {"Code": "InternalFailure"}}, "GetRecords")
+            return get_records(**kwargs)
+
+        monkeypatch.setattr(kinesis, "get_records", flaky_get_records)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path, retry_backoff=0.05)
+
+        report = run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 10)
+        assert sorted(row["user_id"] for row in client.rows()) == list(range(10))
+        assert report["read_errors"] == 2
+
+    def test_mismatched_value_is_skipped(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        kinesis = aws_session.client("kinesis")
+        put_events(aws_session, "events", 0, 2)
+        kinesis.put_record(
+            StreamName="events",
+            Data=json.dumps({"user_id": "abc", "event_type": "click"}).encode(),
+            PartitionKey="a",
+        )
+        put_events(aws_session, "events", 2, 2)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path)
+
+        report = run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 4)
+        assert sorted(row["user_id"] for row in client.rows()) == [0, 1, 2, 3]
+        assert report["skipped"] == 1
+        assert report["insert_errors"] == 0
+
+    def test_checkpoints_batches_of_only_skipped_records(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        kinesis = aws_session.client("kinesis")
+        kinesis.put_record(StreamName="events", Data=b"not json", PartitionKey="a")
+        kinesis.put_record(StreamName="events", Data=b"[1, 2]", PartitionKey="a")
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path, flush_interval=0.05)
+
+        # Checkpointed while running, not only by the flush on shutdown.
+        started = monotonic()
+        run_until(worker, lambda: worker.checkpoints.positions(), timeout=5)
+        assert monotonic() - started < 5
+        assert worker.stats.snapshot()["skipped"] == 2
+        assert client.inserts == []
+
+    def test_skips_bad_records_and_unmapped_streams(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        map_stream(aws_session, "orphan", "uuid-missing", shards=1)
+        kinesis = aws_session.client("kinesis")
+        kinesis.put_record(StreamName="events", Data=b"not json", PartitionKey="a")
+        kinesis.put_record(StreamName="events", Data=b"[1, 2]", PartitionKey="a")
+        put_events(aws_session, "events", 0, 3)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path)
+
+        report = run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 3)
+        assert report["skipped"] == 2
+        assert [sink.table for sink in worker.sinks.values()] == ["events"]
+
+    def test_async_insert_and_stream_filter(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        map_stream(aws_session, "other", "uuid-other", shards=1)
+        put_events(aws_session, "events", 0, 5)
+        put_events(aws_session, "other", 0, 5)
+        client = FakeClient({"uuid-events": "events", "uuid-other": "other"})
+        worker = make_worker(aws_session, client, tmp_path, streams=["events"], async_insert=True)
+
+        run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 5)
+        assert {table for table, _, _ in client.inserts} == {"events"}
+        settings = client.inserts[0][2]["settings"]
+        assert settings.items() >= ASYNC_INSERT_SETTINGS.items()
+        assert settings["async_insert_deduplicate"] == 1
+        assert "insert_deduplication_token" in settings
+
+    def test_without_dedup(self, aws_session, tmp_path):
+        map_stream(aws_session, "events", "uuid-events", shards=1)
+        put_events(aws_session, "events", 0, 5)
+        client = FakeClient({"uuid-events": "events"})
+        worker = make_worker(aws_session, client, tmp_path, dedup=False)
+
+        run_until(worker, lambda: worker.stats.snapshot()["rows"] >= 5)
+        assert client.inserts[0][2]["settings"] == {}
+        assert worker.checkpoints.pending(next(iter(worker.sinks))) == {}